@@ -1,9 +1,17 @@
+import asyncio
+import dataclasses
+import json
+import math
 import re
+import secrets
+import time
 import uuid
+from contextlib import aclosing, asynccontextmanager
 from datetime import datetime, timezone
 
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
 from pydantic import BaseModel
 from google.genai import types
 
@@ -11,13 +19,51 @@ from google.genai import types
 from dotenv import load_dotenv
 load_dotenv()  # 从 .env 文件加载环境变量
 
+import delegation
+import failover
+import http_pool
 import personas  # 在加载环境变量后导入
-
-# 多 persona：每个角色独立 session，切换即切换聊天对象
-USER_ID = "godot"
+import warmup
+from cassettes import CASSETTES
+from conversation_index import CONVERSATION_INDEX
+from conversation_store import MAX_CONVERSATIONS, PHASES, Conversation, Message, MessageLog, PhaseState, Role
+from dispatcher import ADMIN_HEADER, ADMIN_TOKEN
+from knowledge_base import format_facts, retrieve
+from loop_monitor import LOOP_MONITOR, LOOP_MONITOR_ENABLED
+from metrics import METRICS
+from observer_jobs import ObserverJobs
+from players import DEFAULT_PLAYER_ID, PLAYER_HEADER, PLAYER_QUOTAS, PlayerQuotaExceeded, resolve_player_id
+from profiler import PROFILER, ProfilingMiddleware
+from response_cache import RESPONSE_CACHE, cache_key
+from routing import ROUTING
+from scheduler import SCHEDULER
+from semantic_cache import SEMANTIC_CACHE
+from token_usage import TOKENS
+from tracing import TRACES
+from turn_gate import TURN_GATES, ConversationBusyError
+from turn_jobs import TurnJob, TurnJobPool, TurnQueueFull
+
+# 多 persona：每个角色独立 session，切换即切换聊天对象；ADK user_id 为会话所属玩家（见 players.py）
 DEFAULT_PERSONAS = ["mikko", "aino"]  # 默认使用芬兰学生双人组合
 
-app = FastAPI()
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    """启动时开始模型预热与事件循环监控；关闭时停止后台任务。"""
+    if warmup.WARMUP_ENABLED:
+        WARMER.start()
+    if LOOP_MONITOR_ENABLED:
+        LOOP_MONITOR.start()
+    yield
+    await WARMER.stop()
+    await TURN_JOBS.shutdown()
+    await LOOP_MONITOR.stop()
+    await asyncio.to_thread(CASSETTES.flush)
+
+
+app = FastAPI(lifespan=_lifespan)
+# 按请求头 / 抽样率对创建会话与发消息做采样 profile，结果见 /admin/profiles
+app.add_middleware(ProfilingMiddleware)
 
 
 @app.get("/")
@@ -30,8 +76,20 @@ def root():
             "GET /conversations",
             "POST /conversations",
             "GET /conversations/{id}",
+            "DELETE /conversations/{id}",
             "GET /conversations/{id}/messages",
             "POST /conversations/{id}/messages",
+            "GET /conversations/{id}/usage",
+            "GET /conversations/{id}/trace",
+            "GET /turns/{id}",
+            "GET /metrics",
+            "GET /ready",
+            "GET /routing",
+            "GET /admin/profiles",
+            "GET /admin/profiles/{id}",
+            "GET /admin/conversations",
+            "GET /admin/conversations/{id}",
+            "PUT /admin/conversations/{id}",
         ],
     }
 
@@ -39,7 +97,6 @@ def root():
 @app.get("/favicon.ico", include_in_schema=False)
 def favicon():
     """避免浏览器请求 favicon 时 404。"""
-    from fastapi.responses import Response
     return Response(status_code=204)
 
 
@@ -55,6 +112,8 @@ class CreateConversationReq(BaseModel):
 
 class PostMessageReq(BaseModel):
     content: str
+    # 客户端消息 id（幂等键）：超时重试时带上同一个 id，返回同一轮的结果而不是重新生成
+    client_message_id: str | None = None
 
 
 # 单条消息：role=user 时 name 可为空；role=model 时为角色显示名
@@ -78,26 +137,73 @@ class ConversationSummary(BaseModel):
     message_count: int
 
 
-# 会话存储：id -> { persona_ids, messages, created_at }
-CONVERSATIONS: dict[str, dict] = {}
+class ConversationExport(BaseModel):
+    """迁移用的完整会话状态（多 worker rebalance 时在 worker 之间搬运，见 dispatcher.py）。"""
+
+    player_id: str
+    persona_ids: list[str]
+    created_at: str
+    messages: list[MessageItem]
+    state: dict | None = None
+
+
+# 会话存储：id -> Conversation(persona_ids, messages: MessageLog, created_at)
+CONVERSATIONS: dict[str, Conversation] = {}
 
-# 会话状态管理：id -> {
-#     "phase": "small_talk" | "religion_deep" | "allergy_deep" | "wrap_up" | "finished",
-#     "religion_discussed": bool,
-#     "allergy_discussed": bool,
-#     "sub_agent_turns": int,  # 子代理讨论轮数计数
-# }
-CONVERSATION_STATES: dict[str, dict] = {}
+# 会话状态管理：id -> PhaseState(
+#     phase: "small_talk" | "religion_deep" | "allergy_deep" | "wrap_up" | "finished",
+#     religion_discussed, allergy_discussed,
+#     sub_agent_turns,  # 子代理讨论轮数计数
+# )
+CONVERSATION_STATES: dict[str, PhaseState] = {}
 
 # 单次回复最大字符数，避免超长/重复导致 Godot 不显示或卡顿
 MAX_REPLY_LENGTH = 2000
 
+# 检测客户端断开的轮询间隔（秒）
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# finished 阶段总结尚未就绪时的回复
+OBSERVER_PENDING_REPLY = "（对话观察者正在整理总结，稍后可在总结中查看）"
+
+# ---------- 状态机参数（python -m simulate 可覆盖后批量跑玩家脚本调参） ----------
+
+# 玩家当前消息包含这些关键词时进入对应的专家阶段（见 _detect_focus_flags）
+RELIGION_KEYWORDS = [
+    "宗教", "清真", "穆斯林", "伊斯兰", "犹太", "洁食",
+    "halal", "kosher", "斋月", "素食", "纯素", "vegan",
+    "信仰", "禁忌", "不吃猪", "不吃牛",
+]
+ALLERGY_KEYWORDS = [
+    "过敏", "花生", "坚果", "海鲜", "虾", "蟹", "贝类",
+    "乳糖", "牛奶", "奶制品", "麸质", "gluten", "小麦",
+    "不耐受", "敏感",
+]
+
+# 专家阶段持续的回合数，之后回到 small_talk（两个话题都谈过则进入 wrap_up）
+EXPERT_TURNS = 3
+
+# wrap_up 阶段玩家消息包含这些词时视为确认，进入 finished
+WRAP_UP_AFFIRMATIVE_WORDS = ["是", "好了", "可以", "没问题", "考虑清楚了", "没了", "没有"]
+
 
-def _format_conversation_history(messages: list[dict]) -> str:
-    """将会话消息列表格式化为传给模型的文本（玩家: / 角色: ）。"""
+def _to_message_items(msgs) -> list[MessageItem]:
+    """将内部消息记录转为 API 返回的 MessageItem 列表。"""
+    return [MessageItem(role=m.role, name=m.name, content=m.content) for m in msgs]
+
+
+def _format_conversation_history(messages: MessageLog, full: bool = False) -> str:
+    """将会话消息列表格式化为传给模型的文本（玩家: / 角色: ）。
+
+    当前会话因 token 预算被压缩过时只保留最近几条（full=True 时总是完整记录）。
+    """
     lines: list[str] = []
+    limit = None if full else TOKENS.history_limit()
+    if limit is not None and len(messages) > limit:
+        lines.append(f"（更早的 {len(messages) - limit} 条对话已省略）")
+        messages = messages[len(messages) - limit:]
     for m in messages:
-        role, name, content = m.get("role"), m.get("name"), m.get("content", "")
+        role, name, content = m.role, m.name, m.content
         if role == "user":
             lines.append(f"玩家: {content}")
         elif role == "model" and name:
@@ -171,10 +277,16 @@ def _strip_thinking(text: str) -> str:
     return text
 
 
-def _get_reply_from_events(events):
-    """从 ADK 产生的 events 中拼接出 model 的最终文本回复。
-    跳过已出现过的相同文本块（避免模型重复导致超长），并限制总长度。
-    """
+def _clean_reply(text: str) -> str | None:
+    """去掉思考过程并限制长度；结果为空时返回 None。"""
+    reply = _strip_thinking(text.strip()) or None
+    if reply and len(reply) > MAX_REPLY_LENGTH:
+        reply = reply[:MAX_REPLY_LENGTH].rstrip() + "…"
+    return reply
+
+
+def _events_text(events) -> str:
+    """拼接 ADK events 中 model 的原始文本，跳过已出现过的相同文本块。"""
     parts = []
     seen = set()
     for evt in events:
@@ -193,10 +305,54 @@ def _get_reply_from_events(events):
                 continue
             seen.add(text)
             parts.append(text)
-    reply = _strip_thinking("".join(parts).strip()) or None
-    if reply and len(reply) > MAX_REPLY_LENGTH:
-        reply = reply[:MAX_REPLY_LENGTH].rstrip() + "…"
-    return reply
+    return "".join(parts)
+
+
+def _get_reply_from_events(events):
+    """从 ADK 产生的 events 中拼接出 model 的最终文本回复。
+    跳过已出现过的相同文本块（避免模型重复导致超长），并限制总长度。
+    """
+    return _clean_reply(_events_text(events))
+
+
+def _parse_combined_reply(text: str, cast: list[tuple[str, str]]) -> list[tuple[str, str]]:
+    """把合并调用的输出拆成 [(persona_id, 发言), ...]。
+
+    优先解析 JSON 数组；模型没按格式输出时退回按 "Mikko: ..." 行拆分。
+    每条发言都经过 _clean_reply；不在 cast 中的名字与重复的发言者被丢弃。
+    """
+    by_name = {display.lower(): pid for pid, display in cast}
+    text = re.sub(r"<think>.*?</think>", "", text or "", flags=re.DOTALL | re.IGNORECASE)
+
+    items = []
+    start, end = text.find("["), text.rfind("]")
+    if start != -1 and end > start:
+        try:
+            data = json.loads(text[start:end + 1])
+        except ValueError:
+            data = None
+        if isinstance(data, list):
+            items = [
+                (str(d.get("name", "")), str(d.get("content", "")))
+                for d in data if isinstance(d, dict)
+            ]
+    if not items:
+        for line in text.splitlines():
+            m = re.match(r"^\s*(?:【(\w+)】|(\w+)\s*[:：])\s*(.+)$", line)
+            if m:
+                items.append((m.group(1) or m.group(2), m.group(3)))
+
+    result = []
+    seen = set()
+    for name, content in items:
+        pid = by_name.get(name.strip().lower())
+        if pid is None or pid in seen:
+            continue
+        reply = _clean_reply(content)
+        if reply:
+            seen.add(pid)
+            result.append((pid, reply))
+    return result
 
 
 def _session_id(persona_id: str, conversation_id: str | None = None) -> str:
@@ -214,36 +370,91 @@ def _detect_focus_flags(user_content: str) -> tuple[bool, bool]:
     Returns:
         (has_religion_focus, has_allergy_focus)
     """
-    religion_keywords = [
-        "宗教", "清真", "穆斯林", "伊斯兰", "犹太", "洁食", 
-        "halal", "kosher", "斋月", "素食", "纯素", "vegan",
-        "信仰", "禁忌", "不吃猪", "不吃牛",
-    ]
-    allergy_keywords = [
-        "过敏", "花生", "坚果", "海鲜", "虾", "蟹", "贝类",
-        "乳糖", "牛奶", "奶制品", "麸质", "gluten", "小麦",
-        "不耐受", "敏感",
-    ]
-
     content = user_content.lower()
-    has_religion_focus = any(kw in content for kw in religion_keywords)
-    has_allergy_focus = any(kw in content for kw in allergy_keywords)
+    has_religion_focus = any(kw in content for kw in RELIGION_KEYWORDS)
+    has_allergy_focus = any(kw in content for kw in ALLERGY_KEYWORDS)
 
     return has_religion_focus, has_allergy_focus
 
 
+def _user_id(session_id: str) -> str:
+    """ADK session 的 user_id：会话所属玩家；default_ 兼容会话属于 DEFAULT_PLAYER_ID。"""
+    c = CONVERSATIONS.get(session_id)
+    return c.player_id if c is not None else DEFAULT_PLAYER_ID
+
+
 async def _get_or_create_session(runner, app_name: str, session_id: str):
     """获取或创建指定 persona 的 session。"""
+    user_id = _user_id(session_id)
     session = await runner.session_service.get_session(
-        app_name=app_name, user_id=USER_ID, session_id=session_id
+        app_name=app_name, user_id=user_id, session_id=session_id
     )
     if session is None:
         session = await runner.session_service.create_session(
-            app_name=app_name, user_id=USER_ID, session_id=session_id
+            app_name=app_name, user_id=user_id, session_id=session_id
         )
     return session
 
 
+async def _delete_sessions(conversation_id: str, player_id: str) -> None:
+    """删除会话在各 persona ADK session 服务中的 session。
+
+    快速档与委托模式的 Runner 与标准档共用 session 服务，不需要单独处理。
+    """
+    runners = list(personas.RUNNERS.values()) + list(personas.COMBINED_RUNNERS.values())
+    for runner in runners:
+        await runner.session_service.delete_session(
+            app_name=runner.app_name, user_id=player_id, session_id=conversation_id
+        )
+
+
+async def _compact_context(conversation_id: str) -> None:
+    """压缩会话上下文：清空各 persona 的 ADK session（其中保存着之前的完整 prompt）。
+
+    之后 prompt 里的对话记录只保留最近 TOKEN_COMPACT_KEEP_MESSAGES 条（见 _format_conversation_history）。
+    """
+    await _delete_sessions(conversation_id, _user_id(conversation_id))
+    print(f"[TOKENS] {conversation_id}: 用量接近 token 预算，已压缩上下文")
+
+
+async def _forget_conversation(conversation_id: str, reason: str) -> None:
+    """释放会话占用的全部内存：消息、状态、会话锁、后台总结、ADK session、用量、录制与时间线。"""
+    player_id = _user_id(conversation_id)
+    CONVERSATIONS.pop(conversation_id, None)
+    CONVERSATION_STATES.pop(conversation_id, None)
+    CONVERSATION_INDEX.remove(conversation_id)
+    TURN_GATES.discard(conversation_id)
+    OBSERVER_JOBS.discard(conversation_id)
+    TOKENS.forget(conversation_id)
+    CASSETTES.forget(conversation_id)
+    TRACES.forget(conversation_id)
+    await _delete_sessions(conversation_id, player_id)
+    METRICS.inc("conversations_evicted_total", reason=reason)
+    METRICS.set_gauge("conversations", len(CONVERSATIONS))
+
+
+def _conversation_busy(conversation_id: str) -> bool:
+    """会话是否正忙：有进行中或等锁的回合（含正在生成开场的创建）、或有排队中的异步回合。"""
+    return TURN_GATES.busy(conversation_id) or TURN_JOBS.pending(conversation_id)
+
+
+async def _evict_conversations(keep: str) -> None:
+    """会话数超过 MAX_CONVERSATIONS 时按创建顺序淘汰最早的空闲会话（正忙的与 keep 跳过）。"""
+    if MAX_CONVERSATIONS <= 0 or len(CONVERSATIONS) <= MAX_CONVERSATIONS:
+        return
+    excess = len(CONVERSATIONS) - MAX_CONVERSATIONS
+    victims = []
+    for cid in CONVERSATIONS:
+        if len(victims) >= excess:
+            break
+        if cid != keep and not _conversation_busy(cid):
+            victims.append(cid)
+    for cid in victims:
+        await _forget_conversation(cid, "limit")
+    if victims:
+        print(f"[MEMORY] 会话数超过 {MAX_CONVERSATIONS}，已淘汰 {len(victims)} 个最早的空闲会话")
+
+
 async def _run_chat_round(conversation_id: str, persona_ids: list[str], user_content: str) -> str:
     """在指定会话中追加用户消息，调用 ADK 生成回复并追加到会话，返回合并后的回复文本。
 
@@ -260,37 +471,40 @@ async def _run_chat_round(conversation_id: str, persona_ids: list[str], user_con
 
     # 初始化会话状态
     if conversation_id not in CONVERSATION_STATES:
-        CONVERSATION_STATES[conversation_id] = {
-            "phase": "small_talk",
-            "religion_discussed": False,
-            "allergy_discussed": False,
-            "sub_agent_turns": 0,
-        }
+        CONVERSATION_STATES[conversation_id] = PhaseState()
 
     state = CONVERSATION_STATES[conversation_id]
-    messages = conv["messages"]
-    messages.append({"role": "user", "name": None, "content": user_content})
+    messages = conv.messages
+    messages.append(Message("user", None, user_content))
+
+    # === token 预算 ===
+    budget_action = TOKENS.budget_action(conversation_id)
+    if budget_action == "compact":
+        await _compact_context(conversation_id)
+    elif budget_action == "wrap_up" and state.phase in ("small_talk", "religion_deep", "allergy_deep"):
+        print(f"[TOKENS] {conversation_id}: 超出 token 预算，{state.phase} -> wrap_up")
+        state.phase = "wrap_up"
 
     # 获取当前状态
-    phase = state["phase"]
+    phase = state.phase
 
     # === 状态机逻辑 ===
     if phase == "small_talk":
         # 只检测玩家当前消息是否主动提到相关话题
         has_religion, has_allergy = _detect_focus_flags(user_content)
 
-        if has_religion and not state["religion_discussed"]:
-            state["phase"] = "religion_deep"
-            state["sub_agent_turns"] = 0
+        if has_religion and not state.religion_discussed:
+            state.phase = "religion_deep"
+            state.sub_agent_turns = 0
             phase = "religion_deep"  # 立即更新当前 phase
             print(f"[STATE] {conversation_id}: small_talk -> religion_deep")
-        elif has_allergy and not state["allergy_discussed"]:
-            state["phase"] = "allergy_deep"
-            state["sub_agent_turns"] = 0
+        elif has_allergy and not state.allergy_discussed:
+            state.phase = "allergy_deep"
+            state.sub_agent_turns = 0
             phase = "allergy_deep"  # 立即更新当前 phase
             print(f"[STATE] {conversation_id}: small_talk -> allergy_deep")
-        elif state["religion_discussed"] and state["allergy_discussed"]:
-            state["phase"] = "wrap_up"
+        elif state.religion_discussed and state.allergy_discussed:
+            state.phase = "wrap_up"
             phase = "wrap_up"  # 立即更新当前 phase
             print(f"[STATE] {conversation_id}: small_talk -> wrap_up")
         else:
@@ -298,47 +512,70 @@ async def _run_chat_round(conversation_id: str, persona_ids: list[str], user_con
             pass
 
     elif phase == "religion_deep":
-        state["sub_agent_turns"] += 1
-        # 3-4轮后返回
-        if state["sub_agent_turns"] >= 3:
-            state["religion_discussed"] = True
-            if state["allergy_discussed"]:
-                state["phase"] = "wrap_up"
+        state.sub_agent_turns += 1
+        # EXPERT_TURNS 轮后返回
+        if state.sub_agent_turns >= EXPERT_TURNS:
+            state.religion_discussed = True
+            if state.allergy_discussed:
+                state.phase = "wrap_up"
             else:
-                state["phase"] = "small_talk"
-            print(f"[STATE] {conversation_id}: religion_deep -> {state['phase']}")
+                state.phase = "small_talk"
+            print(f"[STATE] {conversation_id}: religion_deep -> {state.phase}")
 
     elif phase == "allergy_deep":
-        state["sub_agent_turns"] += 1
-        # 3-4轮后返回
-        if state["sub_agent_turns"] >= 3:
-            state["allergy_discussed"] = True
-            if state["religion_discussed"]:
-                state["phase"] = "wrap_up"
+        state.sub_agent_turns += 1
+        # EXPERT_TURNS 轮后返回
+        if state.sub_agent_turns >= EXPERT_TURNS:
+            state.allergy_discussed = True
+            if state.religion_discussed:
+                state.phase = "wrap_up"
             else:
-                state["phase"] = "small_talk"
-            print(f"[STATE] {conversation_id}: allergy_deep -> {state['phase']}")
+                state.phase = "small_talk"
+            print(f"[STATE] {conversation_id}: allergy_deep -> {state.phase}")
 
     elif phase == "wrap_up":
         # 检测玩家是否确认
         user_lower = user_content.lower()
-        affirmative_words = ["是", "好了", "可以", "没问题", "考虑清楚了", "没了", "没有"]
-        if any(word in user_lower for word in affirmative_words):
-            state["phase"] = "finished"
+        if any(word in user_lower for word in WRAP_UP_AFFIRMATIVE_WORDS):
+            state.phase = "finished"
             print(f"[STATE] {conversation_id}: wrap_up -> finished")
 
+    CONVERSATION_INDEX.set_phase(conversation_id, state.phase)
+
     # === 根据状态调用对应的 Agent ===
+    with TOKENS.track(conversation_id, phase), TRACES.span("respond_in_phase", phase=phase):
+        return await _respond_in_phase(conversation_id, user_content, messages, state, phase)
+
+
+async def _respond_in_phase(
+    conversation_id: str, user_content: str, messages: MessageLog, state: PhaseState, phase: str
+) -> str:
+    """按本回合所处阶段调用对应的 Agent，返回合并后的回复文本。"""
     if phase == "small_talk":
         # 芬兰学生闲聊
-        return await _finnish_students_respond(conversation_id, user_content, messages)
+        # 负载高时闲聊改用快速档模型
+        tier = ROUTING.choose_tier(conversation_id, phase)
+        return await _finnish_students_respond(conversation_id, user_content, messages, tier=tier)
     elif phase == "religion_deep":
         # 宗教专家附身 Mikko
+        if personas.ORCHESTRATION_MODE == "delegation":
+            reply = await _delegated_expert_respond(conversation_id, user_content, messages, phase)
+            if reply:
+                return reply
+        # Aino 可以补充（可选，压力很高时跳过）
+        with_sidekick = ROUTING.allow_optional(conversation_id, "sidekick")
+        if with_sidekick and personas.ORCHESTRATION_MODE == "combined":
+            reply = await _combined_expert_respond(conversation_id, user_content, messages, "religion_deep")
+            if reply:
+                return reply
         expert_reply = await _expert_respond(
             conversation_id, user_content, messages,
             expert_id="religion_expert",
             expert_display_name="Mikko",
+            phase=phase,
         )
-        # Aino 可以补充（可选）
+        if not with_sidekick:
+            return expert_reply
         aino_reply = await _call_agent(
             conversation_id, "aino",
             f"【对话记录】\n{_format_conversation_history(messages)}\n\nMikko 刚刚说了关于宗教饮食禁忌的内容：{expert_reply}\n\n玩家说：{user_content}\n\n请简短回应或补充，1句话即可。",
@@ -349,12 +586,24 @@ async def _run_chat_round(conversation_id: str, persona_ids: list[str], user_con
         return expert_reply
     elif phase == "allergy_deep":
         # 过敏专家附身 Aino
+        if personas.ORCHESTRATION_MODE == "delegation":
+            reply = await _delegated_expert_respond(conversation_id, user_content, messages, phase)
+            if reply:
+                return reply
+        # Mikko 可以补充（可选，压力很高时跳过）
+        with_sidekick = ROUTING.allow_optional(conversation_id, "sidekick")
+        if with_sidekick and personas.ORCHESTRATION_MODE == "combined":
+            reply = await _combined_expert_respond(conversation_id, user_content, messages, "allergy_deep")
+            if reply:
+                return reply
         expert_reply = await _expert_respond(
             conversation_id, user_content, messages,
             expert_id="allergy_expert",
             expert_display_name="Aino",
+            phase=phase,
         )
-        # Mikko 可以补充（可选）
+        if not with_sidekick:
+            return expert_reply
         mikko_reply = await _call_agent(
             conversation_id, "mikko",
             f"【对话记录】\n{_format_conversation_history(messages)}\n\nAino 刚刚说了关于食物过敏的内容：{expert_reply}\n\n玩家说：{user_content}\n\n请简短回应或补充，1句话即可。",
@@ -366,52 +615,147 @@ async def _run_chat_round(conversation_id: str, persona_ids: list[str], user_con
     elif phase == "wrap_up":
         # 芬兰学生收尾
         reply = await _finnish_students_respond(conversation_id, user_content, messages)
-        # 如果已进入 finished，调用 Observer
-        if state["phase"] == "finished":
-            observer_reply = await _call_observer(conversation_id, messages)
-            return f"{reply}\n\n{observer_reply}"
+        # 如果已进入 finished，在后台低优先级生成 Observer 总结，玩家先拿到回复
+        if state.phase == "finished":
+            OBSERVER_JOBS.schedule(conversation_id, _transcript_length(messages))
         return reply
     elif phase == "finished":
-        # 已完成，只返回 Observer 总结
-        return await _call_observer(conversation_id, messages)
+        # 已完成，返回 Observer 总结（未就绪时提示稍候），同时作为 Observer 消息写入本轮
+        job = OBSERVER_JOBS.get(conversation_id)
+        if job is None or job.status == "failed":
+            job = OBSERVER_JOBS.schedule(conversation_id, _transcript_length(messages))
+        content = job.summary if job.status == "ready" and job.summary else OBSERVER_PENDING_REPLY
+        persona_name = personas.PERSONAS["observer"]["name"]
+        messages.append(Message("model", persona_name, content))
+        return f"{persona_name}: {content}"
 
     return "（对话状态异常，请重启会话）"
 
 
-async def _call_agent(conversation_id: str, persona_id: str, prompt: str, messages: list[dict]) -> str:
-    """调用单个 Agent。"""
-    runner = personas.RUNNERS[persona_id]
+async def _run_agent_stream(runner, persona_id: str, session_id: str, new_message) -> list:
+    """驱动一次 runner.run_async 并收集全部 events。
+
+    调用先向 SCHEDULER 申请槽位（优先级取自 scheduler.CALL_PRIORITY）。
+    被取消（如客户端断开）时关闭模型流，并计入 agent_calls_cancelled_total。
+    完成的调用耗时（含排队）计入 agent_call_seconds，并喂给 ROUTING 计算 p95；
+    token 用量记入 TOKENS（按当前 TOKENS.track 的会话与阶段）。
+    event 流由 CASSETTES 提供：录制模式下同时写入 cassette，回放中不调用 runner。
+    """
+    persona_name = personas.PERSONAS[persona_id]["name"] if persona_id in personas.PERSONAS else persona_id
+    events = []
+    started = time.perf_counter()
+    try:
+        # 经过全局调度器：后端饱和时交互回合优先于后台任务
+        async with SCHEDULER.slot(), aclosing(
+            CASSETTES.stream(runner, _user_id(session_id), persona_id, session_id, new_message)
+        ) as stream:
+            streaming = time.perf_counter()
+            TRACES.record("scheduler_wait", started, streaming, "queue", persona=persona_id)
+            try:
+                async for evt in stream:
+                    TRACES.instant("first_event" if not events else "event", "model", persona=persona_id)
+                    events.append(evt)
+
+                    # Log tool call events
+                    if hasattr(evt, 'content') and evt.content:
+                        if hasattr(evt.content, 'parts'):
+                            for part in evt.content.parts or []:
+                                if hasattr(part, 'function_call') and part.function_call is not None and getattr(part.function_call, 'name', None) is not None:
+                                    print(f"[TOOL CALL] {persona_name} -> {part.function_call.name}({part.function_call.args})")
+                                elif hasattr(part, 'function_response') and part.function_response is not None and getattr(part.function_response, 'response', None) is not None:
+                                    print(f"[TOOL RESULT] {persona_name} <- {part.function_response.response}")
+            finally:
+                TRACES.record(
+                    "model_stream", streaming, time.perf_counter(), "model", persona=persona_id, events=len(events)
+                )
+    except asyncio.CancelledError:
+        METRICS.inc("agent_calls_cancelled_total", persona=persona_id)
+        raise
+    elapsed = time.perf_counter() - started
+    METRICS.observe("agent_call_seconds", elapsed, persona=persona_id)
+    ROUTING.record_latency(elapsed)
+    TOKENS.record_events(persona_id, getattr(runner, "agent", None), new_message, events)
+    return events
+
+
+async def _agent_reply(runner, persona_id: str, session_id: str, prompt: str, cacheable: bool = False) -> str | None:
+    """运行一次 Agent，返回清洗后的回复文本。
+
+    cacheable=True 表示 prompt 是确定性的（如固定开场、对同一对话记录的总结）：
+    persona 开启了 cache_responses 时先查 RESPONSE_CACHE，命中就不再调用模型。
+    """
+    key = None
+    if cacheable and personas.PERSONAS.get(persona_id, {}).get("cache_responses"):
+        key = cache_key(persona_id, runner.agent, prompt)
+        cached = await RESPONSE_CACHE.get(key, persona_id)
+        if cached is not None:
+            return cached
+
+    new_message = types.Content(role="user", parts=[types.Part(text=prompt)])
+    events = await _run_agent_stream(runner, persona_id, session_id, new_message)
+    with TRACES.span("post_process", persona=persona_id):
+        ai_reply = _get_reply_from_events(events)
+    if key is not None and ai_reply:
+        await RESPONSE_CACHE.put(key, ai_reply)
+    return ai_reply
+
+
+async def _call_agent(
+    conversation_id: str,
+    persona_id: str,
+    prompt: str,
+    messages: MessageLog,
+    tier: str = "standard",
+    cacheable: bool = False,
+) -> str:
+    """调用单个 Agent。tier="fast" 时使用该 persona 的快速档模型（若有）；
+    cacheable 见 _agent_reply。"""
+    runner = personas.get_runner(persona_id, tier)
     app_name = f"persona_{persona_id}"
     session_id = _session_id(persona_id, conversation_id)
     persona_name = personas.PERSONAS[persona_id]["name"]
 
-    await _get_or_create_session(runner, app_name, session_id)
+    with TRACES.span("call_agent", "agent", persona=persona_id, tier=tier):
+        with TRACES.span("session_fetch", "session", persona=persona_id):
+            await _get_or_create_session(runner, app_name, session_id)
 
-    new_message = types.Content(role="user", parts=[types.Part(text=prompt)])
-    events = []
-    async for evt in runner.run_async(
-        user_id=USER_ID, session_id=session_id, new_message=new_message
-    ):
-        events.append(evt)
-
-        # Log tool call events
-        if hasattr(evt, 'content') and evt.content:
-            if hasattr(evt.content, 'parts'):
-                for part in evt.content.parts or []:
-                    if hasattr(part, 'function_call') and part.function_call is not None and getattr(part.function_call, 'name', None) is not None:
-                        print(f"[TOOL CALL] {persona_name} -> {part.function_call.name}({part.function_call.args})")
-                    elif hasattr(part, 'function_response') and part.function_response is not None and getattr(part.function_response, 'response', None) is not None:
-                        print(f"[TOOL RESULT] {persona_name} <- {part.function_response.response}")
-
-    ai_reply = _get_reply_from_events(events)
+        # 只有完整收到回复后才写入 messages，被取消时不会留下半条消息
+        ai_reply = await _agent_reply(runner, persona_id, session_id, prompt, cacheable=cacheable)
     if ai_reply:
-        messages.append({"role": "model", "name": persona_name, "content": ai_reply})
+        messages.append(Message("model", persona_name, ai_reply))
         return ai_reply
 
     return ""
 
 
-def _decide_speaker_order(messages: list[dict], user_content: str) -> list[str]:
+async def _call_combined(
+    conversation_id: str, cast_key: str, speakers: list[str], prompt: str, messages: MessageLog
+) -> list[tuple[str, str]]:
+    """一次调用生成多位角色的发言，按角色拆开写入 messages。
+
+    speakers 为本回合应发言的 persona_id；返回 [(persona_id, 发言), ...]，
+    解析不出任何发言时返回空列表（调用方退回逐个角色调用）。
+    """
+    cast = [(pid, display) for pid, display in personas.COMBINED_CASTS[cast_key] if pid in speakers]
+    runner = personas.COMBINED_RUNNERS[cast_key]
+    session_id = _session_id(cast_key, conversation_id)
+
+    with TRACES.span("session_fetch", "session", persona=f"combined_{cast_key}"):
+        await _get_or_create_session(runner, runner.app_name, session_id)
+
+    new_message = types.Content(role="user", parts=[types.Part(text=prompt)])
+    events = await _run_agent_stream(runner, f"combined_{cast_key}", session_id, new_message)
+
+    replies = _parse_combined_reply(_events_text(events), cast)
+    if not replies:
+        METRICS.inc("combined_fallbacks_total", cast=cast_key)
+        print(f"[COMBINED] {conversation_id}: 无法解析合并发言，改为逐个角色调用")
+    for pid, reply in replies:
+        messages.append(Message("model", personas.PERSONAS[pid]["name"], reply))
+    return replies
+
+
+def _decide_speaker_order(messages: MessageLog, user_content: str) -> list[str]:
     """动态决定发言顺序。
     
     规则：
@@ -434,8 +778,8 @@ def _decide_speaker_order(messages: list[dict], user_content: str) -> list[str]:
         # 规则2/3: 交替发言
         last_speaker = None
         for msg in reversed(messages):
-            if msg.get("role") == "model" and msg.get("name") in ["Mikko", "Aino"]:
-                last_speaker = msg["name"].lower()
+            if msg.role == "model" and msg.name in ["Mikko", "Aino"]:
+                last_speaker = msg.name.lower()
                 break
         
         if last_speaker == "mikko":
@@ -454,13 +798,29 @@ def _decide_speaker_order(messages: list[dict], user_content: str) -> list[str]:
     return [first, second]
 
 
-async def _finnish_students_respond(conversation_id: str, user_content: str, messages: list[dict]) -> str:
-    """两个芬兰学生轮流响应玩家。"""
+async def _finnish_students_respond(
+    conversation_id: str, user_content: str, messages: MessageLog, tier: str = "standard"
+) -> str:
+    """两个芬兰学生轮流响应玩家。压力很高时只保留第一位发言者。"""
     speaker_order = _decide_speaker_order(messages, user_content)
+    if len(speaker_order) > 1 and not ROUTING.allow_optional(conversation_id, "second_speaker"):
+        speaker_order = speaker_order[:1]
 
     replies = []
     history_text = _format_conversation_history(messages)
 
+    if personas.ORCHESTRATION_MODE == "combined" and tier == "standard":
+        # 一次调用生成所有发言者的回复
+        names = "、".join(personas.PERSONAS[pid]["name"] for pid in speaker_order)
+        prompt_parts = [f"【对话记录】\n{history_text}"] if history_text else []
+        prompt_parts.append(f"玩家说：{user_content}")
+        prompt_parts.append(f"请按顺序给出 {names} 的回应（后说的人可以接前面的话），每人1-2句话。")
+        combined = await _call_combined(
+            conversation_id, "students", speaker_order, "\n\n".join(prompt_parts), messages
+        )
+        if combined:
+            return "\n\n".join(f"{personas.PERSONAS[pid]['name']}: {reply}" for pid, reply in combined)
+
     for persona_id in speaker_order:
         other_name = "Aino" if persona_id == "mikko" else "Mikko"
         persona_name = personas.PERSONAS[persona_id]["name"]
@@ -481,7 +841,7 @@ async def _finnish_students_respond(conversation_id: str, user_content: str, mes
 
         prompt = "\n\n".join(prompt_parts)
 
-        reply = await _call_agent(conversation_id, persona_id, prompt, messages)
+        reply = await _call_agent(conversation_id, persona_id, prompt, messages, tier=tier)
         if reply:
             # 带上名字前缀
             replies.append(f"{persona_name}: {reply}")
@@ -489,21 +849,44 @@ async def _finnish_students_respond(conversation_id: str, user_content: str, mes
     return "\n\n".join(replies) if replies else "（Mikko 和 Aino 暂时不知道说什么）"
 
 
+def _knowledge_block(expert_id: str, user_content: str, messages: MessageLog) -> str:
+    """从本地知识库检索与玩家问题相关的事实，作为专家 prompt 的【参考资料】段落。
+
+    追问（如"那替代品呢？"）本身检索不到东西时，改用玩家上一句话检索。
+    """
+    domain = personas.PERSONAS.get(expert_id, {}).get("knowledge_domain")
+    if not domain:
+        return ""
+    facts = retrieve(user_content, domain)
+    if not facts:
+        previous = next(
+            (m.content for m in reversed(messages) if m.role == "user" and m.content != user_content), ""
+        )
+        if previous:
+            facts = retrieve(f"{previous} {user_content}", domain)
+    return format_facts(facts)
+
+
 async def _expert_respond(
     conversation_id: str,
     user_content: str,
-    messages: list[dict],
+    messages: MessageLog,
     expert_id: str,
     expert_display_name: str,
+    phase: str | None = None,
 ) -> str:
     """Expert 附身模式：专家以角色身份回应玩家。
 
+    prompt 中附上从知识库检索到的 top-k 相关事实（见 knowledge_base.py）。
+    玩家问题与此前某个问题近似重复时，直接复用 SEMANTIC_CACHE 中的回答（按专家与阶段分区）。
+
     Args:
         conversation_id: 会话 ID
         user_content: 玩家消息
         messages: 对话历史
         expert_id: 专家 persona ID（如 "religion_expert"）
         expert_display_name: 显示名称（如 "Mikko"）
+        phase: 当前阶段（如 "religion_deep"），用于语义缓存分区
 
     Returns:
         专家的回复（带名字前缀）
@@ -514,13 +897,23 @@ async def _expert_respond(
     if history_text:
         prompt_parts.append(f"【对话记录】\n{history_text}")
 
+    knowledge = _knowledge_block(expert_id, user_content, messages)
+    if knowledge:
+        prompt_parts.append(knowledge)
+
     prompt_parts.append(f"玩家说：{user_content}")
     prompt_parts.append("请用你的专业知识回应，2-3句话即可。")
 
     prompt = "\n\n".join(prompt_parts)
 
-    # 调用专家 Agent
-    reply = await _call_agent(conversation_id, expert_id, prompt, messages)
+    scope = (expert_id, phase or "")
+    reply = SEMANTIC_CACHE.lookup(scope, user_content)
+    if reply:
+        messages.append(Message("model", personas.PERSONAS[expert_id]["name"], reply))
+    else:
+        # 调用专家 Agent
+        reply = await _call_agent(conversation_id, expert_id, prompt, messages)
+        SEMANTIC_CACHE.store(scope, user_content, reply)
 
     if reply:
         # 检查是否包含 [DONE] 标记（专家认为讨论完成）
@@ -533,37 +926,124 @@ async def _expert_respond(
     return f"（{expert_display_name} 正在思考...）"
 
 
-async def _call_observer(conversation_id: str, messages: list[dict]) -> str:
-    """调用 Observer 生成总结。"""
+async def _combined_expert_respond(
+    conversation_id: str, user_content: str, messages: MessageLog, cast_key: str
+) -> str | None:
+    """合并模式下的专家回合：一次调用同时生成专家回应与搭档补充。
+
+    Returns:
+        带名字前缀的回复；解析失败时返回 None（调用方退回逐个角色调用）
+    """
+    cast = personas.COMBINED_CASTS[cast_key]
+    (_, expert_name), (_, sidekick_name) = cast
+    history_text = _format_conversation_history(messages)
+
+    prompt_parts = [f"【对话记录】\n{history_text}"] if history_text else []
+    knowledge = _knowledge_block(cast[0][0], user_content, messages)
+    if knowledge:
+        prompt_parts.append(knowledge)
+    prompt_parts.append(f"玩家说：{user_content}")
+    prompt_parts.append(
+        f"请先由 {expert_name} 用专业知识回应，2-3句话；再由 {sidekick_name} 简短回应或补充，1句话即可。"
+    )
+
+    replies = await _call_combined(
+        conversation_id, cast_key, [pid for pid, _ in cast], "\n\n".join(prompt_parts), messages
+    )
+    if not replies:
+        return None
+    display = dict(cast)
+    return "\n\n".join(f"{display[pid]}: {reply.replace('[DONE]', '').strip()}" for pid, reply in replies)
+
+
+async def _delegated_expert_respond(
+    conversation_id: str, user_content: str, messages: MessageLog, phase: str
+) -> str | None:
+    """委托模式下的专家回合：附身的学生在一次 run_async 内调用专家工具并作答。
+
+    工具调用上限、各工具耗时与 token 统计由 delegation.DelegationPlugin 负责。
+
+    Returns:
+        带名字前缀的回复；没有得到回复时返回 None（调用方退回状态机路径）
+    """
+    host_id = personas.DELEGATION_HOSTS[phase]
+    runner = personas.DELEGATION_RUNNERS[host_id]
+    session_id = _session_id(host_id, conversation_id)
+    host_name = personas.PERSONAS[host_id]["name"]
+
+    await _get_or_create_session(runner, runner.app_name, session_id)
+
+    history_text = _format_conversation_history(messages)
+    prompt_parts = [f"【对话记录】\n{history_text}"] if history_text else []
+    prompt_parts.append(f"玩家说：{user_content}")
+    prompt_parts.append("请回应玩家，需要专业饮食知识时先咨询专家，2-3句话即可。")
+    new_message = types.Content(role="user", parts=[types.Part(text="\n\n".join(prompt_parts))])
+
+    with delegation.track_turn() as usage:
+        events = await _run_agent_stream(runner, host_id, session_id, new_message)
+    print(f"[DELEGATION] {conversation_id}: {json.dumps(usage.to_dict(), ensure_ascii=False)}")
+
+    # 只取最终回复：调用工具前模型附带的过渡语不展示给玩家
+    reply = _get_reply_from_events([evt for evt in events if evt.is_final_response()])
+    if not reply:
+        METRICS.inc("delegation_fallbacks_total", phase=phase)
+        return None
+    reply = reply.replace("[DONE]", "").strip()
+    messages.append(Message("model", host_name, reply))
+    return f"{host_name}: {reply}"
+
+
+def _transcript_length(messages: MessageLog) -> int:
+    """被总结的对话记录长度：不含 Observer 自己的消息（总结写回 messages 不会让总结过期）。"""
+    persona_name = personas.PERSONAS["observer"]["name"]
+    return sum(1 for m in messages if m.name != persona_name)
+
+
+async def _summarize_in_background(conversation_id: str) -> tuple[str, int]:
+    """后台总结任务：生成总结后在会话锁内写入 messages，避免混进进行中的回合。
+
+    返回 (总结文本, 总结覆盖的对话记录长度)；生成期间新增的消息不算在内，之后的总结请求会重新生成。
+    """
+    c = CONVERSATIONS.get(conversation_id)
+    if not c:
+        raise ValueError(f"conversation not found: {conversation_id}")
+    covered = _transcript_length(c.messages)
+    with TOKENS.track(conversation_id, "summary"):
+        ai_reply = await _generate_observer_reply(conversation_id, c.messages)
+    if not ai_reply:
+        return "", covered
+    persona_name = personas.PERSONAS["observer"]["name"]
+    async with TURN_GATES.get(conversation_id).lock:
+        c.messages.append(Message("model", persona_name, ai_reply))
+    return ai_reply, covered
+
+
+# Observer 后台总结任务（会话进入 finished 时调度）
+OBSERVER_JOBS = ObserverJobs(_summarize_in_background)
+
+
+async def _generate_observer_reply(conversation_id: str, messages: MessageLog) -> str | None:
+    """让 Observer 总结当前对话，返回总结文本（不写入 messages）。"""
     runner = personas.RUNNERS["observer"]
     app_name = "persona_observer"
     session_id = _session_id("observer", conversation_id)
-    persona_name = personas.PERSONAS["observer"]["name"]
 
-    await _get_or_create_session(runner, app_name, session_id)
+    with TRACES.span("session_fetch", "session", persona="observer"):
+        await _get_or_create_session(runner, app_name, session_id)
 
-    # 传入对话历史
-    history_text = _format_conversation_history(messages)
+    # 传入完整对话历史（不含之前的 Observer 总结）；对话记录不变时总结可直接取缓存
+    persona_name = personas.PERSONAS["observer"]["name"]
+    transcript = MessageLog(m for m in messages if m.name != persona_name)
+    history_text = _format_conversation_history(transcript, full=True)
     user_msg = f"【请总结以下对话】\n\n{history_text}"
 
-    new_message = types.Content(role="user", parts=[types.Part(text=user_msg)])
-    events = []
-    async for evt in runner.run_async(
-        user_id=USER_ID, session_id=session_id, new_message=new_message
-    ):
-        events.append(evt)
+    with TRACES.span("observer_reply", "agent", persona="observer"):
+        return await _agent_reply(runner, "observer", session_id, user_msg, cacheable=True)
 
-    ai_reply = _get_reply_from_events(events)
-    if ai_reply:
-        messages.append({"role": "model", "name": persona_name, "content": ai_reply})
-        return f"\n{persona_name}: {ai_reply}"
 
-    return ""
-
-
-async def _generate_group_initial_messages(persona_ids: list[str], conversation_id: str) -> list[dict]:
-    """生成群聊开场消息，返回 MessageItem 列表。"""
-    out: list[dict] = []
+async def _generate_group_initial_messages(persona_ids: list[str], conversation_id: str) -> MessageLog:
+    """生成群聊开场消息，返回消息日志。"""
+    out = MessageLog()
 
     # 检查是否是芬兰学生组合
     is_finnish = all(pid in personas.FINNISH_STUDENTS for pid in persona_ids) if hasattr(personas, 'FINNISH_STUDENTS') else False
@@ -584,7 +1064,8 @@ async def _generate_group_initial_messages(persona_ids: list[str], conversation_
 示例：
 Moi! 今晚聚餐的事情准备得怎么样了？
 """
-        mikko_reply = await _call_agent(conversation_id, "mikko", mikko_prompt, out)
+        # 固定开场 prompt，可直接取缓存
+        mikko_reply = await _call_agent(conversation_id, "mikko", mikko_prompt, out, cacheable=True)
         
         # Aino 回应 Mikko
         if mikko_reply:
@@ -600,7 +1081,7 @@ Mikko 刚刚说：{mikko_reply}
 示例：
 Selvä! 人数大概定了吗？我在想饮食方面有没有需要注意的。
 """
-            await _call_agent(conversation_id, "aino", aino_prompt, out)
+            await _call_agent(conversation_id, "aino", aino_prompt, out, cacheable=True)
     else:
         # 通用开场（兼容其他 persona）
         names = [personas.PERSONAS[pid]["name"] for pid in persona_ids if pid in personas.PERSONAS]
@@ -614,15 +1095,9 @@ Selvä! 人数大概定了吗？我在想饮食方面有没有需要注意的。
             await _get_or_create_session(runner, app_name, session_id)
             group_context = f"【群聊模式】现在有 {len(persona_ids)} 位角色在对话：{', '.join(names)}。"
             group_context += f"你是 {persona_name}，请以你的角色身份开始对话。"
-            new_message = types.Content(role="user", parts=[types.Part(text=group_context)])
-            events = []
-            async for evt in runner.run_async(
-                user_id=USER_ID, session_id=session_id, new_message=new_message
-            ):
-                events.append(evt)
-            ai_reply = _get_reply_from_events(events)
+            ai_reply = await _agent_reply(runner, pid, session_id, group_context, cacheable=True)
             if ai_reply:
-                out.append({"role": "model", "name": persona_name, "content": ai_reply})
+                out.append(Message("model", persona_name, ai_reply))
     return out
 
 
@@ -638,9 +1113,54 @@ def list_personas():
 # ---------- RESTful: 会话与消息 ----------
 
 
+def _player_id(x_player_id: str | None = Header(None, alias=PLAYER_HEADER)) -> str:
+    """请求所属玩家（请求头 X-Player-Id，不带时为 DEFAULT_PLAYER_ID）。"""
+    try:
+        return resolve_player_id(x_player_id)
+    except ValueError as e:
+        raise HTTPException(400, detail=str(e))
+
+
+def _require_admin(x_admin_token: str | None = Header(None, alias=ADMIN_HEADER)) -> None:
+    """worker 管理接口（跨玩家读写会话）的鉴权：请求头 X-Admin-Token 须等于 ADMIN_TOKEN；未配置时一律拒绝。"""
+    if not ADMIN_TOKEN:
+        raise HTTPException(403, detail="未配置 ADMIN_TOKEN，管理接口已禁用")
+    if x_admin_token is None or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(403, detail="管理令牌无效")
+
+
+def _owned_conversation(conversation_id: str, player_id: str) -> Conversation:
+    """取玩家自己的会话；不存在或属于其他玩家时 404（不暴露其他玩家的会话是否存在）。"""
+    c = CONVERSATIONS.get(conversation_id)
+    if c is None or c.player_id != player_id:
+        raise HTTPException(404, detail="会话不存在")
+    return c
+
+
+_CONVERSATION_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def _quota_exceeded(e: PlayerQuotaExceeded) -> HTTPException:
+    return HTTPException(429, detail=str(e), headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+
+
 @app.post("/conversations", response_model=ConversationItem)
-async def create_conversation(req: CreateConversationReq):
-    """创建会话（单人或群聊）。芬兰学生讨论组会自动生成开场对话。"""
+async def create_conversation(
+    req: CreateConversationReq,
+    player_id: str = Depends(_player_id),
+    conversation_id: str | None = Header(None, alias="X-Conversation-Id"),
+):
+    """创建会话（单人或群聊）。芬兰学生讨论组会自动生成开场对话。
+
+    会话属于请求的玩家；超过 MAX_CONVERSATIONS_PER_HOUR 时返回 429。
+    多 worker 部署时会话 id 由 dispatcher 预先分配（请求头 X-Conversation-Id，32 位十六进制），
+    保证会话创建在一致性哈希选中的 worker 上。
+    """
+    if conversation_id is not None:
+        if not _CONVERSATION_ID_RE.match(conversation_id):
+            raise HTTPException(400, detail="X-Conversation-Id 应为 32 位十六进制")
+        if conversation_id in CONVERSATIONS:
+            raise HTTPException(409, detail="会话已存在")
     persona_ids = [p.strip().lower() for p in req.persona_ids if p.strip()]
     if not persona_ids:
         persona_ids = DEFAULT_PERSONAS.copy()  # 默认使用芬兰学生双人组合
@@ -650,123 +1170,487 @@ async def create_conversation(req: CreateConversationReq):
             400,
             detail=f"未知的聊天对象: {', '.join(invalid)}，可用: {', '.join(personas.PERSONAS)}。",
         )
-    conv_id = uuid.uuid4().hex
-    now = datetime.now(timezone.utc).isoformat()
-    CONVERSATIONS[conv_id] = {
-        "persona_ids": persona_ids,
-        "messages": [],
-        "created_at": now,
-    }
+    try:
+        PLAYER_QUOTAS.admit_conversation(player_id)
+    except PlayerQuotaExceeded as e:
+        raise _quota_exceeded(e)
+    conv_id = conversation_id or uuid.uuid4().hex
+    created = datetime.now(timezone.utc)
+    now = created.isoformat()
+    conv = CONVERSATIONS[conv_id] = Conversation(persona_ids=persona_ids, created_at=now, player_id=player_id)
+    CONVERSATION_INDEX.add(conv_id, persona_ids, player_id=player_id, created_at=created.timestamp())
+    METRICS.set_gauge("conversations", len(CONVERSATIONS))
+    CASSETTES.record_conversation(conv_id, persona_ids)
+    await _evict_conversations(keep=conv_id)
     # 芬兰学生讨论组或多人群聊时生成开场对话
     is_finnish_pair = all(pid in personas.FINNISH_STUDENTS for pid in persona_ids) if hasattr(personas, 'FINNISH_STUDENTS') else False
     if len(persona_ids) >= 2 or is_finnish_pair:
-        try:
-            initial = await _generate_group_initial_messages(persona_ids, conv_id)
-            CONVERSATIONS[conv_id]["messages"] = initial
-        except Exception as e:
-            print(f"[WARNING] 生成开场对话失败: {e}")
-            # 使用默认开场白
-            CONVERSATIONS[conv_id]["messages"] = [
-                {"role": "model", "name": "Mikko", "content": "Moi! 今晚聚餐准备得怎么样了？"},
-                {"role": "model", "name": "Aino", "content": "Selvä! 我们正在讨论细节呢。"}
-            ]
-    msgs = CONVERSATIONS[conv_id]["messages"]
+        # 生成开场期间持有会话锁：其他请求触发的淘汰与迁移导出会把本会话视为正忙
+        async with TURN_GATES.get(conv_id).lock:
+            try:
+                with TOKENS.track(conv_id, "opening"):
+                    initial = await _generate_group_initial_messages(persona_ids, conv_id)
+                conv.messages = MessageLog(initial)
+            except Exception as e:
+                print(f"[WARNING] 生成开场对话失败: {e}")
+                # 使用默认开场白
+                conv.messages = MessageLog([
+                    Message("model", "Mikko", "Moi! 今晚聚餐准备得怎么样了？"),
+                    Message("model", "Aino", "Selvä! 我们正在讨论细节呢。"),
+                ])
+    msgs = conv.messages
     return ConversationItem(
         id=conv_id,
         persona_ids=persona_ids,
-        messages=[MessageItem(role=m["role"], name=m.get("name"), content=m["content"]) for m in msgs],
+        messages=_to_message_items(msgs),
         created_at=now,
     )
 
 
 @app.get("/conversations", response_model=list[ConversationSummary])
-def list_conversations():
-    """返回会话列表（摘要），不含 default_ 兼容会话。"""
+def list_conversations(
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    before: int | None = None,
+    persona: str | None = None,
+    phase: str | None = None,
+    player_id: str = Depends(_player_id),
+):
+    """返回请求玩家的会话列表（摘要，新的在前），按 persona / 阶段过滤，游标分页。
+
+    响应头 X-Total-Count 为符合过滤条件的会话总数；X-Next-Cursor 为下一页的 before 参数，
+    没有更多时不返回。耗时只与 limit 有关（见 conversation_index.py）。
+    """
+    ids, next_cursor = CONVERSATION_INDEX.page(limit, before, persona, phase, player_id)
+    response.headers["X-Total-Count"] = str(CONVERSATION_INDEX.count(persona, phase, player_id))
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = str(next_cursor)
     out = []
-    for cid, c in CONVERSATIONS.items():
-        if cid.startswith("default_"):
-            continue
+    for cid in ids:
+        c = CONVERSATIONS[cid]
         out.append(
             ConversationSummary(
                 id=cid,
-                persona_ids=c["persona_ids"],
-                created_at=c["created_at"],
-                message_count=len(c["messages"]),
+                persona_ids=c.persona_ids,
+                created_at=c.created_at,
+                message_count=len(c.messages),
             )
         )
-    out.sort(key=lambda x: x.created_at, reverse=True)
     return out
 
 
 @app.get("/conversations/{conversation_id}", response_model=ConversationItem)
-def get_conversation(conversation_id: str):
+def get_conversation(conversation_id: str, player_id: str = Depends(_player_id)):
     """获取单个会话详情（含消息历史）。"""
-    c = CONVERSATIONS.get(conversation_id)
-    if not c:
-        raise HTTPException(404, detail="会话不存在")
-    msgs = c["messages"]
+    c = _owned_conversation(conversation_id, player_id)
+    msgs = c.messages
     return ConversationItem(
         id=conversation_id,
-        persona_ids=c["persona_ids"],
-        messages=[MessageItem(role=m["role"], name=m.get("name"), content=m["content"]) for m in msgs],
-        created_at=c["created_at"],
+        persona_ids=c.persona_ids,
+        messages=_to_message_items(msgs),
+        created_at=c.created_at,
     )
 
 
+@app.delete("/conversations/{conversation_id}", status_code=204)
+async def delete_conversation(conversation_id: str, player_id: str = Depends(_player_id)):
+    """删除会话并释放其全部状态；有进行中或排队中的回合时返回 409。"""
+    _owned_conversation(conversation_id, player_id)
+    if _conversation_busy(conversation_id):
+        raise HTTPException(409, detail="会话正忙，请稍后重试")
+    await _forget_conversation(conversation_id, "deleted")
+    return Response(status_code=204)
+
+
 @app.get("/conversations/{conversation_id}/messages")
-def get_conversation_messages(conversation_id: str, limit: int | None = None, offset: int = 0):
+def get_conversation_messages(
+    conversation_id: str, limit: int | None = None, offset: int = 0, player_id: str = Depends(_player_id)
+):
     """获取会话消息列表，支持 limit/offset 分页。"""
-    c = CONVERSATIONS.get(conversation_id)
-    if not c:
-        raise HTTPException(404, detail="会话不存在")
-    msgs = c["messages"]
+    c = _owned_conversation(conversation_id, player_id)
+    msgs = c.messages
     total = len(msgs)
     if offset > 0 or (limit is not None and limit < total):
         msgs = msgs[offset : (offset + limit) if limit is not None else None]
     return {
-        "messages": [MessageItem(role=m["role"], name=m.get("name"), content=m["content"]) for m in msgs],
+        "messages": _to_message_items(msgs),
         "total": total,
     }
 
 
 @app.get("/conversations/{conversation_id}/summary")
-async def get_conversation_summary(conversation_id: str):
-    """获取 Observer 对话总结。"""
-    c = CONVERSATIONS.get(conversation_id)
-    if not c:
-        raise HTTPException(404, detail="会话不存在")
+async def get_conversation_summary(conversation_id: str, wait: float = 0, player_id: str = Depends(_player_id)):
+    """获取 Observer 对话总结。
 
-    # 调用 Observer 生成总结
-    messages = c["messages"]
-    summary = await _call_observer(conversation_id, messages)
+    总结在后台低优先级生成：已有覆盖当前对话的总结时直接返回；
+    否则调度一次生成并最多等待 wait 秒，未就绪时 status 为 "pending"、summary 为 null。
+    """
+    c = _owned_conversation(conversation_id, player_id)
+
+    messages = c.messages
+    transcript_length = _transcript_length(messages)
+    job = OBSERVER_JOBS.get(conversation_id)
+    if job is None or job.status == "failed" or (
+        job.status == "ready" and job.message_count != transcript_length
+    ):
+        job = OBSERVER_JOBS.schedule(conversation_id, transcript_length)
+    await OBSERVER_JOBS.wait(job, wait)
 
+    state = CONVERSATION_STATES.get(conversation_id)
+    persona_name = personas.PERSONAS["observer"]["name"]
     return {
         "conversation_id": conversation_id,
-        "summary": summary,
+        "status": job.status,
+        "summary": (f"\n{persona_name}: {job.summary}" if job.summary else "") if job.status == "ready" else None,
         "messages_count": len(messages),
-        "phase": CONVERSATION_STATES.get(conversation_id, {}).get("phase", "unknown")
+        "phase": state.phase if state else "unknown",
     }
 
 
-@app.post("/conversations/{conversation_id}/messages")
-async def post_conversation_message(conversation_id: str, req: PostMessageReq):
-    """在会话中发送一条消息，返回本轮新增的消息及合并回复。"""
+@app.get("/conversations/{conversation_id}/trace")
+def get_conversation_trace(conversation_id: str, last: int | None = None, player_id: str = Depends(_player_id)):
+    """导出最近记录了时间线的回合（Chrome trace-event JSON，可在 Perfetto / chrome://tracing 打开）。
+
+    只有带 X-Trace: 1 请求头（或命中 TRACE_SAMPLE_RATE 抽样）的回合才有时间线；last 限制导出的回合数。
+    """
+    _owned_conversation(conversation_id, player_id)
+    return TRACES.chrome_trace(conversation_id, last)
+
+
+@app.get("/conversations/{conversation_id}/usage")
+def get_conversation_usage(conversation_id: str, player_id: str = Depends(_player_id)):
+    """获取会话的 token 用量与费用（总计、按 persona、按阶段）及预算状态。"""
+    _owned_conversation(conversation_id, player_id)
+    return {"conversation_id": conversation_id, **TOKENS.conversation(conversation_id)}
+
+
+async def _run_serialized_turn(
+    conversation_id: str,
+    content: str,
+    client_message_id: str | None = None,
+    on_start=None,
+    trace: bool = False,
+) -> dict:
+    """在会话锁内跑一轮对话，返回本轮新增消息及合并回复。
+
+    同一会话的回合串行执行；相同 client_message_id 的重试复用进行中或已缓存的结果。
+    on_start(prev_len) 在拿到会话锁、追加玩家消息之前调用（供异步任务汇报进度）。
+    trace=True 时记录本轮时间线（见 tracing.py），由 GET /conversations/{id}/trace 导出。
+    """
     c = CONVERSATIONS.get(conversation_id)
     if not c:
-        raise HTTPException(404, detail="会话不存在")
+        raise ValueError(f"conversation not found: {conversation_id}")
+    requested = time.perf_counter()
+
+    async def _turn() -> dict:
+        TRACES.record("turn_gate_wait", requested, time.perf_counter(), "queue")
+        prev_len = len(c.messages)
+        if on_start is not None:
+            on_start(prev_len)
+        CASSETTES.record_turn(conversation_id, content)
+        combined = await _run_chat_round(conversation_id, c.persona_ids, content)
+        return {
+            "messages": _to_message_items(c.messages[prev_len:]),
+            "reply": combined,
+        }
+
+    with TRACES.turn(conversation_id, content, enabled=trace):
+        return await TURN_GATES.run(conversation_id, client_message_id, _turn)
+
+
+async def _run_turn_job(job: TurnJob) -> dict:
+    """异步任务池的执行函数：与同步接口走同一条串行化路径。
+
+    提交时占用的玩家回合名额（见 post_conversation_message）在任务结束时释放。
+    """
+    def _started(prev_len: int) -> None:
+        job.base_len = prev_len
+
+    try:
+        return await _run_serialized_turn(
+            job.conversation_id, job.content, job.client_message_id, on_start=_started, trace=job.trace
+        )
+    except ConversationBusyError:
+        raise RuntimeError("会话正忙，请稍后重试") from None
+    finally:
+        if job.player_id is not None:
+            PLAYER_QUOTAS.release_turn(job.player_id)
+
+
+# 异步回合任务池（POST ...?async=true）
+TURN_JOBS = TurnJobPool(_run_turn_job)
+
+
+def _turn_job_view(job: TurnJob) -> dict:
+    """GET /turns/{id} 的返回体：状态、进度（已生成的消息）与结果。"""
+    view = {
+        "turn_id": job.id,
+        "conversation_id": job.conversation_id,
+        "status": job.status,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+    if job.status == "done":
+        view["result"] = job.result
+    elif job.status == "failed":
+        view["error"] = job.error
+    elif job.status == "running" and job.base_len is not None:
+        c = CONVERSATIONS.get(job.conversation_id)
+        partial = c.messages[job.base_len:] if c else []
+        view["progress"] = {"messages": _to_message_items(partial)}
+    return view
+
+
+class ClientDisconnected(Exception):
+    """客户端在回合完成前断开了连接。"""
+
+
+async def _watch_disconnect(request: Request, task: asyncio.Task) -> bool:
+    """轮询客户端连接，断开时取消该请求的回合任务并返回 True。"""
+    while not task.done():
+        if await request.is_disconnected():
+            task.cancel()
+            return True
+        await asyncio.sleep(DISCONNECT_POLL_INTERVAL)
+    return False
+
+
+async def _cancel_on_disconnect(request: Request, coro):
+    """执行 coro；客户端中途断开时取消它并抛出 ClientDisconnected。"""
+    task = asyncio.ensure_future(coro)
+    watcher = asyncio.create_task(_watch_disconnect(request, task))
+    try:
+        return await task
+    except asyncio.CancelledError:
+        if watcher.done() and not watcher.cancelled() and watcher.result():
+            raise ClientDisconnected() from None
+        raise
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+
+
+@app.post("/conversations/{conversation_id}/messages")
+async def post_conversation_message(
+    conversation_id: str,
+    req: PostMessageReq,
+    request: Request,
+    run_async: bool = Query(False, alias="async"),
+    player_id: str = Depends(_player_id),
+):
+    """在会话中发送一条消息，返回本轮新增的消息及合并回复。
+
+    客户端（如 Godot HTTPRequest 超时）断开时取消剩余的 Agent 调用：
+    玩家消息保留，未完成的模型回复不会写入会话。
+
+    async=true 时立即返回 202 与 turn_id，由后台工作池执行，通过 GET /turns/{id} 查询。
+    玩家同时进行的回合（含排队中的异步回合）超过 MAX_CONCURRENT_TURNS_PER_PLAYER 时返回 429。
+    """
+    _owned_conversation(conversation_id, player_id)
     content = (req.content or "").strip()
     if not content:
         raise HTTPException(400, detail="消息内容不能为空")
-    prev_len = len(c["messages"])
+    trace = TRACES.wanted(request.headers)
+    try:
+        PLAYER_QUOTAS.acquire_turn(player_id)
+    except PlayerQuotaExceeded as e:
+        raise _quota_exceeded(e)
+    if run_async:
+        try:
+            job = TURN_JOBS.submit(conversation_id, content, req.client_message_id, trace=trace)
+        except TurnQueueFull:
+            PLAYER_QUOTAS.release_turn(player_id)
+            raise HTTPException(503, detail="服务繁忙，请稍后重试")
+        if job.player_id is None:
+            # 新任务：名额由任务持有，结束时释放
+            job.player_id = player_id
+        else:
+            # 同一 client_message_id 复用了已有任务，它已经占着名额
+            PLAYER_QUOTAS.release_turn(player_id)
+        return JSONResponse(
+            status_code=202,
+            content={"turn_id": job.id, "conversation_id": conversation_id, "status": job.status},
+            headers={"Location": f"/turns/{job.id}"},
+        )
     try:
-        combined = await _run_chat_round(conversation_id, c["persona_ids"], content)
+        return await _cancel_on_disconnect(
+            request,
+            _run_serialized_turn(conversation_id, content, req.client_message_id, trace=trace),
+        )
+    except ClientDisconnected:
+        METRICS.inc("turn_cancellations_total", reason="client_disconnect")
+        print(f"[CANCEL] {conversation_id}: 客户端已断开，取消本轮生成")
+        # 499：客户端已关闭连接（响应不会被读取）
+        return Response(status_code=499)
+    except ConversationBusyError:
+        raise HTTPException(409, detail="会话正忙，请稍后重试")
     except ValueError as e:
         raise HTTPException(404, detail=str(e))
-    new_msgs = c["messages"][prev_len:]
-    return {
-        "messages": [MessageItem(role=m["role"], name=m.get("name"), content=m["content"]) for m in new_msgs],
-        "reply": combined,
-    }
+    finally:
+        PLAYER_QUOTAS.release_turn(player_id)
+
+
+@app.get("/turns/{turn_id}")
+async def get_turn(turn_id: str, wait: float = 0, player_id: str = Depends(_player_id)):
+    """查询异步回合的进度与结果；wait>0 时长轮询，最多等待 wait 秒直到完成。"""
+    job = TURN_JOBS.get(turn_id)
+    if job is None or job.player_id != player_id:
+        raise HTTPException(404, detail="回合不存在")
+    await TURN_JOBS.wait(job, wait)
+    return _turn_job_view(job)
+
+
+# 启动预热：加载 PERSONAS 中的每个模型并保持常驻
+WARMER = warmup.ModelWarmer(
+    warmup.distinct_models(personas.PERSONAS),
+    api_base=personas.OLLAMA_CONFIG["api_base"],
+    keep_alive=personas.OLLAMA_KEEP_ALIVE,
+    client_factory=lambda: http_pool.pool_for(personas.OLLAMA_CONFIG["api_base"]).client(),
+)
+
+
+@app.get("/ready")
+def readiness():
+    """就绪检查：所有模型预热完成才返回 200，否则 503（供负载均衡器使用）。"""
+    ready = WARMER.ready() or not warmup.WARMUP_ENABLED
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "models": WARMER.snapshot()},
+    )
+
+
+@app.get("/metrics")
+def get_metrics():
+    """返回进程内指标快照（计数器、仪表、直方图分位数）、各后端连接池与熔断器状态、token 用量、
+    事件循环延迟与最近的阻塞调用栈、按阶段 / persona 的会话数、玩家配额状态。"""
+    snapshot = METRICS.snapshot()
+    snapshot["http_pools"] = http_pool.stats()
+    snapshot["backends"] = failover.snapshot()
+    snapshot["response_cache"] = RESPONSE_CACHE.stats()
+    snapshot["semantic_cache"] = SEMANTIC_CACHE.stats()
+    snapshot["token_usage"] = TOKENS.snapshot()
+    snapshot["event_loop"] = LOOP_MONITOR.snapshot()
+    snapshot["conversations"] = CONVERSATION_INDEX.counts()
+    snapshot["players"] = PLAYER_QUOTAS.snapshot()
+    return snapshot
+
+
+@app.get("/admin/profiles")
+def list_profiles():
+    """返回最慢的若干个请求 profile 摘要与最近的 profile id。"""
+    return PROFILER.snapshot()
+
+
+@app.get("/admin/profiles/{request_id}")
+def get_profile(request_id: str):
+    """返回一个请求的 folded stacks（flamegraph.pl / speedscope 格式）。"""
+    profile = PROFILER.get(request_id)
+    if profile is None:
+        raise HTTPException(404, detail="profile 不存在或已被淘汰")
+    return PlainTextResponse(profile.folded(), headers={"X-Profile-Duration-Ms": f"{profile.duration * 1000:.1f}"})
+
+
+@app.get("/admin/conversations", dependencies=[Depends(_require_admin)])
+def list_conversation_ids():
+    """本进程持有的全部会话 id（所有玩家；dispatcher rebalance 时据此找出要迁移的会话）。"""
+    return {"ids": list(CONVERSATIONS)}
+
+
+@app.get("/admin/conversations/{conversation_id}", response_model=ConversationExport,
+         dependencies=[Depends(_require_admin)])
+def export_conversation(conversation_id: str):
+    """导出会话的消息、阶段状态与归属；有进行中或排队中的回合时 409（dispatcher 稍后重试）。"""
+    c = CONVERSATIONS.get(conversation_id)
+    if c is None:
+        raise HTTPException(404, detail="会话不存在")
+    if _conversation_busy(conversation_id):
+        raise HTTPException(409, detail="会话正忙，请稍后重试")
+    state = CONVERSATION_STATES.get(conversation_id)
+    return ConversationExport(
+        player_id=c.player_id,
+        persona_ids=c.persona_ids,
+        created_at=c.created_at,
+        messages=_to_message_items(c.messages),
+        state=dataclasses.asdict(state) if state is not None else None,
+    )
+
+
+@app.put("/admin/conversations/{conversation_id}", status_code=204, dependencies=[Depends(_require_admin)])
+async def import_conversation(conversation_id: str, body: ConversationExport):
+    """导入（或覆盖）从其他 worker 迁移来的会话；id、玩家、persona、消息或阶段状态不合法时 400 / 422。
+
+    只搬运消息与阶段状态：各 persona 的 ADK session 不迁移，下一轮从空 session 开始，
+    prompt 中的对话记录与压缩上下文后相同（见 _compact_context）；token 用量、录制与时间线留在原 worker。
+    覆盖本进程已有的副本时先删除旧副本的 ADK session，避免新会话接着旧 session 的上下文。
+    """
+    if not _CONVERSATION_ID_RE.match(conversation_id):
+        raise HTTPException(400, detail="会话 id 应为 32 位十六进制")
+    state, created_at = _validate_import(body)
+    if _conversation_busy(conversation_id):
+        raise HTTPException(409, detail="会话正忙，请稍后重试")
+    stale = CONVERSATIONS.get(conversation_id)
+    if stale is not None:
+        await _delete_sessions(conversation_id, stale.player_id)
+    CONVERSATIONS[conversation_id] = Conversation(
+        persona_ids=body.persona_ids,
+        created_at=body.created_at,
+        messages=MessageLog(m.model_dump() for m in body.messages),
+        player_id=body.player_id,
+    )
+    if state is not None:
+        CONVERSATION_STATES[conversation_id] = state
+    else:
+        CONVERSATION_STATES.pop(conversation_id, None)
+    CONVERSATION_INDEX.add(
+        conversation_id,
+        body.persona_ids,
+        phase=state.phase if state is not None else "small_talk",
+        player_id=body.player_id,
+        created_at=created_at,
+    )
+    METRICS.inc("conversations_imported_total")
+    METRICS.set_gauge("conversations", len(CONVERSATIONS))
+    await _evict_conversations(keep=conversation_id)
+    return Response(status_code=204)
+
+
+def _validate_import(body: ConversationExport) -> tuple[PhaseState | None, float]:
+    """校验导入的会话，返回阶段状态与创建时间（epoch 秒）；不合法时 422。
+
+    发言者只接受 persona 显示名（玩家消息为空）：SPEAKERS 是全进程共享的驻留表，
+    不能让外部数据往里写入任意名字。
+    """
+    try:
+        if resolve_player_id(body.player_id) != body.player_id:
+            raise ValueError(f"玩家 id 不合法: {body.player_id!r}")
+        invalid = [p for p in body.persona_ids if p not in personas.PERSONAS]
+        if invalid or not body.persona_ids:
+            raise ValueError(f"未知的聊天对象: {', '.join(invalid)}")
+        created_at = datetime.fromisoformat(body.created_at).timestamp()
+        names = {p["name"] for p in personas.PERSONAS.values()}
+        for i, m in enumerate(body.messages):
+            Role.parse(m.role)
+            if m.name is not None and m.name not in names:
+                raise ValueError(f"第 {i} 条消息的发言者未知: {m.name!r}")
+        state = None
+        if body.state is not None:
+            state = PhaseState(**body.state)
+            if state.phase not in PHASES:
+                raise ValueError(f"未知的阶段: {state.phase!r}")
+            if not (isinstance(state.religion_discussed, bool) and isinstance(state.allergy_discussed, bool)
+                    and type(state.sub_agent_turns) is int):
+                raise ValueError(f"阶段状态字段类型不正确: {body.state!r}")
+    except (TypeError, ValueError) as e:
+        raise HTTPException(422, detail=f"导入的会话不合法: {e}")
+    return state, created_at
+
+
+@app.get("/routing")
+def get_routing():
+    """返回当前负载压力、延迟目标与最近的降级决定。"""
+    return ROUTING.snapshot()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""合并发言基准：对比逐个角色调用（per_speaker）与一次调用生成所有发言（combined）。
+
+用法：
+    python -m benchmarks.bench_combined_turns [--conversations 20] [--seed 7]
+
+用本地假 Ollama（httpx.MockTransport）跑完整的 _run_chat_round（闲聊 + 宗教专家回合），
+统计每回合的模型调用数与实际发给模型的 prompt 大小（字符数与近似 token 数）。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+_FAKE_BASE = "http://bench-ollama:11434"
+os.environ["OLLAMA_API_BASE"] = _FAKE_BASE
+os.environ["USE_AZURE"] = "false"
+os.environ["FAILOVER_ENABLED"] = "false"
+os.environ["WARMUP_ENABLED"] = "false"
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+import httpx  # noqa: E402
+
+import http_pool  # noqa: E402
+
+# 玩家脚本：闲聊 -> 宗教话题（3 回合专家附身）-> 闲聊
+_SCRIPT = [
+    "今晚聚餐几点开始？",
+    "需要我带点什么吃的吗？",
+    "大家想玩什么游戏？",
+    "有没有朋友需要清真食品？",
+    "那猪肉和酒是不是都不能有？",
+    "斋月的时候要注意什么？",
+    "好的，那音乐谁来准备？",
+    "预算大概多少？",
+]
+
+
+class FakeOllama:
+    """统计请求数与 prompt 大小的假 Ollama /api/chat。"""
+
+    def __init__(self):
+        self.calls = 0
+        self.prompt_chars = 0
+        self.prompt_tokens = 0
+
+    def reset(self):
+        self.calls = self.prompt_chars = self.prompt_tokens = 0
+
+    def handler(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        text = "".join(str(m.get("content") or "") for m in body["messages"])
+        self.calls += 1
+        self.prompt_chars += len(text)
+        self.prompt_tokens += _approx_tokens(text)
+        if "JSON 数组" in (body["messages"][0].get("content") or ""):
+            content = json.dumps([
+                {"name": "Mikko", "content": "听起来不错，我七点就到！"},
+                {"name": "Aino", "content": "清单整理好了，等下发到群里。"},
+            ], ensure_ascii=False)
+        else:
+            content = "听起来不错，我们一起准备吧！"
+        return httpx.Response(200, json={
+            "model": body["model"],
+            "created_at": "2024-01-01T00:00:00Z",
+            "message": {"role": "assistant", "content": content},
+            "done": True,
+            "prompt_eval_count": _approx_tokens(text),
+            "eval_count": _approx_tokens(content),
+        })
+
+
+def _approx_tokens(text: str) -> int:
+    """近似 token 数：CJK 字符各算 1 个，其他字符每 4 个算 1 个。"""
+    cjk = sum(1 for ch in text if "㐀" <= ch <= "鿿" or "＀" <= ch <= "￯")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+async def _run_mode(Main, personas, fake: FakeOllama, mode: str, n_conversations: int, seed: int) -> dict:
+    from datetime import datetime, timezone
+
+    from conversation_store import Conversation, MessageLog
+
+    personas.ORCHESTRATION_MODE = mode
+    random.seed(seed)
+    fake.reset()
+    turns = 0
+    for c in range(n_conversations):
+        cid = f"bench_{mode}_{c}"
+        Main.CONVERSATIONS[cid] = Conversation(
+            persona_ids=["mikko", "aino"],
+            created_at=datetime.now(timezone.utc).isoformat(),
+            messages=MessageLog(),
+        )
+        for content in _SCRIPT:
+            await Main._run_chat_round(cid, ["mikko", "aino"], content)
+            turns += 1
+    return {
+        "turns": turns,
+        "model_calls": fake.calls,
+        "calls_per_turn": round(fake.calls / turns, 2),
+        "prompt_chars_per_turn": round(fake.prompt_chars / turns, 1),
+        "approx_prompt_tokens_per_turn": round(fake.prompt_tokens / turns, 1),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    fake = FakeOllama()
+    # 必须在 personas 构建模型之前注册，所有 persona 的 LiteLlm 都会走这个假后端
+    http_pool.pool_for(_FAKE_BASE, transport=httpx.MockTransport(fake.handler))
+
+    import Main
+    import personas
+
+    async def run():
+        results = {}
+        for mode in ("per_speaker", "combined"):
+            results[mode] = await _run_mode(Main, personas, fake, mode, args.conversations, args.seed)
+        return results
+
+    results = asyncio.run(run())
+    base, combined = results["per_speaker"], results["combined"]
+    results["ratio"] = {
+        "calls": round(combined["model_calls"] / base["model_calls"], 3),
+        "prompt_tokens": round(
+            combined["approx_prompt_tokens_per_turn"] / base["approx_prompt_tokens_per_turn"], 3
+        ),
+    }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
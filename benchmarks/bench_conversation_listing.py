@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""会话列表基准：对比旧的全量扫描 + 排序与 conversation_index 的游标分页。
+
+用法：
+    python -m benchmarks.bench_conversation_listing [--sizes 1000 10000 100000] [--limit 50] [--repeat 20]
+
+旧实现（此处按原样重写）每次遍历全部会话、构造摘要并按 created_at 排序；
+新实现在索引上取一页（新的在前），分别测不带过滤、按 persona、按 persona + 阶段三种查询。
+两者都构造与接口相同的 ConversationSummary，输出每次列表请求的中位耗时（毫秒）。
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from pydantic import BaseModel  # noqa: E402
+
+from conversation_index import ConversationIndex  # noqa: E402
+from conversation_store import Conversation  # noqa: E402
+
+_PERSONAS = [["mikko", "aino"], ["observer"], ["french_student_male", "french_student_female"]]
+_PHASES = ["small_talk", "religion_deep", "allergy_deep", "wrap_up", "finished"]
+
+
+class ConversationSummary(BaseModel):
+    """与 Main.ConversationSummary 相同（避免导入 Main 时构建模型）。"""
+
+    id: str
+    persona_ids: list[str]
+    created_at: str
+    message_count: int
+
+
+def _build(n: int):
+    conversations: dict[str, Conversation] = {}
+    index = ConversationIndex()
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    for i in range(n):
+        cid = f"{i:032x}"
+        persona_ids = _PERSONAS[i % len(_PERSONAS)]
+        created_at = (start + timedelta(seconds=i)).isoformat()
+        conversations[cid] = Conversation(persona_ids=persona_ids, created_at=created_at)
+        index.add(cid, persona_ids)
+        index.set_phase(cid, _PHASES[i % len(_PHASES)])
+    return conversations, index
+
+
+def _summary(cid: str, c: Conversation) -> ConversationSummary:
+    return ConversationSummary(id=cid, persona_ids=c.persona_ids, created_at=c.created_at, message_count=len(c.messages))
+
+
+def _legacy(conversations) -> list[ConversationSummary]:
+    out = []
+    for cid, c in conversations.items():
+        if cid.startswith("default_"):
+            continue
+        out.append(_summary(cid, c))
+    out.sort(key=lambda x: x.created_at, reverse=True)
+    return out
+
+
+def _indexed(conversations, index, limit, persona=None, phase=None) -> list[ConversationSummary]:
+    ids, _ = index.page(limit, None, persona, phase)
+    index.count(persona, phase)
+    return [_summary(cid, conversations[cid]) for cid in ids]
+
+
+def _median_ms(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started)
+    return round(statistics.median(times) * 1000, 3)
+
+
+def run(sizes: list[int], limit: int, repeat: int) -> list[dict]:
+    results = []
+    for n in sizes:
+        conversations, index = _build(n)
+        # 旧实现在大规模下单次就是数百毫秒，少跑几次
+        legacy_repeat = max(1, min(repeat, 200_000 // max(1, n)))
+        results.append({
+            "conversations": n,
+            "limit": limit,
+            "legacy_scan_sort_ms": _median_ms(lambda: _legacy(conversations), legacy_repeat),
+            "index_page_ms": _median_ms(lambda: _indexed(conversations, index, limit), repeat),
+            "index_persona_ms": _median_ms(lambda: _indexed(conversations, index, limit, "mikko"), repeat),
+            "index_persona_phase_ms": _median_ms(
+                lambda: _indexed(conversations, index, limit, "mikko", "wrap_up"), repeat
+            ),
+        })
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+    print(json.dumps(run(args.sizes, args.limit, args.repeat), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""会话内存回归基准：每个会话驻留多少字节、分别落在哪个组件，删除会话后内存能否回到基线。
+
+用法：
+    python -m benchmarks.bench_conversation_memory [--conversations 2000] [--turns 4] [--summaries 2]
+        [--sample 50] [--max-per-conversation-kb 128] [--max-baseline-kb 2048]
+
+用本地假 Ollama（httpx.MockTransport）经 ASGI 驱动整个应用：每个会话 POST /conversations，
+发 --turns 条消息，其间均匀地请求 --summaries 次 Observer 总结（每次总结前都有新消息，总结会重新生成）。
+ADK session、LiteLlm 与各存储都是真实的（假模型下每个会话约 1 秒，主要是 LiteLlm 开销）。开始统计前先跑 --warmup 个会话并删除，排除首次导入与缓存填充。
+
+每轮统计取三次 tracemalloc 快照：开始前、全部会话存活时、DELETE 全部会话并 gc 之后。
+- 总量：--conversations 个会话，只记一层调用栈（开销小）
+- 按组件：另跑 --sample 个会话，记完整调用栈（每回合慢一个数量级），每条驻留的分配按调用栈中
+  最内层属于某个组件的帧归类：main（Main.py 内分配的字符串与对象，如清洗后的回复）、
+  messages（conversation_store）、token_usage、turn_gates、observer_jobs、traces、cassettes、
+  caches（回复缓存 / 语义缓存）、routing（降级决策日志）、metrics、adk（ADK session 中的 Event 等）、
+  litellm、other（其余第三方库与标准库，如 URL 解析缓存）
+
+结果以 JSON 输出：每会话驻留字节（总计与按组件）、删除后相对开始前的增长（总计，以及抽样轮按组件）。
+每会话驻留超过 --max-per-conversation-kb，或删除后增长超过 --max-baseline-kb 时列在 failures 中，
+此时退出码为 1。删除后的增长不会是 0：回复缓存、路由决策日志、指标窗口与 URL 解析缓存都有上限，
+填满之前会随会话数增长；按会话保存的状态（messages、turn_gates、token_usage 等）应当归零。
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import linecache
+import os
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+_ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(_ROOT))
+
+_FAKE_BASE = "http://bench-ollama:11434"
+os.environ["OLLAMA_API_BASE"] = _FAKE_BASE
+os.environ["USE_AZURE"] = "false"
+os.environ["FAILOVER_ENABLED"] = "false"
+os.environ["WARMUP_ENABLED"] = "false"
+os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+os.environ["LOOP_MONITOR_ENABLED"] = "false"
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+import httpx  # noqa: E402
+
+import http_pool  # noqa: E402
+from benchmarks.bench_combined_turns import FakeOllama  # noqa: E402
+
+# 玩家脚本：按顺序循环使用
+_SCRIPT = [
+    "今晚聚餐几点开始？",
+    "需要我带点什么吃的吗？",
+    "有没有朋友需要清真食品？",
+    "有人对花生过敏吗？",
+    "好的，那音乐谁来准备？",
+]
+
+# 本仓库模块按完整路径匹配（避免与 starlette/routing.py 等同名文件混淆）
+_REPO = _ROOT.resolve().as_posix() + "/"
+
+# (组件, 文件路径片段)；按调用栈从内到外找第一个命中的帧
+_COMPONENTS = [
+    ("main", (_REPO + "Main.py",)),
+    ("messages", (_REPO + "conversation_store.py",)),
+    ("token_usage", (_REPO + "token_usage.py",)),
+    ("turn_gates", (_REPO + "turn_gate.py",)),
+    ("observer_jobs", (_REPO + "observer_jobs.py",)),
+    ("traces", (_REPO + "tracing.py",)),
+    ("cassettes", (_REPO + "cassettes.py",)),
+    ("caches", (_REPO + "response_cache.py", _REPO + "semantic_cache.py")),
+    ("routing", (_REPO + "routing.py",)),
+    ("metrics", (_REPO + "metrics.py",)),
+    ("adk", ("google/adk/",)),
+    ("litellm", ("litellm/",)),
+]
+
+_TRACE_DEPTH = 40
+
+
+def _component(traceback) -> str:
+    for frame in reversed(traceback):
+        filename = Path(frame.filename).as_posix()
+        for name, parts in _COMPONENTS:
+            if any(part in filename for part in parts):
+                return name
+    return "other"
+
+
+def _by_component(snapshot: tracemalloc.Snapshot) -> dict[str, int]:
+    sizes: dict[str, int] = {}
+    for stat in snapshot.statistics("traceback"):
+        name = _component(stat.traceback)
+        sizes[name] = sizes.get(name, 0) + stat.size
+    return sizes
+
+
+def _snapshot() -> tracemalloc.Snapshot:
+    gc.collect()
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, linecache.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>", all_frames=True),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>", all_frames=True),
+        tracemalloc.Filter(False, "<unknown>"),
+    ])
+
+
+def _diff(after: dict[str, int], before: dict[str, int]) -> dict[str, int]:
+    names = sorted(set(after) | set(before))
+    return {n: after.get(n, 0) - before.get(n, 0) for n in names}
+
+
+async def _drive(client: httpx.AsyncClient, turns: int, summaries: int, offset: int) -> str:
+    """跑一个会话：创建、发消息、均匀地请求总结；返回会话 id。"""
+    response = await client.post("/conversations", json={"persona_ids": ["mikko", "aino"]})
+    response.raise_for_status()
+    cid = response.json()["id"]
+    summary_after = {turns * (i + 1) // summaries for i in range(summaries)} if summaries else set()
+    for turn in range(1, turns + 1):
+        content = _SCRIPT[(offset + turn) % len(_SCRIPT)]
+        response = await client.post(f"/conversations/{cid}/messages", json={"content": content})
+        response.raise_for_status()
+        if turn in summary_after:
+            response = await client.get(f"/conversations/{cid}/summary", params={"wait": 5})
+            response.raise_for_status()
+    return cid
+
+
+async def _run_batch(client, n: int, args) -> list[str]:
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(i: int) -> str:
+        async with semaphore:
+            return await _drive(client, args.turns, args.summaries, i)
+
+    return await asyncio.gather(*(one(i) for i in range(n)))
+
+
+async def _delete_all(client, ids: list[str]) -> None:
+    for cid in ids:
+        response = await client.delete(f"/conversations/{cid}")
+        if response.status_code != 204:
+            raise RuntimeError(f"DELETE {cid} -> {response.status_code}")
+
+
+async def _measure(client, n: int, depth: int, args) -> dict:
+    """跑 n 个会话再全部删除，返回三次快照之间的差（总计与按组件）。"""
+    tracemalloc.start(depth)
+    try:
+        before = _snapshot()
+        started = time.perf_counter()
+        ids = await _run_batch(client, n, args)
+        elapsed = time.perf_counter() - started
+        live = _snapshot()
+        await _delete_all(client, ids)
+        after = _snapshot()
+    finally:
+        tracemalloc.stop()
+    base = _by_component(before)
+    return {
+        "seconds": elapsed,
+        "live": {k: v for k, v in _diff(_by_component(live), base).items() if v},
+        "retained": {k: v for k, v in _diff(_by_component(after), base).items() if v},
+    }
+
+
+def _ranked(sizes: dict[str, int | float]) -> dict:
+    return {"total": round(sum(sizes.values())), **{k: round(v) for k, v in sorted(sizes.items(), key=lambda kv: -kv[1])}}
+
+
+async def run(args) -> dict:
+    import Main
+
+    transport = httpx.ASGITransport(app=Main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await _delete_all(client, await _run_batch(client, args.warmup, args))
+        totals = await _measure(client, args.conversations, 1, args)
+        sample = await _measure(client, args.sample, _TRACE_DEPTH, args) if args.sample else None
+
+    n = max(1, args.conversations)
+    per_total = sum(totals["live"].values()) / n
+    retained_total = sum(totals["retained"].values())
+    report = {
+        "conversations": args.conversations,
+        "turns": args.turns,
+        "summaries": args.summaries,
+        "seconds": round(totals["seconds"], 2),
+        "live_conversations_after_delete": len(Main.CONVERSATIONS),
+        "per_conversation_bytes": round(per_total),
+        "after_delete_growth_bytes": retained_total,
+    }
+    if sample is not None:
+        m = max(1, args.sample)
+        report["sample"] = {
+            "conversations": args.sample,
+            "per_conversation_bytes": _ranked({k: v / m for k, v in sample["live"].items()}),
+            "after_delete_growth_bytes": _ranked(sample["retained"]),
+        }
+    failures = []
+    if per_total > args.max_per_conversation_kb * 1024:
+        failures.append(f"每会话驻留 {per_total / 1024:.1f} KB > {args.max_per_conversation_kb} KB")
+    if retained_total > args.max_baseline_kb * 1024:
+        failures.append(f"删除后增长 {retained_total / 1024:.1f} KB > {args.max_baseline_kb} KB")
+    if Main.CONVERSATIONS:
+        failures.append(f"删除后仍有 {len(Main.CONVERSATIONS)} 个会话")
+    report["failures"] = failures
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=4, help="每个会话的玩家消息数")
+    parser.add_argument("--summaries", type=int, default=2, help="每个会话请求 Observer 总结的次数")
+    parser.add_argument("--concurrency", type=int, default=16, help="同时进行的会话数")
+    parser.add_argument("--warmup", type=int, default=20, help="开始统计前先跑并删除的会话数")
+    parser.add_argument("--sample", type=int, default=50, help="按组件归类时记完整调用栈的会话数（0 跳过）")
+    parser.add_argument("--max-per-conversation-kb", type=float, default=128)
+    parser.add_argument("--max-baseline-kb", type=float, default=2048)
+    args = parser.parse_args(argv)
+
+    fake = FakeOllama()
+    # 必须在 personas 构建模型之前注册，所有 persona 的 LiteLlm 都会走这个假后端
+    http_pool.pool_for(_FAKE_BASE, transport=httpx.MockTransport(fake.handler))
+
+    report = asyncio.run(run(args))
+    report["model_calls"] = fake.calls
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 1 if report["failures"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""委托模式基准：专家回合走状态机路径（per_speaker）与委托模式（delegation）的对比。
+
+用法：
+    python -m benchmarks.bench_delegation [--conversations 20] [--latency 0.05]
+
+用本地假 Ollama（httpx.MockTransport，每次模型调用固定延迟 --latency 秒）跑宗教、过敏
+两个专家阶段各 3 回合，统计每回合的顶层 run_async 次数、模型调用次数、近似 prompt token 数
+与回合耗时。委托模式下宿主第一次请求返回专家工具调用，拿到工具结果后作答。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+_FAKE_BASE = "http://bench-ollama:11434"
+os.environ["OLLAMA_API_BASE"] = _FAKE_BASE
+os.environ["USE_AZURE"] = "false"
+os.environ["FAILOVER_ENABLED"] = "false"
+os.environ["WARMUP_ENABLED"] = "false"
+os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+import httpx  # noqa: E402
+
+import http_pool  # noqa: E402
+
+_EXPERT_TURNS = {
+    "religion_deep": ["有没有朋友需要清真食品？", "那猪肉和酒是不是都不能有？", "斋月的时候要注意什么？"],
+    "allergy_deep": ["有人对花生过敏吗？", "无麸质的话要准备什么？", "乳糖不耐受的朋友能喝什么？"],
+}
+_TOOLS = {"religion_deep": "agent_religion_expert", "allergy_deep": "agent_allergy_expert"}
+
+
+def _approx_tokens(text: str) -> int:
+    """近似 token 数：CJK 字符各算 1 个，其他字符每 4 个算 1 个。"""
+    cjk = sum(1 for ch in text if "㐀" <= ch <= "鿿" or "＀" <= ch <= "￯")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class FakeOllama:
+    """带固定延迟、会发起专家工具调用的假 Ollama /api/chat。"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.tool = "agent_religion_expert"
+        self.calls = 0
+        self.prompt_tokens = 0
+
+    def reset(self):
+        self.calls = self.prompt_tokens = 0
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        messages = body["messages"]
+        text = "".join(str(m.get("content") or "") for m in messages)
+        self.calls += 1
+        self.prompt_tokens += _approx_tokens(text)
+        await asyncio.sleep(self.latency)
+        last_user = max(i for i, m in enumerate(messages) if m["role"] == "user")
+        if body.get("tools") and not any(m["role"] == "tool" for m in messages[last_user:]):
+            request_text = messages[last_user]["content"][-40:]
+            message = {
+                "role": "assistant",
+                "content": "",
+                "tool_calls": [{"function": {"name": self.tool, "arguments": {"request": request_text}}}],
+            }
+        else:
+            message = {"role": "assistant", "content": "Selvä! 这点要注意，我们把菜单分开标注吧。"}
+        return httpx.Response(200, json={
+            "model": body["model"],
+            "created_at": "2024-01-01T00:00:00Z",
+            "message": message,
+            "done": True,
+            "prompt_eval_count": _approx_tokens(text),
+            "eval_count": 12,
+        })
+
+
+def _top_level_runs(snapshot: dict) -> int:
+    return sum(
+        h["count"] for key, h in snapshot["histograms"].items() if key.startswith("agent_call_seconds")
+    )
+
+
+async def _run_mode(Main, personas, fake: FakeOllama, mode: str, n_conversations: int) -> dict:
+    from datetime import datetime, timezone
+
+    from conversation_store import Conversation, MessageLog, PhaseState
+    from metrics import METRICS
+
+    personas.ORCHESTRATION_MODE = mode
+    fake.reset()
+    METRICS.reset()
+    latencies = []
+    for c in range(n_conversations):
+        cid = f"bench_{mode}_{c}"
+        Main.CONVERSATIONS[cid] = Conversation(
+            persona_ids=["mikko", "aino"],
+            created_at=datetime.now(timezone.utc).isoformat(),
+            messages=MessageLog(),
+        )
+        for phase, questions in _EXPERT_TURNS.items():
+            Main.CONVERSATION_STATES[cid] = PhaseState(phase=phase)
+            fake.tool = _TOOLS[phase]
+            for content in questions:
+                started = time.perf_counter()
+                await Main._run_chat_round(cid, ["mikko", "aino"], content)
+                latencies.append(time.perf_counter() - started)
+    turns = len(latencies)
+    snapshot = METRICS.snapshot()
+    return {
+        "turns": turns,
+        "top_level_runs_per_turn": round(_top_level_runs(snapshot) / turns, 2),
+        "model_calls_per_turn": round(fake.calls / turns, 2),
+        "approx_prompt_tokens_per_turn": round(fake.prompt_tokens / turns, 1),
+        "turn_p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "turn_mean_ms": round(statistics.fmean(latencies) * 1000, 1),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    fake = FakeOllama(args.latency)
+    # 必须在 personas 构建模型之前注册，所有 persona 的 LiteLlm 都会走这个假后端
+    http_pool.pool_for(_FAKE_BASE, transport=httpx.MockTransport(fake.handler))
+
+    import Main
+    import personas
+
+    async def run():
+        results = {}
+        for mode in ("per_speaker", "delegation"):
+            results[mode] = await _run_mode(Main, personas, fake, mode, args.conversations)
+        return results
+
+    results = asyncio.run(run())
+    base, delegated = results["per_speaker"], results["delegation"]
+    results["ratio"] = {
+        key: round(delegated[key] / base[key], 3)
+        for key in (
+            "top_level_runs_per_turn", "model_calls_per_turn", "approx_prompt_tokens_per_turn", "turn_p50_ms",
+        )
+    }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
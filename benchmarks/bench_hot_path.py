@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""编排热路径微基准：每回合都会执行的纯函数，与保存的基线对比，超出阈值即失败。
+
+用法：
+    python -m benchmarks.bench_hot_path [--rounds 7] [--threshold 0.25]
+    python -m benchmarks.bench_hot_path --save-baseline   # 更新基线
+
+覆盖 _strip_thinking、_get_reply_from_events、_format_conversation_history、
+_detect_focus_flags 与 _decide_speaker_order。输入由固定种子生成：中英混合的长对话记录、
+带 <think> 块（闭合 / 未闭合 / 大小写变体）和思考前缀行的模型输出、含大量重复文本块的 event 流。
+
+每个用例跑 --rounds 轮，每轮自动选择迭代次数使单轮约 --min-time 秒，取每次调用耗时（微秒）的
+中位数。结果以 JSON 输出；与基线（默认 benchmarks/baselines/hot_path.json）相比中位数变慢超过
+--threshold（比例）的用例先重测一次，仍然超出的列在 regressions 中，此时退出码为 1。
+基线与机器相关，换机器后先 --save-baseline。
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+os.environ.setdefault("WARMUP_ENABLED", "false")
+os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "false")
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+from google.genai import types  # noqa: E402
+
+from conversation_store import Message, MessageLog  # noqa: E402
+
+DEFAULT_BASELINE = Path(__file__).parent / "baselines" / "hot_path.json"
+
+_ZH = [
+    "今晚聚餐一共有八个人", "我们去超市买点驯鹿肉和土豆吧", "Aino 说她会带蓝莓派",
+    "有个朋友对花生过敏", "清真的肉要去专门的店买", "你觉得做咖喱怎么样", "我负责准备饮料",
+    "乳糖不耐受的话可以用燕麦奶", "记得在菜单上标出过敏原", "斋月期间要等日落以后才吃",
+]
+_EN = [
+    "No niin, sounds good", "Moi! How was your day?", "Selvä, I will check the labels",
+    "Is the sauce gluten free?", "Let's keep the vegan dishes separate", "Kiitos for the help",
+]
+_THINK = [
+    "用户希望我用芬兰学生的口吻回答，先确认人数，再提到过敏。",
+    "Let me think about the dietary constraints first. The guest is Muslim, so no pork.",
+    "首先，我需要回顾对话记录；然后，给出简短建议。",
+]
+_PREFIXES = ["好的，", "首先，", "我需要", "让我", "接下来，", "思考："]
+_NAMES = ["Mikko", "Aino", "宗教禁忌专家", "食物过敏专家"]
+
+
+def _sentence(rng: random.Random) -> str:
+    parts = [rng.choice(_ZH) for _ in range(rng.randint(1, 3))]
+    if rng.random() < 0.5:
+        parts.insert(rng.randint(0, len(parts)), rng.choice(_EN))
+    return "，".join(parts) + rng.choice(["。", "！", "？", "~"])
+
+
+def _model_output(rng: random.Random, kind: str) -> str:
+    """生成一段模型原始输出：带 <think> 块、思考前缀行或对话标识。"""
+    body = "\n".join(_sentence(rng) for _ in range(rng.randint(2, 5)))
+    if kind == "think_closed":
+        think = "\n".join(rng.choice(_THINK) for _ in range(rng.randint(3, 12)))
+        tag_open, tag_close = rng.choice([("<think>", "</think>"), ("<THINK>", "</Think>")])
+        return f"{tag_open}\n{think}\n{tag_close}\n{body}"
+    if kind == "think_unclosed":
+        think = "\n".join(rng.choice(_THINK) for _ in range(rng.randint(3, 12)))
+        return f"{body}\n<think>{think}"
+    if kind == "prefixes":
+        lines = [rng.choice(_PREFIXES) + rng.choice(_THINK) for _ in range(rng.randint(2, 6))]
+        return "\n".join(lines + [body])
+    # dialogue：前面是推理，之后才是 "Mikko: ..."
+    return f"{rng.choice(_THINK)}\n\nMikko: {body}"
+
+
+def _transcript(rng: random.Random, n: int) -> MessageLog:
+    log = MessageLog()
+    for i in range(n):
+        if i % 3 == 0:
+            log.append(Message("user", None, _sentence(rng)))
+        else:
+            log.append(Message("model", rng.choice(_NAMES), _sentence(rng)))
+    return log
+
+
+def _event(text: str, role: str = "model"):
+    return SimpleNamespace(content=types.Content(role=role, parts=[types.Part(text=text)]))
+
+
+def _event_stream(rng: random.Random, chunks: int, distinct: int) -> list:
+    """流式 event：distinct 个不同文本块反复出现（模型复读），夹杂非 model 事件。"""
+    pool = [_sentence(rng) for _ in range(distinct)]
+    events = [_event(rng.choice(pool)) for _ in range(chunks)]
+    for _ in range(chunks // 10):
+        events.insert(rng.randrange(len(events)), _event("玩家的话", role="user"))
+    return events
+
+
+def build_cases(seed: int) -> dict:
+    """生成各用例：name -> 无参可调用对象。"""
+    import Main
+
+    rng = random.Random(seed)
+    outputs = {kind: [_model_output(rng, kind) for _ in range(64)]
+               for kind in ("think_closed", "think_unclosed", "prefixes", "dialogue")}
+    short_log, long_log = _transcript(rng, 20), _transcript(rng, 400)
+    user_lines = [_sentence(rng) for _ in range(64)] + ["Mikko 你觉得呢？", "有人对花生过敏吗", "清真食品哪里买"]
+    repeated = _event_stream(rng, chunks=400, distinct=8)
+    unique = _event_stream(rng, chunks=200, distinct=200)
+
+    def over(items, fn):
+        def run():
+            for item in items:
+                fn(item)
+        run.calls = len(items)
+        return run
+
+    def once(fn, *args):
+        def run():
+            fn(*args)
+        run.calls = 1
+        return run
+
+    # _decide_speaker_order 内部用 random 决定是否只有一人发言，固定种子使结果可复现
+    random.seed(seed)
+    return {
+        "strip_thinking/think_closed": over(outputs["think_closed"], Main._strip_thinking),
+        "strip_thinking/think_unclosed": over(outputs["think_unclosed"], Main._strip_thinking),
+        "strip_thinking/prefixes": over(outputs["prefixes"], Main._strip_thinking),
+        "strip_thinking/dialogue": over(outputs["dialogue"], Main._strip_thinking),
+        "reply_from_events/repeated_chunks_400": once(Main._get_reply_from_events, repeated),
+        "reply_from_events/unique_chunks_200": once(Main._get_reply_from_events, unique),
+        "format_history/20_messages": once(Main._format_conversation_history, short_log),
+        "format_history/400_messages": once(Main._format_conversation_history, long_log),
+        "detect_focus_flags/mixed": over(user_lines, Main._detect_focus_flags),
+        "decide_speaker_order/400_messages": over(
+            user_lines, lambda text: Main._decide_speaker_order(long_log, text)
+        ),
+    }
+
+
+def measure(fn, rounds: int, min_time: float) -> dict:
+    """自动标定迭代次数，返回每次调用耗时（微秒）的中位数与最小值。"""
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        if time.perf_counter() - started >= min_time or number >= 1 << 20:
+            break
+        number *= 2
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - started) / (number * fn.calls) * 1e6)
+    return {
+        "median_us": round(statistics.median(samples), 3),
+        "min_us": round(min(samples), 3),
+        "iterations": number * fn.calls,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[dict]:
+    """列出中位数比基线慢超过 threshold 的用例；基线中没有的用例跳过。"""
+    regressions = []
+    for name, current in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        ratio = current["median_us"] / base["median_us"] if base["median_us"] else 1.0
+        if ratio > 1 + threshold:
+            regressions.append({
+                "case": name,
+                "baseline_us": base["median_us"],
+                "median_us": current["median_us"],
+                "ratio": round(ratio, 3),
+            })
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.05, help="每轮最少耗时（秒）")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--threshold", type=float, default=0.25, help="允许的变慢比例")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果写为基线")
+    parser.add_argument("--filter", default="", help="只跑名字包含该子串的用例")
+    args = parser.parse_args(argv)
+
+    cases = {name: fn for name, fn in build_cases(args.seed).items() if args.filter in name}
+    results = {name: measure(fn, args.rounds, args.min_time) for name, fn in cases.items()}
+    report = {"python": platform.python_version(), "cases": results}
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps(report, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        report["baseline"] = str(args.baseline)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 0
+
+    if args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        report["baseline"] = str(args.baseline)
+        report["threshold"] = args.threshold
+        regressions = compare(results, baseline["cases"], args.threshold)
+        # 疑似变慢的用例重测一次，取较快的结果，过滤掉机器瞬时抖动
+        for item in regressions:
+            again = measure(cases[item["case"]], args.rounds, args.min_time)
+            if again["median_us"] < results[item["case"]]["median_us"]:
+                results[item["case"]] = again
+        report["regressions"] = compare(results, baseline["cases"], args.threshold)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 1 if report.get("regressions") else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""消息/状态存储内存基准：对比旧的 dict 表示与 conversation_store 紧凑表示。
+
+用法：
+    python -m benchmarks.bench_message_memory [--conversations 2000] [--messages 20]
+
+输出每条消息的平均字节数（tracemalloc 统计，含会话状态对象的摊销）。
+"""
+
+import argparse
+import json
+import sys
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from conversation_store import Message, MessageLog, PhaseState  # noqa: E402
+
+_SPEAKERS = ["Mikko", "Aino", "对话观察者"]
+
+
+def _make_contents(n_conversations: int, n_messages: int) -> list[list[str]]:
+    """预先生成消息内容，让两种表示共享同一批字符串，只比较结构开销。"""
+    return [
+        [f"第{c}号会话的第{i}条消息：今晚聚餐准备什么？" for i in range(n_messages)]
+        for c in range(n_conversations)
+    ]
+
+
+def _build_dicts(contents):
+    convs, states = [], []
+    for conv_contents in contents:
+        msgs = []
+        for i, text in enumerate(conv_contents):
+            if i % 3 == 0:
+                msgs.append({"role": "user", "name": None, "content": text})
+            else:
+                # 模型回复的名字来自运行期拼接，模拟非驻留的重复字符串
+                name = "".join(_SPEAKERS[i % 2])
+                msgs.append({"role": "model", "name": name, "content": text})
+        convs.append(msgs)
+        states.append({
+            "phase": "small_talk",
+            "religion_discussed": False,
+            "allergy_discussed": False,
+            "sub_agent_turns": 0,
+        })
+    return convs, states
+
+
+def _build_compact(contents):
+    convs, states = [], []
+    for conv_contents in contents:
+        log = MessageLog()
+        for i, text in enumerate(conv_contents):
+            if i % 3 == 0:
+                log.append(Message("user", None, text))
+            else:
+                name = "".join(_SPEAKERS[i % 2])
+                log.append(Message("model", name, text))
+        convs.append(log)
+        states.append(PhaseState())
+    return convs, states
+
+
+def _measure(builder, contents) -> int:
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = builder(contents)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(s.size_diff for s in after.compare_to(before, "filename"))
+    del kept
+    return size
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=2000)
+    parser.add_argument("--messages", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    contents = _make_contents(args.conversations, args.messages)
+    n_msgs = args.conversations * args.messages
+    results = {}
+    for label, builder in (("dict", _build_dicts), ("compact", _build_compact)):
+        total = _measure(builder, contents)
+        results[label] = {
+            "total_bytes": total,
+            "bytes_per_message": round(total / n_msgs, 1),
+        }
+    results["conversations"] = args.conversations
+    results["messages_per_conversation"] = args.messages
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
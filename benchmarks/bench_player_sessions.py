@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""玩家 session 查找基准：对比原来的单一 user_id 布局与按玩家分片的 ShardedSessionService。
+
+用法：
+    python -m benchmarks.bench_player_sessions [--players 10000] [--sessions-per-player 3] [--lookups 20000] [--lists 5]
+
+旧布局（此处按原样重现）：每个 Runner 一个 InMemorySessionService，所有会话都在 user_id="godot" 下，
+列出某个玩家的会话只能取出全部 session 再按会话归属过滤。
+新布局：user_id 为玩家 id，按 crc32(player_id) 分片（session_shards.py）。
+
+对每种布局测（单位微秒，取中位数与 p99）：
+- get：随机玩家的随机会话 get_session（每回合 _get_or_create_session 的查找）
+- list：列出一个玩家的全部 session
+- delete：删除一个会话的 session（旧布局会先深拷贝整个 session）
+以及全部删除后残留的空 user 桶数。
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from google.adk.events.event import Event  # noqa: E402
+from google.adk.sessions.in_memory_session_service import InMemorySessionService  # noqa: E402
+from google.genai import types  # noqa: E402
+
+from session_shards import SESSION_SHARDS, ShardedSessionService  # noqa: E402
+
+_APP = "persona_mikko"
+_LEGACY_USER = "godot"
+
+
+def _event(i: int) -> Event:
+    author = "user" if i % 2 == 0 else "agent_mikko"
+    return Event(author=author, content=types.Content(role="user", parts=[types.Part(text=f"第{i}条消息：今晚聚餐准备什么？")]))
+
+
+def _stats(samples: list[float]) -> dict:
+    samples = sorted(samples)
+    return {
+        "p50_us": round(statistics.median(samples) * 1e6, 1),
+        "p99_us": round(samples[int(len(samples) * 0.99) - 1] * 1e6, 1),
+    }
+
+
+async def _timed(samples: list[float], coro):
+    started = time.perf_counter()
+    result = await coro
+    samples.append(time.perf_counter() - started)
+    return result
+
+
+async def _run_layout(name: str, service, owners: dict[str, str], args, rng: random.Random) -> dict:
+    legacy = name == "legacy"
+    user = (lambda sid: _LEGACY_USER) if legacy else (lambda sid: owners[sid])
+
+    for sid in owners:
+        session = await service.create_session(app_name=_APP, user_id=user(sid), session_id=sid)
+        for i in range(args.events):
+            await service.append_event(session, _event(i))
+
+    session_ids = list(owners)
+    players = sorted(set(owners.values()))
+
+    gets = []
+    for _ in range(args.lookups):
+        sid = rng.choice(session_ids)
+        await _timed(gets, service.get_session(app_name=_APP, user_id=user(sid), session_id=sid))
+
+    lists = []
+    for _ in range(args.lists):
+        player = rng.choice(players)
+        if legacy:
+            # 旧布局只有一个 user：取出全部 session 再按归属过滤
+            response = await _timed(lists, service.list_sessions(app_name=_APP, user_id=_LEGACY_USER))
+            found = [s for s in response.sessions if owners[s.id] == player]
+        else:
+            response = await _timed(lists, service.list_sessions(app_name=_APP, user_id=player))
+            found = response.sessions
+        assert len(found) == args.sessions_per_player
+
+    deletes = []
+    rng.shuffle(session_ids)
+    for sid in session_ids:
+        await _timed(deletes, service.delete_session(app_name=_APP, user_id=user(sid), session_id=sid))
+
+    shards = service.shards if isinstance(service, ShardedSessionService) else [service]
+    leftover = sum(len(users) for shard in shards for users in shard.sessions.values())
+    return {
+        "get": _stats(gets),
+        "list_player": _stats(lists),
+        "delete": _stats(deletes),
+        "empty_user_buckets_after_delete": leftover,
+    }
+
+
+async def run(args) -> dict:
+    owners = {
+        f"{p:06d}-{s}": f"player-{p}"
+        for p in range(args.players)
+        for s in range(args.sessions_per_player)
+    }
+    report = {
+        "players": args.players,
+        "sessions": len(owners),
+        "events_per_session": args.events,
+        "shards": args.shards,
+    }
+    report["legacy"] = await _run_layout("legacy", InMemorySessionService(), owners, args, random.Random(0))
+    report["sharded"] = await _run_layout(
+        "sharded", ShardedSessionService(args.shards), owners, args, random.Random(0)
+    )
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--players", type=int, default=10000)
+    parser.add_argument("--sessions-per-player", type=int, default=3)
+    parser.add_argument("--events", type=int, default=4, help="每个 session 中的 event 数（get 时会被深拷贝）")
+    parser.add_argument("--lookups", type=int, default=20000)
+    parser.add_argument("--lists", type=int, default=5, help="列出玩家 session 的次数（旧布局每次深拷贝全部 session）")
+    parser.add_argument("--shards", type=int, default=SESSION_SHARDS)
+    args = parser.parse_args(argv)
+    print(json.dumps(asyncio.run(run(args)), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""多 worker 吞吐基准：dispatcher + N 个 uvicorn worker 进程，对比 N = 1 / 2 / 4 的回合吞吐，并验证加 worker 后的 rebalance。
+
+用法：
+    python -m benchmarks.bench_workers [--workers 1 2 4] [--conversations 40] [--turns 3] [--concurrency 16]
+
+需在仓库根目录运行。每个 worker 是 `uvicorn benchmarks.bench_workers:worker_app --factory` 进程：
+导入 Main 前把 Ollama 指向进程内的假模型（httpx.MockTransport，同 bench_combined_turns），
+因此每个回合的耗时全是本仓库与 ADK / LiteLlm 的 CPU 开销，能体现多进程能否摊到多个核上。
+dispatcher 在本进程内经 ASGITransport 驱动（与真实部署相同的转发、归并与迁移逻辑），worker 之间走真实 HTTP。
+
+每个 N：
+- load：并发 --concurrency 个玩家，先创建 --conversations 个会话，再给每个会话发 --turns 条消息；
+  统计回合吞吐（turns/s）与延迟分位数（毫秒）
+- rebalance：再启动一个 worker 并 POST /dispatcher/workers，报告迁移比例（理想值 1/(N+1)）、耗时，
+  以及迁移后每个会话是否都能经 dispatcher 访问到、消息条数不变
+
+吞吐只能扩展到 CPU 核数：报告中的 cpu_count 为 1 时多个 worker 只是分时共用一个核，
+吞吐不会随 N 增长（进程切换反而略有损耗），此时只能验证路由与迁移的正确性。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import secrets
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+_FAKE_BASE = "http://bench-ollama:11434"
+os.environ["OLLAMA_API_BASE"] = _FAKE_BASE
+os.environ["USE_AZURE"] = "false"
+os.environ["FAILOVER_ENABLED"] = "false"
+os.environ["WARMUP_ENABLED"] = "false"
+os.environ["SEMANTIC_CACHE_ENABLED"] = "false"
+os.environ["LOOP_MONITOR_ENABLED"] = "false"
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+import httpx  # noqa: E402
+
+import http_pool  # noqa: E402
+from benchmarks.bench_combined_turns import FakeOllama  # noqa: E402
+from dispatcher import Dispatcher, WorkerProcess, create_app, start_workers  # noqa: E402
+
+_WORKER_APP = "benchmarks.bench_workers:worker_app"
+
+# 玩家脚本：按顺序循环使用
+_SCRIPT = [
+    "今晚聚餐几点开始？",
+    "需要我带点什么吃的吗？",
+    "有人对花生过敏吗？",
+    "好的，那音乐谁来准备？",
+]
+
+
+def worker_app():
+    """worker 进程的应用工厂：注册假 Ollama 后再导入 Main。"""
+    http_pool.pool_for(_FAKE_BASE, transport=httpx.MockTransport(FakeOllama().handler))
+    import Main
+
+    return Main.app
+
+
+def _stats_ms(samples: list[float]) -> dict:
+    samples = sorted(samples)
+    return {
+        "p50_ms": round(statistics.median(samples) * 1000, 1),
+        "p99_ms": round(samples[max(0, int(len(samples) * 0.99) - 1)] * 1000, 1),
+    }
+
+
+async def _load(client: httpx.AsyncClient, args) -> tuple[list[str], dict]:
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def create(i: int) -> str:
+        async with semaphore:
+            r = await client.post("/conversations", json={"persona_ids": ["mikko"]},
+                                  headers={"X-Player-Id": f"player-{i}"})
+            r.raise_for_status()
+            return r.json()["id"]
+
+    ids = await asyncio.gather(*(create(i) for i in range(args.conversations)))
+
+    latencies = []
+    errors = 0
+
+    async def play(i: int, cid: str) -> None:
+        nonlocal errors
+        for t in range(args.turns):
+            async with semaphore:
+                started = time.perf_counter()
+                r = await client.post(f"/conversations/{cid}/messages", json={"content": _SCRIPT[t % len(_SCRIPT)]},
+                                      headers={"X-Player-Id": f"player-{i}"})
+                latencies.append(time.perf_counter() - started)
+                errors += r.status_code != 200
+
+    started = time.perf_counter()
+    await asyncio.gather(*(play(i, cid) for i, cid in enumerate(ids)))
+    seconds = time.perf_counter() - started
+    return ids, {
+        "turns": len(latencies),
+        "errors": errors,
+        "seconds": round(seconds, 2),
+        "turns_per_second": round(len(latencies) / seconds, 2),
+        **_stats_ms(latencies),
+    }
+
+
+async def _message_counts(client: httpx.AsyncClient, ids: list[str]) -> dict[str, int | None]:
+    async def one(i: int, cid: str):
+        r = await client.get(f"/conversations/{cid}", headers={"X-Player-Id": f"player-{i}"})
+        return cid, len(r.json()["messages"]) if r.status_code == 200 else None
+
+    return dict(await asyncio.gather(*(one(i, cid) for i, cid in enumerate(ids))))
+
+
+async def _round(n: int, port: int, args) -> dict:
+    token = secrets.token_urlsafe(16)
+    procs = await start_workers(n, port, _WORKER_APP, factory=True, quiet=True, admin_token=token)
+    extra: WorkerProcess | None = None
+    try:
+        dispatcher = Dispatcher({p.name: p.url for p in procs}, admin_token=token)
+        transport = httpx.ASGITransport(app=create_app(dispatcher))
+        async with httpx.AsyncClient(transport=transport, base_url="http://dispatch", timeout=300) as client:
+            ids, load = await _load(client, args)
+            before = await _message_counts(client, ids)
+
+            extra = WorkerProcess(f"w{n}", port + n, _WORKER_APP, factory=True, quiet=True, admin_token=token)
+            await extra.wait_ready()
+            result = (await client.post("/dispatcher/workers", json={"name": extra.name, "url": extra.url})).json()
+            after = await _message_counts(client, ids)
+        return {
+            "workers": n,
+            "load": load,
+            "rebalance": {
+                "conversations": result["conversations"],
+                "moved": result["moved"],
+                "moved_fraction": round(result["moved"] / max(1, result["conversations"]), 3),
+                "expected_fraction": round(1 / (n + 1), 3),
+                "failed": len(result["failed"]),
+                "seconds": round(result["seconds"], 2),
+                "unreachable_after": sum(1 for v in after.values() if v is None),
+                "message_count_changed": sum(1 for cid in ids if after[cid] != before[cid]),
+            },
+        }
+    finally:
+        for p in [*procs, *([extra] if extra else [])]:
+            p.stop()
+
+
+async def run(args) -> dict:
+    report = {
+        "cpu_count": os.cpu_count(),
+        "conversations": args.conversations,
+        "turns_per_conversation": args.turns,
+        "concurrency": args.concurrency,
+        "rounds": [],
+    }
+    for i, n in enumerate(args.workers):
+        # 每轮换一段端口，避开上一轮刚关闭的监听
+        report["rounds"].append(await _round(n, args.base_port + i * 10, args))
+    base = report["rounds"][0]["load"]["turns_per_second"]
+    for r in report["rounds"]:
+        r["load"]["speedup"] = round(r["load"]["turns_per_second"] / base, 2)
+    return report
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--conversations", type=int, default=40)
+    parser.add_argument("--turns", type=int, default=3, help="每个会话的玩家消息数")
+    parser.add_argument("--concurrency", type=int, default=16, help="同时在途的请求数")
+    parser.add_argument("--base-port", type=int, default=8201)
+    args = parser.parse_args(argv)
+    print(json.dumps(asyncio.run(run(args)), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""回放压测：把录制的真实会话（cassette）当作可复现的负载，离线跑完整编排路径，不需要 Ollama。
+
+用法：
+    python -m benchmarks.replay_cassettes cassettes/ [--speed 10] [--concurrency 8] [--repeat 4]
+
+每个 cassette 在 CASSETTES.playing(...) 中重放：先 create_conversation（开场调用），
+再按顺序发送录制的玩家消息（_run_serialized_turn，与 HTTP 接口同一路径）；模型调用按录制的
+event 时间间隔回放（除以 --speed，0 表示不等待），仍然经过 SCHEDULER 排队。
+--think-time 时按录制的玩家消息间隔（同样除以 --speed）等待后再发送下一条。
+--repeat N 把每个 cassette 复制 N 份并发回放，--concurrency 限制同时进行的会话数。
+
+输出 JSON：会话 / 回合数、墙钟时间、吞吐、回合延迟 p50/p95/最大值（毫秒），
+以及回放的调用数、循环复用数（发言顺序随机，调用次数可能与录制时不同）、prompt 变化（编排改动导致）
+与失败的回合；--strict 时录制调用用完即报错（CassetteMiss），不循环复用。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+os.environ.setdefault("WARMUP_ENABLED", "false")
+os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "false")
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+
+from cassettes import CASSETTES, Cassette, CassetteMiss, load_all  # noqa: E402
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * q))], 1)
+
+
+async def replay_session(cassette: Cassette, speed: float, think_time: bool, strict: bool, stats: dict) -> None:
+    """回放一个会话，把每回合延迟与计数累加到 stats。"""
+    import Main
+
+    with CASSETTES.playing(cassette, speed, strict) as playback:
+        try:
+            # 直接调用路由函数时 FastAPI 不会解析 Depends / Header 默认值，需显式传入
+            conv = await Main.create_conversation(
+                Main.CreateConversationReq(persona_ids=cassette.persona_ids),
+                player_id=Main.DEFAULT_PLAYER_ID,
+                conversation_id=None,
+            )
+        except Exception as e:
+            stats["errors"].append(f"create: {type(e).__name__}: {e}")
+            return
+        previous = 0.0
+        for t, content in cassette.turns:
+            if think_time and speed > 0 and t > previous:
+                await asyncio.sleep((t - previous) / speed)
+            previous = t
+            started = time.perf_counter()
+            try:
+                await Main._run_serialized_turn(conv.id, content)
+            except CassetteMiss as e:
+                stats["errors"].append(str(e))
+                break
+            except Exception as e:
+                stats["errors"].append(f"turn: {type(e).__name__}: {e}")
+                continue
+            stats["latencies_ms"].append((time.perf_counter() - started) * 1000)
+        # 后台总结也从同一个 cassette 回放，等它结束再统计
+        job = Main.OBSERVER_JOBS.get(conv.id)
+        if job is not None and job.task is not None:
+            await asyncio.gather(job.task, return_exceptions=True)
+    stats["served"] += playback.served
+    stats["reused"] += playback.reused
+    stats["prompt_changes"] += playback.prompt_changes
+    stats["misses"] += playback.misses
+
+
+async def run(
+    cassettes: list[Cassette], speed: float, concurrency: int, think_time: bool, strict: bool = False
+) -> dict:
+    stats = {"latencies_ms": [], "errors": [], "served": 0, "reused": 0, "prompt_changes": 0, "misses": 0}
+    limit = asyncio.Semaphore(max(1, concurrency))
+
+    async def one(cassette: Cassette) -> None:
+        async with limit:
+            await replay_session(cassette, speed, think_time, strict, stats)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(c) for c in cassettes))
+    wall = time.perf_counter() - started
+    ordered = sorted(stats["latencies_ms"])
+    return {
+        "sessions": len(cassettes),
+        "turns": len(ordered),
+        "wall_seconds": round(wall, 3),
+        "turns_per_second": round(len(ordered) / wall, 2) if wall else 0.0,
+        "turn_latency_ms": {
+            "p50": _percentile(ordered, 0.5),
+            "p95": _percentile(ordered, 0.95),
+            "max": round(ordered[-1], 1) if ordered else 0.0,
+        },
+        "calls_replayed": stats["served"],
+        "calls_reused": stats["reused"],
+        "prompt_changes": stats["prompt_changes"],
+        "misses": stats["misses"],
+        "errors": stats["errors"][:20],
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", type=Path, help="cassette 文件或目录")
+    parser.add_argument("--speed", type=float, default=1.0, help="回放倍速，0 表示不等待")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=1, help="每个 cassette 并发回放的份数")
+    parser.add_argument("--think-time", action="store_true", help="按录制的玩家消息间隔发送")
+    parser.add_argument("--strict", action="store_true", help="录制调用用完即报错，不循环复用")
+    args = parser.parse_args(argv)
+
+    cassettes = []
+    for path in args.paths:
+        cassettes += load_all(path) if path.is_dir() else [Cassette.load(path)]
+    if not cassettes:
+        parser.error("没有找到 cassette 文件")
+    # 回放产生的会话不再录制
+    CASSETTES.mode = "off"
+
+    report = asyncio.run(run(
+        cassettes * max(1, args.repeat), args.speed, args.concurrency, args.think_time, args.strict
+    ))
+    report["speed"] = args.speed
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
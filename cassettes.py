@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+"""模型调用的录制 / 回放（cassette）：离线复现真实会话，用于调试与压测编排逻辑。
+
+录制（CASSETTE_MODE=record）：每次 runner.run_async 的输入与完整 event 流连同时间戳写入
+CASSETTE_DIR/{conversation_id}.jsonl.gz，一个会话一个文件（gzip 压缩的 JSONL，逐条追加）：
+- {"kind": "conversation", "persona_ids": [...]}              会话创建
+- {"kind": "turn", "t": 秒, "content": "..."}                   玩家消息（t 相对会话创建）
+- {"kind": "call", "t": 秒, "persona": "...", "prompt": "...",  一次模型调用；events 为
+   "seconds": 秒, "events": [[相对调用开始的秒数, event], ...]}  [偏移, {author, content, usage}]
+  调用失败时多一个 "error" 字段；被取消的调用不写入。
+文件写入（mkdir、gzip 压缩与追加）由每个 CassetteDeck 的一个后台写线程按入队顺序完成，
+不占用事件循环；读取刚录下的文件前先调用 CASSETTES.flush()。
+
+回放：CASSETTES.playing(cassette, speed) 范围内（contextvar，后台任务会继承）
+_run_agent_stream 不再调用 runner，而是按 persona 依次取出录制的调用，
+按原始时间间隔（除以 speed，speed<=0 表示不等待）吐出 event，仍然经过 SCHEDULER 排队。
+回放按顺序对应而不比对 prompt：改动编排后 prompt 变化只计入 cassette_replays_total{result=prompt_changed}；
+某个 persona 的录制调用用完时抛出 CassetteMiss（strict=False 时循环复用，见 Playback）。
+
+压测入口见 benchmarks/replay_cassettes.py。
+"""
+
+import asyncio
+import contextvars
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from google.adk.events import Event
+from google.genai import types
+
+from metrics import METRICS
+
+# off | record；回放不靠环境变量开启，而是由调用方进入 CASSETTES.playing(...)
+CASSETTE_MODE = os.getenv("CASSETTE_MODE", "off").strip().lower()
+
+# cassette 文件目录
+CASSETTE_DIR = os.getenv("CASSETTE_DIR", "cassettes")
+
+# 默认回放速度：1 为原速，10 为十倍速，0 为不等待
+CASSETTE_SPEED = float(os.getenv("CASSETTE_SPEED", "1"))
+
+SUFFIX = ".jsonl.gz"
+
+
+class CassetteMiss(LookupError):
+    """回放时某个 persona 已没有录制的调用（编排改动后多出了模型调用）。"""
+
+
+@dataclass(slots=True)
+class RecordedCall:
+    """一次录制的模型调用。"""
+
+    persona_id: str
+    prompt: str
+    t: float = 0.0
+    seconds: float = 0.0
+    # [(相对调用开始的秒数, 序列化的 event), ...]
+    events: list[tuple[float, dict]] = field(default_factory=list)
+    error: str | None = None
+
+
+@dataclass
+class Cassette:
+    """一个会话的录制内容。"""
+
+    conversation_id: str
+    persona_ids: list[str] = field(default_factory=list)
+    # [(相对会话创建的秒数, 玩家消息), ...]
+    turns: list[tuple[float, str]] = field(default_factory=list)
+    calls: list[RecordedCall] = field(default_factory=list)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "Cassette":
+        path = Path(path)
+        cassette = cls(conversation_id=path.name.removesuffix(SUFFIX))
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                rec = json.loads(line)
+                kind = rec.get("kind")
+                if kind == "conversation":
+                    cassette.persona_ids = rec.get("persona_ids") or []
+                elif kind == "turn":
+                    cassette.turns.append((rec["t"], rec["content"]))
+                elif kind == "call":
+                    cassette.calls.append(RecordedCall(
+                        persona_id=rec["persona"],
+                        prompt=rec.get("prompt", ""),
+                        t=rec.get("t", 0.0),
+                        seconds=rec.get("seconds", 0.0),
+                        events=[(at, evt) for at, evt in rec.get("events", [])],
+                        error=rec.get("error"),
+                    ))
+        return cassette
+
+
+def load_all(directory: str | Path) -> list[Cassette]:
+    """读取目录下的全部 cassette（按文件名排序）。"""
+    return [Cassette.load(p) for p in sorted(Path(directory).glob(f"*{SUFFIX}"))]
+
+
+def _prompt_text(new_message) -> str:
+    return "".join(getattr(p, "text", None) or "" for p in (getattr(new_message, "parts", None) or []))
+
+
+def _dump_event(evt) -> dict:
+    """只保留回放需要的字段：author、content（含工具调用）、usage_metadata。"""
+    out = {}
+    author = getattr(evt, "author", None)
+    if author:
+        out["author"] = author
+    content = getattr(evt, "content", None)
+    if content is not None:
+        out["content"] = content.model_dump(mode="json", exclude_none=True)
+    usage = getattr(evt, "usage_metadata", None)
+    if usage is not None:
+        out["usage"] = usage.model_dump(mode="json", exclude_none=True)
+    return out
+
+
+def _load_event(data: dict) -> Event:
+    content = data.get("content")
+    usage = data.get("usage")
+    return Event(
+        author=data.get("author") or "model",
+        content=types.Content.model_validate(content) if content is not None else None,
+        usage_metadata=(
+            types.GenerateContentResponseUsageMetadata.model_validate(usage) if usage is not None else None
+        ),
+    )
+
+
+class Playback:
+    """一次回放：按 persona 排队的录制调用。
+
+    strict=False 时某个 persona 的录制调用用完后循环复用（计为 reused）：
+    发言顺序带随机性，同一段玩家输入回放时各 persona 的调用次数可能与录制时不同，
+    压测只需要负载形状一致。strict=True 时抛出 CassetteMiss。
+    """
+
+    def __init__(self, cassette: Cassette, speed: float = CASSETTE_SPEED, strict: bool = True):
+        self.cassette = cassette
+        self.speed = speed
+        self.strict = strict
+        self._calls: dict[str, list[RecordedCall]] = {}
+        for call in cassette.calls:
+            self._calls.setdefault(call.persona_id, []).append(call)
+        self._next: dict[str, int] = {}
+        self.served = 0
+        self.reused = 0
+        self.misses = 0
+        self.prompt_changes = 0
+
+    def take(self, persona_id: str, prompt: str) -> RecordedCall:
+        calls = self._calls.get(persona_id) or []
+        index = self._next.get(persona_id, 0)
+        if index >= len(calls) and (self.strict or not calls):
+            self.misses += 1
+            METRICS.inc("cassette_replays_total", persona=persona_id, result="miss")
+            raise CassetteMiss(f"cassette {self.cassette.conversation_id} 中没有 {persona_id} 的剩余调用")
+        self._next[persona_id] = index + 1
+        self.served += 1
+        call = calls[index % len(calls)]
+        if index >= len(calls):
+            self.reused += 1
+            result = "reused"
+        elif call.prompt != prompt:
+            self.prompt_changes += 1
+            result = "prompt_changed"
+        else:
+            result = "hit"
+        METRICS.inc("cassette_replays_total", persona=persona_id, result=result)
+        return call
+
+    def remaining(self) -> int:
+        return sum(max(0, len(calls) - self._next.get(pid, 0)) for pid, calls in self._calls.items())
+
+    async def _pause(self, seconds: float) -> None:
+        if self.speed > 0 and seconds > 0:
+            await asyncio.sleep(seconds / self.speed)
+
+    async def stream(self, persona_id: str, new_message):
+        """按录制的时间间隔吐出 event；录制时失败的调用在同一时刻抛出 RuntimeError。"""
+        call = self.take(persona_id, _prompt_text(new_message))
+        elapsed = 0.0
+        for at, data in call.events:
+            await self._pause(at - elapsed)
+            elapsed = max(elapsed, at)
+            yield _load_event(data)
+        await self._pause(call.seconds - elapsed)
+        if call.error:
+            raise RuntimeError(call.error)
+
+
+_PLAYBACK: contextvars.ContextVar[Playback | None] = contextvars.ContextVar("cassette_playback", default=None)
+
+
+class CassetteDeck:
+    """全局录制 / 回放入口。"""
+
+    def __init__(self, mode: str = CASSETTE_MODE, directory: str | Path = CASSETTE_DIR):
+        self.mode = mode
+        self.directory = Path(directory)
+        # conversation_id -> 会话创建时刻（time.monotonic），turn / call 的 t 以此为零点
+        self._origins: dict[str, float] = {}
+        # 待写入的 (路径, 一行 JSON)；由 _writer 线程逐条追加，单线程保证同一文件内的顺序
+        self._pending: queue.Queue[tuple[Path, str]] = queue.Queue()
+        self._writer: threading.Thread | None = None
+        self._writer_lock = threading.Lock()
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @contextmanager
+    def playing(self, cassette: Cassette, speed: float = CASSETTE_SPEED, strict: bool = True):
+        """在 with 块内的模型调用都从 cassette 回放，产出 Playback（含命中 / 未命中计数）。"""
+        playback = Playback(cassette, speed, strict)
+        token = _PLAYBACK.set(playback)
+        try:
+            yield playback
+        finally:
+            _PLAYBACK.reset(token)
+
+    def path(self, conversation_id: str) -> Path:
+        return self.directory / f"{conversation_id}{SUFFIX}"
+
+    def _append(self, conversation_id: str, record: dict) -> None:
+        # 事件循环上只做序列化（record 之后可能被调用方修改），磁盘 IO 交给写线程
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        self._pending.put((self.path(conversation_id), line))
+        if self._writer is None:
+            with self._writer_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name="cassette-writer", daemon=True)
+                    self._writer.start()
+
+    def _write_loop(self) -> None:
+        while True:
+            path, line = self._pending.get()
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                # 每条记录一个 gzip member，gzip.open 读取时会自动拼接
+                with gzip.open(path, "at", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError as e:
+                print(f"[CASSETTE] 写入 {path} 失败: {e}")
+            finally:
+                self._pending.task_done()
+
+    def flush(self) -> None:
+        """阻塞直到已入队的记录全部落盘（测试读取前、进程关闭时调用）。"""
+        self._pending.join()
+
+    def _offset(self, conversation_id: str) -> float:
+        origin = self._origins.get(conversation_id)
+        if origin is None:
+            # 录制开始前就存在的会话：从第一次出现时起算
+            origin = self._origins[conversation_id] = time.monotonic()
+        return round(time.monotonic() - origin, 4)
+
+    def record_conversation(self, conversation_id: str, persona_ids: list[str]) -> None:
+        if not self.recording:
+            return
+        self._origins[conversation_id] = time.monotonic()
+        self._append(conversation_id, {"kind": "conversation", "persona_ids": list(persona_ids)})
+
+    def record_turn(self, conversation_id: str, content: str) -> None:
+        if not self.recording:
+            return
+        self._append(conversation_id, {"kind": "turn", "t": self._offset(conversation_id), "content": content})
+
+    def forget(self, conversation_id: str) -> None:
+        self._origins.pop(conversation_id, None)
+
+    async def _record(self, stream, persona_id: str, session_id: str, new_message):
+        call = {
+            "kind": "call",
+            "t": self._offset(session_id),
+            "persona": persona_id,
+            "prompt": _prompt_text(new_message),
+        }
+        events = []
+        started = time.perf_counter()
+        try:
+            async for evt in stream:
+                events.append([round(time.perf_counter() - started, 4), _dump_event(evt)])
+                yield evt
+        except Exception as e:
+            call["error"] = f"{type(e).__name__}: {e}"
+            self._finish(session_id, call, events, started)
+            raise
+        finally:
+            await stream.aclose()
+        # 被取消（含调用方提前关闭流）的调用走不到这里，不会写入半条回复
+        self._finish(session_id, call, events, started)
+
+    def _finish(self, session_id: str, call: dict, events: list, started: float) -> None:
+        call["seconds"] = round(time.perf_counter() - started, 4)
+        call["events"] = events
+        self._append(session_id, call)
+
+    def stream(self, runner, user_id: str, persona_id: str, session_id: str, new_message):
+        """返回本次调用的 event 流：回放中取 cassette，录制时包一层记录，否则直接 run_async。"""
+        playback = _PLAYBACK.get()
+        if playback is not None:
+            return playback.stream(persona_id, new_message)
+        stream = runner.run_async(user_id=user_id, session_id=session_id, new_message=new_message)
+        if self.recording:
+            return self._record(stream, persona_id, session_id, new_message)
+        return stream
+
+
+CASSETTES = CassetteDeck()
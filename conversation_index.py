@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""会话列表索引：按创建顺序维护、按 persona / 阶段分组，分页与计数都不随会话总数增长。
+
+GET /conversations 原来每次遍历整个 CONVERSATIONS、为每个会话构造摘要再整体按 created_at 排序，
+会话数上万时是 O(n log n) 的时间和 O(n) 的响应体。这里为每个会话分配序号——创建时间（微秒），
+同一微秒内的后一个会话顺延——并为以下每个分组维护一个有序的序号列表：
+- 全部会话
+- 每个阶段（phase）
+- 每个 persona
+- 每个 (persona, 阶段)
+以上每个分组在每个玩家内再各有一份（键前加 ("player", player_id)），列表接口只看请求玩家自己的会话。
+
+分页（新的在前）在对应列表上二分查找游标 before，再切出 limit 个：O(log n + limit)；
+计数就是列表长度。新建会话追加到列表末尾；删除与阶段变化用二分定位后删除 / 插入（一次内存移动）。
+游标是序号，会话被删除后之前拿到的游标仍然有效。序号取自创建时间，从其他 worker 迁移来的会话
+（见 dispatcher.py）按原来的创建时间插入，列表顺序与 created_at 一致。
+"""
+
+import time
+from bisect import bisect_left, insort
+
+_ALL = ("all",)
+
+
+class _Entry:
+    __slots__ = ("seq", "persona_ids", "phase", "player_id")
+
+    def __init__(self, seq: int, persona_ids: tuple[str, ...], phase: str, player_id: str | None):
+        self.seq = seq
+        self.persona_ids = persona_ids
+        self.phase = phase
+        self.player_id = player_id
+
+
+def _scoped(keys, player_id: str | None):
+    # 每个分组同时登记全局的一份与玩家自己的一份
+    for key in keys:
+        yield key
+        if player_id is not None:
+            yield ("player", player_id) + key
+
+
+def _phase_keys(persona_ids: tuple[str, ...], phase: str, player_id: str | None):
+    """与阶段有关的分组（阶段变化时在这些分组之间移动）。"""
+    keys = [("phase", phase)] + [("persona_phase", pid, phase) for pid in persona_ids]
+    return _scoped(keys, player_id)
+
+
+def _keys(persona_ids: tuple[str, ...], phase: str, player_id: str | None):
+    keys = [_ALL] + [("persona", pid) for pid in persona_ids]
+    yield from _scoped(keys, player_id)
+    yield from _phase_keys(persona_ids, phase, player_id)
+
+
+def _filter_key(persona: str | None, phase: str | None, player_id: str | None = None) -> tuple:
+    if persona and phase:
+        key = ("persona_phase", persona, phase)
+    elif persona:
+        key = ("persona", persona)
+    elif phase:
+        key = ("phase", phase)
+    else:
+        key = _ALL
+    return key if player_id is None else ("player", player_id) + key
+
+
+class ConversationIndex:
+    """conversation_id -> 序号，以及每个分组的有序序号列表。"""
+
+    def __init__(self):
+        self._entries: dict[str, _Entry] = {}
+        self._ids: dict[int, str] = {}
+        self._lists: dict[tuple, list[int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, conversation_id: str) -> bool:
+        return conversation_id in self._entries
+
+    def _insert(self, key: tuple, seq: int) -> None:
+        seqs = self._lists.get(key)
+        if seqs is None:
+            seqs = self._lists[key] = []
+        if not seqs or seqs[-1] < seq:
+            seqs.append(seq)
+        else:
+            insort(seqs, seq)
+
+    def _delete(self, key: tuple, seq: int) -> None:
+        seqs = self._lists.get(key)
+        if seqs is None:
+            return
+        i = bisect_left(seqs, seq)
+        if i < len(seqs) and seqs[i] == seq:
+            del seqs[i]
+        if not seqs:
+            del self._lists[key]
+
+    def add(
+        self,
+        conversation_id: str,
+        persona_ids,
+        phase: str = "small_talk",
+        player_id: str | None = None,
+        created_at: float | None = None,
+    ) -> None:
+        """登记会话（created_at 为 epoch 秒，默认现在）；重复登记时先移除旧的。player_id 为 None 时只登记全局分组。"""
+        if conversation_id in self._entries:
+            self.remove(conversation_id)
+        seq = int((time.time() if created_at is None else created_at) * 1_000_000)
+        while seq in self._ids:
+            seq += 1
+        entry = _Entry(seq, tuple(dict.fromkeys(persona_ids)), phase, player_id)
+        self._entries[conversation_id] = entry
+        self._ids[entry.seq] = conversation_id
+        for key in _keys(entry.persona_ids, phase, player_id):
+            self._insert(key, entry.seq)
+
+    def remove(self, conversation_id: str) -> None:
+        entry = self._entries.pop(conversation_id, None)
+        if entry is None:
+            return
+        del self._ids[entry.seq]
+        for key in _keys(entry.persona_ids, entry.phase, entry.player_id):
+            self._delete(key, entry.seq)
+
+    def set_phase(self, conversation_id: str, phase: str) -> None:
+        """会话阶段变化时移到对应阶段的分组（阶段不变时什么都不做）。"""
+        entry = self._entries.get(conversation_id)
+        if entry is None or entry.phase == phase:
+            return
+        for key in _phase_keys(entry.persona_ids, entry.phase, entry.player_id):
+            self._delete(key, entry.seq)
+        for key in _phase_keys(entry.persona_ids, phase, entry.player_id):
+            self._insert(key, entry.seq)
+        entry.phase = phase
+
+    def count(self, persona: str | None = None, phase: str | None = None, player_id: str | None = None) -> int:
+        return len(self._lists.get(_filter_key(persona, phase, player_id), ()))
+
+    def page(
+        self,
+        limit: int,
+        before: int | None = None,
+        persona: str | None = None,
+        phase: str | None = None,
+        player_id: str | None = None,
+    ) -> tuple[list[str], int | None]:
+        """新的在前的一页会话 id，以及下一页的游标（没有更多时为 None）；给出 player_id 时只看该玩家的会话。"""
+        seqs = self._lists.get(_filter_key(persona, phase, player_id), [])
+        end = bisect_left(seqs, before) if before is not None else len(seqs)
+        start = max(0, end - limit)
+        page = seqs[start:end]
+        page.reverse()
+        return [self._ids[s] for s in page], (page[-1] if start > 0 and page else None)
+
+    def counts(self) -> dict:
+        """按阶段与 persona 的会话数（直接取各分组列表的长度），以及有会话的玩家数。"""
+        by_phase, by_persona, players = {}, {}, 0
+        for key, seqs in self._lists.items():
+            if key[0] == "phase":
+                by_phase[key[1]] = len(seqs)
+            elif key[0] == "persona":
+                by_persona[key[1]] = len(seqs)
+            elif key[0] == "player" and key[2:] == _ALL:
+                players += 1
+        return {"total": len(self._entries), "players": players, "by_phase": by_phase, "by_persona": by_persona}
+
+
+CONVERSATION_INDEX = ConversationIndex()
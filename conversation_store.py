@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""会话存储的紧凑数据结构。
+
+大量会话同时在线时，每条消息一个 {"role", "name", "content"} dict、
+每个会话状态一个四键 dict 的开销会占据大部分内存。这里提供：
+- Role / SPEAKERS：角色与发言者名字的驻留（interned）编码
+- Message：不可变的 __slots__ 消息记录
+- MessageLog：列式存储的消息日志（role、speaker 用 array 编码，content 单独一列）
+- PhaseState：会话状态机的紧凑状态对象
+- Conversation：会话对象（persona_ids、messages、created_at、所属玩家 player_id）
+"""
+
+import os
+import sys
+from array import array
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Iterable, Iterator
+
+from players import DEFAULT_PLAYER_ID
+
+# 内存中最多保留的会话数（0 表示不限）；超出时淘汰最早创建的空闲会话
+MAX_CONVERSATIONS = int(os.getenv("MAX_CONVERSATIONS", "0"))
+
+
+class Role(IntEnum):
+    """消息角色编码。"""
+
+    USER = 0
+    MODEL = 1
+
+    @property
+    def label(self) -> str:
+        return _ROLE_LABELS[self]
+
+    @classmethod
+    def parse(cls, label: str) -> "Role":
+        try:
+            return _ROLE_BY_LABEL[label]
+        except KeyError:
+            raise ValueError(f"unknown message role: {label!r}") from None
+
+
+_ROLE_LABELS = {Role.USER: sys.intern("user"), Role.MODEL: sys.intern("model")}
+_ROLE_BY_LABEL = {label: role for role, label in _ROLE_LABELS.items()}
+
+
+class SpeakerTable:
+    """发言者名字 <-> 小整数 id 的驻留表。id 0 保留给 None（玩家消息）。"""
+
+    __slots__ = ("_names", "_ids")
+
+    def __init__(self):
+        self._names: list[str | None] = [None]
+        self._ids: dict[str, int] = {}
+
+    def encode(self, name: str | None) -> int:
+        if name is None:
+            return 0
+        sid = self._ids.get(name)
+        if sid is None:
+            sid = len(self._names)
+            name = sys.intern(name)
+            self._names.append(name)
+            self._ids[name] = sid
+        return sid
+
+    def decode(self, sid: int) -> str | None:
+        return self._names[sid]
+
+    def __len__(self) -> int:
+        return len(self._names) - 1
+
+
+# 全进程共享：Mikko / Aino / 观察者 等名字只存一份
+SPEAKERS = SpeakerTable()
+
+
+@dataclass(frozen=True, slots=True)
+class Message:
+    """单条消息记录（不可变）。role/name 为驻留字符串。"""
+
+    role: str
+    name: str | None
+    content: str
+
+    def to_dict(self) -> dict:
+        return {"role": self.role, "name": self.name, "content": self.content}
+
+
+class MessageLog:
+    """列式消息日志：role 与 speaker 以 array 存储，content 为字符串列表。
+
+    对外行为类似 list[Message]：支持 append / len / 迭代 / 下标 / 切片 / reversed。
+    append 同时接受 Message 和旧格式 dict。
+    """
+
+    __slots__ = ("_roles", "_speakers", "_contents")
+
+    def __init__(self, messages: Iterable = ()):
+        self._roles = array("B")
+        self._speakers = array("H")
+        self._contents: list[str] = []
+        for m in messages:
+            self.append(m)
+
+    def append(self, message) -> None:
+        if isinstance(message, Message):
+            role, name, content = message.role, message.name, message.content
+        else:
+            role, name, content = message["role"], message.get("name"), message.get("content", "")
+        # 可能失败的编码与 speaker 列（array("H") 超过 65535 时 OverflowError）放在前面，失败时三列都不变
+        role = Role.parse(role)
+        self._speakers.append(SPEAKERS.encode(name))
+        self._roles.append(role)
+        self._contents.append(content)
+
+    def _at(self, i: int) -> Message:
+        return Message(
+            _ROLE_LABELS[self._roles[i]],
+            SPEAKERS.decode(self._speakers[i]),
+            self._contents[i],
+        )
+
+    def __len__(self) -> int:
+        return len(self._contents)
+
+    def __bool__(self) -> bool:
+        return bool(self._contents)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._at(i) for i in range(*index.indices(len(self._contents)))]
+        if index < 0:
+            index += len(self._contents)
+        if not 0 <= index < len(self._contents):
+            raise IndexError("message index out of range")
+        return self._at(index)
+
+    def __iter__(self) -> Iterator[Message]:
+        for i in range(len(self._contents)):
+            yield self._at(i)
+
+    def __reversed__(self) -> Iterator[Message]:
+        for i in range(len(self._contents) - 1, -1, -1):
+            yield self._at(i)
+
+    def to_dicts(self) -> list[dict]:
+        return [m.to_dict() for m in self]
+
+
+PHASES = ("small_talk", "religion_deep", "allergy_deep", "wrap_up", "finished")
+
+
+@dataclass(slots=True)
+class PhaseState:
+    """会话状态机状态（替代原来的四键 dict）。"""
+
+    phase: str = "small_talk"
+    religion_discussed: bool = False
+    allergy_discussed: bool = False
+    sub_agent_turns: int = 0  # 子代理讨论轮数计数
+
+
+@dataclass(slots=True)
+class Conversation:
+    """单个会话：参与的 persona、列式消息日志、创建时间与所属玩家。"""
+
+    persona_ids: list[str]
+    created_at: str
+    messages: MessageLog = field(default_factory=MessageLog)
+    player_id: str = DEFAULT_PLAYER_ID
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""委托模式：Mikko / Aino 在一次 run_async 内把专家当作工具调用。
+
+状态机路径在 religion_deep / allergy_deep 里先单独调用专家 Runner，再调用搭档补充，
+一个回合是两次顶层编排（两次排队、两次会话读写）。委托模式（ORCHESTRATION_MODE=delegation）
+下，附身的学生 Agent 挂上 tools.AGENT_TOOLS 里已注册的专家 AgentTool，需要专业知识时
+自己调用专家，拿到结果后用自己的口吻回答：一个回合只有一次顶层 run_async，
+并沿用该学生自己的会话。
+
+DelegationPlugin 是 ADK 插件（AgentTool 会把父 Runner 的插件传给专家的子 Runner），负责：
+- 每回合工具调用上限 DELEGATION_MAX_TOOL_CALLS，超出时不执行工具，直接返回提示让模型作答
+- 每个工具的调用次数与耗时（delegation_tool_calls_total / delegation_tool_seconds）
+- 按 Agent 统计 token（delegation_tokens_total{agent,kind}）；专家 Agent 名即工具名，
+  工具内部的模型调用自然记在该工具名下
+- 专家子 Runner 的用量不会出现在宿主的 event 流里，由插件记入 TOKENS（当前 TOKENS.track 的会话与阶段），
+  计入会话账单、成本与 token 预算；宿主自己的用量仍由 Main 从 event 流记录
+- 专家在工具内被调用时，按请求文本检索知识库，把【参考资料】附在专家输入后面
+
+track_turn() 把一个回合内的用量收集到 TurnUsage，供调用方记录日志。
+"""
+
+import contextvars
+import os
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from google.adk.plugins.base_plugin import BasePlugin
+from google.genai import types
+
+from knowledge_base import format_facts, retrieve
+from metrics import METRICS
+from token_usage import TOKENS
+
+# 每回合最多调用几次专家工具
+DELEGATION_MAX_TOOL_CALLS = int(os.getenv("DELEGATION_MAX_TOOL_CALLS", "2"))
+
+# 超出上限时返回给模型的工具结果
+CAP_REACHED_RESPONSE = {"error": "本回合的专家咨询次数已用完，请根据已有信息直接回答玩家。"}
+
+
+@dataclass
+class AgentUsage:
+    """一个 Agent（宿主或专家工具）在一个回合内的用量。
+
+    calls 为模型调用次数；seconds 为作为工具被调用的总耗时（宿主为 0）。
+    """
+
+    calls: int = 0
+    seconds: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+@dataclass
+class TurnUsage:
+    """一个委托回合的用量：工具调用次数、被上限拦下的次数与各 Agent 的用量。"""
+
+    tool_calls: int = 0
+    capped: int = 0
+    agents: dict[str, AgentUsage] = field(default_factory=dict)
+
+    def agent(self, name: str) -> AgentUsage:
+        usage = self.agents.get(name)
+        if usage is None:
+            usage = self.agents[name] = AgentUsage()
+        return usage
+
+    def to_dict(self) -> dict:
+        return {
+            "tool_calls": self.tool_calls,
+            "capped": self.capped,
+            "agents": {
+                name: {
+                    "calls": u.calls,
+                    "seconds": round(u.seconds, 3),
+                    "prompt_tokens": u.prompt_tokens,
+                    "completion_tokens": u.completion_tokens,
+                }
+                for name, u in self.agents.items()
+            },
+        }
+
+
+_TURN: contextvars.ContextVar[TurnUsage | None] = contextvars.ContextVar("delegation_turn", default=None)
+
+
+@contextmanager
+def track_turn():
+    """在 with 块内收集委托用量（ADK 的工具任务会继承当前 context）。"""
+    usage = TurnUsage()
+    token = _TURN.set(usage)
+    try:
+        yield usage
+    finally:
+        _TURN.reset(token)
+
+
+class DelegationPlugin(BasePlugin):
+    """专家工具调用的上限、计时、token 统计与知识注入。"""
+
+    def __init__(
+        self,
+        knowledge_domains: dict[str, str] | None = None,
+        max_tool_calls: int = DELEGATION_MAX_TOOL_CALLS,
+    ):
+        super().__init__(name="delegation")
+        # 专家 Agent 名 -> 知识库领域
+        self.knowledge_domains = dict(knowledge_domains or {})
+        self.max_tool_calls = max_tool_calls
+        # invocation_id -> 本回合已执行的工具调用数
+        self._calls: dict[str, int] = {}
+        # function_call_id -> 开始时间
+        self._started: dict[str, float] = {}
+        # 作为工具被调用过的专家 Agent 名
+        self._tool_agents: set[str] = set()
+        # invocation_id -> 最近一次模型调用的模型名（记 TOKENS 时计算成本）
+        self._models: dict[str, str] = {}
+
+    async def before_tool_callback(self, *, tool, tool_args, tool_context):
+        invocation_id = tool_context.invocation_id
+        turn = _TURN.get()
+        if self._calls.get(invocation_id, 0) >= self.max_tool_calls:
+            METRICS.inc("delegation_tool_calls_capped_total", tool=tool.name)
+            if turn is not None:
+                turn.capped += 1
+            print(f"[DELEGATION] 已达工具调用上限（{self.max_tool_calls}），跳过 {tool.name}")
+            return dict(CAP_REACHED_RESPONSE)
+        self._calls[invocation_id] = self._calls.get(invocation_id, 0) + 1
+        self._tool_agents.add(tool.name)
+        if turn is not None:
+            turn.tool_calls += 1
+        self._started[tool_context.function_call_id] = time.perf_counter()
+        return None
+
+    async def after_tool_callback(self, *, tool, tool_args, tool_context, result):
+        started = self._started.pop(tool_context.function_call_id, None)
+        if started is None:
+            return None
+        elapsed = time.perf_counter() - started
+        METRICS.inc("delegation_tool_calls_total", tool=tool.name)
+        METRICS.observe("delegation_tool_seconds", elapsed, tool=tool.name)
+        turn = _TURN.get()
+        if turn is not None:
+            turn.agent(tool.name).seconds += elapsed
+        return None
+
+    async def before_model_callback(self, *, callback_context, llm_request):
+        if callback_context.agent_name in self._tool_agents and llm_request.model:
+            self._models[callback_context.invocation_id] = llm_request.model
+        domain = self.knowledge_domains.get(callback_context.agent_name)
+        if not domain or not llm_request.contents:
+            return None
+        last = llm_request.contents[-1]
+        question = "".join(p.text or "" for p in last.parts or [])
+        block = format_facts(retrieve(question, domain))
+        if block:
+            last.parts = list(last.parts or []) + [types.Part(text=f"\n\n{block}")]
+        return None
+
+    async def after_model_callback(self, *, callback_context, llm_response):
+        meta = llm_response.usage_metadata
+        if meta is None:
+            return None
+        agent = callback_context.agent_name
+        prompt_tokens = meta.prompt_token_count or 0
+        completion_tokens = meta.candidates_token_count or 0
+        METRICS.inc("delegation_tokens_total", prompt_tokens, agent=agent, kind="prompt")
+        METRICS.inc("delegation_tokens_total", completion_tokens, agent=agent, kind="completion")
+        if agent in self._tool_agents:
+            model = self._models.get(callback_context.invocation_id, "unknown")
+            TOKENS.record(agent.removeprefix("agent_"), model, prompt_tokens, completion_tokens)
+        turn = _TURN.get()
+        if turn is not None:
+            usage = turn.agent(agent)
+            usage.calls += 1
+            usage.prompt_tokens += prompt_tokens
+            usage.completion_tokens += completion_tokens
+        return None
+
+    async def after_run_callback(self, *, invocation_context):
+        self._calls.pop(invocation_context.invocation_id, None)
+        self._models.pop(invocation_context.invocation_id, None)
+        return None
@@ -0,0 +1,533 @@
+# -*- coding: utf-8 -*-
+"""多进程部署：前置 dispatcher 按会话 id 一致性哈希把请求转发给 worker。
+
+会话状态（CONVERSATIONS、CONVERSATION_STATES、各 Runner 的 session）都在进程内存里，
+`uvicorn --workers N` 会把同一会话的请求分给不同进程。这里改为：
+- N 个 worker 各自是一个普通的 Main:app 进程，只持有哈希环分给自己的会话
+- dispatcher 是一个很薄的 ASGI 反向代理：
+  - /conversations/{id}/...：转发给 HashRing.node_for(id)
+  - POST /conversations：先分配会话 id（X-Conversation-Id），再转发给它的 worker
+  - GET /conversations：并发查询每个 worker 再按 created_at 归并；游标是各 worker 游标的组合
+  - GET /turns/{id}：回合 id 由 worker 生成，并发问所有 worker，返回持有它的那个
+  - /ready 要求所有 worker 就绪；/metrics 汇总各 worker；其余接口轮流转发
+- 增减 worker（POST / DELETE /dispatcher/workers）时 rebalance：找出归属改变的会话（约 1/N），
+  暂停这些会话的请求、等在途请求结束，经 /admin/conversations/{id} 导出、导入新 worker、删除旧副本。
+  只迁移消息、阶段与归属，ADK session 在新 worker 上重新开始（见 Main.import_conversation）
+- worker 的 /admin/conversations 接口跨玩家读写会话，要求请求头 X-Admin-Token 等于 ADMIN_TOKEN；
+  dispatcher 不转发任何 /admin/* 请求，只在迁移时自己带上令牌调用
+
+用法：
+    python -m dispatcher --workers 4 [--port 8000] [--worker-base-port 8101] [--app Main:app]
+会启动 4 个 uvicorn worker 进程；已在运行的 worker 可通过 POST /dispatcher/workers 加入
+（它们需以相同的 ADMIN_TOKEN 启动；未设置 ADMIN_TOKEN 时 dispatcher 为自己启动的 worker 生成一个随机令牌）。
+"""
+
+import argparse
+import asyncio
+import heapq
+import itertools
+import os
+import re
+import secrets
+import subprocess
+import sys
+import time
+import uuid
+
+import httpx
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+
+import http_pool
+from hash_ring import HashRing
+from metrics import METRICS
+
+# worker 管理接口（/admin/conversations）的令牌；为空时 worker 拒绝这些请求
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+ADMIN_HEADER = "X-Admin-Token"
+
+# rebalance 时同时迁移的会话数
+REBALANCE_CONCURRENCY = int(os.getenv("REBALANCE_CONCURRENCY", "8"))
+
+# 导出时会话正忙（409）的重试次数与间隔（秒）
+_EXPORT_RETRIES = 50
+_EXPORT_RETRY_DELAY = 0.2
+
+# 不转发的逐跳请求头 / 响应头（content-length 由 httpx / Starlette 重新计算）
+_HOP_HEADERS = {
+    "host", "connection", "keep-alive", "transfer-encoding", "te", "trailer",
+    "upgrade", "proxy-authorization", "proxy-authenticate", "content-length", "content-encoding",
+}
+
+_CONVERSATION_PATH = re.compile(r"^/conversations/([^/]+)(?:/.*)?$")
+_ADMIN_PATH = re.compile(r"^/admin(?:/.*)?$")
+_TURN_PATH = re.compile(r"^/turns/([^/]+)$")
+
+
+class WorkerUnavailable(Exception):
+    """worker 无法连接。"""
+
+
+class Worker:
+    """一个 worker 进程：名字、地址、管理令牌与共享连接池中的 client。"""
+
+    def __init__(self, name: str, url: str, admin_token: str = ""):
+        self.name = name
+        self.url = url.rstrip("/")
+        self.admin_token = admin_token
+        self.client = http_pool.pool_for(self.url).client()
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        try:
+            return await self.client.request(method, self.url + path, **kwargs)
+        except httpx.TransportError as e:
+            METRICS.inc("dispatcher_worker_errors_total", worker=self.name)
+            raise WorkerUnavailable(f"worker {self.name} 不可用: {e}") from e
+
+    async def admin(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """带管理令牌调用 worker 的 /admin 接口。"""
+        headers = {**kwargs.pop("headers", {}), ADMIN_HEADER: self.admin_token}
+        return await self.request(method, path, headers=headers, **kwargs)
+
+
+def _request_headers(request: Request, extra: dict | None = None) -> dict:
+    headers = {k: v for k, v in request.headers.items() if k.lower() not in _HOP_HEADERS}
+    if extra:
+        headers.update(extra)
+    return headers
+
+
+def _response(upstream: httpx.Response) -> Response:
+    headers = {k: v for k, v in upstream.headers.items() if k.lower() not in _HOP_HEADERS}
+    return Response(content=upstream.content, status_code=upstream.status_code, headers=headers)
+
+
+def _parse_cursor(value: str | None) -> dict[str, int]:
+    """组合游标 "w0:123,w1:0" -> {worker: 游标}；0 表示该 worker 已经取完，缺少的 worker 从头开始。"""
+    cursors = {}
+    for part in (value or "").split(","):
+        name, _, seq = part.partition(":")
+        if name and seq.isdigit():
+            cursors[name] = int(seq)
+    return cursors
+
+
+class Dispatcher:
+    """哈希环、worker 连接与 rebalance 状态。"""
+
+    def __init__(self, workers: dict[str, str] | None = None, admin_token: str = ADMIN_TOKEN):
+        self.admin_token = admin_token
+        self.workers: dict[str, Worker] = {}
+        self.ring = HashRing()
+        for name, url in (workers or {}).items():
+            self.workers[name] = Worker(name, url, admin_token)
+            self.ring.add(name)
+        self._round_robin = itertools.count()
+        # 会话 id -> 转发中的请求数；迁移前等它归零
+        self._inflight: dict[str, int] = {}
+        # 迁移中的会话 id -> 迁移结束事件；这些会话的新请求等待
+        self._moving: dict[str, asyncio.Event] = {}
+        # 环稳定（不在 rebalance 的统计阶段）时才分配新会话
+        self._stable = asyncio.Event()
+        self._stable.set()
+        self._creating = 0
+        self._rebalance_lock = asyncio.Lock()
+
+    # ---------- 转发 ----------
+
+    def owner(self, conversation_id: str) -> Worker:
+        try:
+            return self.workers[self.ring.node_for(conversation_id)]
+        except LookupError:
+            raise HTTPException(503, detail="没有可用的 worker")
+
+    async def _forward(self, worker: Worker, request: Request, body: bytes, extra: dict | None = None) -> Response:
+        started = time.perf_counter()
+        try:
+            upstream = await worker.request(
+                request.method,
+                request.url.path,
+                params=request.query_params,
+                content=body,
+                headers=_request_headers(request, extra),
+            )
+        except WorkerUnavailable as e:
+            raise HTTPException(502, detail=str(e))
+        METRICS.observe("dispatcher_forward_seconds", time.perf_counter() - started, worker=worker.name)
+        return _response(upstream)
+
+    async def forward_conversation(self, conversation_id: str, request: Request, body: bytes) -> Response:
+        """转发会话请求；会话迁移中时等迁移完成再按新的环转发。"""
+        while (moving := self._moving.get(conversation_id)) is not None:
+            await moving.wait()
+        worker = self.owner(conversation_id)
+        self._inflight[conversation_id] = self._inflight.get(conversation_id, 0) + 1
+        try:
+            return await self._forward(worker, request, body)
+        finally:
+            left = self._inflight[conversation_id] - 1
+            if left:
+                self._inflight[conversation_id] = left
+            else:
+                del self._inflight[conversation_id]
+
+    async def create_conversation(self, request: Request, body: bytes) -> Response:
+        """分配会话 id 并转发给它的 worker（rebalance 统计会话期间等待）。"""
+        await self._stable.wait()
+        conversation_id = uuid.uuid4().hex
+        self._creating += 1
+        try:
+            return await self._forward(
+                self.owner(conversation_id), request, body, {"X-Conversation-Id": conversation_id}
+            )
+        finally:
+            self._creating -= 1
+
+    async def list_conversations(self, request: Request) -> Response:
+        """并发查询每个 worker 的一页，按 created_at 归并出前 limit 条，并给出组合游标。"""
+        params = dict(request.query_params)
+        try:
+            limit = max(1, min(500, int(params.pop("limit", 50))))
+        except ValueError:
+            raise HTTPException(422, detail="limit 应为整数")
+        cursors = _parse_cursor(params.pop("before", None))
+        headers = _request_headers(request)
+        # 已取完的 worker（游标 0）也要问：返回空页，但总数要算上它
+        names = self.ring.nodes
+
+        async def fetch(name: str, page_limit: int) -> httpx.Response:
+            query = dict(params, limit=page_limit)
+            if name in cursors:
+                query["before"] = cursors[name]
+            return await self.workers[name].request("GET", "/conversations", params=query, headers=headers)
+
+        try:
+            responses = await asyncio.gather(*(fetch(n, limit) for n in names))
+        except WorkerUnavailable as e:
+            raise HTTPException(502, detail=str(e))
+        for r in responses:
+            if r.status_code != 200:
+                return _response(r)
+        pages = {n: r.json() for n, r in zip(names, responses)}
+        # 每个 worker 的一页已按 created_at 从新到旧排好（见 conversation_index.py），归并保持各自顺序
+        merged = list(itertools.islice(heapq.merge(
+            *([(item["created_at"], n, item) for item in pages[n]] for n in names),
+            key=lambda t: t[0],
+            reverse=True,
+        ), limit))
+
+        taken = {n: 0 for n in names}
+        for _, n, _ in merged:
+            taken[n] += 1
+        next_cursors = {}
+        for n, r in zip(names, responses):
+            if taken[n] == len(pages[n]):
+                next_cursors[n] = int(r.headers.get("X-Next-Cursor", 0))
+            elif taken[n] == 0:
+                if n in cursors:
+                    next_cursors[n] = cursors[n]
+            else:
+                # 只用了这一页的前几条：按用掉的条数再取一次，得到该 worker 的下一页游标
+                try:
+                    r = await fetch(n, taken[n])
+                except WorkerUnavailable as e:
+                    raise HTTPException(502, detail=str(e))
+                next_cursors[n] = int(r.headers.get("X-Next-Cursor", 0))
+
+        out_headers = {"X-Total-Count": str(sum(int(r.headers.get("X-Total-Count", 0)) for r in responses))}
+        if any(next_cursors.get(n) != 0 for n in names):
+            out_headers["X-Next-Cursor"] = ",".join(f"{n}:{c}" for n, c in sorted(next_cursors.items()))
+        return JSONResponse([item for _, _, item in merged], headers=out_headers)
+
+    async def forward_turn(self, request: Request, body: bytes) -> Response:
+        """回合 id 不含会话信息：问所有 worker，返回不是 404 的那个。"""
+        workers = [self.workers[n] for n in self.ring.nodes]
+        responses = await asyncio.gather(
+            *(self._forward(w, request, body) for w in workers), return_exceptions=True
+        )
+        for r in responses:
+            if isinstance(r, Response) and r.status_code != 404:
+                return r
+        return JSONResponse(status_code=404, content={"detail": "回合不存在"})
+
+    async def forward_any(self, request: Request, body: bytes) -> Response:
+        """与会话无关的接口（/personas、/routing 等）轮流转发。"""
+        nodes = self.ring.nodes
+        if not nodes:
+            raise HTTPException(503, detail="没有可用的 worker")
+        worker = self.workers[nodes[next(self._round_robin) % len(nodes)]]
+        return await self._forward(worker, request, body)
+
+    async def ready(self) -> Response:
+        async def one(worker: Worker):
+            try:
+                r = await worker.request("GET", "/ready")
+                return r.status_code == 200
+            except WorkerUnavailable:
+                return False
+
+        states = await asyncio.gather(*(one(self.workers[n]) for n in self.ring.nodes))
+        workers = dict(zip(self.ring.nodes, states))
+        ready = bool(workers) and all(states)
+        return JSONResponse(status_code=200 if ready else 503, content={"ready": ready, "workers": workers})
+
+    async def metrics(self) -> dict:
+        async def one(worker: Worker):
+            try:
+                return (await worker.request("GET", "/metrics")).json()
+            except WorkerUnavailable as e:
+                return {"error": str(e)}
+
+        names = self.ring.nodes
+        snapshots = await asyncio.gather(*(one(self.workers[n]) for n in names))
+        return {"dispatcher": self.snapshot(), "workers": dict(zip(names, snapshots))}
+
+    def snapshot(self) -> dict:
+        return {
+            "workers": {n: self.workers[n].url for n in self.ring.nodes},
+            "vnodes": self.ring.vnodes,
+            "inflight_conversations": len(self._inflight),
+            "moving_conversations": len(self._moving),
+        }
+
+    # ---------- rebalance ----------
+
+    async def add_worker(self, name: str, url: str) -> dict:
+        """加入 worker 并把哈希环分给它的会话迁移过去。
+
+        切换哈希环之前失败（如列出会话时某个 worker 不可用）时撤销登记，之后可以重试。
+        """
+        async with self._rebalance_lock:
+            if name in self.workers:
+                raise ValueError(f"worker {name} 已存在")
+            self.workers[name] = Worker(name, url, self.admin_token)
+            ring = self.ring.copy()
+            ring.add(name)
+            try:
+                return await self._rebalance(ring)
+            except BaseException:
+                if name not in self.ring.nodes:
+                    del self.workers[name]
+                raise
+
+    async def remove_worker(self, name: str) -> dict:
+        """把 worker 上的会话迁移到其他 worker 后移除它（不会停止 worker 进程）。"""
+        async with self._rebalance_lock:
+            if name not in self.workers:
+                raise KeyError(name)
+            ring = self.ring.copy()
+            ring.remove(name)
+            if not len(ring):
+                raise ValueError("不能移除最后一个 worker")
+            result = await self._rebalance(ring)
+            del self.workers[name]
+            return result
+
+    async def _rebalance(self, ring: HashRing) -> dict:
+        started = time.perf_counter()
+        # 统计阶段：暂停分配新会话，等在途的创建结束，再列出各 worker 上的会话
+        self._stable.clear()
+        try:
+            while self._creating:
+                await asyncio.sleep(0.01)
+            old_nodes = self.ring.nodes
+            listed = await asyncio.gather(
+                *(self.workers[n].admin("GET", "/admin/conversations") for n in old_nodes)
+            )
+            moves = []
+            total = 0
+            for source, r in zip(old_nodes, listed):
+                r.raise_for_status()
+                ids = r.json()["ids"]
+                total += len(ids)
+                for cid in ids:
+                    target = ring.node_for(cid)
+                    if target != source:
+                        moves.append((cid, source, target))
+            for cid, _, _ in moves:
+                self._moving[cid] = asyncio.Event()
+            # 不迁移的会话在新旧环上归属相同，切换后照常转发；迁移中的会话等迁移完成
+            self.ring = ring
+        finally:
+            self._stable.set()
+
+        semaphore = asyncio.Semaphore(REBALANCE_CONCURRENCY)
+        failed = []
+
+        async def move(cid: str, source: str, target: str) -> None:
+            async with semaphore:
+                try:
+                    await self._migrate(cid, self.workers[source], self.workers[target])
+                except Exception as e:
+                    failed.append(cid)
+                    print(f"[DISPATCH] 迁移会话 {cid} {source} -> {target} 失败: {e}")
+                finally:
+                    self._moving.pop(cid).set()
+
+        await asyncio.gather(*(move(*m) for m in moves))
+        METRICS.inc("dispatcher_rebalances_total")
+        METRICS.inc("dispatcher_conversations_moved_total", len(moves) - len(failed))
+        elapsed = time.perf_counter() - started
+        print(f"[DISPATCH] rebalance：{total} 个会话中迁移 {len(moves)} 个，失败 {len(failed)} 个，{elapsed:.2f}s")
+        return {"workers": ring.nodes, "conversations": total, "moved": len(moves), "failed": failed, "seconds": elapsed}
+
+    async def _migrate(self, cid: str, source: Worker, target: Worker) -> None:
+        while self._inflight.get(cid):
+            await asyncio.sleep(0.01)
+        for _ in range(_EXPORT_RETRIES):
+            exported = await source.admin("GET", f"/admin/conversations/{cid}")
+            if exported.status_code != 409:
+                break
+            await asyncio.sleep(_EXPORT_RETRY_DELAY)
+        if exported.status_code == 404:
+            return  # 统计之后被删除或淘汰
+        exported.raise_for_status()
+        body = exported.json()
+        (await target.admin("PUT", f"/admin/conversations/{cid}", json=body)).raise_for_status()
+        deleted = await source.request("DELETE", f"/conversations/{cid}", headers={"X-Player-Id": body["player_id"]})
+        if deleted.status_code not in (204, 404):
+            deleted.raise_for_status()
+
+
+class AddWorkerReq(BaseModel):
+    name: str
+    url: str
+
+
+def create_app(dispatcher: Dispatcher) -> FastAPI:
+    """dispatcher 的 ASGI 应用：管理接口 + 其余全部按规则转发。"""
+    app = FastAPI()
+
+    @app.get("/dispatcher/workers")
+    def list_workers():
+        return dispatcher.snapshot()
+
+    @app.post("/dispatcher/workers")
+    async def add_worker(req: AddWorkerReq):
+        try:
+            return await dispatcher.add_worker(req.name, req.url)
+        except ValueError as e:
+            raise HTTPException(409, detail=str(e))
+        except (WorkerUnavailable, httpx.HTTPStatusError) as e:
+            raise HTTPException(502, detail=f"rebalance 失败: {e}")
+
+    @app.delete("/dispatcher/workers/{name}")
+    async def remove_worker(name: str):
+        try:
+            return await dispatcher.remove_worker(name)
+        except KeyError:
+            raise HTTPException(404, detail="worker 不存在")
+        except ValueError as e:
+            raise HTTPException(409, detail=str(e))
+
+    @app.get("/ready")
+    async def ready():
+        return await dispatcher.ready()
+
+    @app.get("/metrics")
+    async def metrics():
+        return await dispatcher.metrics()
+
+    @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE"])
+    async def proxy(request: Request):
+        path = request.url.path
+        if _ADMIN_PATH.match(path):
+            # worker 的管理接口只在内部使用（迁移由 dispatcher 自己调用），不对外转发
+            raise HTTPException(404, detail="Not Found")
+        body = await request.body()
+        if path == "/conversations":
+            if request.method == "POST":
+                return await dispatcher.create_conversation(request, body)
+            return await dispatcher.list_conversations(request)
+        m = _CONVERSATION_PATH.match(path)
+        if m:
+            return await dispatcher.forward_conversation(m.group(1), request, body)
+        if _TURN_PATH.match(path):
+            return await dispatcher.forward_turn(request, body)
+        return await dispatcher.forward_any(request, body)
+
+    return app
+
+
+# ---------- 本地 worker 进程 ----------
+
+
+class WorkerProcess:
+    """一个本地 uvicorn worker 进程。"""
+
+    def __init__(self, name: str, port: int, app: str = "Main:app", factory: bool = False, host: str = "127.0.0.1",
+                 quiet: bool = False, admin_token: str = ADMIN_TOKEN):
+        self.name = name
+        self.url = f"http://{host}:{port}"
+        cmd = [sys.executable, "-m", "uvicorn", app, "--host", host, "--port", str(port), "--log-level", "warning"]
+        if factory:
+            cmd.append("--factory")
+        output = subprocess.DEVNULL if quiet else None
+        env = {**os.environ, "ADMIN_TOKEN": admin_token}
+        self.process = subprocess.Popen(cmd, stdout=output, stderr=output, env=env)
+
+    async def wait_ready(self, timeout: float = 120.0) -> None:
+        """等到 worker 能响应 GET /（导入 Main 与构建 Runner 需要几秒）。"""
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient() as client:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"worker {self.name} 启动失败（退出码 {self.process.returncode}）")
+                try:
+                    if (await client.get(self.url + "/")).status_code == 200:
+                        return
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.2)
+        raise TimeoutError(f"worker {self.name} 在 {timeout:.0f}s 内没有就绪")
+
+    def stop(self) -> None:
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+async def start_workers(n: int, base_port: int, app: str = "Main:app", factory: bool = False,
+                        quiet: bool = False, admin_token: str = ADMIN_TOKEN) -> list[WorkerProcess]:
+    procs = [WorkerProcess(f"w{i}", base_port + i, app, factory, quiet=quiet, admin_token=admin_token)
+             for i in range(n)]
+    try:
+        await asyncio.gather(*(p.wait_ready() for p in procs))
+    except BaseException:
+        for p in procs:
+            p.stop()
+        raise
+    return procs
+
+
+def main(argv=None) -> int:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--worker-base-port", type=int, default=8101)
+    parser.add_argument("--app", default="Main:app", help="worker 的 ASGI 应用（uvicorn 格式）")
+    parser.add_argument("--factory", action="store_true", help="--app 是返回应用的工厂函数")
+    args = parser.parse_args(argv)
+
+    admin_token = ADMIN_TOKEN or secrets.token_urlsafe(32)
+    procs = asyncio.run(start_workers(args.workers, args.worker_base_port, args.app, args.factory,
+                                      admin_token=admin_token))
+    try:
+        dispatcher = Dispatcher({p.name: p.url for p in procs}, admin_token)
+        print(f"[DISPATCH] {len(procs)} 个 worker 就绪：{', '.join(p.url for p in procs)}")
+        uvicorn.run(create_app(dispatcher), host=args.host, port=args.port)
+    finally:
+        for p in procs:
+            p.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""主/备后端的对冲请求与故障转移。
+
+USE_AZURE 是启动时的全局开关：本地 Ollama 卡住时所有会话都会跟着卡住。
+开启 FAILOVER_ENABLED 后，每个 persona 的模型是一个 HedgedLlm（主后端 + 备用后端）：
+- 主后端在「对冲截止时间」内没有返回第一个响应，就同时向备用后端发同一请求，
+  先返回的一方胜出，另一方被取消
+- 截止时间取主后端最近首响应延迟的百分位（HEDGE_PERCENTILE），样本不足时用默认值
+- 每个后端地址有一个熔断器：连续失败 BREAKER_FAILURE_THRESHOLD 次后熔断，
+  BREAKER_RESET_SECONDS 秒内不再参与路由，之后放行试探请求（half_open）
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from typing import AsyncGenerator
+
+from google.adk.models.base_llm import BaseLlm
+from google.adk.models.llm_request import LlmRequest
+from google.adk.models.llm_response import LlmResponse
+
+from metrics import METRICS, percentile
+
+# 是否为每个 persona 配置备用后端（另一种后端：Ollama <-> Azure）
+FAILOVER_ENABLED = os.getenv("FAILOVER_ENABLED", "false").lower() == "true"
+
+# 对冲截止时间：主后端最近首响应延迟的该百分位
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+
+# 样本不足 HEDGE_MIN_SAMPLES 时使用的默认截止时间（秒），以及截止时间的上下限
+HEDGE_DEFAULT_DELAY = float(os.getenv("HEDGE_DEFAULT_DELAY", "10"))
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MAX_DELAY = float(os.getenv("HEDGE_MAX_DELAY", "30"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "10"))
+
+# 熔断：连续失败次数阈值与熔断时长（秒）
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+BREAKER_RESET_SECONDS = float(os.getenv("BREAKER_RESET_SECONDS", "30"))
+
+# 计算截止时间的最近样本数
+_LATENCY_WINDOW = 200
+
+
+class EndpointHealth:
+    """单个后端地址的熔断状态与首响应延迟。state: closed | open | half_open"""
+
+    def __init__(
+        self,
+        endpoint: str,
+        failure_threshold: int = BREAKER_FAILURE_THRESHOLD,
+        reset_seconds: float = BREAKER_RESET_SECONDS,
+    ):
+        self.endpoint = endpoint
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at: float | None = None
+        self.last_error: str | None = None
+        self._first_token: deque[float] = deque(maxlen=_LATENCY_WINDOW)
+
+    def _transition(self, state: str) -> None:
+        if state != self.state:
+            print(f"[FAILOVER] {self.endpoint}: 熔断器 {self.state} -> {state}")
+            self.state = state
+            METRICS.inc("circuit_transitions_total", endpoint=self.endpoint, state=state)
+
+    def allow(self) -> bool:
+        """该后端当前是否参与路由。熔断到期后转为 half_open 放行试探请求。"""
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                return False
+            self._transition("half_open")
+        return True
+
+    def record_success(self, first_token_seconds: float) -> None:
+        self._first_token.append(first_token_seconds)
+        self.consecutive_failures = 0
+        self._transition("closed")
+
+    def record_failure(self, error: BaseException) -> None:
+        self.consecutive_failures += 1
+        self.last_error = str(error) or type(error).__name__
+        METRICS.inc("backend_failures_total", endpoint=self.endpoint)
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._transition("open")
+
+    def hedge_delay(self) -> float:
+        """对冲截止时间（秒）。"""
+        if len(self._first_token) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        delay = percentile(self._first_token, HEDGE_PERCENTILE)
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, delay))
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "hedge_delay_seconds": round(self.hedge_delay(), 3),
+            "first_token_samples": len(self._first_token),
+            "last_error": self.last_error,
+        }
+
+
+# 后端地址 -> 健康状态
+HEALTH: dict[str, EndpointHealth] = {}
+
+
+def health_for(endpoint: str) -> EndpointHealth:
+    key = endpoint.rstrip("/").lower()
+    health = HEALTH.get(key)
+    if health is None:
+        health = HEALTH[key] = EndpointHealth(key)
+    return health
+
+
+def snapshot() -> dict:
+    return {endpoint: health.snapshot() for endpoint, health in HEALTH.items()}
+
+
+async def _first_response(llm: BaseLlm, request: LlmRequest, stream: bool):
+    """启动一路调用并等到第一个响应，返回 (生成器, 第一个响应, 首响应耗时)。"""
+    started = time.perf_counter()
+    gen = llm.generate_content_async(request, stream=stream)
+    try:
+        first = await gen.__anext__()
+    except StopAsyncIteration:
+        await gen.aclose()
+        raise RuntimeError(f"{llm.model} 没有返回任何响应") from None
+    except BaseException:
+        await gen.aclose()
+        raise
+    return gen, first, time.perf_counter() - started
+
+
+class HedgedLlm(BaseLlm):
+    """主/备两个后端的对冲模型。对 ADK 来说就是一个普通的 BaseLlm。"""
+
+    primary: BaseLlm
+    secondary: BaseLlm
+    primary_endpoint: str
+    secondary_endpoint: str
+
+    def __init__(self, primary: BaseLlm, secondary: BaseLlm, primary_endpoint: str, secondary_endpoint: str):
+        super().__init__(
+            model=primary.model,
+            primary=primary,
+            secondary=secondary,
+            primary_endpoint=primary_endpoint,
+            secondary_endpoint=secondary_endpoint,
+        )
+
+    async def generate_content_async(
+        self, llm_request: LlmRequest, stream: bool = False
+    ) -> AsyncGenerator[LlmResponse, None]:
+        legs = [
+            ("primary", self.primary, health_for(self.primary_endpoint)),
+            ("secondary", self.secondary, health_for(self.secondary_endpoint)),
+        ]
+        # 熔断中的后端不参与；两个都熔断时仍尝试主后端
+        queue = [leg for leg in legs if leg[2].allow()] or legs[:1]
+        if queue[0][0] != "primary":
+            METRICS.inc("backend_failovers_total", reason="circuit_open")
+        # 底层模型会修改请求（如补 user content），第二路用副本
+        requests = [llm_request]
+        if len(queue) > 1:
+            requests.append(llm_request.model_copy(deep=True))
+
+        running: dict[asyncio.Task, tuple] = {}
+
+        def launch() -> None:
+            leg = queue.pop(0)
+            running[asyncio.create_task(_first_response(leg[1], requests.pop(0), stream))] = leg
+
+        launch()
+        deadline = health_for(self.primary_endpoint).hedge_delay()
+        winner = None
+        last_error: BaseException | None = None
+        try:
+            while running:
+                done, _ = await asyncio.wait(
+                    running,
+                    timeout=deadline if queue else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    # 主后端在截止时间内没有首响应：对冲到备用后端
+                    METRICS.inc("hedged_requests_total")
+                    launch()
+                    continue
+                for task in done:
+                    name, _, health = running.pop(task)
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        health.record_failure(last_error)
+                        print(f"[FAILOVER] {health.endpoint} 调用失败: {health.last_error}")
+                        continue
+                    gen, first, elapsed = task.result()
+                    if winner is None:
+                        health.record_success(elapsed)
+                        winner = (name, gen, first)
+                    else:
+                        await gen.aclose()
+                if winner is not None:
+                    break
+                if not running and queue:
+                    # 正在跑的一路失败了：立即转到下一路
+                    METRICS.inc("backend_failovers_total", reason="error")
+                    launch()
+        finally:
+            # 取消输掉的一路（或整个调用被取消时的所有在途调用）
+            if running and winner is not None:
+                METRICS.inc("hedge_losers_cancelled_total")
+            for task in running:
+                task.cancel()
+            for result in await asyncio.gather(*running, return_exceptions=True):
+                if isinstance(result, tuple):
+                    await result[0].aclose()
+
+        if winner is None:
+            raise last_error
+        name, gen, first = winner
+        METRICS.inc("backend_responses_total", leg=name)
+        try:
+            yield first
+            async for response in gen:
+                yield response
+        finally:
+            await gen.aclose()
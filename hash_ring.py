@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""一致性哈希环：会话 id -> 负责该会话的 worker。
+
+每个 worker 在环上放 DISPATCHER_VNODES 个虚拟节点（md5 的前 8 字节，跨进程稳定），
+会话 id 落到顺时针方向的第一个虚拟节点。增减一个 worker 时只有约 1/N 的会话换了归属，
+rebalance 只需要迁移这些会话（见 dispatcher.py）。
+"""
+
+import hashlib
+import os
+from bisect import bisect_right
+
+# 每个 worker 的虚拟节点数（越多分布越均匀）
+DISPATCHER_VNODES = int(os.getenv("DISPATCHER_VNODES", "64"))
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """worker 名 -> 环上的虚拟节点。"""
+
+    def __init__(self, nodes=(), vnodes: int = DISPATCHER_VNODES):
+        self.vnodes = max(1, vnodes)
+        self._nodes: set[str] = set()
+        self._points: list[int] = []
+        self._owners: list[str] = []
+        for node in nodes:
+            self.add(node)
+
+    @property
+    def nodes(self) -> list[str]:
+        return sorted(self._nodes)
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def __contains__(self, node: str) -> bool:
+        return node in self._nodes
+
+    def copy(self) -> "HashRing":
+        return HashRing(self._nodes, self.vnodes)
+
+    def _rebuild(self) -> None:
+        ring = sorted((_point(f"{node}#{i}"), node) for node in self._nodes for i in range(self.vnodes))
+        self._points = [p for p, _ in ring]
+        self._owners = [n for _, n in ring]
+
+    def add(self, node: str) -> None:
+        if node not in self._nodes:
+            self._nodes.add(node)
+            self._rebuild()
+
+    def remove(self, node: str) -> None:
+        if node in self._nodes:
+            self._nodes.discard(node)
+            self._rebuild()
+
+    def node_for(self, key: str) -> str:
+        """负责 key 的 worker。
+
+        Raises:
+            LookupError: 环上没有 worker
+        """
+        if not self._points:
+            raise LookupError("哈希环上没有 worker")
+        i = bisect_right(self._points, _point(key))
+        return self._owners[i % len(self._owners)]
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""LiteLlm 后端共享的 HTTP 连接池。
+
+每个 persona 都有自己的 LiteLlm，但它们指向同一个 Ollama（或 Azure）地址。
+这里按后端地址维护唯一的连接池，所有 persona 模型共用：
+- 可配置连接池大小、keep-alive 数量与过期时间
+- 安装了 h2 时启用 HTTP/2
+- 按地址统计请求数、错误数、在途请求、新建连接数与当前连接状态
+
+用法（personas._create_model 中）：
+    LiteLlm(model=..., api_base=base, **http_pool.litellm_client_kwargs(base))
+"""
+
+import os
+import time
+import weakref
+
+import httpx
+
+from metrics import METRICS
+
+# 每个后端地址的最大连接数
+HTTP_POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "32"))
+
+# 保持 keep-alive 的空闲连接数与过期时间（秒）
+HTTP_POOL_MAX_KEEPALIVE = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "16"))
+HTTP_POOL_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_POOL_KEEPALIVE_EXPIRY", "120"))
+
+# 单次请求超时（秒）；本地大模型首 token 可能很慢
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "600"))
+
+# HTTP/2："auto"（安装了 h2 就用）| "true" | "false"
+HTTP_POOL_HTTP2 = os.getenv("HTTP_POOL_HTTP2", "auto").lower()
+
+
+def _http2_enabled() -> bool:
+    if HTTP_POOL_HTTP2 == "false":
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        if HTTP_POOL_HTTP2 == "true":
+            print("[WARN] HTTP_POOL_HTTP2=true 但未安装 h2，回退到 HTTP/1.1")
+        return False
+    return True
+
+
+def _normalize(api_base: str) -> str:
+    return api_base.rstrip("/").lower()
+
+
+class _InstrumentedTransport(httpx.AsyncBaseTransport):
+    """包一层底层 transport，统计每个后端地址的请求与连接。"""
+
+    def __init__(self, pool: "EndpointPool", inner: httpx.AsyncBaseTransport):
+        self._pool = pool
+        self._inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        pool = self._pool
+        pool.requests += 1
+        pool.in_flight += 1
+        started = time.perf_counter()
+        try:
+            response = await self._inner.handle_async_request(request)
+        except Exception:
+            pool.errors += 1
+            METRICS.inc("http_pool_errors_total", endpoint=pool.endpoint)
+            raise
+        finally:
+            pool.in_flight -= 1
+            pool.track_new_connections()
+        METRICS.observe(
+            "http_pool_response_headers_seconds",
+            time.perf_counter() - started,
+            endpoint=pool.endpoint,
+        )
+        return response
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+
+class EndpointPool:
+    """单个后端地址的共享连接池与统计。"""
+
+    def __init__(self, endpoint: str, transport: httpx.AsyncBaseTransport | None = None):
+        self.endpoint = endpoint
+        self.http2 = _http2_enabled()
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.connections_opened = 0
+        self._seen_connections: weakref.WeakSet = weakref.WeakSet()
+        if transport is None:
+            transport = httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(
+                    max_connections=HTTP_POOL_MAX_CONNECTIONS,
+                    max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE,
+                    keepalive_expiry=HTTP_POOL_KEEPALIVE_EXPIRY,
+                ),
+                http2=self.http2,
+            )
+        self._inner = transport
+        self.transport = _InstrumentedTransport(self, transport)
+        self._client: httpx.AsyncClient | None = None
+        self._litellm_handler = None
+
+    def _connections(self) -> list:
+        # httpx.AsyncHTTPTransport -> httpcore.AsyncConnectionPool
+        pool = getattr(self._inner, "_pool", None)
+        return list(getattr(pool, "connections", []) or [])
+
+    def track_new_connections(self) -> None:
+        for conn in self._connections():
+            if conn not in self._seen_connections:
+                self._seen_connections.add(conn)
+                self.connections_opened += 1
+                METRICS.inc("http_pool_connections_opened_total", endpoint=self.endpoint)
+
+    def client(self) -> httpx.AsyncClient:
+        """共享的 httpx.AsyncClient（供 openai SDK / 预热等直接使用）。"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                transport=self.transport,
+                timeout=HTTP_POOL_TIMEOUT,
+            )
+        return self._client
+
+    def litellm_handler(self):
+        """共享的 litellm AsyncHTTPHandler（ollama_chat 等走 litellm 自带 HTTP 处理的后端）。"""
+        if self._litellm_handler is None:
+            from litellm.llms.custom_httpx.http_handler import AsyncHTTPHandler
+
+            handler = AsyncHTTPHandler(timeout=HTTP_POOL_TIMEOUT)
+            handler.client = self.client()
+            self._litellm_handler = handler
+        return self._litellm_handler
+
+    def azure_client(self, api_key: str, api_version: str):
+        """共享连接池上的 AsyncAzureOpenAI 客户端。"""
+        import openai
+
+        return openai.AsyncAzureOpenAI(
+            azure_endpoint=self.endpoint,
+            api_key=api_key,
+            api_version=api_version,
+            http_client=self.client(),
+        )
+
+    def stats(self) -> dict:
+        conns = self._connections()
+        idle = sum(1 for c in conns if getattr(c, "is_idle", lambda: False)())
+        return {
+            "http2": self.http2,
+            "requests": self.requests,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "connections_opened": self.connections_opened,
+            "open_connections": len(conns),
+            "idle_connections": idle,
+        }
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+        else:
+            await self.transport.aclose()
+
+
+# 后端地址 -> 连接池
+POOLS: dict[str, EndpointPool] = {}
+
+
+def pool_for(api_base: str, transport: httpx.AsyncBaseTransport | None = None) -> EndpointPool:
+    """返回该后端地址的共享连接池（首次调用时创建）。"""
+    key = _normalize(api_base)
+    pool = POOLS.get(key)
+    if pool is None:
+        pool = POOLS[key] = EndpointPool(key, transport)
+    return pool
+
+
+def litellm_client_kwargs(api_base: str, azure: dict | None = None) -> dict:
+    """传给 LiteLlm 的 client 参数：Ollama 用 AsyncHTTPHandler，Azure 用 AsyncAzureOpenAI。"""
+    pool = pool_for(api_base)
+    if azure is not None:
+        return {"client": pool.azure_client(azure["api_key"], azure["api_version"])}
+    return {"client": pool.litellm_handler()}
+
+
+def stats() -> dict:
+    return {endpoint: pool.stats() for endpoint, pool in POOLS.items()}
+
+
+async def aclose_all() -> None:
+    for pool in list(POOLS.values()):
+        await pool.aclose()
+    POOLS.clear()
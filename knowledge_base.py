@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""专家知识的本地检索索引。
+
+宗教 / 过敏专家原来把所有饮食规则都写在 instruction 里，每一轮都要把整段规则
+发给模型。现在规则放在本地知识库（KNOWLEDGE_BASE_PATH，每行一条 JSON 事实），
+启动时一次性建成内存倒排索引，每轮只检索与当前问题最相关的 KNOWLEDGE_TOP_K 条
+事实塞进专家 prompt。
+
+打分用 BM25：建索引时就把每个 (词, 文档) 的 BM25 分量算好存进倒排表，查询时
+只需按查询词把对应的倒排数组累加到分数向量上（NumPy 向量化），再 argpartition
+取 top-k。NumPy 未安装时退回纯 Python 的逐条累加，结果相同。
+
+分词：ASCII 单词 + 中文字符二元组（单字的中文片段保留单字），不依赖分词库。
+"""
+
+import json
+import math
+import os
+import re
+import time
+from dataclasses import dataclass
+from pathlib import Path
+
+from metrics import METRICS
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - 取决于部署环境
+    np = None
+
+# 是否在专家 prompt 中注入检索到的事实
+KNOWLEDGE_ENABLED = os.getenv("KNOWLEDGE_ENABLED", "true").lower() == "true"
+
+# 知识库文件（JSONL：id, domain, topic, text）
+KNOWLEDGE_BASE_PATH = os.getenv(
+    "KNOWLEDGE_BASE_PATH", str(Path(__file__).parent / "knowledge" / "dietary_rules.jsonl")
+)
+
+# 每轮注入专家 prompt 的事实条数
+KNOWLEDGE_TOP_K = int(os.getenv("KNOWLEDGE_TOP_K", "4"))
+
+# BM25 参数
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+_ASCII_WORD = re.compile(r"[a-z0-9]+")
+_CJK_RUN = re.compile(r"[\u3400-\u9fff]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """ASCII 单词 + 中文字符二元组。"""
+    text = (text or "").lower()
+    tokens = _ASCII_WORD.findall(text)
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+@dataclass(frozen=True)
+class Fact:
+    """知识库中的一条事实。"""
+
+    id: str
+    domain: str
+    topic: str
+    text: str
+
+
+class KnowledgeIndex:
+    """事实的内存倒排索引（BM25）。"""
+
+    def __init__(self, facts: list[Fact], k1: float = BM25_K1, b: float = BM25_B):
+        self.facts = list(facts)
+        self.k1 = k1
+        self.b = b
+        n = len(self.facts)
+        term_freqs = []
+        df: dict[str, int] = {}
+        for fact in self.facts:
+            tf: dict[str, int] = {}
+            for token in tokenize(f"{fact.topic} {fact.text}"):
+                tf[token] = tf.get(token, 0) + 1
+            term_freqs.append(tf)
+            for token in tf:
+                df[token] = df.get(token, 0) + 1
+        lengths = [sum(tf.values()) for tf in term_freqs]
+        avgdl = (sum(lengths) / n) if n else 1.0
+
+        # term -> ([文档下标], [BM25 分量])
+        postings: dict[str, tuple[list[int], list[float]]] = {}
+        for doc, (tf, dl) in enumerate(zip(term_freqs, lengths)):
+            norm = k1 * (1 - b + b * dl / avgdl)
+            for token, freq in tf.items():
+                idf = _idf(n, df[token])
+                docs, weights = postings.setdefault(token, ([], []))
+                docs.append(doc)
+                weights.append(idf * freq * (k1 + 1) / (freq + norm))
+        self._postings = postings
+
+        self._domains: dict[str, list[int]] = {}
+        for doc, fact in enumerate(self.facts):
+            self._domains.setdefault(fact.domain, []).append(doc)
+
+        self.vectorized = np is not None
+        if self.vectorized:
+            self._np_postings = {
+                token: (np.asarray(docs, dtype=np.int32), np.asarray(weights, dtype=np.float32))
+                for token, (docs, weights) in postings.items()
+            }
+            self._np_domains = {}
+            for domain, docs in self._domains.items():
+                mask = np.zeros(n, dtype=bool)
+                mask[docs] = True
+                self._np_domains[domain] = mask
+
+    def __len__(self) -> int:
+        return len(self.facts)
+
+    @classmethod
+    def from_jsonl(cls, path: str, **kwargs) -> "KnowledgeIndex":
+        facts = []
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    row = json.loads(line)
+                    facts.append(Fact(row["id"], row["domain"], row.get("topic", ""), row["text"]))
+        return cls(facts, **kwargs)
+
+    def _query_terms(self, query: str) -> list[str]:
+        # 查询词去重：BM25 的查询端词频在短问题里没有意义
+        return [t for t in dict.fromkeys(tokenize(query)) if t in self._postings]
+
+    def _search_numpy(self, terms: list[str], domain: str | None, k: int) -> list[tuple[int, float]]:
+        scores = np.zeros(len(self.facts), dtype=np.float32)
+        for term in terms:
+            docs, weights = self._np_postings[term]
+            # 同一词的倒排表中文档不重复，可以直接花式索引累加
+            scores[docs] += weights
+        if domain is not None:
+            mask = self._np_domains.get(domain)
+            if mask is None:
+                return []
+            scores = np.where(mask, scores, 0.0)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(int(i), float(scores[i])) for i in top if scores[i] > 0]
+
+    def _search_python(self, terms: list[str], domain: str | None, k: int) -> list[tuple[int, float]]:
+        scores: dict[int, float] = {}
+        for term in terms:
+            docs, weights = self._postings[term]
+            for doc, weight in zip(docs, weights):
+                scores[doc] = scores.get(doc, 0.0) + weight
+        if domain is not None:
+            scores = {doc: s for doc, s in scores.items() if self.facts[doc].domain == domain}
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [(doc, s) for doc, s in ranked[:k] if s > 0]
+
+    def search(
+        self, query: str, domain: str | None = None, k: int = KNOWLEDGE_TOP_K, vectorized: bool | None = None
+    ) -> list[tuple[Fact, float]]:
+        """按 BM25 返回最相关的 k 条事实及其分数；domain 限定事实所属领域。"""
+        terms = self._query_terms(query)
+        if not terms or k <= 0 or not self.facts:
+            return []
+        use_numpy = self.vectorized if vectorized is None else (vectorized and self.vectorized)
+        search = self._search_numpy if use_numpy else self._search_python
+        return [(self.facts[doc], score) for doc, score in search(terms, domain, k)]
+
+
+def _idf(n: int, df: int) -> float:
+    # BM25 的 idf（+1 保证非负）
+    return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+
+def _load_default() -> KnowledgeIndex:
+    try:
+        index = KnowledgeIndex.from_jsonl(KNOWLEDGE_BASE_PATH)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[WARN] 知识库加载失败（{KNOWLEDGE_BASE_PATH}）: {e}")
+        return KnowledgeIndex([])
+    print(f"[KNOWLEDGE] 已加载 {len(index)} 条事实")
+    return index
+
+
+# 全局知识索引（启动时加载一次）
+KNOWLEDGE = _load_default()
+
+
+def retrieve(query: str, domain: str, k: int = KNOWLEDGE_TOP_K) -> list[Fact]:
+    """检索某个领域的 top-k 事实，并记录检索耗时。"""
+    if not KNOWLEDGE_ENABLED:
+        return []
+    started = time.perf_counter()
+    hits = KNOWLEDGE.search(query, domain=domain, k=k)
+    METRICS.observe("knowledge_retrieval_seconds", time.perf_counter() - started, domain=domain)
+    return [fact for fact, _ in hits]
+
+
+def format_facts(facts: list[Fact]) -> str:
+    """把事实格式化成注入专家 prompt 的参考资料段落；没有事实时返回空串。"""
+    if not facts:
+        return ""
+    lines = "\n".join(f"- {fact.text}" for fact in facts)
+    return f"【参考资料】（只在与问题相关时使用，资料里没有的不要编造）\n{lines}"
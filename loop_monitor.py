@@ -0,0 +1,267 @@
+# -*- coding: utf-8 -*-
+"""事件循环延迟监控与阻塞检测。
+
+整个 FastAPI 应用跑在一个 asyncio 事件循环上，循环上的任何同步工作都会卡住所有玩家：
+_call_agent 里的 print、长输出上的 _strip_thinking 正则、list_conversations 的扫描排序、
+LiteLlm 内部的同步代码……
+
+- 心跳：循环上的一个 task 每 LOOP_LAG_INTERVAL_MS 毫秒 sleep 一次，实际醒来时间比预期晚多少
+  就是循环延迟，记入直方图 event_loop_lag_seconds（/metrics 中有 p50/p95/p99）
+- 看门狗：后台线程发现心跳超过 LOOP_BLOCK_THRESHOLD_MS 毫秒没有按时醒来时，
+  抓取事件循环线程当时的调用栈（就是正在阻塞循环的代码）；循环恢复后记录阻塞时长，
+  计入 event_loop_blocks_total{cause}，打印 [LOOP] 日志，最近 LOOP_BLOCK_KEEP 次见 GET /metrics 的 event_loop
+- 垃圾回收：通过 gc.callbacks 统计每次回收的停顿（gc_pause_seconds{generation}），
+  阻塞期间回收占了一半以上时，这次阻塞记为 gc 造成（此时抓到的栈只是恰好在分配内存的代码）
+- 调试模式（LOOP_MONITOR_STRICT=true）：阻塞记录为违规，raise_if_blocked() 抛出 LoopBlockedError；
+  测试中由 conftest 对每个用例检查，故意阻塞的用例标记 @pytest.mark.allow_blocking。
+  gc 造成的阻塞不算违规（与被测代码无关）
+"""
+
+import asyncio
+import gc
+import math
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass, field
+
+from metrics import METRICS
+
+# 是否在应用启动时开启监控
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+
+# 心跳间隔（毫秒）
+LOOP_LAG_INTERVAL_MS = float(os.getenv("LOOP_LAG_INTERVAL_MS", "50"))
+
+# 心跳迟到超过该值（毫秒）视为阻塞，抓取调用栈
+LOOP_BLOCK_THRESHOLD_MS = float(os.getenv("LOOP_BLOCK_THRESHOLD_MS", "100"))
+
+# 保留的最近阻塞记录数
+LOOP_BLOCK_KEEP = int(os.getenv("LOOP_BLOCK_KEEP", "20"))
+
+# 调试模式：阻塞视为错误（测试中让用例失败）
+LOOP_MONITOR_STRICT = os.getenv("LOOP_MONITOR_STRICT", "false").lower() == "true"
+
+# 调用栈最多保留的帧数（从最内层算起）
+_STACK_LIMIT = 30
+
+
+class LoopBlockedError(AssertionError):
+    """调试模式下事件循环被同步代码阻塞。"""
+
+
+@dataclass
+class BlockEvent:
+    """一次阻塞：开始时刻（epoch 秒）、时长与阻塞时抓到的调用栈。"""
+
+    started_at: float
+    seconds: float = 0.0
+    stack: list[str] = field(default_factory=list)
+    # 阻塞期间垃圾回收的停顿（秒）
+    gc_seconds: float = 0.0
+
+    @property
+    def by_gc(self) -> bool:
+        return self.gc_seconds * 2 >= self.seconds > 0
+
+    @property
+    def where(self) -> str:
+        """最内层的一帧（通常就是阻塞的那行代码）。"""
+        if self.by_gc:
+            return f"垃圾回收（gc 停顿 {self.gc_seconds * 1000:.0f} ms）"
+        return self.stack[-1] if self.stack else "（未捕获到调用栈：阻塞期间一直未释放 GIL，多为 C 扩展或首次导入）"
+
+    def to_dict(self) -> dict:
+        return {
+            "started_at": self.started_at,
+            "ms": round(self.seconds * 1000, 1),
+            "gc_ms": round(self.gc_seconds * 1000, 1),
+            "where": self.where,
+            "stack": self.stack,
+        }
+
+
+def _format_stack(frame) -> list[str]:
+    """事件循环线程的调用栈（外层在前），去掉 asyncio 自身的调度帧。"""
+    frames = []
+    for summary in traceback.extract_stack(frame):
+        if summary.name == "_run" and summary.filename.endswith(os.path.join("asyncio", "events.py")):
+            frames = []
+            continue
+        frames.append(f"{os.path.basename(summary.filename)}:{summary.lineno} in {summary.name}")
+    return frames[-_STACK_LIMIT:]
+
+
+class _LoopState:
+    __slots__ = ("loop", "thread_id", "expected", "gc_mark", "episode", "task")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, thread_id: int):
+        self.loop = loop
+        self.thread_id = thread_id
+        # 心跳预期醒来的时刻（perf_counter）；刚开始时心跳 task 应立即被调度
+        self.expected = time.perf_counter()
+        # 设置 expected 时的 gc 停顿累计值，用于算出这段时间内的 gc 停顿
+        self.gc_mark = 0.0
+        # 看门狗发现的进行中的阻塞
+        self.episode: BlockEvent | None = None
+        self.task: asyncio.Task | None = None
+
+
+class LoopMonitor:
+    """心跳 task（每个事件循环一个）+ 一个看门狗线程。"""
+
+    def __init__(
+        self,
+        interval_ms: float = LOOP_LAG_INTERVAL_MS,
+        threshold_ms: float = LOOP_BLOCK_THRESHOLD_MS,
+        keep: int = LOOP_BLOCK_KEEP,
+        strict: bool = LOOP_MONITOR_STRICT,
+    ):
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self.strict = strict
+        self.blocks: deque[BlockEvent] = deque(maxlen=keep)
+        self.violations: list[BlockEvent] = []
+        self.max_lag = 0.0
+        self._lock = threading.Lock()
+        self._states: dict[int, _LoopState] = {}
+        self._thread: threading.Thread | None = None
+        # 垃圾回收停顿累计（秒）与当前这次回收的开始时刻
+        self.gc_total = 0.0
+        self._gc_started: float | None = None
+
+    def _on_gc(self, phase: str, info: dict) -> None:
+        if phase == "start":
+            self._gc_started = time.perf_counter()
+        elif self._gc_started is not None:
+            pause = time.perf_counter() - self._gc_started
+            self._gc_started = None
+            self.gc_total += pause
+            METRICS.observe("gc_pause_seconds", pause, generation=info.get("generation"))
+
+    @property
+    def running(self) -> bool:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return False
+        return id(loop) in self._states
+
+    def start(self) -> None:
+        """在当前事件循环上开始监控（重复调用无副作用）。"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if id(loop) in self._states:
+                return
+            state = self._states[id(loop)] = _LoopState(loop, threading.get_ident())
+            state.gc_mark = self.gc_total
+            if self._on_gc not in gc.callbacks:
+                gc.callbacks.append(self._on_gc)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._watchdog, name="loop-monitor", daemon=True)
+                self._thread.start()
+        state.task = loop.create_task(self._heartbeat(state), name="loop-monitor")
+
+    async def stop(self) -> None:
+        """停止当前事件循环上的监控。"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            state = self._states.pop(id(loop), None)
+            if not self._states and self._on_gc in gc.callbacks:
+                gc.callbacks.remove(self._on_gc)
+        if state is not None and state.task is not None:
+            # 最后测量一次：停止前那段同步代码可能还没被心跳看到
+            self._measure(state)
+            state.task.cancel()
+            await asyncio.gather(state.task, return_exceptions=True)
+
+    async def _heartbeat(self, state: _LoopState) -> None:
+        # 第一次测量从 start() 算起：心跳 task 第一次被调度之前的阻塞也要算进去
+        while True:
+            self._measure(state)
+            with self._lock:
+                state.expected = time.perf_counter() + self.interval
+            state.gc_mark = self.gc_total
+            await asyncio.sleep(self.interval)
+
+    def _measure(self, state: _LoopState) -> None:
+        lag = max(0.0, time.perf_counter() - state.expected)
+        METRICS.observe("event_loop_lag_seconds", lag)
+        self.max_lag = max(self.max_lag, lag)
+        with self._lock:
+            episode, state.episode = state.episode, None
+            # 心跳设置下一个预期时刻之前，看门狗不再认为循环被阻塞
+            state.expected = math.inf
+        if episode is None and lag >= self.threshold:
+            # 阻塞太短，看门狗没来得及抓栈
+            episode = BlockEvent(started_at=time.time() - lag)
+        if episode is not None:
+            episode.seconds = lag
+            episode.gc_seconds = self.gc_total - state.gc_mark
+            self._record(episode)
+
+    def _watchdog(self) -> None:
+        poll = max(0.005, self.threshold / 4)
+        while True:
+            time.sleep(poll)
+            now = time.perf_counter()
+            with self._lock:
+                states = list(self._states.values())
+            for state in states:
+                expected = state.expected
+                if now - expected < self.threshold:
+                    continue
+                frame = sys._current_frames().get(state.thread_id)
+                stack = _format_stack(frame) if frame is not None else []
+                with self._lock:
+                    if state.expected != expected:
+                        # 抓栈期间心跳已经醒来并完成测量，这个栈属于已经结束的阻塞（或空闲的循环）
+                        continue
+                    if state.episode is None:
+                        state.episode = BlockEvent(started_at=time.time() - (now - expected), stack=stack)
+                    elif len(stack) > len(state.episode.stack):
+                        # 仍在阻塞：保留最深的一次栈（第一次可能恰好停在 C 调用的入口）
+                        state.episode.stack = stack
+
+    def _record(self, episode: BlockEvent) -> None:
+        METRICS.inc("event_loop_blocks_total", cause="gc" if episode.by_gc else "code")
+        self.blocks.append(episode)
+        if self.strict and not episode.by_gc:
+            self.violations.append(episode)
+        print(f"[LOOP] 事件循环被阻塞 {episode.seconds * 1000:.0f} ms：{episode.where}")
+
+    def raise_if_blocked(self) -> None:
+        """调试模式下有阻塞记录时抛出 LoopBlockedError（并清空记录）。"""
+        violations, self.violations = self.violations, []
+        if not violations:
+            return
+        details = "\n\n".join(
+            f"阻塞 {v.seconds * 1000:.0f} ms：\n  " + "\n  ".join(v.stack or [v.where]) for v in violations
+        )
+        raise LoopBlockedError(f"事件循环被阻塞 {len(violations)} 次（阈值 {self.threshold * 1000:.0f} ms）：\n{details}")
+
+    def snapshot(self) -> dict:
+        return {
+            "interval_ms": round(self.interval * 1000, 3),
+            "threshold_ms": round(self.threshold * 1000, 3),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "recent_blocks": [b.to_dict() for b in self.blocks],
+        }
+
+
+LOOP_MONITOR = LoopMonitor()
+
+
+async def monitored(coro):
+    """在监控下运行 coro（供测试包装 asyncio.run 的入口协程）。"""
+    started = not LOOP_MONITOR.running
+    if started:
+        LOOP_MONITOR.start()
+    try:
+        return await coro
+    finally:
+        if started:
+            await LOOP_MONITOR.stop()
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""进程内指标注册表（计数器 + 滑动窗口直方图），由 GET /metrics 以 JSON 暴露。
+
+用法：
+    METRICS.inc("turn_cancellations_total", reason="client_disconnect")
+    METRICS.observe("agent_call_seconds", 1.23, persona="mikko")
+"""
+
+import math
+import threading
+from collections import deque
+
+# 每个直方图保留的最近样本数（用于分位数）
+HISTOGRAM_WINDOW = 1024
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_key(name: str, key: tuple) -> str:
+    if not key:
+        return name
+    inner = ",".join(f"{k}={v}" for k, v in key)
+    return f"{name}{{{inner}}}"
+
+
+def percentile(samples, q: float) -> float:
+    """最近邻分位数（q 取 0-100）。样本为空时返回 0.0。"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    idx = max(0, math.ceil(q / 100 * len(ordered)) - 1)
+    return ordered[idx]
+
+
+class Histogram:
+    """累计 count/sum + 最近 HISTOGRAM_WINDOW 个样本。"""
+
+    __slots__ = ("count", "total", "window")
+
+    def __init__(self, window: int = HISTOGRAM_WINDOW):
+        self.count = 0
+        self.total = 0.0
+        self.window: deque[float] = deque(maxlen=window)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        self.window.append(value)
+
+    def percentile(self, q: float) -> float:
+        return percentile(self.window, q)
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "p50": round(self.percentile(50), 6),
+            "p95": round(self.percentile(95), 6),
+            "p99": round(self.percentile(99), 6),
+        }
+
+
+class Metrics:
+    """线程安全的指标注册表。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[tuple[str, tuple], float] = {}
+        self._gauges: dict[tuple[str, tuple], float] = {}
+        self._histograms: dict[tuple[str, tuple], Histogram] = {}
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels) -> None:
+        with self._lock:
+            self._gauges[(name, _label_key(labels))] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, _label_key(labels))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = Histogram()
+            hist.observe(value)
+
+    def counter(self, name: str, **labels) -> float:
+        return self._counters.get((name, _label_key(labels)), 0)
+
+    def histogram(self, name: str, **labels) -> Histogram | None:
+        return self._histograms.get((name, _label_key(labels)))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": {_format_key(n, k): v for (n, k), v in sorted(self._counters.items())},
+                "gauges": {_format_key(n, k): v for (n, k), v in sorted(self._gauges.items())},
+                "histograms": {
+                    _format_key(n, k): h.snapshot() for (n, k), h in sorted(self._histograms.items())
+                },
+            }
+
+    def reset(self) -> None:
+        """清空所有指标（用于测试）。"""
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+
+# 全局注册表
+METRICS = Metrics()
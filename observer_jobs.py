@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Observer 总结的后台任务。
+
+observer 用的是最大的模型（qwen3:8b），放在交互路径上会让最后一轮特别慢。
+会话进入 finished 时只调度一个低优先级后台任务，玩家立即拿到芬兰学生的回复；
+总结就绪后通过 GET /conversations/{id}/summary 取得。
+"""
+
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+from metrics import METRICS
+from scheduler import BACKGROUND, CALL_PRIORITY
+
+
+class SummaryJob:
+    """一个会话的总结任务。status: pending -> ready | failed"""
+
+    __slots__ = ("status", "summary", "message_count", "task", "created_at", "finished_at", "error")
+
+    def __init__(self, message_count: int):
+        self.status = "pending"
+        self.summary: str | None = None
+        # 总结覆盖的对话记录长度（不含 Observer 自己的消息）
+        self.message_count = message_count
+        self.task: asyncio.Task | None = None
+        self.created_at = time.time()
+        self.finished_at: float | None = None
+        self.error: str | None = None
+
+
+class ObserverJobs:
+    """conversation_id -> SummaryJob；同一会话同时最多一个进行中的总结。"""
+
+    def __init__(self, generate: Callable[[str], Awaitable[tuple[str, int]]]):
+        # generate(conversation_id) -> (总结文本, 总结覆盖的对话记录长度)，在 BACKGROUND 优先级下运行
+        self._generate = generate
+        self._jobs: dict[str, SummaryJob] = {}
+
+    def get(self, conversation_id: str) -> SummaryJob | None:
+        return self._jobs.get(conversation_id)
+
+    def discard(self, conversation_id: str) -> None:
+        job = self._jobs.pop(conversation_id, None)
+        if job is not None and job.task is not None and not job.task.done():
+            job.task.cancel()
+
+    def __len__(self) -> int:
+        return len(self._jobs)
+
+    def schedule(self, conversation_id: str, message_count: int) -> SummaryJob:
+        """为会话调度后台总结；已有进行中或覆盖相同对话记录长度的总结时直接复用。"""
+        job = self._jobs.get(conversation_id)
+        if job is not None and (
+            job.status == "pending" or (job.status == "ready" and job.message_count == message_count)
+        ):
+            return job
+        job = self._jobs[conversation_id] = SummaryJob(message_count)
+        job.task = asyncio.create_task(self._run(conversation_id, job))
+        METRICS.inc("observer_jobs_scheduled_total")
+        return job
+
+    async def _run(self, conversation_id: str, job: SummaryJob) -> None:
+        CALL_PRIORITY.set(BACKGROUND)
+        try:
+            job.summary, job.message_count = await self._generate(conversation_id)
+            job.status = "ready"
+        except asyncio.CancelledError:
+            job.status = "failed"
+            job.error = "cancelled"
+            raise
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e) or type(e).__name__
+            print(f"[OBSERVER] {conversation_id}: 后台总结失败: {job.error}")
+        finally:
+            job.finished_at = time.time()
+            METRICS.inc("observer_jobs_finished_total", status=job.status)
+            METRICS.observe("observer_job_seconds", job.finished_at - job.created_at)
+
+    async def wait(self, job: SummaryJob, timeout: float) -> None:
+        """等待总结完成，最多 timeout 秒。"""
+        if timeout <= 0 or job.task is None or job.task.done():
+            return
+        await asyncio.wait({job.task}, timeout=timeout)
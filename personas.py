@@ -16,8 +16,14 @@
 import os
 from google.adk.agents.llm_agent import Agent
 from google.adk.models.lite_llm import LiteLlm
-from google.adk.runners import InMemoryRunner
+from google.adk.artifacts import InMemoryArtifactService
+from google.adk.memory import InMemoryMemoryService
+from google.adk.runners import Runner
+import delegation
+import failover
+import http_pool
 import tools
+from session_shards import ShardedSessionService
 
 
 # ============================================================================
@@ -32,6 +38,15 @@ OLLAMA_CONFIG = {
     "api_base": os.getenv("OLLAMA_API_BASE", "http://localhost:11434"),
 }
 
+# Ollama 模型常驻时长（随每次请求下发 keep_alive，避免空闲模型被卸载）
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+# 负载高时 small_talk 回合改用的快速小模型（见 routing.py）
+FAST_MODEL_CONFIG = {
+    "ollama_model": os.getenv("OLLAMA_FAST_MODEL", "ollama_chat/qwen3:1.7b"),
+    "azure_model": os.getenv("AZURE_FAST_MODEL", "azure/gpt-4o-mini"),
+}
+
 # Azure OpenAI 配置
 AZURE_CONFIG = {
     "api_base": os.getenv("AZURE_OPENAI_ENDPOINT"),
@@ -41,15 +56,19 @@ AZURE_CONFIG = {
 
 # 验证 Azure 配置
 def _validate_azure_config():
-    """检查 Azure 配置是否完整"""
-    if USE_AZURE:
+    """检查 Azure 配置是否完整（主后端或备用后端为 Azure 时都需要）"""
+    if USE_AZURE or failover.FAILOVER_ENABLED:
+        flag = "USE_AZURE=true" if USE_AZURE else "FAILOVER_ENABLED=true"
         if not AZURE_CONFIG["api_base"]:
-            raise ValueError("USE_AZURE=true 但未设置 AZURE_OPENAI_ENDPOINT 环境变量")
+            raise ValueError(f"{flag} 但未设置 AZURE_OPENAI_ENDPOINT 环境变量")
         if not AZURE_CONFIG["api_key"]:
-            raise ValueError("USE_AZURE=true 但未设置 AZURE_OPENAI_API_KEY 环境变量")
+            raise ValueError(f"{flag} 但未设置 AZURE_OPENAI_API_KEY 环境变量")
+    if USE_AZURE:
         print("[INFO] 使用 Azure OpenAI 模型")
     else:
         print("[INFO] 使用本地 Ollama 模型")
+    if failover.FAILOVER_ENABLED:
+        print("[INFO] 已启用主/备后端对冲与故障转移")
 
 # 启动时验证
 _validate_azure_config()
@@ -63,17 +82,35 @@ def _create_model(ollama_model: str, azure_model: str = "azure/gpt-4o"):
         azure_model: Azure 模型名称（默认 "azure/gpt-4o"）
 
     Returns:
-        LiteLlm 模型实例
+        LiteLlm 模型实例（同一后端地址的所有模型共用 http_pool 中的连接池）；
+        FAILOVER_ENABLED 时为 failover.HedgedLlm（USE_AZURE 选中的后端为主，另一种为备）
     """
-    if USE_AZURE:
+    if not failover.FAILOVER_ENABLED:
+        return _create_backend_model(USE_AZURE, ollama_model, azure_model)
+    primary_base = AZURE_CONFIG["api_base"] if USE_AZURE else OLLAMA_CONFIG["api_base"]
+    secondary_base = OLLAMA_CONFIG["api_base"] if USE_AZURE else AZURE_CONFIG["api_base"]
+    return failover.HedgedLlm(
+        primary=_create_backend_model(USE_AZURE, ollama_model, azure_model),
+        secondary=_create_backend_model(not USE_AZURE, ollama_model, azure_model),
+        primary_endpoint=primary_base,
+        secondary_endpoint=secondary_base,
+    )
+
+
+def _create_backend_model(azure: bool, ollama_model: str, azure_model: str):
+    """在指定后端上创建 LiteLlm。"""
+    if azure:
         return LiteLlm(
             model=azure_model,
-            **AZURE_CONFIG
+            **AZURE_CONFIG,
+            **http_pool.litellm_client_kwargs(AZURE_CONFIG["api_base"], azure=AZURE_CONFIG),
         )
     else:
         return LiteLlm(
             model=ollama_model,
-            **OLLAMA_CONFIG
+            keep_alive=OLLAMA_KEEP_ALIVE,
+            **OLLAMA_CONFIG,
+            **http_pool.litellm_client_kwargs(OLLAMA_CONFIG["api_base"]),
         )
 
 # 所有 persona 统一要求：用中文交流
@@ -209,23 +246,9 @@ _religion_expert_instruction = """【必须遵守】不要输出任何 <think> 
 - 不要输出英文或其他语言
 - 用 Mikko 的口吻说话（外向热情）
 
-【讨论主题】
-1. **伊斯兰教清真（Halal）**
-   - 禁食猪肉、血液、未诵真主之名宰杀的动物
-   - 禁饮含酒精的饮品
-   - 专门清真餐厅或清真认证食品
-
-2. **犹太教洁食（Kosher）**
-   - 禁食猪肉、贝类、无鳞鱼
-   - 肉乳分离（不同餐具）
-   - 犹太餐厅或洁食认证
-
-3. **素食/纯素**
-   - 素食：不吃肉类，可吃蛋奶
-   - 纯素：不吃任何动物产品
-
-4. **斋月等宗教节日**
-   - 斋月期间白天禁食，注意时间安排
+【专业范围】
+清真（Halal）、洁食（Kosher）、素食/纯素、斋月等宗教节日的饮食安排。
+具体规则见每轮 prompt 里的【参考资料】（从本地知识库检索），以资料为准。
 
 【对话方式】
 - 用 Mikko 的口吻说话（外向热情）
@@ -253,26 +276,9 @@ _allergy_expert_instruction = """【必须遵守】不要输出任何 <think> 
 - 不要输出英文或其他语言
 - 用 Aino 的口吻说话（细心有条理）
 
-【讨论主题】
-1. **坚果类过敏**（花生、开心果、腰果、核桃等）
-   - 严重可致过敏性休克
-   - 检查食品标签"含坚果"警告
-   - 准备坚果替代品（如种子类零食）
-
-2. **海鲜过敏**（虾、蟹、贝类、鱼）
-   - 避免交叉污染（不同厨具）
-   - 海鲜和素菜分开准备
-   - 提供非海鲜主菜选项
-
-3. **乳糖不耐受**
-   - 无牛奶、奶油、奶酪
-   - 可用植物奶（燕麦奶、杏仁奶）
-   - 准备无乳糖选项
-
-4. **麸质过敏（Celiac Disease）**
-   - 无小麦、大麦、黑麦
-   - 使用无麸质面包和主食
-   - 避免交叉污染（专用烤面包机）
+【专业范围】
+坚果/花生过敏、海鲜过敏、乳糖不耐受与牛奶过敏、麸质过敏（Celiac Disease）、交叉污染与急救。
+具体规则见每轮 prompt 里的【参考资料】（从本地知识库检索），以资料为准。
 
 【对话方式】
 - 用 Aino 的口吻说话（细心有条理）
@@ -339,7 +345,10 @@ PERSONAS = {
             ollama_model="ollama_chat/qwen3:4b-instruct",
             azure_model="azure/gpt-4o"
         ),
+        "fast_model": _create_model(**FAST_MODEL_CONFIG),
         "instruction": _mikko_instruction,
+        # 固定开场等确定性 prompt 走响应缓存（见 response_cache.py）
+        "cache_responses": True,
     },
     "aino": {
         "name": "Aino",
@@ -347,7 +356,9 @@ PERSONAS = {
             ollama_model="ollama_chat/qwen3:4b-instruct-2507-fp16",
             azure_model="azure/gpt-4o"
         ),
+        "fast_model": _create_model(**FAST_MODEL_CONFIG),
         "instruction": _aino_instruction,
+        "cache_responses": True,
     },
     "religion_expert": {
         "name": "宗教禁忌专家",
@@ -356,6 +367,8 @@ PERSONAS = {
             azure_model="azure/gpt-35-turbo"
         ),
         "instruction": _religion_expert_instruction,
+        # 每轮从知识库检索该领域的事实注入 prompt（见 knowledge_base.py）
+        "knowledge_domain": "religion",
     },
     "allergy_expert": {
         "name": "食物过敏专家",
@@ -364,6 +377,7 @@ PERSONAS = {
             azure_model="azure/gpt-35-turbo"
         ),
         "instruction": _allergy_expert_instruction,
+        "knowledge_domain": "allergy",
     },
     "observer": {
         "name": "对话观察者",
@@ -372,6 +386,8 @@ PERSONAS = {
             azure_model="azure/gpt-4o"
         ),
         "instruction": _observer_instruction,
+        # 对同一份对话记录的总结直接复用
+        "cache_responses": True,
     },
 }
 
@@ -379,12 +395,125 @@ PERSONAS = {
 FINNISH_STUDENTS = ["mikko", "aino"]
 
 
+# ============================================================================
+# 合并发言 - 一次调用生成本回合多位角色的发言
+# ============================================================================
+
+# "per_speaker"（默认，每位角色各调用一次）| "combined"（一次调用输出所有角色的发言）
+# | "delegation"（专家阶段由学生把专家当作工具调用，见 delegation.py）
+ORCHESTRATION_MODE = os.getenv("ORCHESTRATION_MODE", "per_speaker").lower()
+
+# 合并调用的角色组合：key -> [(persona_id, 显示名), ...]；使用第一位角色的模型
+COMBINED_CASTS = {
+    "students": [("mikko", "Mikko"), ("aino", "Aino")],
+    "religion_deep": [("religion_expert", "Mikko"), ("aino", "Aino")],
+    "allergy_deep": [("allergy_expert", "Aino"), ("mikko", "Mikko")],
+}
+
+_COMBINED_FORMAT = """【输出格式 - 必须遵守】
+只输出一个 JSON 数组，不要输出任何其他内容（不要代码块标记、不要解释）：
+[{"name": "角色名", "content": "这个角色说的话"}, ...]
+- name 只能是上面列出的角色名
+- 按要求的发言顺序排列，每个角色最多一条
+- content 里不要再写角色名前缀
+"""
+
+
+def _combined_instruction(cast: list[tuple[str, str]]) -> str:
+    """把多个角色的 instruction 合并成一个，要求按 JSON 输出每个角色的发言。"""
+    names = "、".join(display for _, display in cast)
+    sections = [f"你要在同一段对话里同时扮演 {len(cast)} 个角色：{names}。各角色的设定如下，彼此独立，不要混淆。"]
+    shared = _NO_COT + _LANG
+    for pid, display in cast:
+        # 各角色共有的输出规范只保留一份
+        instruction = PERSONAS[pid]["instruction"].replace(shared, "").strip()
+        sections.append(f"==== 角色：{display} ====\n{instruction}")
+    sections.append(shared.strip())
+    sections.append(_COMBINED_FORMAT)
+    return "\n\n".join(sections)
+
+
+def _in_memory_runner(agent, app_name: str) -> Runner:
+    """与 InMemoryRunner 相同的内存 Runner，但 session 按玩家分片存放（见 session_shards.py）。"""
+    return Runner(
+        app_name=app_name,
+        agent=agent,
+        session_service=ShardedSessionService(),
+        artifact_service=InMemoryArtifactService(),
+        memory_service=InMemoryMemoryService(),
+    )
+
+
+def _build_combined_runners():
+    """为每个角色组合创建一个合并发言的 Agent 和内存 Runner。"""
+    runners = {}
+    for key, cast in COMBINED_CASTS.items():
+        agent = Agent(
+            model=PERSONAS[cast[0][0]]["model"],
+            name=f"agent_combined_{key}",
+            instruction=_combined_instruction(cast),
+            # prompt 已包含完整对话记录，不再重复发送 ADK session 中的历史
+            include_contents="none",
+        )
+        runners[key] = _in_memory_runner(agent, f"combined_{key}")
+    return runners
+
+
+# 委托模式（ORCHESTRATION_MODE=delegation）：专家阶段由附身的学生在一次 run_async 内
+# 调用专家 AgentTool（见 delegation.py）。phase -> 宿主 persona
+DELEGATION_HOSTS = {
+    "religion_deep": "mikko",
+    "allergy_deep": "aino",
+}
+
+# 宿主可调用的专家（tools.AGENT_TOOLS 中注册的 AgentTool）
+DELEGATION_EXPERTS = ["religion_expert", "allergy_expert"]
+
+_DELEGATION_GUIDE = """【专家工具】
+- 玩家问到宗教饮食禁忌（清真、洁食、素食、斋月等）时，调用 agent_religion_expert
+- 玩家问到食物过敏、不耐受或交叉污染时，调用 agent_allergy_expert
+- request 里写清玩家的问题；拿到回答后用你自己的口吻告诉玩家，2-3句话
+- 不要提到"工具"或"专家"；已经知道答案时不必调用
+"""
+
+
+def _build_delegation_runners(runners):
+    """为委托模式的宿主创建挂着专家 AgentTool 的 Runner。
+
+    与标准档共用 app_name、agent 名和 session 服务：委托回合与普通回合是同一段会话。
+    """
+    plugin = delegation.DelegationPlugin(knowledge_domains={
+        f"agent_{pid}": PERSONAS[pid]["knowledge_domain"]
+        for pid in DELEGATION_EXPERTS
+        if "knowledge_domain" in PERSONAS[pid]
+    })
+    expert_tools = [tools.AGENT_TOOLS[pid] for pid in DELEGATION_EXPERTS]
+    delegation_runners = {}
+    for pid in dict.fromkeys(DELEGATION_HOSTS.values()):
+        info = PERSONAS[pid]
+        base = runners[pid]
+        delegation_runners[pid] = Runner(
+            app_name=base.app_name,
+            agent=Agent(
+                model=info["model"],
+                name=f"agent_{pid}",
+                instruction=info["instruction"].strip() + "\n\n" + _DELEGATION_GUIDE,
+                tools=expert_tools,
+            ),
+            session_service=base.session_service,
+            artifact_service=base.artifact_service,
+            memory_service=base.memory_service,
+            plugins=[plugin],
+        )
+    return delegation_runners
+
+
 # ============================================================================
 # 构建 Runners - 简单架构，每个 Agent 独立
 # ============================================================================
 
 def _build_runners():
-    """为每个 persona 创建 Agent 和 InMemoryRunner。
+    """为每个 persona 创建 Agent 和内存 Runner。
     
     架构说明：
     - Mikko 和 Aino: 独立 Agent，各自有自己的模型
@@ -400,19 +529,50 @@ def _build_runners():
             instruction=info["instruction"].strip(),
         )
     
-    # Step 2: Register agent tools (for potential future use)
+    # Step 2: Register agent tools (委托模式下供学生调用专家，见 _build_delegation_runners)
     for pid, agent in agents.items():
         tools.register_agent_tool(pid, agent)
     
     # Step 3: Create runners
     runners = {}
     for pid, agent in agents.items():
-        runners[pid] = InMemoryRunner(
-            agent=agent,
-            app_name=f"persona_{pid}",
-        )
+        runners[pid] = _in_memory_runner(agent, f"persona_{pid}")
     return runners
 
 
+def _build_fast_runners(runners):
+    """为配置了 fast_model 的 persona 创建快速档 Runner。
+
+    与标准档共用 app_name、agent 名和 session 服务，同一会话在两档之间切换不会丢上下文。
+    """
+    fast_runners = {}
+    for pid, info in PERSONAS.items():
+        if "fast_model" not in info:
+            continue
+        base = runners[pid]
+        fast_runners[pid] = Runner(
+            app_name=base.app_name,
+            agent=Agent(
+                model=info["fast_model"],
+                name=f"agent_{pid}",
+                instruction=info["instruction"].strip(),
+            ),
+            session_service=base.session_service,
+            artifact_service=base.artifact_service,
+            memory_service=base.memory_service,
+        )
+    return fast_runners
+
+
+def get_runner(persona_id: str, tier: str = "standard"):
+    """按档位取 Runner；没有快速档的 persona 总是返回标准档。"""
+    if tier == "fast" and persona_id in FAST_RUNNERS:
+        return FAST_RUNNERS[persona_id]
+    return RUNNERS[persona_id]
+
+
 # 启动时构建，供 Main 使用
 RUNNERS = _build_runners()
+FAST_RUNNERS = _build_fast_runners(RUNNERS)
+COMBINED_RUNNERS = _build_combined_runners()
+DELEGATION_RUNNERS = _build_delegation_runners(RUNNERS)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""玩家身份与按玩家的配额。
+
+会话接口通过请求头 X-Player-Id 识别玩家（不带时为 DEFAULT_PLAYER_ID，兼容现有 Godot 客户端）：
+会话归属创建它的玩家，其他玩家访问时视为不存在；ADK session 以玩家 id 作为 user_id
+（按玩家分片存放，见 session_shards.py）。
+
+配额（0 表示不限制）：
+- MAX_CONCURRENT_TURNS_PER_PLAYER：同一玩家同时进行的回合数（同步回合执行期间与异步回合从提交到结束）
+- MAX_CONVERSATIONS_PER_HOUR：同一玩家最近一小时内创建的会话数（滑动窗口）
+超出时抛出 PlayerQuotaExceeded（接口返回 429 与 Retry-After），计入 player_quota_rejections_total{quota}。
+"""
+
+import os
+import re
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from metrics import METRICS
+
+# 请求头与不带请求头时的玩家 id（原来写死的 ADK user_id）
+PLAYER_HEADER = "X-Player-Id"
+DEFAULT_PLAYER_ID = os.getenv("DEFAULT_PLAYER_ID", "godot")
+
+# 同一玩家同时进行的回合数上限
+MAX_CONCURRENT_TURNS_PER_PLAYER = int(os.getenv("MAX_CONCURRENT_TURNS_PER_PLAYER", "0"))
+
+# 同一玩家每小时可创建的会话数上限
+MAX_CONVERSATIONS_PER_HOUR = int(os.getenv("MAX_CONVERSATIONS_PER_HOUR", "0"))
+
+# 会话创建频率的统计窗口（秒）
+_WINDOW = 3600.0
+
+_PLAYER_ID_RE = re.compile(r"^[A-Za-z0-9_.:@-]{1,64}$")
+
+
+class PlayerQuotaExceeded(Exception):
+    """玩家超出配额；retry_after 为建议的重试等待（秒）。"""
+
+    def __init__(self, quota: str, limit: int, retry_after: float):
+        super().__init__(f"超出玩家配额 {quota}（上限 {limit}）")
+        self.quota = quota
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+def resolve_player_id(value: str | None) -> str:
+    """请求头中的玩家 id；没有时为 DEFAULT_PLAYER_ID。
+
+    Raises:
+        ValueError: 格式不合法（1-64 个字母、数字或 _ . : @ -）
+    """
+    if value is None or not value.strip():
+        return DEFAULT_PLAYER_ID
+    value = value.strip()
+    if not _PLAYER_ID_RE.match(value):
+        raise ValueError("玩家 id 不合法：应为 1-64 个字母、数字或 _ . : @ -")
+    return value
+
+
+class PlayerQuotas:
+    """按玩家的并发回合计数与会话创建滑动窗口。"""
+
+    def __init__(
+        self,
+        max_turns: int = MAX_CONCURRENT_TURNS_PER_PLAYER,
+        max_conversations_per_hour: int = MAX_CONVERSATIONS_PER_HOUR,
+        clock=time.monotonic,
+    ):
+        self.max_turns = max_turns
+        self.max_conversations_per_hour = max_conversations_per_hour
+        self._clock = clock
+        # player_id -> 进行中的回合数（归零即删除）
+        self._turns: dict[str, int] = {}
+        # player_id -> 窗口内的会话创建时刻；按最近创建时间排序，过期的从头部清理
+        self._created: OrderedDict[str, deque[float]] = OrderedDict()
+
+    def _reject(self, quota: str, limit: int, retry_after: float):
+        METRICS.inc("player_quota_rejections_total", quota=quota)
+        return PlayerQuotaExceeded(quota, limit, retry_after)
+
+    def acquire_turn(self, player_id: str) -> None:
+        """占用一个回合名额；配额已满时抛出 PlayerQuotaExceeded。"""
+        active = self._turns.get(player_id, 0)
+        if self.max_turns > 0 and active >= self.max_turns:
+            raise self._reject("concurrent_turns", self.max_turns, 1.0)
+        self._turns[player_id] = active + 1
+
+    def release_turn(self, player_id: str) -> None:
+        active = self._turns.get(player_id, 0) - 1
+        if active > 0:
+            self._turns[player_id] = active
+        else:
+            self._turns.pop(player_id, None)
+
+    @contextmanager
+    def turn(self, player_id: str):
+        """在回合执行期间占用一个名额。"""
+        self.acquire_turn(player_id)
+        try:
+            yield
+        finally:
+            self.release_turn(player_id)
+
+    def active_turns(self, player_id: str) -> int:
+        return self._turns.get(player_id, 0)
+
+    def admit_conversation(self, player_id: str) -> None:
+        """记录一次会话创建；最近一小时已达上限时抛出 PlayerQuotaExceeded。"""
+        if self.max_conversations_per_hour <= 0:
+            return
+        now = self._clock()
+        self._expire(now)
+        times = self._created.get(player_id)
+        if times is None:
+            times = self._created[player_id] = deque()
+        while times and times[0] <= now - _WINDOW:
+            times.popleft()
+        if len(times) >= self.max_conversations_per_hour:
+            raise self._reject("conversations_per_hour", self.max_conversations_per_hour, times[0] + _WINDOW - now)
+        times.append(now)
+        self._created.move_to_end(player_id)
+
+    def _expire(self, now: float) -> None:
+        # 最近一次创建都已超出窗口的玩家不再需要记录（按最近创建时间排序，只看头部）
+        while self._created:
+            player_id, times = next(iter(self._created.items()))
+            if times and times[-1] > now - _WINDOW:
+                return
+            del self._created[player_id]
+
+    def snapshot(self) -> dict:
+        return {
+            "max_concurrent_turns": self.max_turns,
+            "max_conversations_per_hour": self.max_conversations_per_hour,
+            "players_with_active_turns": len(self._turns),
+            "players_in_window": len(self._created),
+        }
+
+
+PLAYER_QUOTAS = PlayerQuotas()
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""按请求开启的采样 profiler：慢回合的 Python 时间花在哪（pydantic、_strip_thinking、ADK event、session 查询……）。
+
+开启方式（只对 POST /conversations 与 POST /conversations/{id}/messages 生效）：
+- 请求头 PROFILE_HEADER（默认 X-Profile: 1）
+- 或按 PROFILE_SAMPLE_RATE 的比例随机抽样（默认 0，不抽样）
+
+采样：后台线程每 PROFILE_INTERVAL_MS 毫秒读取一次事件循环线程的调用栈（sys._current_frames），
+当时正在运行的 asyncio task 属于被 profile 的请求时，把栈记到该请求名下。
+请求内创建的子 task（如回合任务、gather）通过 task factory 按 contextvar 归属到同一请求；
+循环空闲（在等模型返回）记为 idle，运行的是其他请求的 task 记为 other，二者都不进火焰图。
+
+结果是 folded stacks（"root;...;leaf 次数"，flamegraph.pl / speedscope 可直接打开），
+按请求 id 保存最近 PROFILE_KEEP_RECENT 个，另外保留最慢的 PROFILE_KEEP_SLOWEST 个，
+由 GET /admin/profiles 与 GET /admin/profiles/{id} 查看；响应头 X-Profile-Id 给出请求 id。
+"""
+
+import asyncio
+import contextvars
+import heapq
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+
+from metrics import METRICS
+
+# 随机抽样比例（0-1）；0 表示只 profile 带请求头的请求
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+
+# 采样间隔（毫秒）
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+# 请求头名；值为 1 / true 时 profile 该请求
+PROFILE_HEADER = os.getenv("PROFILE_HEADER", "X-Profile")
+
+# 按请求 id 可查询的最近 profile 数
+PROFILE_KEEP_RECENT = int(os.getenv("PROFILE_KEEP_RECENT", "100"))
+
+# 保留的最慢 profile 数
+PROFILE_KEEP_SLOWEST = int(os.getenv("PROFILE_KEEP_SLOWEST", "20"))
+
+# 会被 profile 的路由（POST）
+PROFILED_ROUTES = re.compile(r"^/conversations(/[^/]+/messages)?/?$")
+
+_ACTIVE: contextvars.ContextVar["Profile | None"] = contextvars.ContextVar("profile", default=None)
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+
+
+def _is_loop_dispatch(frame) -> bool:
+    code = frame.f_code
+    return code.co_name == "_run" and code.co_filename.endswith(os.path.join("asyncio", "events.py"))
+
+
+def folded_stack(frame) -> str:
+    """把调用栈折叠成 "root;...;leaf"；去掉事件循环自身的帧，从 task 的协程开始。"""
+    frames = []
+    while frame is not None:
+        if _is_loop_dispatch(frame):
+            break
+        frames.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(frames))
+
+
+class Profile:
+    """一个请求的采样结果。"""
+
+    __slots__ = (
+        "id", "name", "started_at", "duration", "stacks", "samples", "idle", "other", "finished",
+    )
+
+    def __init__(self, request_id: str, name: str):
+        self.id = request_id
+        self.name = name
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.stacks: Counter[str] = Counter()
+        self.samples = 0
+        self.idle = 0
+        self.other = 0
+        self.finished = False
+
+    def folded(self) -> str:
+        """flamegraph.pl / speedscope 的 folded 格式，按次数降序。"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration * 1000, 1),
+            "samples": self.samples,
+            "idle_samples": self.idle,
+            "other_samples": self.other,
+            "top": [{"stack": s.rsplit(";", 1)[-1], "samples": n} for s, n in self.stacks.most_common(5)],
+        }
+
+
+class SamplingProfiler:
+    """全局采样器：管理进行中的 profile、采样线程与结果缓冲。"""
+
+    def __init__(
+        self,
+        sample_rate: float = PROFILE_SAMPLE_RATE,
+        interval_ms: float = PROFILE_INTERVAL_MS,
+        keep_recent: int = PROFILE_KEEP_RECENT,
+        keep_slowest: int = PROFILE_KEEP_SLOWEST,
+        header: str = PROFILE_HEADER,
+    ):
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000
+        self.keep_recent = keep_recent
+        self.keep_slowest = keep_slowest
+        self.header = header.lower()
+        self._lock = threading.Lock()
+        # 进行中的 profile -> (事件循环, 循环所在线程 id)
+        self._active: dict[Profile, tuple[asyncio.AbstractEventLoop, int]] = {}
+        # 被 profile 请求的 task -> Profile（task 结束后自动移除）
+        self._tasks: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self._loops: weakref.WeakSet = weakref.WeakSet()
+        self._recent: OrderedDict[str, Profile] = OrderedDict()
+        # (耗时, 序号, Profile) 小顶堆
+        self._slowest: list[tuple[float, int, Profile]] = []
+        self._seq = 0
+        self._thread: threading.Thread | None = None
+        self._wake = threading.Event()
+
+    def wanted(self, headers: dict[str, str]) -> bool:
+        """请求头要求 profile，或命中随机抽样。headers 的键为小写。"""
+        flag = headers.get(self.header, "").strip().lower()
+        if flag in ("1", "true", "yes"):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _install_task_factory(self, loop: asyncio.AbstractEventLoop) -> None:
+        """让被 profile 的请求内创建的 task 归属该请求（按创建时的 contextvar）。"""
+        if loop in self._loops:
+            return
+        previous = loop.get_task_factory()
+        tasks = self._tasks
+
+        def factory(loop, coro, **kwargs):
+            if previous is not None:
+                task = previous(loop, coro, **kwargs)
+            else:
+                task = asyncio.Task(coro, loop=loop, **kwargs)
+            context = kwargs.get("context")
+            profile = context.get(_ACTIVE) if context is not None else _ACTIVE.get()
+            if profile is not None and not profile.finished:
+                tasks[task] = profile
+            return task
+
+        loop.set_task_factory(factory)
+        self._loops.add(loop)
+
+    @contextmanager
+    def profiling(self, name: str, request_id: str | None = None):
+        """在 with 块内 profile 当前 task 及其创建的子 task，产出 Profile。须在事件循环线程内调用。"""
+        loop = asyncio.get_running_loop()
+        self._install_task_factory(loop)
+        profile = Profile(request_id or uuid.uuid4().hex, name)
+        token = _ACTIVE.set(profile)
+        task = asyncio.current_task()
+        if task is not None:
+            self._tasks[task] = profile
+        started = time.perf_counter()
+        with self._lock:
+            self._active[profile] = (loop, threading.get_ident())
+            self._ensure_thread()
+        self._wake.set()
+        try:
+            yield profile
+        finally:
+            profile.duration = time.perf_counter() - started
+            profile.finished = True
+            with self._lock:
+                self._active.pop(profile, None)
+            if task is not None and self._tasks.get(task) is profile:
+                del self._tasks[task]
+            _ACTIVE.reset(token)
+            self._store(profile)
+
+    def _store(self, profile: Profile) -> None:
+        METRICS.inc("profiles_total", route=profile.name)
+        METRICS.observe("profile_samples", profile.samples, route=profile.name)
+        with self._lock:
+            self._recent[profile.id] = profile
+            while len(self._recent) > self.keep_recent:
+                self._recent.popitem(last=False)
+            self._seq += 1
+            entry = (profile.duration, self._seq, profile)
+            if len(self._slowest) < self.keep_slowest:
+                heapq.heappush(self._slowest, entry)
+            elif self.keep_slowest and entry > self._slowest[0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+            self._thread.start()
+
+    def _sample_loop(self) -> None:
+        while True:
+            with self._lock:
+                active = list(self._active.items())
+            if not active:
+                # 没有进行中的 profile 时睡眠，不占用 GIL
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            self._sample(active)
+            time.sleep(self.interval)
+
+    def _sample(self, active: list) -> None:
+        frames = sys._current_frames()
+        by_loop: dict[int, tuple] = {}
+        for profile, (loop, thread_id) in active:
+            if profile.finished:
+                continue
+            if id(loop) not in by_loop:
+                task = asyncio.current_task(loop)
+                owner = self._tasks.get(task) if task is not None else None
+                frame = frames.get(thread_id)
+                stack = folded_stack(frame) if owner is not None and frame is not None else None
+                by_loop[id(loop)] = (task, owner, stack)
+            task, owner, stack = by_loop[id(loop)]
+            if task is None:
+                profile.idle += 1
+            elif owner is not profile:
+                profile.other += 1
+            elif stack:
+                profile.samples += 1
+                profile.stacks[stack] += 1
+
+    def get(self, request_id: str) -> Profile | None:
+        with self._lock:
+            profile = self._recent.get(request_id)
+            if profile is None:
+                profile = next((p for _, _, p in self._slowest if p.id == request_id), None)
+        return profile
+
+    def slowest(self) -> list[Profile]:
+        with self._lock:
+            return [p for _, _, p in sorted(self._slowest, reverse=True)]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            recent = [p.id for p in reversed(self._recent.values())]
+            active = len(self._active)
+        return {
+            "sample_rate": self.sample_rate,
+            "interval_ms": round(self.interval * 1000, 3),
+            "active": active,
+            "slowest": [p.summary() for p in self.slowest()],
+            "recent": recent,
+        }
+
+
+PROFILER = SamplingProfiler()
+
+
+class ProfilingMiddleware:
+    """ASGI 中间件：对 PROFILED_ROUTES 的 POST 请求按需 profile，并在响应头写入 X-Profile-Id。
+
+    纯 ASGI 实现（不经过 BaseHTTPMiddleware），不改变断开检测与取消语义。
+    """
+
+    def __init__(self, app, profiler: SamplingProfiler | None = None):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        profiler = self.profiler or PROFILER
+        if scope["type"] != "http" or scope["method"] != "POST" or not PROFILED_ROUTES.match(scope["path"]):
+            await self.app(scope, receive, send)
+            return
+        headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+        if not profiler.wanted(headers):
+            await self.app(scope, receive, send)
+            return
+        request_id = headers.get("x-request-id") or uuid.uuid4().hex
+        name = "POST /conversations" if scope["path"].rstrip("/") == "/conversations" else "POST /messages"
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", request_id.encode())]}
+            await send(message)
+
+        with profiler.profiling(name, request_id):
+            await self.app(scope, receive, send_with_id)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""确定性 prompt 的精确匹配响应缓存。
+
+有些 prompt 每次都一模一样：芬兰学生的固定开场、通用群聊开场、对同一份对话记录的
+Observer 总结。它们不需要每次都打到模型上。
+
+缓存键 = (persona, 模型, instruction 哈希, prompt 哈希, 采样参数)，两级存储：
+- 内存 LRU（RESPONSE_CACHE_SIZE 条）
+- 可选的磁盘层（设置 RESPONSE_CACHE_DIR 时启用，进程重启后仍可命中）
+条目超过 RESPONSE_CACHE_TTL 秒失效。只有在 PERSONAS 中设置了 "cache_responses": True
+的 persona、且调用方声明 prompt 是确定性的（cacheable=True）时才会走缓存。
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from metrics import METRICS
+
+# 内存层最多缓存的条目数
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+
+# 条目有效期（秒）
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+
+# 磁盘层目录；为空时只用内存层
+RESPONSE_CACHE_DIR = os.getenv("RESPONSE_CACHE_DIR", "")
+
+# 影响输出的采样参数（LiteLlm 额外参数与 generate_content_config 中的字段）
+_SAMPLING_KEYS = (
+    "temperature", "top_p", "top_k", "seed", "max_tokens", "max_output_tokens",
+    "num_predict", "presence_penalty", "frequency_penalty", "stop", "stop_sequences",
+)
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def sampling_params(agent) -> dict:
+    """Agent 的模型与生成配置中影响输出的采样参数。"""
+    params = {}
+    extra = getattr(agent.model, "_additional_args", None) or {}
+    for key in _SAMPLING_KEYS:
+        if extra.get(key) is not None:
+            params[key] = extra[key]
+    config = getattr(agent, "generate_content_config", None)
+    if config is not None:
+        for key, value in config.model_dump(exclude_none=True).items():
+            if key in _SAMPLING_KEYS:
+                params[key] = value
+    return params
+
+
+def cache_key(persona_id: str, agent, prompt: str) -> str:
+    """(persona, 模型, instruction 哈希, prompt 哈希, 采样参数) 的摘要。"""
+    model = agent.model if isinstance(agent.model, str) else agent.model.model
+    instruction = agent.instruction if isinstance(agent.instruction, str) else repr(agent.instruction)
+    parts = {
+        "persona": persona_id,
+        "model": model,
+        "instruction": _sha256(instruction),
+        "prompt": _sha256(prompt),
+        "sampling": sampling_params(agent),
+    }
+    return _sha256(json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str))
+
+
+class _DiskTier:
+    """每个条目一个 JSON 文件（按键前缀分目录），写入用临时文件 + 原子替换。"""
+
+    def __init__(self, directory: str):
+        self.root = Path(directory)
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, key: str, ttl: float) -> str | None:
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get("created_at", 0) > ttl:
+            path.unlink(missing_ok=True)
+            return None
+        return entry.get("reply")
+
+    def put(self, key: str, reply: str) -> None:
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({"reply": reply, "created_at": time.time()}, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+
+    def clear(self) -> None:
+        for path in self.root.glob("*/*.json"):
+            path.unlink(missing_ok=True)
+
+
+class ResponseCache:
+    """内存 LRU + 可选磁盘层的响应缓存。"""
+
+    def __init__(
+        self,
+        max_entries: int = RESPONSE_CACHE_SIZE,
+        ttl: float = RESPONSE_CACHE_TTL,
+        directory: str = RESPONSE_CACHE_DIR,
+    ):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        # key -> (reply, created_at)
+        self._memory: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._disk = _DiskTier(directory) if directory else None
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    def _remember(self, key: str, reply: str, created_at: float) -> None:
+        self._memory[key] = (reply, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str, persona_id: str) -> str | None:
+        entry = self._memory.get(key)
+        if entry is not None:
+            if time.time() - entry[1] <= self.ttl:
+                self._memory.move_to_end(key)
+                METRICS.inc("response_cache_hits_total", persona=persona_id, tier="memory")
+                return entry[0]
+            del self._memory[key]
+        if self._disk is not None:
+            reply = await asyncio.to_thread(self._disk.get, key, self.ttl)
+            if reply is not None:
+                self._remember(key, reply, time.time())
+                METRICS.inc("response_cache_hits_total", persona=persona_id, tier="disk")
+                return reply
+        METRICS.inc("response_cache_misses_total", persona=persona_id)
+        return None
+
+    async def put(self, key: str, reply: str) -> None:
+        self._remember(key, reply, time.time())
+        if self._disk is not None:
+            try:
+                await asyncio.to_thread(self._disk.put, key, reply)
+            except OSError as e:
+                print(f"[CACHE] 写入磁盘缓存失败: {e}")
+
+    def clear(self) -> None:
+        self._memory.clear()
+        if self._disk is not None:
+            self._disk.clear()
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._memory),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "disk": str(self._disk.root) if self._disk is not None else None,
+        }
+
+
+# 全局响应缓存
+RESPONSE_CACHE = ResponseCache()
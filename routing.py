@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""负载感知的模型路由与优雅降级。
+
+每个 persona 在 PERSONAS 中固定一个模型，不管负载如何。GPU 队列很深时，
+与其打破延迟目标，不如：
+- 压力升高（elevated）：small_talk 回合改用更小更快的模型（PERSONAS[pid]["fast_model"]）
+- 压力很高（high）：再关掉可选调用（专家回复后的搭档补充、闲聊的第二位发言者）
+
+压力由调度器排队深度和最近模型调用的 p95 延迟共同决定。每个降级决定都会
+记录到计数器、日志和最近决定的环形缓冲里（GET /routing）。
+"""
+
+import os
+import time
+from collections import deque
+
+from metrics import METRICS, percentile
+from scheduler import INTERACTIVE, MODEL_CONCURRENCY, SCHEDULER
+
+# 单次模型调用（含排队）的 p95 延迟目标（秒）
+LATENCY_SLO_SECONDS = float(os.getenv("LATENCY_SLO_SECONDS", "8"))
+
+# 排队的交互调用数达到该值视为压力升高，达到两倍视为压力很高
+ROUTING_QUEUE_DEPTH_LIMIT = int(os.getenv("ROUTING_QUEUE_DEPTH_LIMIT", str(MODEL_CONCURRENCY)))
+
+# 计算 p95 的最近调用数
+ROUTING_LATENCY_WINDOW = int(os.getenv("ROUTING_LATENCY_WINDOW", "100"))
+
+# 保留的最近降级决定数
+ROUTING_DECISION_LOG = 200
+
+NORMAL, ELEVATED, HIGH = 0, 1, 2
+PRESSURE_NAMES = {NORMAL: "normal", ELEVATED: "elevated", HIGH: "high"}
+
+# 允许换快速模型的阶段
+FAST_TIER_PHASES = ("small_talk",)
+
+
+class RoutingPolicy:
+    """根据排队深度与最近 p95 选择模型档位、决定是否跳过可选调用。"""
+
+    def __init__(
+        self,
+        queue_depth,
+        slo_seconds: float = LATENCY_SLO_SECONDS,
+        queue_limit: int = ROUTING_QUEUE_DEPTH_LIMIT,
+        window: int = ROUTING_LATENCY_WINDOW,
+    ):
+        # queue_depth() -> 当前排队等待模型槽位的调用数
+        self._queue_depth = queue_depth
+        self.slo_seconds = slo_seconds
+        self.queue_limit = max(1, queue_limit)
+        self._latencies: deque[float] = deque(maxlen=window)
+        self.decisions: deque[dict] = deque(maxlen=ROUTING_DECISION_LOG)
+
+    def record_latency(self, seconds: float) -> None:
+        self._latencies.append(seconds)
+
+    def p95(self) -> float:
+        return percentile(self._latencies, 95)
+
+    def pressure(self) -> int:
+        depth = self._queue_depth()
+        p95 = self.p95()
+        if depth >= 2 * self.queue_limit or p95 > 1.5 * self.slo_seconds:
+            return HIGH
+        if depth >= self.queue_limit or p95 > self.slo_seconds:
+            return ELEVATED
+        return NORMAL
+
+    def _record(self, conversation_id: str, decision: str, level: int) -> None:
+        entry = {
+            "at": time.time(),
+            "conversation_id": conversation_id,
+            "decision": decision,
+            "pressure": PRESSURE_NAMES[level],
+            "queue_depth": self._queue_depth(),
+            "p95_seconds": round(self.p95(), 3),
+        }
+        self.decisions.append(entry)
+        METRICS.inc("routing_degradations_total", decision=decision)
+        print(
+            f"[ROUTING] {conversation_id}: {decision} "
+            f"(pressure={entry['pressure']}, queue={entry['queue_depth']}, p95={entry['p95_seconds']}s)"
+        )
+
+    def choose_tier(self, conversation_id: str, phase: str) -> str:
+        """本回合的模型档位："standard" 或 "fast"。"""
+        level = self.pressure()
+        if level >= ELEVATED and phase in FAST_TIER_PHASES:
+            self._record(conversation_id, "fast_model", level)
+            return "fast"
+        return "standard"
+
+    def allow_optional(self, conversation_id: str, kind: str) -> bool:
+        """可选调用（如 "sidekick"、"second_speaker"）在压力很高时关闭。"""
+        level = self.pressure()
+        if level >= HIGH:
+            self._record(conversation_id, f"skip_{kind}", level)
+            return False
+        return True
+
+    def snapshot(self) -> dict:
+        level = self.pressure()
+        return {
+            "pressure": PRESSURE_NAMES[level],
+            "queue_depth": self._queue_depth(),
+            "p95_seconds": round(self.p95(), 3),
+            "latency_slo_seconds": self.slo_seconds,
+            "queue_depth_limit": self.queue_limit,
+            "recent_decisions": list(self.decisions),
+        }
+
+
+# 全局路由策略；只看交互优先级的排队（后台总结不影响玩家延迟）
+ROUTING = RoutingPolicy(lambda: SCHEDULER.queue_depth(INTERACTIVE))
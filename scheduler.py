@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""模型调用调度：限制同时在跑的 LLM 调用数，并让交互回合优先于后台任务。
+
+后端（GPU）饱和时，等待中的调用按优先级出队：INTERACTIVE（玩家正在等的回合）
+先于 BACKGROUND（如 observer 总结）。优先级通过 contextvar 传递，
+后台任务只需在入口处 CALL_PRIORITY.set(BACKGROUND)，其内部的所有模型调用都会继承。
+"""
+
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from metrics import METRICS
+
+# 同时在跑的模型调用上限
+MODEL_CONCURRENCY = int(os.getenv("MODEL_CONCURRENCY", "4"))
+
+INTERACTIVE = 0
+BACKGROUND = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# 当前任务的模型调用优先级
+CALL_PRIORITY: ContextVar[int] = ContextVar("call_priority", default=INTERACTIVE)
+
+
+class ModelScheduler:
+    """带优先级的计数信号量。释放的槽位直接交给优先级最高（同级先到）的等待者。"""
+
+    def __init__(self, slots: int = MODEL_CONCURRENCY):
+        self.slots = max(1, slots)
+        self.in_use = 0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+
+    def queue_depth(self, priority: int | None = None) -> int:
+        """排队等待槽位的调用数（可按优先级过滤）。"""
+        return sum(
+            1 for p, _, fut in self._waiters
+            if not fut.done() and (priority is None or p == priority)
+        )
+
+    async def acquire(self, priority: int | None = None) -> None:
+        if priority is None:
+            priority = CALL_PRIORITY.get()
+        if self.in_use < self.slots and self.queue_depth() == 0:
+            self.in_use += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # 槽位已经交给我们但任务被取消了：转交给下一个
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while self._waiters:
+            _, _, fut = heapq.heappop(self._waiters)
+            if not fut.done():
+                # 槽位直接转交，in_use 不变
+                fut.set_result(None)
+                return
+        self.in_use -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: int | None = None):
+        if priority is None:
+            priority = CALL_PRIORITY.get()
+        started = time.perf_counter()
+        await self.acquire(priority)
+        METRICS.observe(
+            "model_queue_wait_seconds",
+            time.perf_counter() - started,
+            priority=PRIORITY_NAMES.get(priority, str(priority)),
+        )
+        try:
+            yield
+        finally:
+            self.release()
+
+
+# 全局调度器，所有 runner.run_async 调用都经过它
+SCHEDULER = ModelScheduler()
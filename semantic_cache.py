@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""专家阶段的近似重复问题缓存（语义缓存）。
+
+religion_deep / allergy_deep 里玩家反复问同一小撮问题（清真、花生、麸质、乳糖），
+只是说法略有不同，每次都要完整调用一次专家模型。这里按 (专家, 阶段) 分区，
+用本地轻量嵌入（字符 n-gram 哈希到固定维度，纯 CPU、离线可用）+ NumPy 余弦索引
+找相似问题，相似度达到 SEMANTIC_CACHE_THRESHOLD 时直接复用答案。
+
+n-gram 相似度分不清只差一个食物的问题（"沙拉里能放杏仁吗" 和 "能放花生吗" 余弦约 0.88），
+而这个领域里答案恰恰取决于这个词。所以命中还要求两个问题提到的领域词（过敏原、食物、
+宗教饮食，见 _KEY_TERMS）完全相同；不含任何领域词的问题（"那这个呢"）依赖上下文，不走缓存。
+
+答案变化：每个问题最多积累 SEMANTIC_CACHE_VARIANTS 个不同回答（前几次命中仍调用模型补齐），
+只有归一化后完全相同的问题才会给同一条目补充回答；之后命中时随机挑一个，
+并避开上一次给出的那个，回复不会千篇一律。
+
+NumPy 未安装时语义缓存自动关闭。
+"""
+
+import os
+import random
+import re
+import zlib
+
+from metrics import METRICS
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - 取决于部署环境
+    np = None
+
+# 是否启用语义缓存
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+
+# 余弦相似度阈值
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.75"))
+
+# 嵌入维度（n-gram 哈希桶数）
+SEMANTIC_CACHE_DIM = int(os.getenv("SEMANTIC_CACHE_DIM", "1024"))
+
+# 每个分区最多缓存的问题数（超出时淘汰最早的）
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "256"))
+
+# 每个问题积累的不同回答数；1 表示不做变化
+SEMANTIC_CACHE_VARIANTS = int(os.getenv("SEMANTIC_CACHE_VARIANTS", "3"))
+
+# 归一化后短于该长度的问题（如"还有呢"）不走缓存，避免跨话题误命中
+SEMANTIC_CACHE_MIN_CHARS = int(os.getenv("SEMANTIC_CACHE_MIN_CHARS", "4"))
+
+# n-gram 长度与权重：单字 n-gram 噪声大，权重低
+_NGRAM_WEIGHTS = ((1, 0.5), (2, 1.0), (3, 1.0))
+
+# 问句里的虚词与套话：不携带话题信息，却会让"有没有人花生过敏"和"有没有人乳糖不耐受"看起来很像
+_FILLERS = (
+    "有没有", "是不是", "能不能", "可不可以", "请问", "我们", "你们", "大家", "需要", "准备",
+    "一下", "什么", "怎么", "的话", "吗", "呢", "吧", "啊", "的", "了", "有", "人", "对", "会", "要", "都",
+)
+_FILLER_RE = re.compile("|".join(sorted(map(re.escape, _FILLERS), key=len, reverse=True)))
+
+_NON_WORD = re.compile(r"[\W_]+", re.UNICODE)
+
+# 领域词：问题里提到的过敏原、食物与宗教饮食。两个问题的领域词集合不同，答案就不能互相复用。
+# 单字词（虾、鱼、酒）在知识库的二元组分词里取不出来，所以这里按最长匹配直接在文本中查找。
+_KEY_TERMS = (
+    # 坚果、种子与豆类
+    "花生", "杏仁", "核桃", "腰果", "榛子", "开心果", "夏威夷果", "碧根果", "栗子", "坚果",
+    "芝麻", "大豆", "豆腐", "豆浆", "酱油", "毛豆",
+    # 谷物与麸质
+    "小麦", "大麦", "黑麦", "燕麦", "面粉", "面包", "面条", "意面", "麸质", "米饭",
+    # 乳制品与蛋
+    "牛奶", "奶酪", "芝士", "黄油", "酸奶", "奶油", "乳糖", "乳制品", "鸡蛋", "蛋黄酱",
+    # 海鲜
+    "三文鱼", "鱼露", "鱼", "虾", "蟹", "龙虾", "贝", "牡蛎", "鱿鱼", "海鲜", "甲壳",
+    # 肉类与动物制品
+    "猪肉", "牛肉", "羊肉", "鸡肉", "鸭肉", "火腿", "培根", "香肠", "猪油", "明胶", "血", "肉",
+    # 酒
+    "啤酒", "红酒", "白酒", "葡萄酒", "料酒", "酒精", "酒",
+    # 其他常见食材
+    "芹菜", "芥末", "蜂蜜", "洋葱", "大蒜", "咖啡", "茶",
+    # 宗教与饮食方式
+    "清真", "穆斯林", "伊斯兰", "洁食", "犹太", "斋月", "逾越节", "印度教", "耆那教", "佛教",
+    "锡克教", "基督教", "安息日", "摩门教", "蛋奶素", "素食", "纯素",
+    "halal", "kosher", "vegan", "vegetarian",
+)
+_KEY_TERM_RE = re.compile("|".join(sorted(map(re.escape, _KEY_TERMS), key=len, reverse=True)))
+
+
+def normalize(text: str) -> str:
+    """小写，去掉空白、标点与问句虚词。"""
+    return _FILLER_RE.sub("", _NON_WORD.sub("", (text or "").lower()))
+
+
+def key_terms(text: str) -> frozenset[str]:
+    """问题里提到的领域词集合（最长匹配，"三文鱼" 不会再算出 "鱼"）。"""
+    return frozenset(_KEY_TERM_RE.findall(_NON_WORD.sub("", (text or "").lower())))
+
+
+def embed(text: str, dim: int = SEMANTIC_CACHE_DIM):
+    """字符 n-gram 哈希嵌入（带符号哈希），返回 L2 归一化的 float32 向量。"""
+    vec = np.zeros(dim, dtype=np.float32)
+    t = normalize(text)
+    for n, weight in _NGRAM_WEIGHTS:
+        for i in range(len(t) - n + 1):
+            h = zlib.crc32(t[i:i + n].encode("utf-8"))
+            vec[h % dim] += weight if h & 0x80000000 else -weight
+    norm = float(np.linalg.norm(vec))
+    return vec / norm if norm else vec
+
+
+class SemanticIndex:
+    """一个分区内的问题向量矩阵与对应的回答。"""
+
+    def __init__(self, dim: int = SEMANTIC_CACHE_DIM, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES):
+        self.dim = dim
+        self.max_entries = max(1, max_entries)
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self.questions: list[str] = []
+        # 每条问题的归一化文本与领域词集合
+        self.normalized: list[str] = []
+        self.terms: list[frozenset[str]] = []
+        self.answers: list[list[str]] = []
+        self.last_served: list[int] = []
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.questions)
+
+    def nearest(self, vec, terms: frozenset[str]) -> tuple[int, float]:
+        """领域词相同的问题中最相似的下标与余弦相似度；没有候选时返回 (-1, 0.0)。"""
+        candidates = [k for k, t in enumerate(self.terms) if t == terms]
+        if not candidates:
+            return -1, 0.0
+        sims = self._vectors[candidates] @ vec
+        j = int(np.argmax(sims))
+        return candidates[j], float(sims[j])
+
+    def add(self, question: str, vec, terms: frozenset[str], answer: str) -> None:
+        if len(self.questions) >= self.max_entries:
+            self._vectors = self._vectors[1:]
+            del self.questions[0], self.normalized[0], self.terms[0], self.answers[0], self.last_served[0]
+        self._vectors = np.vstack([self._vectors, vec[None, :]])
+        self.questions.append(question)
+        self.normalized.append(normalize(question))
+        self.terms.append(terms)
+        self.answers.append([answer])
+        self.last_served.append(0)
+
+
+class SemanticCache:
+    """按 (专家, 阶段) 分区的语义缓存。"""
+
+    def __init__(
+        self,
+        threshold: float = SEMANTIC_CACHE_THRESHOLD,
+        variants: int = SEMANTIC_CACHE_VARIANTS,
+        dim: int = SEMANTIC_CACHE_DIM,
+        max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES,
+        enabled: bool = SEMANTIC_CACHE_ENABLED,
+    ):
+        self.threshold = threshold
+        self.variants = max(1, variants)
+        self.dim = dim
+        self.max_entries = max_entries
+        self.enabled = enabled and np is not None
+        if enabled and np is None:
+            print("[WARN] 未安装 numpy，语义缓存已关闭")
+        self._indexes: dict[tuple[str, str], SemanticIndex] = {}
+
+    def _index(self, scope: tuple[str, str]) -> SemanticIndex:
+        index = self._indexes.get(scope)
+        if index is None:
+            index = self._indexes[scope] = SemanticIndex(self.dim, self.max_entries)
+        return index
+
+    def _usable(self, question: str, terms: frozenset[str]) -> bool:
+        return self.enabled and bool(terms) and len(normalize(question)) >= SEMANTIC_CACHE_MIN_CHARS
+
+    def lookup(self, scope: tuple[str, str], question: str) -> str | None:
+        """返回相似问题的缓存回答；未命中（或该问题的回答变体还没攒够）时返回 None。"""
+        terms = key_terms(question)
+        if not self._usable(question, terms):
+            return None
+        index = self._index(scope)
+        label = "/".join(scope)
+        i, sim = index.nearest(embed(question, self.dim), terms)
+        answers = index.answers[i] if i >= 0 else None
+        if answers is None or sim < self.threshold or len(answers) < self.variants:
+            index.misses += 1
+            METRICS.inc("semantic_cache_misses_total", scope=label)
+            return None
+        # 随机挑一个回答，避开上次给出的那个
+        choices = [k for k in range(len(answers)) if k != index.last_served[i]] or [0]
+        k = random.choice(choices)
+        index.last_served[i] = k
+        index.hits += 1
+        METRICS.inc("semantic_cache_hits_total", scope=label)
+        METRICS.observe("semantic_cache_hit_similarity", sim, scope=label)
+        return answers[k]
+
+    def store(self, scope: tuple[str, str], question: str, answer: str) -> None:
+        """记录模型对该问题的回答：归一化后相同的问题并入回答变体，相似但不同的问题新建一条。"""
+        terms = key_terms(question)
+        if not answer or not self._usable(question, terms):
+            return
+        index = self._index(scope)
+        vec = embed(question, self.dim)
+        i, sim = index.nearest(vec, terms)
+        if i >= 0 and sim >= self.threshold:
+            if index.normalized[i] == normalize(question):
+                answers = index.answers[i]
+                if answer not in answers and len(answers) < self.variants:
+                    answers.append(answer)
+                return
+        index.add(question, vec, terms, answer)
+
+    def clear(self) -> None:
+        self._indexes.clear()
+
+    def stats(self) -> dict:
+        out = {}
+        for scope, index in self._indexes.items():
+            total = index.hits + index.misses
+            out["/".join(scope)] = {
+                "entries": len(index),
+                "hits": index.hits,
+                "misses": index.misses,
+                "hit_rate": round(index.hits / total, 3) if total else 0.0,
+            }
+        return out
+
+
+# 全局语义缓存
+SEMANTIC_CACHE = SemanticCache()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""按玩家分片的 ADK session 存储。
+
+原来所有会话都以同一个 user_id（"godot"）存在每个 InMemoryRunner 自带的 InMemorySessionService 里：
+sessions[app_name]["godot"] 是一个装着全部会话的大字典，按用户列出 session 要遍历所有玩家的会话。
+这里每个 Runner 使用一个 ShardedSessionService：
+- SESSION_SHARDS 个 InMemorySessionService，按 crc32(user_id) 选分片（同一玩家的 session 总在同一分片）
+- 分片内仍按 app_name -> user_id -> session_id 存放，查找只经过该玩家自己的桶
+- 删除 session 时直接移除，不像 InMemorySessionService 那样先深拷贝整个 session；
+  玩家的最后一个 session 删除后连同空桶一起移除，玩家数不会只增不减
+
+分片与 Runner 无关：标准档、快速档与委托模式的 Runner 共用同一个 ShardedSessionService（见 personas.py）。
+"""
+
+import os
+import zlib
+from typing import Any, Optional
+
+from google.adk.events.event import Event
+from google.adk.sessions.base_session_service import BaseSessionService, GetSessionConfig, ListSessionsResponse
+from google.adk.sessions.in_memory_session_service import InMemorySessionService
+from google.adk.sessions.session import Session
+
+# 每个 session 服务的分片数
+SESSION_SHARDS = int(os.getenv("SESSION_SHARDS", "16"))
+
+
+def shard_of(user_id: str, shards: int = SESSION_SHARDS) -> int:
+    """玩家所在的分片号（稳定哈希，跨进程一致）。"""
+    return zlib.crc32(user_id.encode("utf-8")) % max(1, shards)
+
+
+class ShardedSessionService(BaseSessionService):
+    """按 user_id 分片的内存 session 服务。"""
+
+    def __init__(self, shards: int = SESSION_SHARDS):
+        self.shards = [InMemorySessionService() for _ in range(max(1, shards))]
+
+    def _shard(self, user_id: str) -> InMemorySessionService:
+        return self.shards[shard_of(user_id, len(self.shards))]
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        return await self._shard(user_id).create_session(
+            app_name=app_name, user_id=user_id, state=state, session_id=session_id
+        )
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        return await self._shard(user_id).get_session(
+            app_name=app_name, user_id=user_id, session_id=session_id, config=config
+        )
+
+    async def list_sessions(self, *, app_name: str, user_id: str) -> ListSessionsResponse:
+        return await self._shard(user_id).list_sessions(app_name=app_name, user_id=user_id)
+
+    async def delete_session(self, *, app_name: str, user_id: str, session_id: str) -> None:
+        users = self._shard(user_id).sessions.get(app_name)
+        if not users:
+            return
+        sessions = users.get(user_id)
+        if sessions is None:
+            return
+        sessions.pop(session_id, None)
+        if not sessions:
+            del users[user_id]
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        return await self._shard(session.user_id).append_event(session=session, event=event)
+
+    def sizes(self) -> list[int]:
+        """每个分片中的玩家数（各 app 合计）。"""
+        return [sum(len(users) for users in shard.sessions.values()) for shard in self.shards]
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+"""离线批量模拟：把 JSONL 玩家脚本直接交给 _run_chat_round，用于调状态机参数。
+
+脚本文件每行一个 JSON 对象：
+    {"id": "allergy-early", "turns": ["今晚几点开始？", "有人对花生过敏吗？", ...],
+     "persona_ids": ["mikko", "aino"], "player_id": "sim"}
+只有 turns 必填；id 默认为行号（续跑按 id 判断，脚本文件改动后最好显式给 id），persona_ids 默认 DEFAULT_PERSONAS。
+
+每个脚本新建一个会话（不生成开场对话），按顺序发送 turns，跑完释放会话的全部状态。
+同时跑 --concurrency 个脚本（asyncio）；--processes N 时按脚本顺序轮流分给 N 个 spawn 子进程，
+每个子进程各自导入 Main、各跑 --concurrency 个，结果经队列交给主进程写出。
+
+结果逐个脚本追加写入 --out（JSONL，每写一行 flush）：
+    {"id", "persona_ids", "turns": [{"turn", "content", "focus": {"religion", "allergy"},
+      "phase_before", "phase_after", "speakers", "latency_ms"}], "final_phase", "finished_at_turn",
+     "seconds", "error"}
+续跑：--out 已存在时跳过其中没有 error 的脚本（中断时写了一半的末行会被截掉），失败的脚本重跑。
+同一个输出文件续跑时应使用相同的状态机参数。
+
+状态机参数可覆盖（只影响本次运行）：--expert-turns（EXPERT_TURNS）、--affirmative-words（WRAP_UP_AFFIRMATIVE_WORDS）、
+--religion-keywords / --allergy-keywords（RELIGION_KEYWORDS / ALLERGY_KEYWORDS），均为逗号分隔。
+--fake-model 使用进程内的假 Ollama（benchmarks.bench_combined_turns.FakeOllama），只验证阶段流转时不必启动模型；此时的耗时没有参考价值。
+
+用法：
+    python -m simulate scripts.jsonl --out results.jsonl [--concurrency 8] [--processes 1] [--fake-model]
+结束时输出汇总 JSON：脚本数、错误数、回合延迟分位数、最终阶段与阶段转移计数。
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import queue
+import statistics
+import sys
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+from conversation_store import Conversation, MessageLog
+
+# 覆盖项 -> Main 中的模块常量
+_OVERRIDES = {
+    "expert_turns": "EXPERT_TURNS",
+    "affirmative_words": "WRAP_UP_AFFIRMATIVE_WORDS",
+    "religion_keywords": "RELIGION_KEYWORDS",
+    "allergy_keywords": "ALLERGY_KEYWORDS",
+}
+
+
+def load_scripts(path: str | Path) -> list[dict]:
+    """读取脚本文件（跳过空行）。
+
+    Raises:
+        ValueError: 行不是 JSON 对象、turns 不是非空字符串列表，或 id 重复
+    """
+    scripts = []
+    seen = set()
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                script = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{path}:{lineno}: 不是合法的 JSON: {e}") from None
+            if not isinstance(script, dict):
+                raise ValueError(f"{path}:{lineno}: 应为 JSON 对象")
+            turns = script.get("turns")
+            if not turns or not isinstance(turns, list) or not all(isinstance(t, str) for t in turns):
+                raise ValueError(f"{path}:{lineno}: turns 应为非空的字符串列表")
+            script["id"] = str(script.get("id", lineno))
+            if script["id"] in seen:
+                raise ValueError(f"{path}:{lineno}: 脚本 id 重复: {script['id']}")
+            seen.add(script["id"])
+            scripts.append(script)
+    return scripts
+
+
+def completed_ids(path: str | Path) -> set[str]:
+    """输出文件中已成功跑完的脚本 id；顺带截掉中断时没写完的末行，之后可以直接追加。"""
+    path = Path(path)
+    if not path.exists():
+        return set()
+    data = path.read_bytes()
+    if data and not data.endswith(b"\n"):
+        keep = data.rfind(b"\n") + 1
+        with open(path, "r+b") as f:
+            f.truncate(keep)
+        data = data[:keep]
+    done = set()
+    for line in data.decode("utf-8").splitlines():
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(record, dict) and record.get("error") is None and "id" in record:
+            done.add(record["id"])
+    return done
+
+
+def _apply_overrides(Main, overrides: dict) -> None:
+    for key, value in overrides.items():
+        if value is not None:
+            setattr(Main, _OVERRIDES[key], value)
+
+
+async def _run_script(Main, script: dict) -> dict:
+    persona_ids = script.get("persona_ids") or Main.DEFAULT_PERSONAS.copy()
+    record = {"id": script["id"], "persona_ids": persona_ids, "turns": [], "final_phase": None,
+              "finished_at_turn": None, "seconds": 0.0, "error": None}
+    unknown = [p for p in persona_ids if p not in Main.personas.PERSONAS]
+    if unknown:
+        record["error"] = f"未知的 persona: {', '.join(unknown)}"
+        return record
+
+    cid = uuid.uuid4().hex
+    player_id = script.get("player_id") or Main.DEFAULT_PLAYER_ID
+    Main.CONVERSATIONS[cid] = conv = Conversation(
+        persona_ids=persona_ids, created_at=datetime.now(timezone.utc).isoformat(),
+        messages=MessageLog(), player_id=player_id,
+    )
+    Main.CONVERSATION_INDEX.add(cid, persona_ids, player_id=player_id)
+    started = time.perf_counter()
+    try:
+        for i, content in enumerate(script["turns"]):
+            state = Main.CONVERSATION_STATES.get(cid)
+            before = state.phase if state is not None else "small_talk"
+            religion, allergy = Main._detect_focus_flags(content)
+            n = len(conv.messages)
+            turn_started = time.perf_counter()
+            try:
+                await Main._run_chat_round(cid, persona_ids, content)
+            except Exception as e:
+                record["error"] = f"第 {i} 回合失败: {type(e).__name__}: {e}"
+                break
+            after = Main.CONVERSATION_STATES[cid].phase
+            record["turns"].append({
+                "turn": i,
+                "content": content,
+                "focus": {"religion": religion, "allergy": allergy},
+                "phase_before": before,
+                "phase_after": after,
+                # 跳过本回合开头追加的玩家消息
+                "speakers": [m.name for m in conv.messages[n + 1:] if m.role == "model"],
+                "latency_ms": round((time.perf_counter() - turn_started) * 1000, 1),
+            })
+            if after == "finished" and record["finished_at_turn"] is None:
+                record["finished_at_turn"] = i
+        state = Main.CONVERSATION_STATES.get(cid)
+        record["final_phase"] = state.phase if state is not None else None
+    finally:
+        record["seconds"] = round(time.perf_counter() - started, 3)
+        await Main._forget_conversation(cid, "simulated")
+    return record
+
+
+async def run_scripts(Main, scripts: list[dict], concurrency: int, emit) -> None:
+    """并发跑脚本（最多 concurrency 个同时进行），每跑完一个调用 emit(record)。"""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def one(script: dict) -> None:
+        async with semaphore:
+            emit(await _run_script(Main, script))
+
+    await asyncio.gather(*(one(s) for s in scripts))
+
+
+def _use_fake_model() -> None:
+    """把 Ollama 指向进程内的假模型；必须在导入 Main 之前调用。
+
+    bench_combined_turns 导入时设置 OLLAMA_API_BASE 并关闭 Azure、failover 与预热。
+    """
+    import httpx
+
+    import http_pool
+    from benchmarks.bench_combined_turns import FakeOllama
+
+    http_pool.pool_for(os.environ["OLLAMA_API_BASE"], transport=httpx.MockTransport(FakeOllama().handler))
+
+
+def _import_main(fake_model: bool, overrides: dict):
+    if fake_model:
+        _use_fake_model()
+    import Main
+
+    _apply_overrides(Main, overrides)
+    return Main
+
+
+def _process_main(scripts: list[dict], concurrency: int, fake_model: bool, overrides: dict, results) -> None:
+    """子进程入口：跑分到的脚本，结果逐个放进队列，最后放 None。"""
+    try:
+        Main = _import_main(fake_model, overrides)
+        asyncio.run(run_scripts(Main, scripts, concurrency, results.put))
+    finally:
+        results.put(None)
+
+
+def _run_in_processes(scripts: list[dict], processes: int, concurrency: int, fake_model: bool, overrides: dict, emit):
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(target=_process_main, args=(scripts[i::processes], concurrency, fake_model, overrides, results))
+        for i in range(processes)
+    ]
+    for p in procs:
+        p.start()
+    remaining = len(procs)
+    try:
+        while remaining:
+            try:
+                record = results.get(timeout=1.0)
+            except queue.Empty:
+                if not any(p.is_alive() for p in procs):
+                    print("[SIM] 子进程异常退出，未跑完的脚本可续跑")
+                    break
+                continue
+            if record is None:
+                remaining -= 1
+            else:
+                emit(record)
+    finally:
+        for p in procs:
+            p.join(timeout=10)
+            if p.is_alive():
+                p.terminate()
+
+
+def _summary(records: list[dict], total: int, skipped: int, seconds: float) -> dict:
+    latencies = sorted(t["latency_ms"] for r in records for t in r["turns"])
+    transitions = Counter(
+        f"{t['phase_before']}->{t['phase_after']}"
+        for r in records for t in r["turns"] if t["phase_before"] != t["phase_after"]
+    )
+    finished = [r["finished_at_turn"] for r in records if r["finished_at_turn"] is not None]
+    summary = {
+        "scripts": total,
+        "skipped": skipped,
+        "run": len(records),
+        "errors": sum(1 for r in records if r["error"] is not None),
+        "turns": len(latencies),
+        "seconds": round(seconds, 2),
+        "final_phases": dict(Counter(r["final_phase"] for r in records if r["error"] is None)),
+        "transitions": dict(transitions.most_common()),
+        "finished_at_turn_mean": round(statistics.mean(finished), 2) if finished else None,
+    }
+    if latencies:
+        summary["turn_latency_ms"] = {
+            "p50": latencies[len(latencies) // 2],
+            "p99": latencies[max(0, int(len(latencies) * 0.99) - 1)],
+        }
+    return summary
+
+
+def simulate(
+    scripts_path: str | Path,
+    out_path: str | Path,
+    concurrency: int = 8,
+    processes: int = 1,
+    fake_model: bool = False,
+    overrides: dict | None = None,
+) -> dict:
+    """跑脚本文件中尚未完成的脚本，结果追加到 out_path，返回汇总。"""
+    overrides = overrides or {}
+    scripts = load_scripts(scripts_path)
+    done = completed_ids(out_path)
+    pending = [s for s in scripts if s["id"] not in done]
+    print(f"[SIM] {len(scripts)} 个脚本，已完成 {len(scripts) - len(pending)} 个，本次运行 {len(pending)} 个")
+
+    records = []
+    started = time.perf_counter()
+    with open(out_path, "a", encoding="utf-8") as out:
+        def emit(record: dict) -> None:
+            records.append(record)
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+        if pending and processes > 1:
+            _run_in_processes(pending, min(processes, len(pending)), concurrency, fake_model, overrides, emit)
+        elif pending:
+            Main = _import_main(fake_model, overrides)
+            asyncio.run(run_scripts(Main, pending, concurrency, emit))
+    return _summary(records, len(scripts), len(scripts) - len(pending), time.perf_counter() - started)
+
+
+def _words(value: str) -> list[str]:
+    return [w.strip() for w in value.split(",") if w.strip()]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("scripts", help="玩家脚本 JSONL")
+    parser.add_argument("--out", required=True, help="结果 JSONL（已存在时续跑）")
+    parser.add_argument("--concurrency", type=int, default=8, help="每个进程同时跑的脚本数")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--fake-model", action="store_true", help="使用进程内的假 Ollama")
+    parser.add_argument("--expert-turns", type=int)
+    parser.add_argument("--affirmative-words", type=_words)
+    parser.add_argument("--religion-keywords", type=_words)
+    parser.add_argument("--allergy-keywords", type=_words)
+    args = parser.parse_args(argv)
+    overrides = {key: getattr(args, key) for key in _OVERRIDES}
+    summary = simulate(args.scripts, args.out, args.concurrency, args.processes, args.fake_model, overrides)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    return 1 if summary["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
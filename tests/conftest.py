@@ -1,12 +1,59 @@
+import asyncio
 import pytest
+from unittest.mock import AsyncMock, patch
 from fastapi.testclient import TestClient
+import os
 import sys
 from pathlib import Path
 
 # Add project root to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+# Use litellm's bundled model cost map instead of fetching it over the network
+os.environ.setdefault("LITELLM_LOCAL_MODEL_COST_MAP", "True")
+# Tests run without a local Ollama: do not warm models on app startup
+os.environ.setdefault("WARMUP_ENABLED", "false")
+# Keep expert replies independent across tests; semantic-cache tests build their own cache
+os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "false")
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "allow_blocking: the test blocks the event loop on purpose (skips the LOOP_MONITOR_STRICT check)"
+    )
+
+
+@pytest.fixture(autouse=True)
+def loop_blocking_guard(request, monkeypatch):
+    """With LOOP_MONITOR_STRICT=true, fail any test whose event loop is blocked past the threshold."""
+    from loop_monitor import LOOP_MONITOR, monitored
+
+    if not LOOP_MONITOR.strict or request.node.get_closest_marker("allow_blocking"):
+        yield
+        return
+    real_run = asyncio.run
+    monkeypatch.setattr(asyncio, "run", lambda main, **kwargs: real_run(monitored(main), **kwargs))
+    LOOP_MONITOR.violations.clear()
+    yield
+    LOOP_MONITOR.raise_if_blocked()
+
+
 @pytest.fixture
 def client():
     from Main import app
     return TestClient(app)
+
+
+@pytest.fixture
+def mock_generate_initial():
+    """Mock _generate_group_initial_messages to avoid hitting Ollama."""
+    with patch('Main._generate_group_initial_messages', new_callable=AsyncMock) as mock:
+        mock.return_value = []
+        yield mock
+
+
+@pytest.fixture
+def mock_run_chat():
+    """Mock _run_chat_round to avoid hitting Ollama."""
+    with patch('Main._run_chat_round', new_callable=AsyncMock) as mock:
+        mock.return_value = "[芬兰学生讨论组] Moi!"
+        yield mock
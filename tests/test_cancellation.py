@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for client-disconnect cancellation of in-flight turns."""
+
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from conversation_store import Conversation, PhaseState
+from metrics import METRICS
+from turn_gate import TurnGates
+
+
+class FakeRunner:
+    """Minimal stand-in for InMemoryRunner that streams scripted chunks."""
+
+    def __init__(self, chunks, delay=0.0, hang=False):
+        self.session_service = InMemorySessionService()
+        self.chunks = chunks
+        self.delay = delay
+        self.hang = hang
+        self.closed = False
+
+    async def run_async(self, user_id, session_id, new_message):
+        try:
+            for chunk in self.chunks:
+                await asyncio.sleep(self.delay)
+                yield SimpleNamespace(
+                    content=types.Content(role="model", parts=[types.Part(text=chunk)])
+                )
+            if self.hang:
+                await asyncio.sleep(3600)
+        finally:
+            self.closed = True
+
+
+class FakeRequest:
+    """Request whose client disconnects once `disconnect` is set."""
+
+    def __init__(self):
+        self.disconnect = asyncio.Event()
+
+    async def is_disconnected(self):
+        return self.disconnect.is_set()
+
+
+def _religion_conversation(Main) -> str:
+    cid = f"cancel_{id(object()):x}"
+    Main.CONVERSATIONS[cid] = Conversation(
+        persona_ids=["mikko", "aino"],
+        created_at=datetime.now(timezone.utc).isoformat(),
+    )
+    Main.CONVERSATION_STATES[cid] = PhaseState(phase="religion_deep")
+    return cid
+
+
+class TestDisconnectCancellation:
+    """A disconnected client cancels the rest of the agent chain."""
+
+    def test_remaining_agent_calls_are_cancelled(self):
+        import Main
+
+        cid = _religion_conversation(Main)
+        expert = FakeRunner(["猪肉和酒精都要避免。"])
+        sidekick = FakeRunner(["我补充一下，", "半句话"], hang=True)
+        before = METRICS.counter("agent_calls_cancelled_total", persona="aino")
+
+        async def main():
+            request = FakeRequest()
+            turn = Main._cancel_on_disconnect(
+                request, Main._run_serialized_turn(cid, "那酒呢？")
+            )
+            task = asyncio.ensure_future(turn)
+            # Wait for the expert reply, let the sidekick start streaming, then drop the client
+            while len(Main.CONVERSATIONS[cid].messages) < 2:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)
+            request.disconnect.set()
+            try:
+                await task
+            except Main.ClientDisconnected:
+                return "disconnected"
+
+        with patch.object(Main, "DISCONNECT_POLL_INTERVAL", 0.01), \
+             patch.dict(Main.personas.RUNNERS, {"religion_expert": expert, "aino": sidekick}):
+            outcome = asyncio.run(main())
+
+        assert outcome == "disconnected"
+        assert sidekick.closed
+        msgs = Main.CONVERSATIONS[cid].messages
+        # The user message and the complete expert reply stay; no half sidekick reply
+        assert [(m.role, m.name) for m in msgs] == [("user", None), ("model", "宗教禁忌专家")]
+        assert all("半句话" not in m.content for m in msgs)
+        assert METRICS.counter("agent_calls_cancelled_total", persona="aino") == before + 1
+
+    def test_connected_client_gets_full_turn(self):
+        import Main
+
+        cid = _religion_conversation(Main)
+        expert = FakeRunner(["猪肉和酒精都要避免。"])
+        sidekick = FakeRunner(["对，我记下了。"])
+
+        async def main():
+            return await Main._cancel_on_disconnect(
+                FakeRequest(), Main._run_serialized_turn(cid, "那酒呢？")
+            )
+
+        with patch.dict(Main.personas.RUNNERS, {"religion_expert": expert, "aino": sidekick}):
+            result = asyncio.run(main())
+
+        assert len(result["messages"]) == 3
+        assert "Aino: 对，我记下了。" in result["reply"]
+
+
+class TestRetryKeepsTurnAlive:
+    """Cancelling one waiter does not cancel a turn another retry is waiting on."""
+
+    def test_turn_survives_until_last_waiter_leaves(self):
+        gates = TurnGates()
+        finished = []
+
+        async def turn():
+            await asyncio.sleep(0.05)
+            finished.append(1)
+            return "ok"
+
+        async def main():
+            original = asyncio.create_task(gates.run("c1", "m1", turn))
+            await asyncio.sleep(0)
+            retry = asyncio.create_task(gates.run("c1", "m1", turn))
+            await asyncio.sleep(0.01)
+            original.cancel()
+            return await retry
+
+        assert asyncio.run(main()) == "ok"
+        assert finished == [1]
+
+    def test_last_waiter_leaving_cancels_turn(self):
+        gates = TurnGates()
+        finished = []
+
+        async def turn():
+            await asyncio.sleep(0.05)
+            finished.append(1)
+
+        async def main():
+            task = asyncio.create_task(gates.run("c1", "m1", turn))
+            await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.sleep(0.1)
+
+        asyncio.run(main())
+        assert finished == []
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for recording and replaying model traffic with cassettes."""
+
+import asyncio
+import random
+import time
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import pytest
+from google.adk.events import Event
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from cassettes import Cassette, CassetteDeck, CassetteMiss, RecordedCall
+from conversation_store import Conversation
+
+
+class ScriptedRunner:
+    """Stand-in for InMemoryRunner that streams real ADK events with usage metadata."""
+
+    def __init__(self, reply="Moi! 我们八点开始。", delay=0.0, fail=False, hang=False):
+        self.session_service = InMemorySessionService()
+        self.reply = reply
+        self.delay = delay
+        self.fail = fail
+        self.hang = hang
+        self.calls = 0
+
+    async def run_async(self, user_id, session_id, new_message):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            raise ConnectionError("ollama down")
+        yield Event(
+            author="agent",
+            content=types.Content(role="model", parts=[types.Part(text=self.reply)]),
+            usage_metadata=types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=40, candidates_token_count=8
+            ),
+        )
+        if self.hang:
+            await asyncio.sleep(3600)
+
+
+class ForbiddenRunner:
+    """Runner that must not be reached while a cassette is playing."""
+
+    session_service = InMemorySessionService()
+
+    def run_async(self, **kwargs):
+        raise AssertionError("replay called the real runner")
+
+
+def _conversation(Main) -> str:
+    cid = f"cassette_{random.getrandbits(64):x}"
+    Main.CONVERSATIONS[cid] = Conversation(
+        persona_ids=["mikko", "aino"],
+        created_at=datetime.now(timezone.utc).isoformat(),
+    )
+    return cid
+
+
+def _message(text="今晚几点开始？"):
+    return types.Content(role="user", parts=[types.Part(text=text)])
+
+
+class TestRecording:
+    """CASSETTE_MODE=record writes every completed call with its timing."""
+
+    def test_call_is_written_with_events_and_timing(self, tmp_path):
+        import Main
+
+        deck = CassetteDeck(mode="record", directory=tmp_path)
+        runner = ScriptedRunner(delay=0.02)
+        with patch("Main.CASSETTES", deck):
+            deck.record_conversation("c1", ["mikko", "aino"])
+            deck.record_turn("c1", "今晚几点开始？")
+            events = asyncio.run(Main._run_agent_stream(runner, "mikko", "c1", _message()))
+
+        assert len(events) == 1
+        deck.flush()
+        cassette = Cassette.load(deck.path("c1"))
+        assert cassette.persona_ids == ["mikko", "aino"]
+        assert [content for _, content in cassette.turns] == ["今晚几点开始？"]
+        (call,) = cassette.calls
+        assert call.persona_id == "mikko"
+        assert call.prompt == "今晚几点开始？"
+        assert call.error is None
+        assert call.seconds >= 0.02
+        at, event = call.events[0]
+        assert at >= 0.02
+        assert event["content"]["parts"][0]["text"] == "Moi! 我们八点开始。"
+        assert event["usage"]["prompt_token_count"] == 40
+
+    def test_failed_call_is_recorded_with_error(self, tmp_path):
+        import Main
+
+        deck = CassetteDeck(mode="record", directory=tmp_path)
+        with patch("Main.CASSETTES", deck), pytest.raises(ConnectionError):
+            asyncio.run(Main._run_agent_stream(ScriptedRunner(fail=True), "mikko", "c1", _message()))
+        deck.flush()
+        (call,) = Cassette.load(deck.path("c1")).calls
+        assert call.error == "ConnectionError: ollama down"
+
+    def test_cancelled_call_is_not_recorded(self, tmp_path):
+        import Main
+
+        deck = CassetteDeck(mode="record", directory=tmp_path)
+
+        async def main():
+            task = asyncio.ensure_future(
+                Main._run_agent_stream(ScriptedRunner(hang=True), "mikko", "c1", _message())
+            )
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        with patch("Main.CASSETTES", deck):
+            asyncio.run(main())
+        deck.flush()
+        assert not deck.path("c1").exists()
+
+    def test_files_are_written_off_the_event_loop(self, tmp_path):
+        import gzip
+        import threading
+
+        writers = []
+        real_open = gzip.open
+
+        def spy_open(*args, **kwargs):
+            writers.append(threading.current_thread())
+            return real_open(*args, **kwargs)
+
+        deck = CassetteDeck(mode="record", directory=tmp_path / "nested")
+        with patch("cassettes.gzip.open", side_effect=spy_open):
+            deck.record_conversation("c1", ["mikko"])
+            deck.record_turn("c1", "moi")
+            deck.flush()
+        assert writers and threading.main_thread() not in writers
+        cassette = Cassette.load(deck.path("c1"))
+        assert (cassette.persona_ids, [c for _, c in cassette.turns]) == (["mikko"], ["moi"])
+
+    def test_off_mode_writes_nothing(self, tmp_path):
+        import Main
+
+        deck = CassetteDeck(mode="off", directory=tmp_path)
+        with patch("Main.CASSETTES", deck):
+            deck.record_conversation("c1", ["mikko"])
+            asyncio.run(Main._run_agent_stream(ScriptedRunner(), "mikko", "c1", _message()))
+        assert list(tmp_path.iterdir()) == []
+
+
+class TestReplay:
+    """Playback serves recorded calls through the normal agent path."""
+
+    def _record_turn(self, Main, deck, text):
+        runner = ScriptedRunner()
+        cid = _conversation(Main)
+        deck.record_conversation(cid, ["mikko", "aino"])
+        random.seed(3)
+        with patch("Main.CASSETTES", deck), patch("Main.personas.get_runner", return_value=runner):
+            result = asyncio.run(Main._run_serialized_turn(cid, text))
+        return cid, result, runner
+
+    def test_replayed_turn_matches_recorded_turn(self, tmp_path):
+        import Main
+
+        deck = CassetteDeck(mode="record", directory=tmp_path)
+        cid, recorded, runner = self._record_turn(Main, deck, "今晚几点开始？")
+        assert runner.calls >= 1
+        deck.flush()
+        cassette = Cassette.load(deck.path(cid))
+        assert len(cassette.calls) == runner.calls
+
+        replay_cid = _conversation(Main)
+        deck.mode = "off"
+        random.seed(3)
+
+        async def main():
+            with deck.playing(cassette, speed=0) as playback:
+                result = await Main._run_serialized_turn(replay_cid, cassette.turns[0][1])
+            return result, playback
+
+        with patch("Main.CASSETTES", deck), patch("Main.personas.get_runner", return_value=ForbiddenRunner()):
+            replayed, playback = asyncio.run(main())
+
+        assert replayed["reply"] == recorded["reply"]
+        assert playback.served == len(cassette.calls)
+        assert playback.remaining() == 0
+        assert playback.prompt_changes == 0
+
+    def test_speed_scales_recorded_timing(self):
+        cassette = Cassette("c1", calls=[
+            RecordedCall("mikko", "hi", seconds=0.2, events=[(0.2, {"author": "agent"})])
+        ])
+        deck = CassetteDeck(mode="off")
+
+        async def timed(speed):
+            with deck.playing(cassette, speed=speed) as playback:
+                started = time.perf_counter()
+                events = [e async for e in playback.stream("mikko", _message("hi"))]
+                return time.perf_counter() - started, events
+
+        slow, events = asyncio.run(timed(1))
+        fast, _ = asyncio.run(timed(10))
+        assert slow >= 0.19
+        assert fast < 0.1
+        assert events[0].author == "agent"
+
+    def test_exhausted_persona_raises_miss(self):
+        cassette = Cassette("c1", calls=[RecordedCall("mikko", "hi")])
+        deck = CassetteDeck(mode="off")
+
+        async def main():
+            with deck.playing(cassette, speed=0) as playback:
+                assert [e async for e in playback.stream("mikko", _message("hi"))] == []
+                with pytest.raises(CassetteMiss):
+                    [e async for e in playback.stream("mikko", _message("hi"))]
+                with pytest.raises(CassetteMiss):
+                    [e async for e in playback.stream("aino", _message("hi"))]
+                return playback
+
+        assert asyncio.run(main()).misses == 2
+
+    def test_non_strict_playback_reuses_recorded_calls(self):
+        """Without strict, an exhausted persona cycles through its recorded calls."""
+        cassette = Cassette("c1", calls=[RecordedCall("mikko", "a"), RecordedCall("mikko", "b")])
+        deck = CassetteDeck(mode="off")
+
+        async def main():
+            with deck.playing(cassette, speed=0, strict=False) as playback:
+                prompts = [playback.take("mikko", "a").prompt for _ in range(3)]
+                with pytest.raises(CassetteMiss):
+                    playback.take("aino", "a")
+                return prompts, playback
+
+        prompts, playback = asyncio.run(main())
+        assert prompts == ["a", "b", "a"]
+        assert playback.reused == 1
+        assert playback.prompt_changes == 1
+
+    def test_recorded_error_is_replayed(self):
+        cassette = Cassette("c1", calls=[RecordedCall("mikko", "hi", error="ConnectionError: ollama down")])
+        deck = CassetteDeck(mode="off")
+
+        async def main():
+            with deck.playing(cassette, speed=0) as playback:
+                with pytest.raises(RuntimeError, match="ollama down"):
+                    [e async for e in playback.stream("mikko", _message("hi"))]
+
+        asyncio.run(main())
+
+
+class TestReplaySessionBenchmark:
+    """benchmarks.replay_cassettes drives a whole recorded session through Main."""
+
+    def test_replay_session_creates_and_plays_turns(self):
+        import Main
+        from benchmarks.replay_cassettes import replay_session
+
+        reply = {"author": "agent", "content": {"role": "model", "parts": [{"text": "Moi! 我们八点开始。"}]}}
+        # speaker order is random: record one call per persona and let non-strict playback reuse them
+        cassette = Cassette("c1", persona_ids=["mikko", "aino"], turns=[(0.0, "今晚几点开始？")],
+                            calls=[RecordedCall(pid, "", events=[(0.0, reply)]) for pid in ("mikko", "aino")])
+        stats = {"latencies_ms": [], "errors": [], "served": 0, "reused": 0, "prompt_changes": 0, "misses": 0}
+        live = set(Main.CONVERSATIONS)
+
+        with patch("Main.personas.get_runner", return_value=ForbiddenRunner()):
+            asyncio.run(replay_session(cassette, speed=0, think_time=False, strict=False, stats=stats))
+
+        assert stats["errors"] == []
+        assert len(stats["latencies_ms"]) == 1
+        assert stats["served"] >= 1 and stats["misses"] == 0
+        (cid,) = set(Main.CONVERSATIONS) - live
+        conv = Main.CONVERSATIONS[cid]
+        assert conv.player_id == Main.DEFAULT_PLAYER_ID
+        assert conv.messages[-1].content == "Moi! 我们八点开始。"
+        asyncio.run(Main._forget_conversation(cid, "deleted"))
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for the single-call multi-speaker (combined) orchestration mode."""
+
+import asyncio
+import json
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from google.genai import types
+
+from conversation_store import Conversation, MessageLog, PhaseState
+from metrics import METRICS
+
+STUDENTS = [("mikko", "Mikko"), ("aino", "Aino")]
+
+
+def _events(text: str) -> list:
+    return [SimpleNamespace(content=types.Content(role="model", parts=[types.Part(text=text)]))]
+
+
+def _conversation(Main, phase: str) -> str:
+    cid = f"combined_{id(object()):x}"
+    Main.CONVERSATIONS[cid] = Conversation(
+        persona_ids=["mikko", "aino"],
+        created_at=datetime.now(timezone.utc).isoformat(),
+        messages=MessageLog(),
+    )
+    Main.CONVERSATION_STATES[cid] = PhaseState(phase=phase)
+    return cid
+
+
+class TestParseCombinedReply:
+    """Tests for splitting a combined reply into per-speaker entries."""
+
+    def test_json_list(self):
+        import Main
+
+        text = json.dumps([
+            {"name": "Aino", "content": "沙拉交给我。"},
+            {"name": "Mikko", "content": "我带音响！"},
+        ], ensure_ascii=False)
+        assert Main._parse_combined_reply(text, STUDENTS) == [("aino", "沙拉交给我。"), ("mikko", "我带音响！")]
+
+    def test_think_block_and_code_fence_are_ignored(self):
+        import Main
+
+        text = '<think>先想想</think>```json\n[{"name": "mikko", "content": "Moi!"}]\n```'
+        assert Main._parse_combined_reply(text, STUDENTS) == [("mikko", "Moi!")]
+
+    def test_falls_back_to_dialogue_lines(self):
+        import Main
+
+        text = "Mikko: 今晚七点开始！\nAino：我负责饮料。"
+        assert Main._parse_combined_reply(text, STUDENTS) == [("mikko", "今晚七点开始！"), ("aino", "我负责饮料。")]
+
+    def test_unknown_and_repeated_speakers_dropped(self):
+        import Main
+
+        text = json.dumps([
+            {"name": "Mikko", "content": "第一句"},
+            {"name": "Player", "content": "冒充玩家"},
+            {"name": "Mikko", "content": "第二句"},
+        ], ensure_ascii=False)
+        assert Main._parse_combined_reply(text, STUDENTS) == [("mikko", "第一句")]
+
+    def test_length_guard_applies_per_speaker(self):
+        import Main
+
+        text = json.dumps([{"name": "Aino", "content": "好" * (Main.MAX_REPLY_LENGTH + 50)}])
+        [(_, reply)] = Main._parse_combined_reply(text, STUDENTS)
+        assert len(reply) == Main.MAX_REPLY_LENGTH + 1
+        assert reply.endswith("…")
+
+    def test_garbage_yields_nothing(self):
+        import Main
+
+        assert Main._parse_combined_reply("嗯……", STUDENTS) == []
+
+
+class TestCombinedTurns:
+    """_run_chat_round issues one model call per turn in combined mode."""
+
+    def test_small_talk_single_call(self):
+        import Main
+
+        cid = _conversation(Main, "small_talk")
+        reply_json = json.dumps([
+            {"name": "Aino", "content": "七点见。"},
+            {"name": "Mikko", "content": "我带游戏！"},
+        ], ensure_ascii=False)
+        with patch("personas.ORCHESTRATION_MODE", "combined"), \
+             patch("Main._decide_speaker_order", return_value=["aino", "mikko"]), \
+             patch("Main._run_agent_stream", return_value=_events(reply_json)) as stream:
+            reply = asyncio.run(Main._run_chat_round(cid, ["mikko", "aino"], "几点开始？"))
+
+        assert reply == "Aino: 七点见。\n\nMikko: 我带游戏！"
+        assert stream.await_count == 1
+        messages = Main.CONVERSATIONS[cid].messages
+        assert [(m.role, m.name) for m in messages] == [("user", None), ("model", "Aino"), ("model", "Mikko")]
+
+    def test_unparseable_reply_falls_back_to_per_speaker(self):
+        import Main
+
+        METRICS.reset()
+        cid = _conversation(Main, "small_talk")
+        outputs = [_events("嗯……"), _events("七点见。"), _events("我带游戏！")]
+        with patch("personas.ORCHESTRATION_MODE", "combined"), \
+             patch("Main._decide_speaker_order", return_value=["aino", "mikko"]), \
+             patch("Main._run_agent_stream", side_effect=outputs) as stream:
+            reply = asyncio.run(Main._run_chat_round(cid, ["mikko", "aino"], "几点开始？"))
+
+        assert reply == "Aino: 七点见。\n\nMikko: 我带游戏！"
+        assert stream.await_count == 3
+        assert METRICS.snapshot()["counters"]["combined_fallbacks_total{cast=students}"] == 1
+
+    def test_expert_turn_single_call(self):
+        import Main
+
+        cid = _conversation(Main, "religion_deep")
+        reply_json = json.dumps([
+            {"name": "Mikko", "content": "穆斯林朋友不吃猪肉，也不喝酒。[DONE]"},
+            {"name": "Aino", "content": "那我们准备清真烤鸡吧。"},
+        ], ensure_ascii=False)
+        with patch("personas.ORCHESTRATION_MODE", "combined"), \
+             patch("Main._run_agent_stream", return_value=_events(reply_json)) as stream:
+            reply = asyncio.run(Main._run_chat_round(cid, ["mikko", "aino"], "有清真食品吗？"))
+
+        assert reply == "Mikko: 穆斯林朋友不吃猪肉，也不喝酒。\n\nAino: 那我们准备清真烤鸡吧。"
+        assert stream.await_count == 1
+        names = [m.name for m in Main.CONVERSATIONS[cid].messages if m.role == "model"]
+        assert names == ["宗教禁忌专家", "Aino"]
+
+    def test_per_speaker_mode_unchanged(self):
+        import Main
+
+        cid = _conversation(Main, "small_talk")
+        with patch("Main._decide_speaker_order", return_value=["mikko", "aino"]), \
+             patch("Main._run_agent_stream", side_effect=[_events("Moi!"), _events("Hei!")]) as stream:
+            reply = asyncio.run(Main._run_chat_round(cid, ["mikko", "aino"], "你好"))
+
+        assert reply == "Mikko: Moi!\n\nAino: Hei!"
+        assert stream.await_count == 2
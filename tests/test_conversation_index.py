@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for the time-ordered conversation listing index."""
+
+from conversation_index import ConversationIndex
+
+
+def _index(n: int = 5) -> ConversationIndex:
+    index = ConversationIndex()
+    for i in range(n):
+        index.add(f"c{i}", ["mikko", "aino"] if i % 2 == 0 else ["observer"])
+    return index
+
+
+class TestPaging:
+    """Newest-first pages and cursors."""
+
+    def test_pages_walk_newest_first(self):
+        index = _index(5)
+        first, cursor = index.page(2)
+        assert first == ["c4", "c3"]
+        second, cursor = index.page(2, before=cursor)
+        assert second == ["c2", "c1"]
+        third, cursor = index.page(2, before=cursor)
+        assert third == ["c0"]
+        assert cursor is None
+
+    def test_exact_last_page_has_no_cursor(self):
+        ids, cursor = _index(2).page(2)
+        assert ids == ["c1", "c0"]
+        assert cursor is None
+
+    def test_cursor_survives_deletion(self):
+        index = _index(5)
+        _, cursor = index.page(2)
+        index.remove("c3")
+        index.remove("c2")
+        assert index.page(2, before=cursor)[0] == ["c1", "c0"]
+
+    def test_empty_index(self):
+        assert ConversationIndex().page(10) == ([], None)
+
+
+class TestFilters:
+    """Persona and phase groups, and cached counts."""
+
+    def test_persona_filter(self):
+        index = _index(5)
+        assert index.page(10, persona="mikko")[0] == ["c4", "c2", "c0"]
+        assert index.count(persona="observer") == 2
+
+    def test_phase_moves_between_groups(self):
+        index = _index(3)
+        index.set_phase("c1", "finished")
+        assert index.page(10, phase="finished")[0] == ["c1"]
+        assert index.page(10, phase="small_talk")[0] == ["c2", "c0"]
+        assert index.page(10, persona="observer", phase="finished")[0] == ["c1"]
+        assert index.count(persona="observer", phase="small_talk") == 0
+
+    def test_remove_clears_every_group(self):
+        index = _index(3)
+        index.set_phase("c0", "wrap_up")
+        index.remove("c0")
+        assert "c0" not in index
+        assert index.count(persona="mikko") == 1
+        assert index.counts() == {
+            "total": 2,
+            "players": 0,
+            "by_phase": {"small_talk": 2},
+            "by_persona": {"mikko": 1, "aino": 1, "observer": 1},
+        }
+
+    def test_duplicate_personas_are_indexed_once(self):
+        index = ConversationIndex()
+        index.add("c0", ["mikko", "mikko"])
+        assert index.count(persona="mikko") == 1
+        index.remove("c0")
+        assert len(index) == 0
+
+
+class TestPlayers:
+    """Per-player partitions of every group."""
+
+    def test_player_sees_only_own_conversations(self):
+        index = ConversationIndex()
+        index.add("a0", ["mikko"], player_id="alice")
+        index.add("b0", ["mikko"], player_id="bob")
+        index.add("a1", ["aino"], player_id="alice")
+        assert index.page(10, player_id="alice")[0] == ["a1", "a0"]
+        assert index.page(10, persona="mikko", player_id="bob")[0] == ["b0"]
+        assert index.page(10)[0] == ["a1", "b0", "a0"]
+        assert index.counts()["players"] == 2
+
+    def test_phase_change_moves_player_groups(self):
+        index = ConversationIndex()
+        index.add("a0", ["mikko"], player_id="alice")
+        index.set_phase("a0", "wrap_up")
+        assert index.count(phase="wrap_up", player_id="alice") == 1
+        assert index.count(persona="mikko", phase="small_talk", player_id="alice") == 0
+        index.remove("a0")
+        assert index.counts() == {"total": 0, "players": 0, "by_phase": {}, "by_persona": {}}
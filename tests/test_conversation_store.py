@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for conversation_store compact records."""
+
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+from conversation_store import SPEAKERS, Conversation, Message, MessageLog, PhaseState, SpeakerTable
+
+
+class TestMessageLog:
+    """Tests for the columnar MessageLog."""
+
+    def test_append_and_read_back(self):
+        """Messages appended as records or dicts read back identically."""
+        log = MessageLog()
+        log.append(Message("user", None, "你好"))
+        log.append({"role": "model", "name": "Mikko", "content": "Moi!"})
+
+        assert len(log) == 2
+        assert log[0].to_dict() == {"role": "user", "name": None, "content": "你好"}
+        assert log[1] == Message("model", "Mikko", "Moi!")
+        assert log[-1].name == "Mikko"
+
+    def test_slice_returns_messages(self):
+        """Slicing returns a list of Message records like a list would."""
+        log = MessageLog(Message("model", "Aino", str(i)) for i in range(5))
+        tail = log[3:]
+        assert [m.content for m in tail] == ["3", "4"]
+        assert log[10:] == []
+
+    def test_reversed_and_iteration(self):
+        """Iteration and reversed() walk the log in the expected order."""
+        log = MessageLog(Message("model", "Mikko", str(i)) for i in range(3))
+        assert [m.content for m in log] == ["0", "1", "2"]
+        assert [m.content for m in reversed(log)] == ["2", "1", "0"]
+
+    def test_speaker_names_are_interned(self):
+        """Equal speaker names decode to the same string object."""
+        log = MessageLog()
+        log.append(Message("model", "".join(["Mi", "kko"]), "a"))
+        log.append(Message("model", "".join(["Mik", "ko"]), "b"))
+        assert log[0].name is log[1].name
+        assert SPEAKERS.decode(SPEAKERS.encode("Mikko")) is log[0].name
+
+    def test_message_is_immutable(self):
+        """Message records read back from the log cannot be modified in place."""
+        m = MessageLog([Message("user", None, "hi")])[0]
+        with pytest.raises(AttributeError):
+            m.content = "changed"
+
+    def test_unknown_role_rejected(self):
+        """Unknown roles are rejected instead of silently stored."""
+        with pytest.raises(ValueError):
+            MessageLog().append({"role": "system", "name": None, "content": ""})
+
+    def test_failed_append_leaves_columns_aligned(self):
+        """A speaker id that overflows the array("H") column leaves every column unchanged."""
+        log = MessageLog([Message("model", "Mikko", "a")])
+        with patch.object(SpeakerTable, "encode", return_value=70000), pytest.raises(OverflowError):
+            log.append(Message("model", "Mikko", "b"))
+        with pytest.raises(ValueError):
+            log.append({"role": "system", "name": "Mikko", "content": "c"})
+        assert len(log._roles) == len(log._speakers) == len(log) == 1
+        assert log[-1] == Message("model", "Mikko", "a")
+
+
+class TestPhaseState:
+    """Tests for the compact PhaseState."""
+
+    def test_defaults(self):
+        state = PhaseState()
+        assert state.phase == "small_talk"
+        assert state.religion_discussed is False
+        assert state.allergy_discussed is False
+        assert state.sub_agent_turns == 0
+
+    def test_is_slotted(self):
+        assert not hasattr(PhaseState(), "__dict__")
+
+
+class TestPhaseTransitions:
+    """The state machine reads and writes PhaseState attributes across deep-phase exits."""
+
+    def test_deep_phases_exit_to_small_talk_then_wrap_up(self):
+        import Main
+
+        cid = "phase_transitions"
+        Main.CONVERSATIONS[cid] = Conversation(persona_ids=["mikko", "aino"], created_at="2024-01-01T00:00:00Z")
+        Main.CONVERSATION_STATES[cid] = PhaseState(phase="religion_deep")
+        state = Main.CONVERSATION_STATES[cid]
+
+        async def turns(n):
+            for _ in range(n):
+                await Main._run_chat_round(cid, ["mikko", "aino"], "嗯嗯")
+
+        with patch("Main._expert_respond", new_callable=AsyncMock, return_value="Mikko: 好问题。"), \
+             patch("Main._call_agent", new_callable=AsyncMock, return_value=""):
+            asyncio.run(turns(3))
+            assert (state.phase, state.religion_discussed) == ("small_talk", True)
+
+            state.phase = "allergy_deep"
+            state.sub_agent_turns = 0
+            asyncio.run(turns(3))
+
+        assert (state.phase, state.allergy_discussed) == ("wrap_up", True)
@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for the in-process expert delegation mode (students call experts as AgentTools)."""
+
+import asyncio
+import json
+from unittest.mock import patch
+
+import httpx
+import pytest
+from google.adk.agents.llm_agent import Agent
+from google.adk.models.lite_llm import LiteLlm
+from google.adk.runners import InMemoryRunner
+from google.adk.tools.agent_tool import AgentTool
+from google.genai import types
+
+import delegation
+import http_pool
+from conversation_store import Conversation, MessageLog, PhaseState
+from metrics import METRICS
+
+EXPERT_REPLY = "清真饮食不吃猪肉，也不喝酒。"
+HOST_REPLY = "Selvä! 猪肉和酒都别准备，鸡肉和果汁就很好。"
+
+
+class ScriptedOllama:
+    """A fake Ollama /api/chat: the host asks the expert tool, then answers; the expert just answers.
+
+    The host keeps calling the tool until it has seen `host_tool_calls` tool results
+    (or the cap message) after the latest player message.
+    """
+
+    def __init__(self, endpoint: str, host_tool_calls: int = 1):
+        self.endpoint = endpoint
+        self.host_tool_calls = host_tool_calls
+        self.expert_prompts: list[str] = []
+        self.host_requests = 0
+
+    @staticmethod
+    def _reply(body: dict, message: dict) -> httpx.Response:
+        return httpx.Response(200, json={
+            "model": body["model"],
+            "created_at": "2024-01-01T00:00:00Z",
+            "message": message,
+            "done": True,
+            "prompt_eval_count": 30,
+            "eval_count": 10,
+        })
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        messages = body["messages"]
+        if not body.get("tools"):
+            self.expert_prompts.append(str(messages[-1].get("content")))
+            return self._reply(body, {"role": "assistant", "content": EXPERT_REPLY})
+
+        self.host_requests += 1
+        last_user = max(i for i, m in enumerate(messages) if m["role"] == "user")
+        results = [str(m.get("content")) for m in messages[last_user:] if m["role"] == "tool"]
+        capped = any("已用完" in r for r in results)
+        if len(results) >= self.host_tool_calls or capped:
+            return self._reply(body, {"role": "assistant", "content": HOST_REPLY})
+        return self._reply(body, {
+            "role": "assistant",
+            "content": "",
+            "tool_calls": [{"function": {
+                "name": "agent_religion_expert",
+                "arguments": {"request": "清真饮食有什么禁忌？"},
+            }}],
+        })
+
+    def model(self) -> LiteLlm:
+        pool = http_pool.EndpointPool(self.endpoint, transport=httpx.MockTransport(self.handler))
+        return LiteLlm(
+            model="ollama_chat/qwen3:4b-instruct",
+            api_base=self.endpoint,
+            client=pool.litellm_handler(),
+            num_retries=0,
+        )
+
+
+def _host_runner(fake: ScriptedOllama, max_tool_calls: int = 2) -> InMemoryRunner:
+    expert = Agent(model=fake.model(), name="agent_religion_expert", instruction="你是宗教饮食专家。")
+    host = Agent(
+        model=fake.model(),
+        name="agent_mikko",
+        instruction="你是 Mikko。",
+        tools=[AgentTool(agent=expert)],
+    )
+    plugin = delegation.DelegationPlugin(
+        knowledge_domains={"agent_religion_expert": "religion"}, max_tool_calls=max_tool_calls
+    )
+    return InMemoryRunner(agent=host, app_name="persona_mikko", plugins=[plugin])
+
+
+@pytest.fixture
+def delegated_mode():
+    def install(fake: ScriptedOllama, max_tool_calls: int = 2):
+        runner = _host_runner(fake, max_tool_calls)
+        return patch.multiple(
+            "personas", ORCHESTRATION_MODE="delegation", DELEGATION_RUNNERS={"mikko": runner}
+        )
+    return install
+
+
+def _respond(text: str = "有清真的要求吗？") -> tuple[str, MessageLog]:
+    import Main
+
+    messages = MessageLog()
+    reply = asyncio.run(Main._delegated_expert_respond("deleg_conv", text, messages, "religion_deep"))
+    return reply, messages
+
+
+class TestDelegatedTurn:
+    """One top-level run: the host calls the expert tool and answers in its own voice."""
+
+    # the first LiteLlm completion in the process does its one-time setup synchronously
+    @pytest.mark.allow_blocking
+    def test_host_answers_after_consulting_expert(self, delegated_mode):
+        METRICS.reset()
+        fake = ScriptedOllama("http://deleg-1:11434")
+        with delegated_mode(fake):
+            reply, messages = _respond()
+
+        assert reply == f"Mikko: {HOST_REPLY}"
+        assert [(m.name, m.content) for m in messages] == [("Mikko", HOST_REPLY)]
+        assert fake.host_requests == 2
+        assert len(fake.expert_prompts) == 1
+
+        snap = METRICS.snapshot()
+        counters = snap["counters"]
+        assert snap["histograms"]["agent_call_seconds{persona=mikko}"]["count"] == 1
+        assert counters["delegation_tool_calls_total{tool=agent_religion_expert}"] == 1
+        assert counters["delegation_tokens_total{agent=agent_mikko,kind=prompt}"] == 60
+        assert counters["delegation_tokens_total{agent=agent_religion_expert,kind=completion}"] == 10
+        assert snap["histograms"]["delegation_tool_seconds{tool=agent_religion_expert}"]["count"] == 1
+
+    def test_expert_tool_gets_retrieved_facts(self, delegated_mode):
+        fake = ScriptedOllama("http://deleg-2:11434")
+        with delegated_mode(fake):
+            _respond()
+        assert "【参考资料】" in fake.expert_prompts[0]
+        assert "猪肉" in fake.expert_prompts[0]
+
+    def test_tool_calls_capped_per_turn(self, delegated_mode):
+        METRICS.reset()
+        fake = ScriptedOllama("http://deleg-3:11434", host_tool_calls=5)
+        with delegated_mode(fake, max_tool_calls=2):
+            reply, _ = _respond()
+            # The cap is per turn: the next turn may consult the expert again
+            _respond("斋月要注意什么？")
+
+        assert reply == f"Mikko: {HOST_REPLY}"
+        counters = METRICS.snapshot()["counters"]
+        assert counters["delegation_tool_calls_total{tool=agent_religion_expert}"] == 4
+        assert counters["delegation_tool_calls_capped_total{tool=agent_religion_expert}"] == 2
+        assert len(fake.expert_prompts) == 4
+
+    def test_expert_tokens_count_toward_conversation_budget(self, delegated_mode, monkeypatch):
+        import Main
+        from token_usage import TOKENS
+
+        cid = "deleg_budget"
+        fake = ScriptedOllama("http://deleg-6:11434")
+
+        async def turn():
+            with TOKENS.track(cid, "religion_deep"):
+                await Main._delegated_expert_respond(cid, "有清真的要求吗？", MessageLog(), "religion_deep")
+
+        with delegated_mode(fake):
+            asyncio.run(turn())
+
+        usage = TOKENS.conversation(cid)
+        assert usage["by_persona"]["religion_expert"]["prompt_tokens"] == 30
+        assert usage["by_persona"]["mikko"]["total_tokens"] == 80
+        assert usage["total"]["total_tokens"] == 120
+        # the host alone (80 tokens) would stay under this budget
+        monkeypatch.setattr(TOKENS, "budget", 100)
+        assert TOKENS.budget_action(cid) == "wrap_up"
+        TOKENS.forget(cid)
+
+    def test_turn_usage_accounting(self):
+        fake = ScriptedOllama("http://deleg-4:11434")
+        runner = _host_runner(fake)
+
+        async def main():
+            await runner.session_service.create_session(app_name="persona_mikko", user_id="u", session_id="s")
+            with delegation.track_turn() as usage:
+                async for _ in runner.run_async(
+                    user_id="u", session_id="s",
+                    new_message=types.Content(role="user", parts=[types.Part(text="有清真要求吗？")]),
+                ):
+                    pass
+            return usage
+
+        usage = asyncio.run(main()).to_dict()
+        assert usage["tool_calls"] == 1 and usage["capped"] == 0
+        assert usage["agents"]["agent_mikko"]["calls"] == 2
+        assert usage["agents"]["agent_religion_expert"]["calls"] == 1
+        assert usage["agents"]["agent_religion_expert"]["prompt_tokens"] == 30
+        assert usage["agents"]["agent_religion_expert"]["seconds"] >= 0
+
+    def test_falls_back_to_state_machine_without_reply(self, delegated_mode):
+        import Main
+
+        METRICS.reset()
+        cid = "deleg_fallback"
+        Main.CONVERSATIONS[cid] = Conversation(persona_ids=["mikko", "aino"], created_at="2024-01-01T00:00:00Z")
+        Main.CONVERSATION_STATES[cid] = PhaseState(phase="religion_deep")
+        fake = ScriptedOllama("http://deleg-5:11434")
+        with delegated_mode(fake), \
+             patch("Main._get_reply_from_events", return_value=None), \
+             patch("Main._expert_respond", return_value="Mikko: 专家回答。") as expert, \
+             patch("Main._call_agent", return_value=""):
+            reply = asyncio.run(Main._run_chat_round(cid, ["mikko", "aino"], "清真食品有哪些？"))
+
+        assert expert.await_count == 1
+        assert reply == "Mikko: 专家回答。"
+        assert METRICS.snapshot()["counters"]["delegation_fallbacks_total{phase=religion_deep}"] == 1
+
+
+class TestDelegationRunners:
+    """The delegation runners reuse the registered AgentTools and the hosts' sessions."""
+
+    def test_hosts_share_sessions_and_registered_tools(self):
+        import personas
+        import tools
+
+        for phase, host in personas.DELEGATION_HOSTS.items():
+            runner = personas.DELEGATION_RUNNERS[host]
+            assert runner.session_service is personas.RUNNERS[host].session_service
+            assert runner.app_name == f"persona_{host}"
+            assert runner.agent.tools == [tools.AGENT_TOOLS[pid] for pid in personas.DELEGATION_EXPERTS]
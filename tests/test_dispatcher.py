@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for the consistent-hash ring and the multi-worker dispatcher."""
+
+import asyncio
+import itertools
+import uuid
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+import httpx
+import pytest
+from fastapi import APIRouter, Depends, FastAPI, Header, HTTPException, Response
+
+import http_pool
+from conversation_index import ConversationIndex
+from conversation_store import SPEAKERS
+from dispatcher import Dispatcher, Worker, create_app
+from hash_ring import HashRing
+
+_CLOCK = itertools.count()
+_EPOCH = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+# worker url -> that fake worker's conversation store
+_STORES: dict[str, dict] = {}
+
+_ADMIN_TOKEN = "test-admin-token"
+
+
+def _fake_worker() -> tuple[FastAPI, dict]:
+    """The subset of the Main worker API the dispatcher relies on, backed by a real ConversationIndex."""
+    store: dict[str, dict] = {}
+    index = ConversationIndex()
+
+    def admin(x_admin_token: str = Header(None)):
+        if x_admin_token != _ADMIN_TOKEN:
+            raise HTTPException(403)
+
+    app = FastAPI()
+    admin_routes = APIRouter(dependencies=[Depends(admin)])
+
+    def _add(cid: str, conv: dict) -> None:
+        store[cid] = conv
+        index.add(cid, conv["persona_ids"], created_at=datetime.fromisoformat(conv["created_at"]).timestamp())
+
+    @app.post("/conversations")
+    def create(body: dict, x_conversation_id: str = Header(None), x_player_id: str = Header("godot")):
+        created_at = (_EPOCH + timedelta(seconds=next(_CLOCK))).isoformat()
+        _add(x_conversation_id, {"player_id": x_player_id, "persona_ids": body["persona_ids"],
+                                 "created_at": created_at, "messages": [], "state": None})
+        return {"id": x_conversation_id, "created_at": created_at}
+
+    @app.get("/conversations")
+    def list_(response: Response, limit: int = 50, before: int | None = None):
+        ids, cursor = index.page(limit, before)
+        response.headers["X-Total-Count"] = str(index.count())
+        if cursor is not None:
+            response.headers["X-Next-Cursor"] = str(cursor)
+        return [{"id": cid, "created_at": store[cid]["created_at"]} for cid in ids]
+
+    @app.get("/conversations/{cid}")
+    def get(cid: str):
+        if cid not in store:
+            raise HTTPException(404)
+        return {"id": cid}
+
+    @app.delete("/conversations/{cid}", status_code=204)
+    def delete(cid: str):
+        store.pop(cid, None)
+        index.remove(cid)
+
+    @admin_routes.get("/admin/conversations")
+    def ids():
+        return {"ids": list(store)}
+
+    @admin_routes.get("/admin/conversations/{cid}")
+    def export(cid: str):
+        if cid not in store:
+            raise HTTPException(404)
+        return store[cid]
+
+    @admin_routes.put("/admin/conversations/{cid}", status_code=204)
+    def import_(cid: str, body: dict):
+        _add(cid, body)
+
+    app.include_router(admin_routes)
+
+    @app.get("/turns/{turn_id}")
+    def turn(turn_id: str):
+        if turn_id not in store:
+            raise HTTPException(404)
+        return {"turn_id": turn_id}
+
+    return app, store
+
+
+def _worker_urls(n: int) -> dict[str, str]:
+    urls = {}
+    for i in range(n):
+        url = f"http://w{i}-{uuid.uuid4().hex[:8]}.test"
+        worker, _STORES[url] = _fake_worker()
+        http_pool.pool_for(url, transport=httpx.ASGITransport(app=worker))
+        urls[f"w{i}"] = url
+    return urls
+
+
+def _store(url: str) -> dict:
+    return _STORES[url]
+
+
+async def _create(client, n: int) -> list[str]:
+    ids = []
+    for _ in range(n):
+        r = await client.post("/conversations", json={"persona_ids": ["mikko"]})
+        ids.append(r.json()["id"])
+    return ids
+
+
+class TestHashRing:
+    """Consistent hashing moves only the new worker's share."""
+
+    def test_keys_spread_over_workers(self):
+        ring = HashRing(["w0", "w1", "w2", "w3"])
+        owners = [ring.node_for(f"c{i}") for i in range(4000)]
+        for node in ring.nodes:
+            assert 700 < owners.count(node) < 1300
+
+    def test_adding_a_worker_moves_about_one_in_n(self):
+        ring = HashRing(["w0", "w1", "w2"])
+        bigger = ring.copy()
+        bigger.add("w3")
+        keys = [f"c{i}" for i in range(4000)]
+        moved = [k for k in keys if ring.node_for(k) != bigger.node_for(k)]
+        assert all(bigger.node_for(k) == "w3" for k in moved)
+        assert 0.15 < len(moved) / len(keys) < 0.35
+
+
+class TestDispatcher:
+    """Routing, listing and rebalancing against in-process fake workers."""
+
+    def _run(self, n_workers: int, body):
+        urls = _worker_urls(n_workers)
+
+        async def main():
+            dispatcher = Dispatcher(urls, admin_token=_ADMIN_TOKEN)
+            transport = httpx.ASGITransport(app=create_app(dispatcher))
+            async with httpx.AsyncClient(transport=transport, base_url="http://dispatch") as client:
+                await body(dispatcher, client, urls)
+
+        asyncio.run(main())
+
+    def test_conversations_live_on_their_ring_owner(self):
+        async def body(dispatcher, client, urls):
+            ids = await _create(client, 30)
+            for cid in ids:
+                assert cid in _store(urls[dispatcher.ring.node_for(cid)])
+                assert (await client.get(f"/conversations/{cid}")).status_code == 200
+            assert sum(len(_store(u)) for u in urls.values()) == 30
+
+        self._run(3, body)
+
+    def test_listing_merges_workers_with_cursor(self):
+        async def body(dispatcher, client, urls):
+            ids = await _create(client, 25)
+            seen, cursor = [], None
+            while True:
+                r = await client.get("/conversations", params={"limit": 7, **({"before": cursor} if cursor else {})})
+                assert r.headers["X-Total-Count"] == "25"
+                seen += [c["id"] for c in r.json()]
+                cursor = r.headers.get("X-Next-Cursor")
+                if cursor is None:
+                    break
+            assert seen == ids[::-1]
+
+        self._run(3, body)
+
+    def test_turns_are_found_on_any_worker(self):
+        async def body(dispatcher, client, urls):
+            (cid,) = await _create(client, 1)
+            assert (await client.get(f"/turns/{cid}")).status_code == 200
+            assert (await client.get("/turns/unknown")).status_code == 404
+
+        self._run(2, body)
+
+    def test_adding_a_worker_migrates_its_share(self):
+        async def body(dispatcher, client, urls):
+            ids = await _create(client, 40)
+            new = _worker_urls(1)["w0"]
+            r = await client.post("/dispatcher/workers", json={"name": "w9", "url": new})
+            result = r.json()
+            assert result["conversations"] == 40
+            assert result["failed"] == []
+            assert len(_store(new)) == result["moved"] > 0
+            for cid in ids:
+                owner_url = urls.get(dispatcher.ring.node_for(cid), new)
+                assert cid in _store(owner_url)
+                assert (await client.get(f"/conversations/{cid}")).status_code == 200
+            assert sum(len(_store(u)) for u in [*urls.values(), new]) == 40
+
+        self._run(2, body)
+
+    def test_failed_add_can_be_retried(self):
+        async def body(dispatcher, client, urls):
+            ids = await _create(client, 10)
+            down = f"http://down-{uuid.uuid4().hex[:8]}.test"
+            http_pool.pool_for(down, transport=httpx.MockTransport(lambda request: httpx.Response(503)))
+            healthy = dispatcher.workers["w1"]
+            # listing w1's conversations fails before the ring switch
+            dispatcher.workers["w1"] = Worker("w1", down, _ADMIN_TOKEN)
+            new = _worker_urls(1)["w0"]
+            r = await client.post("/dispatcher/workers", json={"name": "w9", "url": new})
+            assert r.status_code == 502
+            assert "w9" not in dispatcher.workers and dispatcher.ring.nodes == ["w0", "w1"]
+
+            dispatcher.workers["w1"] = healthy
+            r = await client.post("/dispatcher/workers", json={"name": "w9", "url": new})
+            assert r.status_code == 200 and r.json()["failed"] == []
+            for cid in ids:
+                assert (await client.get(f"/conversations/{cid}")).status_code == 200
+
+        self._run(2, body)
+
+    def test_removing_a_worker_drains_it(self):
+        async def body(dispatcher, client, urls):
+            ids = await _create(client, 30)
+            r = await client.delete("/dispatcher/workers/w1")
+            assert r.json()["failed"] == []
+            assert _store(urls["w1"]) == {}
+            for cid in ids:
+                assert (await client.get(f"/conversations/{cid}")).status_code == 200
+            assert (await client.delete("/dispatcher/workers/w0")).status_code == 409
+
+        self._run(2, body)
+
+    def test_migration_waits_for_queued_async_turn(self, admin, mock_generate_initial):
+        """A conversation whose async turn is still queued on a Main worker moves only after the turn."""
+        import Main
+        from turn_jobs import TurnJobPool
+
+        release = asyncio.Event()
+
+        async def slow_round(conversation_id, persona_ids, user_content):
+            await release.wait()
+            Main.CONVERSATIONS[conversation_id].messages.append({"role": "user", "content": user_content})
+            return "Mikko: Moi!"
+
+        main_url = f"http://main-{uuid.uuid4().hex[:8]}.test"
+        http_pool.pool_for(main_url, transport=httpx.ASGITransport(app=Main.app))
+        new_url = _worker_urls(1)["w0"]
+
+        async def main():
+            dispatcher = Dispatcher({"w0": main_url}, admin_token=_ADMIN_TOKEN)
+            transport = httpx.ASGITransport(app=create_app(dispatcher))
+            async with httpx.AsyncClient(transport=transport, base_url="http://dispatch") as client:
+                ids = await _create(client, 20)
+                ring = dispatcher.ring.copy()
+                ring.add("w9")
+                moving = next(cid for cid in ids if ring.node_for(cid) == "w9")
+                staying = next(cid for cid in ids if ring.node_for(cid) == "w0")
+
+                # one pool worker: the turn on `staying` runs, the one on `moving` waits in the queue
+                for cid in (staying, moving):
+                    r = await client.post(f"/conversations/{cid}/messages?async=true", json={"content": "moi"})
+                    assert r.status_code == 202
+                    turn_id = r.json()["turn_id"]
+                await asyncio.sleep(0.05)
+                assert Main.TURN_JOBS.get(turn_id).status == "queued"
+                assert not Main.TURN_GATES.busy(moving)
+
+                adding = asyncio.create_task(client.post("/dispatcher/workers", json={"name": "w9", "url": new_url}))
+                await asyncio.sleep(0.5)
+                assert moving in Main.CONVERSATIONS and moving not in _store(new_url)
+
+                release.set()
+                result = (await adding).json()
+                assert result["failed"] == []
+                assert Main.TURN_JOBS.get(turn_id).status == "done"
+                assert moving not in Main.CONVERSATIONS
+                assert [m["content"] for m in _store(new_url)[moving]["messages"]] == ["moi"]
+                for cid in ids:
+                    if cid in Main.CONVERSATIONS:
+                        await client.delete(f"/conversations/{cid}")
+            await Main.TURN_JOBS.shutdown()
+
+        with patch("Main._run_chat_round", side_effect=slow_round), \
+                patch("Main.TURN_JOBS", TurnJobPool(Main._run_turn_job, workers=1)):
+            asyncio.run(main())
+
+    def test_admin_routes_are_not_proxied(self):
+        async def body(dispatcher, client, urls):
+            (cid,) = await _create(client, 1)
+            headers = {"X-Admin-Token": _ADMIN_TOKEN}
+            for path in ("/admin/conversations", f"/admin/conversations/{cid}", "/admin/profiles"):
+                assert (await client.get(path, headers=headers)).status_code == 404
+            r = await client.put(f"/admin/conversations/{cid}", headers=headers, json={})
+            assert r.status_code == 404
+
+        self._run(2, body)
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    """Configure the worker's admin token and return the header that carries it."""
+    monkeypatch.setattr("Main.ADMIN_TOKEN", _ADMIN_TOKEN)
+    return {"X-Admin-Token": _ADMIN_TOKEN}
+
+
+class TestWorkerAdminRoutes:
+    """The Main endpoints the dispatcher uses to place and migrate conversations."""
+
+    def test_admin_routes_require_the_token(self, client, mock_generate_initial, monkeypatch):
+        cid = client.post("/conversations", json={"persona_ids": ["mikko"]}).json()["id"]
+        paths = ["/admin/conversations", f"/admin/conversations/{cid}"]
+        # no token configured: disabled even for callers that send one
+        monkeypatch.setattr("Main.ADMIN_TOKEN", "")
+        for path in paths:
+            assert client.get(path, headers={"X-Admin-Token": ""}).status_code == 403
+        monkeypatch.setattr("Main.ADMIN_TOKEN", _ADMIN_TOKEN)
+        for headers in ({}, {"X-Admin-Token": "wrong"}):
+            for path in paths:
+                assert client.get(path, headers=headers).status_code == 403
+            assert client.put(paths[1], headers=headers, json={}).status_code == 403
+        assert client.get(paths[1], headers={"X-Admin-Token": _ADMIN_TOKEN}).status_code == 200
+        client.delete(f"/conversations/{cid}")
+
+    def test_dispatcher_assigned_conversation_id(self, client, mock_generate_initial):
+        cid = uuid.uuid4().hex
+        headers = {"X-Conversation-Id": cid}
+        response = client.post("/conversations", json={"persona_ids": ["mikko"]}, headers=headers)
+        assert response.json()["id"] == cid
+        assert client.post("/conversations", json={"persona_ids": ["mikko"]}, headers=headers).status_code == 409
+        bad = {"X-Conversation-Id": "not-a-hex-id"}
+        assert client.post("/conversations", json={"persona_ids": ["mikko"]}, headers=bad).status_code == 400
+        client.delete(f"/conversations/{cid}")
+
+    def test_export_then_import_keeps_conversation_and_order(self, client, mock_generate_initial, admin):
+        import Main
+
+        alice = {"X-Player-Id": "alice"}
+        older = client.post("/conversations", json={"persona_ids": ["mikko"]}, headers=alice).json()["id"]
+        newer = client.post("/conversations", json={"persona_ids": ["mikko"]}, headers=alice).json()["id"]
+        Main.CONVERSATIONS[older].messages.append({"role": "user", "name": None, "content": "moi"})
+        assert older in client.get("/admin/conversations", headers=admin).json()["ids"]
+
+        exported = client.get(f"/admin/conversations/{older}", headers=admin).json()
+        assert exported["player_id"] == "alice"
+        assert client.delete(f"/conversations/{older}", headers=alice).status_code == 204
+        assert client.get(f"/admin/conversations/{older}", headers=admin).status_code == 404
+
+        assert client.put(f"/admin/conversations/{older}", json=exported, headers=admin).status_code == 204
+        restored = client.get(f"/conversations/{older}", headers=alice).json()
+        assert restored["messages"][-1]["content"] == "moi"
+        assert [c["id"] for c in client.get("/conversations", headers=alice).json()] == [newer, older]
+        for cid in (older, newer):
+            client.delete(f"/conversations/{cid}", headers=alice)
+
+    def test_invalid_imports_are_rejected(self, client, admin):
+        import Main
+
+        cid = uuid.uuid4().hex
+        valid = {
+            "player_id": "alice",
+            "persona_ids": ["mikko"],
+            "created_at": _EPOCH.isoformat(),
+            "messages": [{"role": "user", "name": None, "content": "moi"},
+                         {"role": "model", "name": "Mikko", "content": "Moi!"}],
+            "state": {"phase": "small_talk"},
+        }
+        assert client.put("/admin/conversations/not-a-hex-id", json=valid, headers=admin).status_code == 400
+        bad_bodies = [
+            {**valid, "state": {"phase": "small_talk", "unknown": 1}},
+            {**valid, "state": {"phase": "dancing"}},
+            {**valid, "state": {"sub_agent_turns": "many"}},
+            {**valid, "messages": [{"role": "system", "name": None, "content": "x"}]},
+            {**valid, "messages": [{"role": "model", "name": "Somebody Else", "content": "x"}]},
+            {**valid, "persona_ids": ["nobody"]},
+            {**valid, "player_id": "not a player id"},
+            {**valid, "created_at": "yesterday"},
+        ]
+        speakers = len(SPEAKERS)
+        for body in bad_bodies:
+            assert client.put(f"/admin/conversations/{cid}", json=body, headers=admin).status_code == 422, body
+        assert cid not in Main.CONVERSATIONS
+        assert len(SPEAKERS) == speakers
+
+        assert client.put(f"/admin/conversations/{cid}", json=valid, headers=admin).status_code == 204
+        assert [m["name"] for m in client.get(f"/conversations/{cid}", headers={"X-Player-Id": "alice"})
+                .json()["messages"]] == [None, "Mikko"]
+        client.delete(f"/conversations/{cid}", headers={"X-Player-Id": "alice"})
+
+    def test_overwriting_import_drops_stale_adk_sessions(self, client, mock_generate_initial, admin):
+        import Main
+
+        cid = client.post("/conversations", json={"persona_ids": ["mikko"]}).json()["id"]
+        runner = Main.personas.RUNNERS["mikko"]
+        asyncio.run(Main._get_or_create_session(runner, runner.app_name, cid))
+        exported = client.get(f"/admin/conversations/{cid}", headers=admin).json()
+
+        assert client.put(f"/admin/conversations/{cid}", json=exported, headers=admin).status_code == 204
+        session = asyncio.run(runner.session_service.get_session(
+            app_name=runner.app_name, user_id=Main.DEFAULT_PLAYER_ID, session_id=cid
+        ))
+        assert session is None
+        assert cid in Main.CONVERSATIONS
+        client.delete(f"/conversations/{cid}")
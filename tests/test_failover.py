@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for hedged requests, failover and circuit breaking between backends."""
+
+import asyncio
+import json
+from unittest.mock import patch
+
+import httpx
+import pytest
+from google.adk.agents.llm_agent import Agent
+from google.adk.models.lite_llm import LiteLlm
+from google.adk.runners import InMemoryRunner
+from google.genai import types
+
+import failover
+import http_pool
+from metrics import METRICS
+
+
+class FakeOllama:
+    """A local fake Ollama endpoint with a fixed latency (or a failure)."""
+
+    def __init__(self, endpoint: str, reply: str, latency: float = 0.0, fail: bool = False):
+        self.endpoint = endpoint
+        self.reply = reply
+        self.latency = latency
+        self.fail = fail
+        self.started = 0
+        self.completed = 0
+        self.cancelled = 0
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        self.started += 1
+        try:
+            await asyncio.sleep(self.latency)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.fail:
+            return httpx.Response(500, json={"error": "model crashed"})
+        self.completed += 1
+        return httpx.Response(200, json={
+            "model": body["model"],
+            "created_at": "2024-01-01T00:00:00Z",
+            "message": {"role": "assistant", "content": self.reply},
+            "done": True,
+            "prompt_eval_count": 5,
+            "eval_count": 2,
+        })
+
+    def model(self) -> LiteLlm:
+        pool = http_pool.EndpointPool(self.endpoint, transport=httpx.MockTransport(self.handler))
+        return LiteLlm(
+            model="ollama_chat/qwen3:4b-instruct",
+            api_base=self.endpoint,
+            client=pool.litellm_handler(),
+            num_retries=0,
+        )
+
+
+def _hedged(primary: FakeOllama, secondary: FakeOllama) -> failover.HedgedLlm:
+    return failover.HedgedLlm(
+        primary=primary.model(),
+        secondary=secondary.model(),
+        primary_endpoint=primary.endpoint,
+        secondary_endpoint=secondary.endpoint,
+    )
+
+
+async def _ask(model, text: str = "hi") -> str:
+    runner = InMemoryRunner(agent=Agent(model=model, name="hedged", instruction="hi"), app_name="failover_test")
+    await runner.session_service.create_session(app_name="failover_test", user_id="u", session_id="s")
+    parts = []
+    async for evt in runner.run_async(
+        user_id="u", session_id="s",
+        new_message=types.Content(role="user", parts=[types.Part(text=text)]),
+    ):
+        if evt.content and evt.content.parts:
+            parts.extend(p.text for p in evt.content.parts if p.text)
+    return "".join(parts)
+
+
+@pytest.fixture(autouse=True)
+def _fresh_health():
+    failover.HEALTH.clear()
+    METRICS.reset()
+    yield
+    failover.HEALTH.clear()
+
+
+class TestHedging:
+    """A slow primary is hedged to the secondary after the deadline."""
+
+    def test_fast_primary_is_not_hedged(self):
+        primary = FakeOllama("http://fast-a:11434", "from-a", latency=0.01)
+        secondary = FakeOllama("http://fast-b:11434", "from-b", latency=0.01)
+        with patch.object(failover, "HEDGE_DEFAULT_DELAY", 0.5):
+            assert asyncio.run(_ask(_hedged(primary, secondary))) == "from-a"
+        assert secondary.started == 0
+        assert "hedged_requests_total" not in METRICS.snapshot()["counters"]
+
+    def test_slow_primary_hedged_and_loser_cancelled(self):
+        primary = FakeOllama("http://slow:11434", "from-slow", latency=5.0)
+        secondary = FakeOllama("http://quick:11434", "from-quick", latency=0.01)
+
+        async def main():
+            started = asyncio.get_running_loop().time()
+            reply = await _ask(_hedged(primary, secondary))
+            return reply, asyncio.get_running_loop().time() - started
+
+        with patch.object(failover, "HEDGE_DEFAULT_DELAY", 0.1):
+            reply, elapsed = asyncio.run(main())
+
+        assert reply == "from-quick"
+        assert elapsed < 2.0
+        assert primary.cancelled == 1 and primary.completed == 0
+        counters = METRICS.snapshot()["counters"]
+        assert counters["hedged_requests_total"] == 1
+        assert counters["hedge_losers_cancelled_total"] == 1
+        assert counters["backend_responses_total{leg=secondary}"] == 1
+
+    def test_deadline_follows_primary_percentile(self):
+        health = failover.EndpointHealth("http://a")
+        assert health.hedge_delay() == failover.HEDGE_DEFAULT_DELAY
+        for _ in range(failover.HEDGE_MIN_SAMPLES):
+            health.record_success(1.0)
+        health.record_success(2.0)
+        assert 1.0 <= health.hedge_delay() <= 2.0
+
+    def test_primary_error_fails_over_immediately(self):
+        primary = FakeOllama("http://broken:11434", "never", fail=True)
+        secondary = FakeOllama("http://backup:11434", "from-backup", latency=0.01)
+        with patch.object(failover, "HEDGE_DEFAULT_DELAY", 10):
+            assert asyncio.run(_ask(_hedged(primary, secondary))) == "from-backup"
+        counters = METRICS.snapshot()["counters"]
+        assert counters["backend_failovers_total{reason=error}"] == 1
+        assert failover.health_for(primary.endpoint).consecutive_failures == 1
+
+
+class TestCircuitBreaker:
+    """Unhealthy endpoints are taken out of rotation."""
+
+    def test_breaker_opens_and_skips_endpoint(self):
+        primary = FakeOllama("http://flaky:11434", "never", fail=True)
+        secondary = FakeOllama("http://steady:11434", "ok", latency=0.01)
+        model = _hedged(primary, secondary)
+
+        async def main():
+            return [await _ask(model) for _ in range(5)]
+
+        with patch.object(failover, "HEDGE_DEFAULT_DELAY", 10):
+            assert asyncio.run(main()) == ["ok"] * 5
+        # After BREAKER_FAILURE_THRESHOLD failures the primary is no longer tried
+        assert primary.started == failover.BREAKER_FAILURE_THRESHOLD
+        assert failover.health_for(primary.endpoint).state == "open"
+        assert METRICS.snapshot()["counters"]["backend_failovers_total{reason=circuit_open}"] == 2
+
+    def test_half_open_trial_closes_breaker(self):
+        health = failover.EndpointHealth("http://a", failure_threshold=1, reset_seconds=0)
+        health.record_failure(RuntimeError("boom"))
+        assert health.state == "open"
+        assert health.allow() is True
+        assert health.state == "half_open"
+        health.record_success(0.1)
+        assert health.state == "closed"
+
+    def test_failed_trial_reopens(self):
+        health = failover.EndpointHealth("http://a", failure_threshold=3, reset_seconds=60)
+        for _ in range(3):
+            health.record_failure(RuntimeError("boom"))
+        assert health.allow() is False
+        health.opened_at -= 60
+        assert health.allow() is True
+        health.record_failure(RuntimeError("still down"))
+        assert health.state == "open"
+
+    def test_both_down_raises(self):
+        primary = FakeOllama("http://down-a:11434", "never", fail=True)
+        secondary = FakeOllama("http://down-b:11434", "never", fail=True)
+        with pytest.raises(Exception):
+            asyncio.run(_ask(_hedged(primary, secondary)))
+
+
+class TestBackendsInMetrics:
+    """GET /metrics exposes breaker state per endpoint."""
+
+    def test_metrics_include_backends(self, client):
+        failover.health_for("http://fake:11434")
+        data = client.get("/metrics").json()
+        assert data["backends"]["http://fake:11434"]["state"] == "closed"
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for the shared per-endpoint HTTP pool used by LiteLlm models."""
+
+import asyncio
+import json
+
+import httpx
+from google.adk.agents.llm_agent import Agent
+from google.adk.models.lite_llm import LiteLlm
+from google.adk.runners import InMemoryRunner
+from google.genai import types
+
+import http_pool
+
+
+def _fake_ollama(seen):
+    """httpx handler answering Ollama /api/chat requests."""
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        seen.append(body["model"])
+        return httpx.Response(200, json={
+            "model": body["model"],
+            "created_at": "2024-01-01T00:00:00Z",
+            "message": {"role": "assistant", "content": "Moi!"},
+            "done": True,
+            "prompt_eval_count": 5,
+            "eval_count": 2,
+        })
+    return handler
+
+
+async def _ask(model: LiteLlm, text: str) -> str:
+    runner = InMemoryRunner(agent=Agent(model=model, name="pooled", instruction="hi"), app_name="pool_test")
+    await runner.session_service.create_session(app_name="pool_test", user_id="u", session_id="s")
+    parts = []
+    async for evt in runner.run_async(
+        user_id="u", session_id="s",
+        new_message=types.Content(role="user", parts=[types.Part(text=text)]),
+    ):
+        if evt.content and evt.content.parts:
+            parts.extend(p.text for p in evt.content.parts if p.text)
+    return "".join(parts)
+
+
+class TestEndpointPool:
+    """Tests for EndpointPool routing and accounting."""
+
+    def test_models_on_one_endpoint_share_the_pool(self):
+        seen = []
+        pool = http_pool.EndpointPool("http://fake-ollama:11434", transport=httpx.MockTransport(_fake_ollama(seen)))
+        handler = pool.litellm_handler()
+        small = LiteLlm(model="ollama_chat/qwen3:4b-instruct", api_base=pool.endpoint, client=handler)
+        large = LiteLlm(model="ollama_chat/qwen3:8b", api_base=pool.endpoint, client=handler)
+
+        async def main():
+            return await _ask(small, "hi"), await _ask(large, "hi")
+
+        assert asyncio.run(main()) == ("Moi!", "Moi!")
+        assert seen == ["qwen3:4b-instruct", "qwen3:8b"]
+        stats = pool.stats()
+        assert stats["requests"] == 2
+        assert stats["errors"] == 0
+        assert stats["in_flight"] == 0
+
+    def test_errors_are_counted(self):
+        def broken(request):
+            raise httpx.ConnectError("refused", request=request)
+
+        pool = http_pool.EndpointPool("http://down:11434", transport=httpx.MockTransport(broken))
+
+        async def main():
+            try:
+                await pool.client().get("http://down:11434/api/tags")
+            except httpx.ConnectError:
+                pass
+
+        asyncio.run(main())
+        assert pool.stats()["errors"] == 1
+
+    def test_pool_for_normalizes_endpoint(self):
+        a = http_pool.pool_for("http://Example:11434/")
+        b = http_pool.pool_for("http://example:11434")
+        assert a is b
+
+    def test_personas_share_one_client_per_backend(self):
+        import personas
+
+        clients = {id(info["model"]._additional_args["client"]) for info in personas.PERSONAS.values()}
+        assert len(clients) == 1
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for the local expert-knowledge retrieval index."""
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from google.genai import types
+
+from conversation_store import Message, MessageLog
+from knowledge_base import KNOWLEDGE, Fact, KnowledgeIndex, format_facts, tokenize
+
+
+def _ids(hits) -> list[str]:
+    return [fact.id for fact, _ in hits]
+
+
+class TestTokenize:
+    """ASCII words plus CJK character bigrams."""
+
+    def test_mixed_text(self):
+        assert tokenize("无麸质 Tamari 酱油") == ["tamari", "无麸", "麸质", "酱油"]
+
+    def test_single_cjk_char_kept(self):
+        assert tokenize("虾，蟹") == ["虾", "蟹"]
+
+
+class TestKnowledgeIndex:
+    """BM25 ranking, domain filtering and scorer equivalence."""
+
+    def test_bundled_rules_loaded(self):
+        assert len(KNOWLEDGE) >= 40
+        assert {fact.domain for fact in KNOWLEDGE.facts} == {"religion", "allergy"}
+
+    def test_relevant_facts_rank_first(self):
+        assert _ids(KNOWLEDGE.search("有人对花生过敏吗？", domain="allergy", k=2)) == [
+            "peanut-severity", "peanut-hidden",
+        ]
+        assert _ids(KNOWLEDGE.search("斋月怎么安排聚餐", domain="religion", k=1)) == ["ramadan-fasting"]
+
+    def test_domain_filter(self):
+        hits = KNOWLEDGE.search("猪肉和虾能吃吗", domain="allergy", k=10)
+        assert hits and all(fact.domain == "allergy" for fact, _ in hits)
+        assert KNOWLEDGE.search("猪肉", domain="unknown") == []
+
+    def test_no_matching_terms(self):
+        assert KNOWLEDGE.search("？？", domain="allergy") == []
+        assert KnowledgeIndex([]).search("花生") == []
+
+    def test_vectorized_matches_python_scorer(self):
+        for query in ("有人对花生过敏吗？", "无麸质怎么准备", "洁食的肉和奶能一起吃吗"):
+            py = KNOWLEDGE.search(query, k=5, vectorized=False)
+            vec = KNOWLEDGE.search(query, k=5, vectorized=True)
+            assert _ids(py) == _ids(vec)
+            assert [round(s, 4) for _, s in py] == [round(s, 4) for _, s in vec]
+
+    def test_format_facts(self):
+        block = format_facts([Fact("a", "allergy", "花生", "花生过敏很危险。")])
+        assert block.startswith("【参考资料】")
+        assert block.endswith("- 花生过敏很危险。")
+        assert format_facts([]) == ""
+
+
+class TestExpertPrompt:
+    """_expert_respond injects only the retrieved facts into the expert prompt."""
+
+    def _prompt_for(self, question: str, messages: MessageLog) -> str:
+        import Main
+
+        events = [SimpleNamespace(content=types.Content(role="model", parts=[types.Part(text="要看清标签哦。")]))]
+        with patch("Main._run_agent_stream", return_value=events) as stream:
+            asyncio.run(Main._expert_respond(
+                "kb_expert", question, messages,
+                expert_id="allergy_expert", expert_display_name="Aino", phase="allergy_deep",
+            ))
+        return stream.await_args.args[3].parts[0].text
+
+    def test_top_k_facts_in_prompt(self):
+        prompt = self._prompt_for("有人对花生过敏吗？", MessageLog())
+        assert "【参考资料】" in prompt
+        assert "沙爹酱" in prompt
+        assert "清真" not in prompt
+        assert prompt.count("\n- ") == 4
+
+    def test_followup_uses_previous_question(self):
+        messages = MessageLog([Message("user", None, "有人乳糖不耐受"), Message("model", "Aino", "有的。")])
+        prompt = self._prompt_for("嗯嗯", messages)
+        assert "乳糖" in prompt.split("【参考资料】")[1]
+
+    def test_expert_instructions_no_longer_embed_rules(self):
+        import personas
+
+        for pid, domain in (("religion_expert", "religion"), ("allergy_expert", "allergy")):
+            persona = personas.PERSONAS[pid]
+            assert persona["knowledge_domain"] == domain
+            assert "【讨论主题】" not in persona["instruction"]
+            assert "[DONE]" in persona["instruction"]
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for the event-loop lag monitor and blocking-call detector."""
+
+import asyncio
+import time
+
+import pytest
+
+from loop_monitor import LoopBlockedError, LoopMonitor
+from metrics import METRICS
+
+# these tests block their own monitors on purpose
+pytestmark = pytest.mark.allow_blocking
+
+
+def _blocking_helper(seconds: float) -> None:
+    """Synchronous work on the event loop (time.sleep releases the GIL, so the watchdog can look)."""
+    time.sleep(seconds)
+
+
+def _run_monitored(monitor: LoopMonitor, body) -> None:
+    async def main():
+        monitor.start()
+        try:
+            await body()
+        finally:
+            await monitor.stop()
+
+    asyncio.run(main())
+
+
+class TestLoopMonitor:
+    """Lag measurement and block capture."""
+
+    def test_block_is_recorded_with_stack(self):
+        monitor = LoopMonitor(interval_ms=10, threshold_ms=50, strict=False)
+
+        async def body():
+            await asyncio.sleep(0.03)
+            _blocking_helper(0.2)
+            await asyncio.sleep(0.03)
+
+        _run_monitored(monitor, body)
+        assert len(monitor.blocks) == 1
+        block = monitor.blocks[0]
+        assert block.seconds >= 0.2
+        assert "_blocking_helper" in block.where
+        assert any("body" in frame for frame in block.stack)
+        assert not any("events.py" in frame for frame in block.stack)
+        assert monitor.snapshot()["recent_blocks"][0]["ms"] >= 200
+
+    def test_lag_reaches_histogram(self):
+        METRICS.reset()
+        monitor = LoopMonitor(interval_ms=5, threshold_ms=1000, strict=False)
+
+        async def body():
+            await asyncio.sleep(0.05)
+
+        _run_monitored(monitor, body)
+        snap = METRICS.snapshot()
+        assert snap["histograms"]["event_loop_lag_seconds"]["count"] >= 3
+        assert "event_loop_blocks_total{cause=code}" not in snap["counters"]
+        assert list(monitor.blocks) == []
+
+    def test_short_pauses_are_not_blocks(self):
+        monitor = LoopMonitor(interval_ms=10, threshold_ms=100, strict=False)
+
+        async def body():
+            for _ in range(5):
+                _blocking_helper(0.01)
+                await asyncio.sleep(0)
+
+        _run_monitored(monitor, body)
+        assert list(monitor.blocks) == []
+        assert monitor.max_lag > 0
+
+    def test_block_without_await_is_caught_on_stop(self):
+        monitor = LoopMonitor(interval_ms=10, threshold_ms=50, strict=False)
+
+        async def body():
+            _blocking_helper(0.1)
+
+        _run_monitored(monitor, body)
+        assert len(monitor.blocks) == 1
+
+
+class TestStrictMode:
+    """LOOP_MONITOR_STRICT turns blocks into errors."""
+
+    def test_strict_mode_raises(self):
+        monitor = LoopMonitor(interval_ms=10, threshold_ms=50, strict=True)
+
+        async def body():
+            _blocking_helper(0.1)
+            await asyncio.sleep(0.02)
+
+        _run_monitored(monitor, body)
+        with pytest.raises(LoopBlockedError, match="_blocking_helper"):
+            monitor.raise_if_blocked()
+        monitor.raise_if_blocked()  # violations are cleared once reported
+
+    def test_lenient_mode_only_records(self):
+        monitor = LoopMonitor(interval_ms=10, threshold_ms=50, strict=False)
+
+        async def body():
+            _blocking_helper(0.1)
+            await asyncio.sleep(0.02)
+
+        _run_monitored(monitor, body)
+        monitor.raise_if_blocked()
+        assert len(monitor.blocks) == 1
+
+
+class TestMetricsEndpoint:
+    """The monitor's state is exposed on /metrics."""
+
+    def test_metrics_include_event_loop(self, client):
+        body = client.get("/metrics").json()
+        assert body["event_loop"]["threshold_ms"] > 0
+        assert "recent_blocks" in body["event_loop"]
@@ -6,6 +6,7 @@ Tests cover:
 - POST /conversations
 - GET /conversations
 - GET /conversations/{id}
+- DELETE /conversations/{id} and eviction
 - GET /conversations/{id}/messages
 - POST /conversations/{id}/messages
 - Message filtering (_strip_thinking)
@@ -17,22 +18,6 @@ import pytest
 from unittest.mock import AsyncMock, patch, MagicMock
 
 
-@pytest.fixture
-def mock_generate_initial():
-    """Mock _generate_group_initial_messages to avoid hitting Ollama."""
-    with patch('Main._generate_group_initial_messages', new_callable=AsyncMock) as mock:
-        mock.return_value = []
-        yield mock
-
-
-@pytest.fixture
-def mock_run_chat():
-    """Mock _run_chat_round to avoid hitting Ollama."""
-    with patch('Main._run_chat_round', new_callable=AsyncMock) as mock:
-        mock.return_value = "[芬兰学生讨论组] Moi!"
-        yield mock
-
-
 class TestGetPersonas:
     """Tests for GET /personas endpoint."""
 
@@ -318,6 +303,145 @@ class TestConversationIsolation:
         assert response.status_code == 404
 
 
+
+class TestDeleteConversation:
+    """Tests for DELETE /conversations/{id} and MAX_CONVERSATIONS eviction."""
+
+    def test_delete_releases_all_state(self, client, mock_generate_initial):
+        """DELETE frees the conversation from every per-conversation store."""
+        import Main
+
+        conv_id = client.post("/conversations", json={"persona_ids": ["mikko", "aino"]}).json()["id"]
+        Main.CONVERSATION_STATES[conv_id] = Main.PhaseState()
+        Main.TURN_GATES.get(conv_id)
+        Main.TOKENS._conversations[conv_id] = object()
+        Main.TRACES._turns[conv_id] = []
+
+        response = client.delete(f"/conversations/{conv_id}")
+        assert response.status_code == 204
+        assert conv_id not in Main.CONVERSATIONS
+        assert conv_id not in Main.CONVERSATION_STATES
+        assert conv_id not in Main.TURN_GATES._gates
+        assert conv_id not in Main.TOKENS._conversations
+        assert conv_id not in Main.TRACES._turns
+        assert client.get(f"/conversations/{conv_id}").status_code == 404
+
+    def test_delete_removes_adk_sessions(self, client, mock_generate_initial):
+        """The conversation's ADK sessions are deleted from every session service."""
+        import asyncio
+
+        import Main
+
+        conv_id = client.post("/conversations", json={"persona_ids": ["mikko", "aino"]}).json()["id"]
+        runner = Main.personas.RUNNERS["mikko"]
+        asyncio.run(Main._get_or_create_session(runner, runner.app_name, conv_id))
+
+        client.delete(f"/conversations/{conv_id}")
+        session = asyncio.run(runner.session_service.get_session(
+            app_name=runner.app_name, user_id=Main.DEFAULT_PLAYER_ID, session_id=conv_id
+        ))
+        assert session is None
+
+    def test_delete_nonexistent_conversation(self, client):
+        """DELETE for an unknown conversation returns 404."""
+        assert client.delete("/conversations/nonexistent-id").status_code == 404
+
+    def test_delete_busy_conversation_returns_409(self, client, mock_generate_initial):
+        """A conversation with a turn in progress cannot be deleted."""
+        import Main
+
+        conv_id = client.post("/conversations", json={"persona_ids": ["mikko", "aino"]}).json()["id"]
+        with patch.object(Main.TURN_GATES, "busy", return_value=True):
+            assert client.delete(f"/conversations/{conv_id}").status_code == 409
+        assert conv_id in Main.CONVERSATIONS
+
+    def test_oldest_idle_conversations_are_evicted(self, client, mock_generate_initial):
+        """Creating past MAX_CONVERSATIONS evicts the oldest idle conversations."""
+        import Main
+
+        for cid in list(Main.CONVERSATIONS):
+            Main.CONVERSATIONS.pop(cid)
+            Main.CONVERSATION_INDEX.remove(cid)
+        with patch("Main.MAX_CONVERSATIONS", 2):
+            ids = [client.post("/conversations", json={"persona_ids": ["mikko", "aino"]}).json()["id"]
+                   for _ in range(3)]
+            assert list(Main.CONVERSATIONS) == ids[1:]
+
+            # a busy conversation is skipped; the next idle one goes instead
+            with patch.object(Main.TURN_GATES, "busy", side_effect=lambda cid: cid == ids[1]):
+                newest = client.post("/conversations", json={"persona_ids": ["mikko", "aino"]}).json()["id"]
+            assert list(Main.CONVERSATIONS) == [ids[1], newest]
+
+    def test_conversation_with_queued_async_turn_is_not_evicted(self, client, mock_generate_initial):
+        """Conversations whose async turns are queued or running in TURN_JOBS count as busy."""
+        import asyncio
+
+        import Main
+        from turn_jobs import TurnJobPool
+
+        for cid in list(Main.CONVERSATIONS):
+            Main.CONVERSATIONS.pop(cid)
+            Main.CONVERSATION_INDEX.remove(cid)
+        ids = [client.post("/conversations", json={"persona_ids": ["mikko", "aino"]}).json()["id"]
+               for _ in range(3)]
+
+        async def main():
+            release = asyncio.Event()
+
+            async def execute(job):
+                await release.wait()
+                return {}
+
+            pool = TurnJobPool(execute, workers=1)
+            pool.submit(ids[0], "running")
+            pool.submit(ids[1], "queued")
+            await asyncio.sleep(0)
+            with patch("Main.TURN_JOBS", pool), patch("Main.MAX_CONVERSATIONS", 1):
+                await Main._evict_conversations(keep=ids[2])
+            release.set()
+            await pool.shutdown()
+
+        asyncio.run(main())
+        assert list(Main.CONVERSATIONS) == ids
+
+    def test_conversation_awaiting_its_opening_is_not_evicted(self, client):
+        """A conversation still generating its opening is busy for other requests' eviction."""
+        import asyncio
+
+        import Main
+
+        for cid in list(Main.CONVERSATIONS):
+            Main.CONVERSATIONS.pop(cid)
+            Main.CONVERSATION_INDEX.remove(cid)
+
+        async def main():
+            release = asyncio.Event()
+
+            async def opening(persona_ids, conversation_id):
+                await release.wait()
+                return []
+
+            def create():
+                return Main.create_conversation(
+                    Main.CreateConversationReq(persona_ids=["mikko", "aino"]),
+                    player_id=Main.DEFAULT_PLAYER_ID, conversation_id=None,
+                )
+
+            with patch("Main._generate_group_initial_messages", side_effect=opening), \
+                    patch("Main.MAX_CONVERSATIONS", 1):
+                first = asyncio.ensure_future(create())
+                await asyncio.sleep(0.01)
+                (creating,) = Main.CONVERSATIONS
+                second = asyncio.ensure_future(create())
+                await asyncio.sleep(0.01)
+                assert creating in Main.CONVERSATIONS
+                release.set()
+                return creating, (await first).id, (await second).id
+
+        creating, first, second = asyncio.run(main())
+        assert creating == first
+        assert first in Main.CONVERSATIONS and second in Main.CONVERSATIONS
+
 class TestGetConversationMessages:
     """Tests for GET /conversations/{id}/messages endpoint."""
 
@@ -369,6 +493,42 @@ class TestGetConversationsList:
             assert "created_at" in item
             assert "message_count" in item
 
+    def test_cursor_pagination(self, client, mock_generate_initial):
+        """limit / before walk the list newest first; headers carry the total and next cursor."""
+        ids = [client.post("/conversations", json={"persona_ids": ["mikko", "aino"]}).json()["id"]
+               for _ in range(3)]
+
+        first = client.get("/conversations?limit=2")
+        assert [c["id"] for c in first.json()] == ids[::-1][:2]
+        assert int(first.headers["X-Total-Count"]) >= 3
+        cursor = first.headers["X-Next-Cursor"]
+
+        second = client.get(f"/conversations?limit=2&before={cursor}")
+        assert second.json()[0]["id"] == ids[0]
+
+    def test_filter_by_persona_and_phase(self, client, mock_generate_initial):
+        """persona and phase filters use the index groups."""
+        import Main
+
+        solo = client.post("/conversations", json={"persona_ids": ["observer"]}).json()["id"]
+        Main.CONVERSATION_INDEX.set_phase(solo, "finished")
+
+        by_persona = client.get("/conversations?persona=observer&phase=finished")
+        assert solo in [c["id"] for c in by_persona.json()]
+        assert all("observer" in c["persona_ids"] for c in by_persona.json())
+        assert solo not in [c["id"] for c in client.get("/conversations?phase=small_talk&limit=500").json()]
+
+    def test_deleted_conversations_leave_the_list(self, client, mock_generate_initial):
+        """DELETE removes the conversation from the listing index."""
+        conv_id = client.post("/conversations", json={"persona_ids": ["mikko", "aino"]}).json()["id"]
+        client.delete(f"/conversations/{conv_id}")
+        assert conv_id not in [c["id"] for c in client.get("/conversations?limit=500").json()]
+
+    def test_limit_is_bounded(self, client):
+        """limit outside 1..500 is rejected."""
+        assert client.get("/conversations?limit=0").status_code == 422
+        assert client.get("/conversations?limit=501").status_code == 422
+
 
 class TestRootEndpoint:
     """Tests for GET / root endpoint."""
@@ -381,3 +541,18 @@ class TestRootEndpoint:
         assert "message" in data
         assert "endpoints" in data
         assert isinstance(data["endpoints"], list)
+
+
+class TestMetricsEndpoint:
+    """Tests for GET /metrics endpoint."""
+
+    def test_metrics_snapshot_structure(self, client):
+        """GET /metrics returns counters, gauges and histograms."""
+        from metrics import METRICS
+
+        METRICS.inc("test_events_total", kind="unit")
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        data = response.json()
+        assert {"counters", "gauges", "histograms", "http_pools"} <= set(data)
+        assert data["counters"]["test_events_total{kind=unit}"] >= 1
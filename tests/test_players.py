@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for player identity, per-player quotas and player-sharded ADK sessions."""
+
+import asyncio
+
+import pytest
+
+from players import DEFAULT_PLAYER_ID, PlayerQuotaExceeded, PlayerQuotas, resolve_player_id
+from session_shards import ShardedSessionService, shard_of
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class TestResolvePlayerId:
+    """X-Player-Id parsing."""
+
+    def test_missing_header_is_default_player(self):
+        assert resolve_player_id(None) == DEFAULT_PLAYER_ID
+        assert resolve_player_id("  ") == DEFAULT_PLAYER_ID
+
+    def test_invalid_id_is_rejected(self):
+        with pytest.raises(ValueError):
+            resolve_player_id("bad id with spaces")
+        with pytest.raises(ValueError):
+            resolve_player_id("x" * 65)
+
+
+class TestPlayerQuotas:
+    """Concurrent-turn and conversations-per-hour limits."""
+
+    def test_concurrent_turns(self):
+        quotas = PlayerQuotas(max_turns=2)
+        quotas.acquire_turn("alice")
+        quotas.acquire_turn("alice")
+        with pytest.raises(PlayerQuotaExceeded) as exc:
+            quotas.acquire_turn("alice")
+        assert exc.value.quota == "concurrent_turns"
+        quotas.acquire_turn("bob")  # other players are unaffected
+        quotas.release_turn("alice")
+        quotas.acquire_turn("alice")
+
+    def test_turn_counts_are_dropped_when_idle(self):
+        quotas = PlayerQuotas(max_turns=1)
+        with quotas.turn("alice"):
+            assert quotas.active_turns("alice") == 1
+        assert quotas.snapshot()["players_with_active_turns"] == 0
+
+    def test_conversations_per_hour_window_slides(self):
+        clock = _Clock()
+        quotas = PlayerQuotas(max_conversations_per_hour=2, clock=clock)
+        quotas.admit_conversation("alice")
+        clock.now += 600
+        quotas.admit_conversation("alice")
+        with pytest.raises(PlayerQuotaExceeded) as exc:
+            quotas.admit_conversation("alice")
+        assert exc.value.retry_after == pytest.approx(3000)
+        clock.now += 3000
+        quotas.admit_conversation("alice")
+
+    def test_expired_players_are_forgotten(self):
+        clock = _Clock()
+        quotas = PlayerQuotas(max_conversations_per_hour=5, clock=clock)
+        for i in range(100):
+            quotas.admit_conversation(f"p{i}")
+        clock.now += 3601
+        quotas.admit_conversation("late")
+        assert quotas.snapshot()["players_in_window"] == 1
+
+
+class TestShardedSessionService:
+    """Sessions are stored in the shard picked by the player id."""
+
+    def test_sessions_live_in_the_players_shard(self):
+        service = ShardedSessionService(shards=4)
+
+        async def body():
+            await service.create_session(app_name="app", user_id="alice", session_id="s1")
+            assert await service.get_session(app_name="app", user_id="alice", session_id="s1") is not None
+            assert await service.get_session(app_name="app", user_id="bob", session_id="s1") is None
+            listed = await service.list_sessions(app_name="app", user_id="alice")
+            assert [s.id for s in listed.sessions] == ["s1"]
+
+        asyncio.run(body())
+        assert service.sizes()[shard_of("alice", 4)] == 1
+        assert sum(service.sizes()) == 1
+
+    def test_delete_drops_empty_player_bucket(self):
+        service = ShardedSessionService(shards=4)
+
+        async def body():
+            await service.create_session(app_name="app", user_id="alice", session_id="s1")
+            await service.delete_session(app_name="app", user_id="alice", session_id="s1")
+            await service.delete_session(app_name="app", user_id="nobody", session_id="s1")
+
+        asyncio.run(body())
+        assert sum(service.sizes()) == 0
+
+
+class TestPlayerRoutes:
+    """X-Player-Id on the conversation routes."""
+
+    def test_conversations_are_private_to_their_player(self, client, mock_generate_initial):
+        alice = {"X-Player-Id": "alice"}
+        conv_id = client.post("/conversations", json={"persona_ids": ["mikko"]}, headers=alice).json()["id"]
+
+        assert client.get(f"/conversations/{conv_id}", headers=alice).status_code == 200
+        assert client.get(f"/conversations/{conv_id}", headers={"X-Player-Id": "bob"}).status_code == 404
+        assert client.get(f"/conversations/{conv_id}").status_code == 404
+        assert client.delete(f"/conversations/{conv_id}", headers={"X-Player-Id": "bob"}).status_code == 404
+
+        ids = [c["id"] for c in client.get("/conversations", headers=alice).json()]
+        assert ids == [conv_id]
+        assert conv_id not in [c["id"] for c in client.get("/conversations?limit=500").json()]
+
+    def test_agent_sessions_use_the_player_id(self, client, mock_generate_initial):
+        import Main
+
+        conv_id = client.post(
+            "/conversations", json={"persona_ids": ["mikko"]}, headers={"X-Player-Id": "carol"}
+        ).json()["id"]
+        runner = Main.personas.RUNNERS["mikko"]
+        asyncio.run(Main._get_or_create_session(runner, runner.app_name, conv_id))
+        session = asyncio.run(runner.session_service.get_session(
+            app_name=runner.app_name, user_id="carol", session_id=conv_id
+        ))
+        assert session is not None
+        client.delete(f"/conversations/{conv_id}", headers={"X-Player-Id": "carol"})
+
+    def test_invalid_player_id_is_rejected(self, client):
+        assert client.get("/conversations", headers={"X-Player-Id": "no spaces please"}).status_code == 400
+
+    def test_conversation_rate_limit_returns_429(self, client, mock_generate_initial, monkeypatch):
+        import Main
+
+        monkeypatch.setattr(Main, "PLAYER_QUOTAS", PlayerQuotas(max_conversations_per_hour=1))
+        dave = {"X-Player-Id": "dave"}
+        assert client.post("/conversations", json={"persona_ids": ["mikko"]}, headers=dave).status_code == 200
+        response = client.post("/conversations", json={"persona_ids": ["mikko"]}, headers=dave)
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) > 0
+
+    def test_concurrent_turn_limit_returns_429(self, client, mock_generate_initial, mock_run_chat, monkeypatch):
+        import Main
+
+        quotas = PlayerQuotas(max_turns=1)
+        monkeypatch.setattr(Main, "PLAYER_QUOTAS", quotas)
+        erin = {"X-Player-Id": "erin"}
+        conv_id = client.post("/conversations", json={"persona_ids": ["mikko"]}, headers=erin).json()["id"]
+
+        quotas.acquire_turn("erin")  # a turn already in progress elsewhere
+        response = client.post(f"/conversations/{conv_id}/messages", json={"content": "moi"}, headers=erin)
+        assert response.status_code == 429
+        quotas.release_turn("erin")
+
+        response = client.post(f"/conversations/{conv_id}/messages", json={"content": "moi"}, headers=erin)
+        assert response.status_code == 200
+        assert quotas.active_turns("erin") == 0
+
+    def test_async_turn_holds_its_slot_until_done(self, client, mock_generate_initial, mock_run_chat, monkeypatch):
+        import Main
+
+        quotas = PlayerQuotas(max_turns=1)
+        monkeypatch.setattr(Main, "PLAYER_QUOTAS", quotas)
+        frank = {"X-Player-Id": "frank"}
+        conv_id = client.post("/conversations", json={"persona_ids": ["mikko"]}, headers=frank).json()["id"]
+
+        with client:
+            response = client.post(f"/conversations/{conv_id}/messages?async=true", json={"content": "moi"}, headers=frank)
+            turn_id = response.json()["turn_id"]
+            assert client.get(f"/turns/{turn_id}", headers={"X-Player-Id": "bob"}).status_code == 404
+            assert client.get(f"/turns/{turn_id}?wait=5", headers=frank).json()["status"] == "done"
+        assert quotas.active_turns("frank") == 0
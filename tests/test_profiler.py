@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for the per-request sampling profiler."""
+
+import asyncio
+import time
+
+import pytest
+
+from profiler import SamplingProfiler
+
+
+def _busy_work(seconds: float) -> int:
+    """CPU-bound work that holds the event loop."""
+    deadline = time.perf_counter() + seconds
+    n = 0
+    while time.perf_counter() < deadline:
+        n += 1
+    return n
+
+
+async def _child_work(seconds: float) -> int:
+    await asyncio.sleep(0)
+    return _busy_work(seconds)
+
+
+def _profiler(**kwargs) -> SamplingProfiler:
+    kwargs.setdefault("interval_ms", 1)
+    return SamplingProfiler(**kwargs)
+
+
+class TestSamplingProfiler:
+    """Sampling, attribution and retention."""
+
+    @pytest.mark.allow_blocking
+    def test_samples_land_in_folded_stacks(self):
+        profiler = _profiler()
+
+        async def main():
+            with profiler.profiling("turn", "req-1") as profile:
+                _busy_work(0.1)
+            return profile
+
+        profile = asyncio.run(main())
+        assert profile.samples > 0
+        assert profile.duration >= 0.1
+        lines = profile.folded().splitlines()
+        assert any("_busy_work" in line for line in lines)
+        # folded format: "root;...;leaf count"; asyncio loop frames are trimmed
+        stack, count = lines[0].rsplit(" ", 1)
+        assert int(count) > 0
+        assert "base_events.py" not in stack
+        assert profiler.get("req-1") is profile
+
+    def test_child_tasks_are_attributed_to_request(self):
+        profiler = _profiler()
+
+        async def main():
+            with profiler.profiling("turn") as profile:
+                await asyncio.gather(asyncio.create_task(_child_work(0.08)), asyncio.sleep(0.02))
+            return profile
+
+        profile = asyncio.run(main())
+        assert any("_child_work" in line for line in profile.folded().splitlines())
+
+    def test_other_requests_and_idle_time_are_excluded(self):
+        profiler = _profiler()
+
+        async def other_player():
+            await asyncio.sleep(0.01)
+            _busy_work(0.08)
+
+        async def main():
+            noisy = asyncio.create_task(other_player())
+            with profiler.profiling("turn") as profile:
+                await asyncio.sleep(0.15)
+            await noisy
+            return profile
+
+        profile = asyncio.run(main())
+        assert profile.samples == 0
+        assert profile.other > 0
+        assert profile.idle > 0
+        assert "_busy_work" not in profile.folded()
+
+    @pytest.mark.allow_blocking
+    def test_keeps_only_slowest_and_recent(self):
+        profiler = _profiler(keep_recent=2, keep_slowest=2)
+
+        async def main():
+            for i, seconds in enumerate([0.1, 0.0, 0.15, 0.0]):
+                with profiler.profiling("turn", f"r{i}"):
+                    _busy_work(seconds)
+
+        asyncio.run(main())
+        assert [p.id for p in profiler.slowest()] == ["r2", "r0"]
+        snapshot = profiler.snapshot()
+        assert snapshot["recent"] == ["r3", "r2"]
+        assert profiler.get("r0") is not None  # still held as one of the slowest
+        assert profiler.get("r1") is None
+
+    def test_header_and_sample_rate(self):
+        assert _profiler().wanted({"x-profile": "1"})
+        assert not _profiler().wanted({})
+        assert _profiler(sample_rate=1.0).wanted({})
+
+
+class TestProfileApi:
+    """Profiling through the HTTP middleware and admin endpoints."""
+
+    def test_header_profiles_create_conversation(self, client, mock_generate_initial):
+        response = client.post("/conversations", json={"persona_ids": ["mikko", "aino"]}, headers={"X-Profile": "1"})
+        assert response.status_code == 200
+        request_id = response.headers["x-profile-id"]
+
+        profile = client.get(f"/admin/profiles/{request_id}")
+        assert profile.status_code == 200
+        assert profile.headers["content-type"].startswith("text/plain")
+        listing = client.get("/admin/profiles").json()
+        assert request_id in listing["recent"]
+
+    def test_request_id_header_is_reused(self, client, mock_generate_initial):
+        response = client.post(
+            "/conversations",
+            json={"persona_ids": ["mikko", "aino"]},
+            headers={"X-Profile": "1", "X-Request-Id": "trace-abc"},
+        )
+        assert response.headers["x-profile-id"] == "trace-abc"
+
+    def test_unprofiled_requests_have_no_profile_id(self, client, mock_generate_initial):
+        response = client.post("/conversations", json={"persona_ids": ["mikko", "aino"]})
+        assert "x-profile-id" not in response.headers
+        assert client.get("/admin/profiles/missing").status_code == 404
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for the exact-match response cache."""
+
+import asyncio
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from google.adk.agents.llm_agent import Agent
+from google.genai import types
+
+from conversation_store import Conversation, Message, MessageLog
+from metrics import METRICS
+from response_cache import ResponseCache, cache_key
+
+
+def _events(text: str) -> list:
+    return [SimpleNamespace(content=types.Content(role="model", parts=[types.Part(text=text)]))]
+
+
+def _agent(instruction="你是 Mikko。", model="ollama_chat/qwen3:4b-instruct", **config):
+    from google.adk.models.lite_llm import LiteLlm
+
+    return Agent(name="agent_test", instruction=instruction, model=LiteLlm(model=model, **config))
+
+
+@pytest.fixture
+def fresh_cache():
+    cache = ResponseCache(max_entries=16, ttl=3600, directory="")
+    with patch("Main.RESPONSE_CACHE", cache):
+        yield cache
+
+
+class TestCacheKey:
+    """Keys cover persona, model, instruction, prompt and sampling params."""
+
+    def test_key_components(self):
+        base = cache_key("mikko", _agent(), "Moi")
+        assert cache_key("mikko", _agent(), "Moi") == base
+        assert cache_key("aino", _agent(), "Moi") != base
+        assert cache_key("mikko", _agent(model="ollama_chat/qwen3:8b"), "Moi") != base
+        assert cache_key("mikko", _agent(instruction="你是 Aino。"), "Moi") != base
+        assert cache_key("mikko", _agent(), "Hei") != base
+        assert cache_key("mikko", _agent(temperature=0.2), "Moi") != base
+
+    def test_unrelated_client_args_do_not_change_key(self):
+        assert cache_key("mikko", _agent(api_base="http://a"), "Moi") == cache_key("mikko", _agent(), "Moi")
+
+
+class TestResponseCache:
+    """Tests for the LRU, TTL and disk tiers."""
+
+    def test_lru_eviction(self):
+        cache = ResponseCache(max_entries=2, ttl=60, directory="")
+
+        async def main():
+            await cache.put("a", "A")
+            await cache.put("b", "B")
+            assert await cache.get("a", "mikko") == "A"
+            await cache.put("c", "C")
+            return await cache.get("b", "mikko"), await cache.get("a", "mikko")
+
+        assert asyncio.run(main()) == (None, "A")
+        assert len(cache) == 2
+
+    def test_ttl_expiry(self):
+        cache = ResponseCache(max_entries=4, ttl=10, directory="")
+        with patch("response_cache.time.time", return_value=1000.0):
+            asyncio.run(cache.put("a", "A"))
+        with patch("response_cache.time.time", return_value=1005.0):
+            assert asyncio.run(cache.get("a", "mikko")) == "A"
+        with patch("response_cache.time.time", return_value=1011.0):
+            assert asyncio.run(cache.get("a", "mikko")) is None
+        assert len(cache) == 0
+
+    def test_disk_tier_survives_restart(self, tmp_path):
+        METRICS.reset()
+        asyncio.run(ResponseCache(directory=str(tmp_path)).put("k" * 64, "Moi!"))
+        restarted = ResponseCache(directory=str(tmp_path))
+        assert asyncio.run(restarted.get("k" * 64, "mikko")) == "Moi!"
+        assert asyncio.run(restarted.get("k" * 64, "mikko")) == "Moi!"
+        counters = METRICS.snapshot()["counters"]
+        assert counters["response_cache_hits_total{persona=mikko,tier=disk}"] == 1
+        assert counters["response_cache_hits_total{persona=mikko,tier=memory}"] == 1
+
+    def test_expired_disk_entries_removed(self, tmp_path):
+        cache = ResponseCache(ttl=10, directory=str(tmp_path))
+        with patch("response_cache.time.time", return_value=1000.0):
+            asyncio.run(cache.put("k" * 64, "Moi!"))
+        cache._memory.clear()
+        with patch("response_cache.time.time", return_value=2000.0):
+            assert asyncio.run(cache.get("k" * 64, "mikko")) is None
+        assert list(tmp_path.glob("*/*.json")) == []
+
+
+class TestCachedCalls:
+    """The cache sits underneath _call_agent and the observer."""
+
+    def test_fixed_openers_hit_cache(self, fresh_cache):
+        import Main
+
+        METRICS.reset()
+        with patch("Main._run_agent_stream", side_effect=[_events("Moi! 今晚几点？"), _events("Selvä! 七点吧。")]) as stream:
+            first = asyncio.run(Main._generate_group_initial_messages(["mikko", "aino"], "cache_open_1"))
+            second = asyncio.run(Main._generate_group_initial_messages(["mikko", "aino"], "cache_open_2"))
+
+        assert stream.await_count == 2
+        assert first.to_dicts() == second.to_dicts()
+        counters = METRICS.snapshot()["counters"]
+        assert counters["response_cache_misses_total{persona=mikko}"] == 1
+        assert counters["response_cache_hits_total{persona=mikko,tier=memory}"] == 1
+
+    def test_observer_summary_cached_for_unchanged_transcript(self, fresh_cache):
+        import Main
+
+        messages = MessageLog([Message("user", None, "有清真食品吗？"), Message("model", "Mikko", "有的！")])
+        with patch("Main._run_agent_stream", return_value=_events("总结：讨论了清真食品。")) as stream:
+            a = asyncio.run(Main._generate_observer_reply("cache_obs_1", messages))
+            b = asyncio.run(Main._generate_observer_reply("cache_obs_2", messages))
+            messages.append(Message("user", None, "还有吗？"))
+            asyncio.run(Main._generate_observer_reply("cache_obs_1", messages))
+
+        assert a == b == "总结：讨论了清真食品。"
+        assert stream.await_count == 2
+
+    def test_regular_turns_and_non_opted_personas_bypass_cache(self, fresh_cache):
+        import Main
+
+        cid = "cache_turns"
+        Main.CONVERSATIONS[cid] = Conversation(
+            persona_ids=["mikko", "aino"], created_at=datetime.now(timezone.utc).isoformat()
+        )
+        out = MessageLog()
+        with patch("Main._run_agent_stream", return_value=_events("好的呀。")) as stream:
+            for _ in range(2):
+                asyncio.run(Main._call_agent(cid, "mikko", "同一句话", out))
+                asyncio.run(Main._call_agent(cid, "religion_expert", "同一句话", out, cacheable=True))
+
+        assert stream.await_count == 4
+        assert len(fresh_cache) == 0
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for load-aware model routing and graceful degradation."""
+
+import asyncio
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, patch
+
+from conversation_store import Conversation, MessageLog, PhaseState
+from metrics import METRICS
+from routing import ELEVATED, HIGH, NORMAL, RoutingPolicy
+
+
+def _policy(depth=0, slo=1.0, queue_limit=2):
+    queue = [depth]
+    policy = RoutingPolicy(lambda: queue[0], slo_seconds=slo, queue_limit=queue_limit)
+    return policy, queue
+
+
+class TestRoutingPolicy:
+    """Tests for pressure levels and routing decisions."""
+
+    def test_pressure_from_queue_depth(self):
+        policy, queue = _policy()
+        assert policy.pressure() == NORMAL
+        queue[0] = 2
+        assert policy.pressure() == ELEVATED
+        queue[0] = 4
+        assert policy.pressure() == HIGH
+
+    def test_pressure_from_recent_p95(self):
+        policy, _ = _policy(slo=1.0)
+        for _ in range(20):
+            policy.record_latency(0.2)
+        assert policy.pressure() == NORMAL
+        for _ in range(5):
+            policy.record_latency(1.2)
+        assert policy.pressure() == ELEVATED
+        for _ in range(10):
+            policy.record_latency(3.0)
+        assert policy.pressure() == HIGH
+
+    def test_fast_tier_only_for_small_talk_under_pressure(self):
+        policy, queue = _policy()
+        assert policy.choose_tier("c1", "small_talk") == "standard"
+        queue[0] = 2
+        assert policy.choose_tier("c1", "religion_deep") == "standard"
+        assert policy.choose_tier("c1", "small_talk") == "fast"
+
+    def test_optional_calls_dropped_only_under_high_pressure(self):
+        policy, queue = _policy(depth=2)
+        assert policy.allow_optional("c1", "sidekick") is True
+        queue[0] = 4
+        assert policy.allow_optional("c1", "sidekick") is False
+
+    def test_degradations_are_recorded(self):
+        METRICS.reset()
+        policy, _ = _policy(depth=4)
+        policy.choose_tier("c1", "small_talk")
+        policy.allow_optional("c1", "second_speaker")
+        decisions = [d["decision"] for d in policy.snapshot()["recent_decisions"]]
+        assert decisions == ["fast_model", "skip_second_speaker"]
+        assert policy.snapshot()["pressure"] == "high"
+        counters = METRICS.snapshot()["counters"]
+        assert counters["routing_degradations_total{decision=fast_model}"] == 1
+        assert counters["routing_degradations_total{decision=skip_second_speaker}"] == 1
+
+
+class TestFastRunners:
+    """Fast-tier runners share sessions with the standard tier."""
+
+    def test_fast_runner_shares_session_service(self):
+        import personas
+
+        for pid in personas.FINNISH_STUDENTS:
+            fast = personas.get_runner(pid, "fast")
+            assert fast is not personas.RUNNERS[pid]
+            assert fast.session_service is personas.RUNNERS[pid].session_service
+            assert fast.app_name == personas.RUNNERS[pid].app_name
+
+    def test_personas_without_fast_model_fall_back(self):
+        import personas
+
+        assert personas.get_runner("observer", "fast") is personas.RUNNERS["observer"]
+
+
+class TestDegradedTurns:
+    """_run_chat_round follows the routing policy."""
+
+    def _conversation(self, Main, phase: str) -> str:
+        cid = f"routing_{id(object()):x}"
+        Main.CONVERSATIONS[cid] = Conversation(
+            persona_ids=["mikko", "aino"],
+            created_at=datetime.now(timezone.utc).isoformat(),
+            messages=MessageLog(),
+        )
+        Main.CONVERSATION_STATES[cid] = PhaseState(phase=phase)
+        return cid
+
+    def test_small_talk_uses_fast_tier_and_one_speaker_under_high_pressure(self):
+        import Main
+
+        cid = self._conversation(Main, "small_talk")
+        policy, _ = _policy(depth=10)
+        with patch("Main.ROUTING", policy), \
+             patch("Main._decide_speaker_order", return_value=["mikko", "aino"]), \
+             patch("Main._call_agent", new_callable=AsyncMock) as agent:
+            agent.return_value = "Moi!"
+            reply = asyncio.run(Main._run_chat_round(cid, ["mikko", "aino"], "今晚几点？"))
+
+        assert reply == "Mikko: Moi!"
+        assert agent.await_count == 1
+        assert agent.await_args.kwargs["tier"] == "fast"
+
+    def test_expert_sidekick_skipped_under_high_pressure(self):
+        import Main
+
+        cid = self._conversation(Main, "religion_deep")
+        policy, _ = _policy(depth=10)
+        with patch("Main.ROUTING", policy), \
+             patch("Main._expert_respond", new_callable=AsyncMock) as expert, \
+             patch("Main._call_agent", new_callable=AsyncMock) as agent:
+            expert.return_value = "穆斯林不吃猪肉。"
+            reply = asyncio.run(Main._run_chat_round(cid, ["mikko", "aino"], "还有呢？"))
+
+        assert reply == "穆斯林不吃猪肉。"
+        agent.assert_not_awaited()
+
+    def test_expert_sidekick_kept_when_idle(self):
+        import Main
+
+        cid = self._conversation(Main, "religion_deep")
+        policy, _ = _policy()
+        with patch("Main.ROUTING", policy), \
+             patch("Main._expert_respond", new_callable=AsyncMock) as expert, \
+             patch("Main._call_agent", new_callable=AsyncMock) as agent:
+            expert.return_value = "穆斯林不吃猪肉。"
+            agent.return_value = "对，我们准备清真的吧。"
+            reply = asyncio.run(Main._run_chat_round(cid, ["mikko", "aino"], "还有呢？"))
+
+        assert reply.endswith("Aino: 对，我们准备清真的吧。")
+        assert policy.snapshot()["recent_decisions"] == []
+
+
+class TestRoutingEndpoint:
+    """Tests for GET /routing."""
+
+    def test_routing_snapshot(self, client):
+        data = client.get("/routing").json()
+        assert data["pressure"] in ("normal", "elevated", "high")
+        assert "latency_slo_seconds" in data
+        assert isinstance(data["recent_decisions"], list)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for the model-call scheduler and background observer jobs."""
+
+import asyncio
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, patch
+
+from conversation_store import Conversation, PhaseState
+from scheduler import BACKGROUND, CALL_PRIORITY, INTERACTIVE, ModelScheduler
+
+
+class TestModelScheduler:
+    """Tests for the priority-aware slot scheduler."""
+
+    def test_concurrency_is_bounded(self):
+        sched = ModelScheduler(slots=2)
+        active, peak = [0], [0]
+
+        async def call():
+            async with sched.slot():
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+                await asyncio.sleep(0.01)
+                active[0] -= 1
+
+        async def main():
+            await asyncio.gather(*[call() for _ in range(8)])
+
+        asyncio.run(main())
+        assert peak[0] == 2
+        assert sched.in_use == 0
+
+    def test_interactive_calls_jump_background_queue(self):
+        sched = ModelScheduler(slots=1)
+        order = []
+
+        async def call(name, priority):
+            async with sched.slot(priority):
+                order.append(name)
+                await asyncio.sleep(0.005)
+
+        async def main():
+            holder = asyncio.create_task(call("holder", INTERACTIVE))
+            await asyncio.sleep(0)
+            tasks = [asyncio.create_task(call(f"bg{i}", BACKGROUND)) for i in range(3)]
+            await asyncio.sleep(0)
+            tasks.append(asyncio.create_task(call("player", INTERACTIVE)))
+            await asyncio.gather(holder, *tasks)
+
+        asyncio.run(main())
+        assert order[:2] == ["holder", "player"]
+
+    def test_priority_inherited_from_context(self):
+        sched = ModelScheduler(slots=1)
+        order = []
+
+        async def background_job():
+            CALL_PRIORITY.set(BACKGROUND)
+            async with sched.slot():
+                order.append("background")
+
+        async def interactive():
+            async with sched.slot():
+                order.append("interactive")
+
+        async def main():
+            await sched.acquire(INTERACTIVE)
+            bg = asyncio.create_task(background_job())
+            await asyncio.sleep(0)
+            it = asyncio.create_task(interactive())
+            await asyncio.sleep(0)
+            assert sched.queue_depth(BACKGROUND) == 1
+            sched.release()
+            await asyncio.gather(bg, it)
+
+        asyncio.run(main())
+        assert order == ["interactive", "background"]
+
+    def test_cancelled_waiter_does_not_leak_slot(self):
+        sched = ModelScheduler(slots=1)
+
+        async def main():
+            await sched.acquire()
+            waiter = asyncio.create_task(sched.acquire())
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            sched.release()
+            assert sched.in_use == 0
+            await asyncio.wait_for(sched.acquire(), 1)
+
+        asyncio.run(main())
+
+
+class TestBackgroundObserver:
+    """The observer no longer runs on the interactive path."""
+
+    def _wrap_up_conversation(self, Main) -> str:
+        cid = f"observer_{id(object()):x}"
+        Main.CONVERSATIONS[cid] = Conversation(
+            persona_ids=["mikko", "aino"],
+            created_at=datetime.now(timezone.utc).isoformat(),
+        )
+        Main.CONVERSATION_STATES[cid] = PhaseState(
+            phase="wrap_up", religion_discussed=True, allergy_discussed=True
+        )
+        return cid
+
+    def test_finishing_turn_does_not_wait_for_observer(self):
+        import Main
+
+        cid = self._wrap_up_conversation(Main)
+
+        async def slow_observer(conversation_id, messages):
+            await asyncio.sleep(0.2)
+            return "总结：大家讨论了饮食需求。"
+
+        async def main():
+            result = await asyncio.wait_for(Main._run_serialized_turn(cid, "好了，没问题了"), 0.1)
+            job = Main.OBSERVER_JOBS.get(cid)
+            assert job.status == "pending"
+            await Main.OBSERVER_JOBS.wait(job, 2)
+            return result, job
+
+        with patch("Main._finnish_students_respond", new_callable=AsyncMock) as students, \
+             patch("Main._generate_observer_reply", side_effect=slow_observer):
+            students.return_value = "Mikko: Kiitos!"
+            result, job = asyncio.run(main())
+
+        assert result["reply"] == "Mikko: Kiitos!"
+        assert Main.CONVERSATION_STATES[cid].phase == "finished"
+        assert job.status == "ready"
+        assert "总结" in job.summary
+        assert Main.CONVERSATIONS[cid].messages[-1].name == "对话观察者"
+
+    def test_finished_turn_reply_matches_messages(self):
+        import Main
+
+        cid = self._wrap_up_conversation(Main)
+        Main.CONVERSATION_STATES[cid].phase = "finished"
+
+        async def observer(conversation_id, messages):
+            return "总结：大家讨论了饮食需求。"
+
+        async def main():
+            pending = await Main._run_serialized_turn(cid, "谢谢")
+            await Main.OBSERVER_JOBS.wait(Main.OBSERVER_JOBS.get(cid), 2)
+            ready = await Main._run_serialized_turn(cid, "再见")
+            return pending, ready
+
+        with patch("Main._generate_observer_reply", side_effect=observer):
+            pending, ready = asyncio.run(main())
+
+        for result in (pending, ready):
+            new = result["messages"]
+            assert [m.role for m in new] == ["user", "model"]
+            assert result["reply"] == f"{new[1].name}: {new[1].content}"
+        assert pending["messages"][1].content == Main.OBSERVER_PENDING_REPLY
+        assert ready["messages"][1].content == "总结：大家讨论了饮食需求。"
+
+    def test_observer_messages_do_not_make_summary_stale(self, client, mock_generate_initial):
+        import Main
+
+        conv_id = client.post("/conversations", json={"persona_ids": ["mikko", "aino"]}).json()["id"]
+        with patch("Main._generate_observer_reply", new_callable=AsyncMock, return_value="总结内容") as generate:
+            client.get(f"/conversations/{conv_id}/summary?wait=5")
+            # The summary written back, plus more observer lines, never trigger a regeneration
+            Main.CONVERSATIONS[conv_id].messages.append(Main.Message("model", "对话观察者", "总结内容"))
+            client.get(f"/conversations/{conv_id}/summary?wait=5")
+            assert generate.await_count == 1
+
+            Main.CONVERSATIONS[conv_id].messages.append(Main.Message("user", None, "还有一件事"))
+            client.get(f"/conversations/{conv_id}/summary?wait=5")
+        assert generate.await_count == 2
+
+    def test_observer_prompt_excludes_previous_summaries(self):
+        import Main
+        from conversation_store import Message, MessageLog
+
+        messages = MessageLog([
+            Message("user", None, "有人对花生过敏"),
+            Message("model", "对话观察者", "旧的总结"),
+            Message("model", "Aino", "记下了。"),
+        ])
+        with patch("Main._agent_reply", new_callable=AsyncMock, return_value="新的总结") as reply:
+            asyncio.run(Main._generate_observer_reply("observer_prompt", messages))
+        prompt = reply.await_args.args[3]
+        assert "旧的总结" not in prompt
+        assert "记下了" in prompt
+
+    def test_summary_endpoint_serves_ready_summary(self, client, mock_generate_initial):
+        import Main
+
+        conv_id = client.post("/conversations", json={"persona_ids": ["mikko", "aino"]}).json()["id"]
+        with patch("Main._generate_observer_reply", new_callable=AsyncMock) as observer:
+            observer.return_value = "总结内容"
+            data = client.get(f"/conversations/{conv_id}/summary?wait=5").json()
+            assert data["status"] == "ready"
+            assert data["summary"].endswith("总结内容")
+            # Transcript unchanged since: cached, no second observer call
+            again = client.get(f"/conversations/{conv_id}/summary").json()
+        assert again["summary"] == data["summary"]
+        assert observer.await_count == 1
+        # The summary written back to the transcript does not make it stale
+        assert Main.OBSERVER_JOBS.get(conv_id).message_count == Main._transcript_length(
+            Main.CONVERSATIONS[conv_id].messages
+        )
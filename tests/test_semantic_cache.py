@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for the semantic (near-duplicate question) cache."""
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import numpy as np
+from google.genai import types
+
+from conversation_store import MessageLog
+from metrics import METRICS
+from semantic_cache import SemanticCache, embed, key_terms, normalize
+
+RELIGION = ("religion_expert", "religion_deep")
+ALLERGY = ("allergy_expert", "allergy_deep")
+
+
+def _cos(a: str, b: str) -> float:
+    return float(np.dot(embed(a), embed(b)))
+
+
+class TestEmbedding:
+    """The hashed n-gram embedding separates topics and matches paraphrases."""
+
+    def test_normalize_drops_punctuation_and_fillers(self):
+        assert normalize("有没有人对花生过敏吗？") == "花生过敏"
+
+    def test_paraphrases_are_close(self):
+        assert _cos("有人对花生过敏吗？", "有没有人花生过敏？") > 0.9
+        assert _cos("有无麸质的食物吗？", "需要准备无麸质食品吗") > 0.75
+
+    def test_different_topics_are_far(self):
+        assert _cos("有没有人花生过敏？", "有没有人乳糖不耐受") < 0.3
+        assert _cos("有清真食品吗？", "有无麸质的食物吗？") < 0.3
+
+    def test_embedding_is_deterministic_and_normalized(self):
+        a, b = embed("有清真食品吗？"), embed("有清真食品吗？")
+        assert np.array_equal(a, b)
+        assert abs(float(np.linalg.norm(a)) - 1.0) < 1e-5
+
+
+class TestSemanticCache:
+    """Lookup, scoping and answer variation."""
+
+    def test_hit_after_store(self):
+        cache = SemanticCache(threshold=0.75, variants=1, enabled=True)
+        assert cache.lookup(ALLERGY, "有人对花生过敏吗？") is None
+        cache.store(ALLERGY, "有人对花生过敏吗？", "花生过敏很危险，要看清标签。")
+        assert cache.lookup(ALLERGY, "有没有人花生过敏？") == "花生过敏很危险，要看清标签。"
+        assert cache.lookup(ALLERGY, "有没有人乳糖不耐受") is None
+
+    def test_scoped_per_expert_and_phase(self):
+        cache = SemanticCache(threshold=0.75, variants=1, enabled=True)
+        cache.store(ALLERGY, "有人对花生过敏吗？", "花生过敏很危险。")
+        assert cache.lookup(RELIGION, "有人对花生过敏吗？") is None
+
+    def test_short_followups_are_not_cached(self):
+        cache = SemanticCache(threshold=0.75, variants=1, enabled=True)
+        cache.store(RELIGION, "还有呢？", "还有斋月。")
+        assert cache.lookup(RELIGION, "还有呢？") is None
+
+    def test_answer_variation(self):
+        cache = SemanticCache(threshold=0.75, variants=3, enabled=True)
+        answers = ["回答一", "回答二", "回答三"]
+        for answer in answers:
+            # Until three variants exist, a similar question still goes to the model
+            assert cache.lookup(ALLERGY, "有没有人花生过敏？") is None
+            cache.store(ALLERGY, "有人对花生过敏吗？", answer)
+        served = [cache.lookup(ALLERGY, "有没有人花生过敏？") for _ in range(20)]
+        assert set(served) <= set(answers)
+        assert len(set(served)) > 1
+        assert all(a != b for a, b in zip(served, served[1:]))
+
+    def test_hit_rate_stats_and_metrics(self):
+        METRICS.reset()
+        cache = SemanticCache(threshold=0.75, variants=1, enabled=True)
+        cache.lookup(ALLERGY, "有人对花生过敏吗？")
+        cache.store(ALLERGY, "有人对花生过敏吗？", "要看清标签。")
+        cache.lookup(ALLERGY, "有没有人花生过敏？")
+        stats = cache.stats()["allergy_expert/allergy_deep"]
+        assert stats == {"entries": 1, "hits": 1, "misses": 1, "hit_rate": 0.5}
+        counters = METRICS.snapshot()["counters"]
+        assert counters["semantic_cache_hits_total{scope=allergy_expert/allergy_deep}"] == 1
+
+    def test_disabled_cache_never_hits(self):
+        cache = SemanticCache(enabled=False)
+        cache.store(ALLERGY, "有人对花生过敏吗？", "要看清标签。")
+        assert cache.lookup(ALLERGY, "有人对花生过敏吗？") is None
+
+
+class TestKeyTerms:
+    """Questions that differ only in the food or allergen never share answers."""
+
+    PEANUT = "我的室友对花生严重过敏，今晚的沙拉里能放花生吗"
+    ALMOND = "我的室友对花生严重过敏，今晚的沙拉里能放杏仁吗"
+    BEEF = "有一位穆斯林朋友要来，牛肉炖菜可以吗"
+    PORK = "有一位穆斯林朋友要来，猪肉炖菜可以吗"
+
+    def test_key_terms_longest_match(self):
+        assert key_terms(self.ALMOND) == {"花生", "杏仁"}
+        assert key_terms("三文鱼和虾可以吗？") == {"三文鱼", "虾"}
+        assert key_terms("那这个怎么办呢") == frozenset()
+
+    def test_contrasting_pairs_look_similar_to_the_embedding(self):
+        # The n-gram cosine alone would call these duplicates
+        assert _cos(self.PEANUT, self.ALMOND) > 0.75
+        assert _cos(self.BEEF, self.PORK) > 0.75
+
+    def test_contrasting_pairs_do_not_hit(self):
+        cache = SemanticCache(threshold=0.75, variants=1, enabled=True)
+        cache.store(ALLERGY, self.ALMOND, "杏仁也是坚果，最好别放。")
+        cache.store(RELIGION, self.BEEF, "清真牛肉就可以。")
+        assert cache.lookup(ALLERGY, self.PEANUT) is None
+        assert cache.lookup(RELIGION, self.PORK) is None
+        assert cache.lookup(ALLERGY, self.ALMOND) == "杏仁也是坚果，最好别放。"
+
+    def test_different_question_does_not_add_variant(self):
+        cache = SemanticCache(threshold=0.75, variants=2, enabled=True)
+        cache.store(ALLERGY, "有人对花生过敏吗？", "花生过敏很危险。")
+        # Similar enough to hit, but a different question: its answer must not become a variant
+        assert _cos("有人对花生过敏吗？", "对花生过敏怎么办") > 0.75
+        cache.store(ALLERGY, "对花生过敏怎么办", "随身带肾上腺素笔。")
+        stats = cache.stats()["allergy_expert/allergy_deep"]
+        assert stats["entries"] == 2
+        # The first question still has a single answer, so it keeps asking the model
+        assert cache.lookup(ALLERGY, "有没有人花生过敏？") is None
+        cache.store(ALLERGY, "有没有人花生过敏？", "记得看标签。")
+        assert cache.lookup(ALLERGY, "有人对花生过敏吗？") in {"花生过敏很危险。", "记得看标签。"}
+
+    def test_context_dependent_questions_are_not_cached(self):
+        cache = SemanticCache(threshold=0.75, variants=1, enabled=True)
+        cache.store(ALLERGY, "那这种情况怎么处理比较好", "看情况。")
+        assert cache.lookup(ALLERGY, "那这种情况怎么处理比较好") is None
+
+
+class TestExpertRespondUsesCache:
+    """_expert_respond skips the expert model call on a near-duplicate question."""
+
+    def test_repeated_question_skips_model(self):
+        import Main
+
+        cache = SemanticCache(threshold=0.75, variants=1, enabled=True)
+        events = [SimpleNamespace(content=types.Content(role="model", parts=[types.Part(text="花生过敏要避开坚果酱。")]))]
+        messages = MessageLog()
+        with patch("Main.SEMANTIC_CACHE", cache), \
+             patch("Main._run_agent_stream", return_value=events) as stream:
+            first = asyncio.run(Main._expert_respond(
+                "sem_1", "有人对花生过敏吗？", messages,
+                expert_id="allergy_expert", expert_display_name="Aino", phase="allergy_deep",
+            ))
+            second = asyncio.run(Main._expert_respond(
+                "sem_2", "有没有人花生过敏？", messages,
+                expert_id="allergy_expert", expert_display_name="Aino", phase="allergy_deep",
+            ))
+
+        assert first == second == "Aino: 花生过敏要避开坚果酱。"
+        assert stream.await_count == 1
+        assert [m.name for m in messages] == ["食物过敏专家", "食物过敏专家"]
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for the offline batch simulation runner."""
+
+import json
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+from google.genai import types
+
+import simulate
+
+ALLERGY_SCRIPT = ["今晚几点开始？", "有人对花生过敏吗？", "虾呢？", "牛奶呢？", "预算多少？"]
+
+
+def _events(*args, **kwargs) -> list:
+    return [SimpleNamespace(content=types.Content(role="model", parts=[types.Part(text="今晚七点见！")]))]
+
+
+def _write_scripts(path, scripts: list[dict]) -> None:
+    path.write_text("".join(json.dumps(s, ensure_ascii=False) + "\n" for s in scripts), encoding="utf-8")
+
+
+def _records(path) -> list[dict]:
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+@pytest.fixture
+def fake_model():
+    with patch("Main._run_agent_stream", side_effect=_events) as stream:
+        yield stream
+
+
+class TestLoadScripts:
+    """Script file parsing."""
+
+    def test_ids_default_to_line_numbers(self, tmp_path):
+        path = tmp_path / "scripts.jsonl"
+        path.write_text('{"turns": ["moi"]}\n\n{"id": "b", "turns": ["hei"]}\n', encoding="utf-8")
+        assert [s["id"] for s in simulate.load_scripts(path)] == ["1", "b"]
+
+    def test_invalid_scripts_are_rejected(self, tmp_path):
+        path = tmp_path / "scripts.jsonl"
+        for bad in ('{"id": "a", "turns": []}\n', '{"id": "a", "turns": [1]}\n', "not json\n",
+                    '{"id": "a", "turns": ["x"]}\n{"id": "a", "turns": ["y"]}\n'):
+            path.write_text(bad, encoding="utf-8")
+            with pytest.raises(ValueError):
+                simulate.load_scripts(path)
+
+
+class TestCompletedIds:
+    """Resuming from an existing output file."""
+
+    def test_failed_scripts_are_not_completed(self, tmp_path):
+        out = tmp_path / "out.jsonl"
+        out.write_text('{"id": "a", "error": null}\n{"id": "b", "error": "boom"}\n', encoding="utf-8")
+        assert simulate.completed_ids(out) == {"a"}
+
+    def test_truncated_last_line_is_dropped(self, tmp_path):
+        out = tmp_path / "out.jsonl"
+        out.write_text('{"id": "a", "error": null}\n{"id": "b", "err', encoding="utf-8")
+        assert simulate.completed_ids(out) == {"a"}
+        assert out.read_text(encoding="utf-8") == '{"id": "a", "error": null}\n'
+
+
+class TestSimulate:
+    """End-to-end runs against _run_chat_round with a stubbed model."""
+
+    def test_records_phases_and_speakers_per_turn(self, tmp_path, fake_model):
+        import Main
+
+        scripts, out = tmp_path / "scripts.jsonl", tmp_path / "out.jsonl"
+        _write_scripts(scripts, [{"id": "allergy", "turns": ALLERGY_SCRIPT}])
+        live = len(Main.CONVERSATIONS)
+        summary = simulate.simulate(scripts, out, concurrency=2)
+
+        [record] = _records(out)
+        assert record["error"] is None
+        phases = [(t["phase_before"], t["phase_after"]) for t in record["turns"]]
+        assert phases == [
+            ("small_talk", "small_talk"),
+            ("small_talk", "allergy_deep"),
+            ("allergy_deep", "allergy_deep"),
+            ("allergy_deep", "allergy_deep"),
+            ("allergy_deep", "small_talk"),
+        ]
+        assert record["turns"][1]["focus"] == {"religion": False, "allergy": True}
+        assert record["turns"][1]["speakers"][0] == Main.personas.PERSONAS["allergy_expert"]["name"]
+        assert all(t["latency_ms"] >= 0 for t in record["turns"])
+        assert summary["transitions"] == {"small_talk->allergy_deep": 1, "allergy_deep->small_talk": 1}
+        # the simulated conversation is released afterwards
+        assert len(Main.CONVERSATIONS) == live
+
+    def test_expert_turns_override(self, tmp_path, fake_model, monkeypatch):
+        import Main
+
+        monkeypatch.setattr(Main, "EXPERT_TURNS", 1)
+        scripts, out = tmp_path / "scripts.jsonl", tmp_path / "out.jsonl"
+        _write_scripts(scripts, [{"id": "allergy", "turns": ALLERGY_SCRIPT[:3]}])
+        simulate.simulate(scripts, out)
+        [record] = _records(out)
+        assert [t["phase_after"] for t in record["turns"]] == ["small_talk", "allergy_deep", "small_talk"]
+
+    def test_resume_skips_completed_and_retries_failed(self, tmp_path, fake_model):
+        scripts, out = tmp_path / "scripts.jsonl", tmp_path / "out.jsonl"
+        _write_scripts(scripts, [
+            {"id": "a", "turns": ["moi"]},
+            {"id": "b", "turns": ["hei"]},
+            {"id": "c", "turns": ["moi"], "persona_ids": ["nobody"]},
+        ])
+        out.write_text('{"id": "a", "error": null}\n{"id": "b", "error": "interrupted"}\n{"id": "c"', encoding="utf-8")
+
+        summary = simulate.simulate(scripts, out, concurrency=1)
+        assert (summary["skipped"], summary["run"], summary["errors"]) == (1, 2, 1)
+        rerun = _records(out)[2:]
+        assert [(r["id"], r["error"] is None) for r in rerun] == [("b", True), ("c", False)]
+        assert simulate.completed_ids(out) == {"a", "b"}
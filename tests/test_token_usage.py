@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for per-conversation token / cost accounting and the token budget."""
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from google.genai import types
+
+from conversation_store import Conversation, Message, MessageLog, PhaseState
+from metrics import METRICS
+from token_usage import TOKENS, TokenLedger, cost_usd, estimate_tokens
+
+
+def _event(text: str, usage=None):
+    return SimpleNamespace(
+        content=types.Content(role="model", parts=[types.Part(text=text)]),
+        usage_metadata=usage,
+    )
+
+
+def _prompt(text: str) -> types.Content:
+    return types.Content(role="user", parts=[types.Part(text=text)])
+
+
+class TestEstimates:
+    """Local token estimate and price lookup."""
+
+    def test_estimate_tokens(self):
+        assert estimate_tokens("") == 0
+        assert estimate_tokens("花生过敏") == 4
+        assert estimate_tokens("Moi kaikki") == 3
+        assert estimate_tokens("Moi 你好") == 3
+
+    def test_cost_from_litellm_price_table(self):
+        assert cost_usd("ollama_chat/qwen3:4b-instruct", 1000, 1000) == 0
+        assert cost_usd("azure/gpt-4o", 1000, 1000) > 0
+
+
+class TestLedgerRecord:
+    """record / record_events attribute usage to conversation, persona and phase."""
+
+    def test_record_in_scope(self):
+        ledger = TokenLedger()
+        with ledger.track("c1", "small_talk"):
+            ledger.record("mikko", "azure/gpt-4o", 100, 20)
+        ledger.record("aino", "azure/gpt-4o", 50, 5)
+
+        usage = ledger.conversation("c1")
+        assert usage["total"]["total_tokens"] == 120
+        assert usage["by_persona"]["mikko"]["prompt_tokens"] == 100
+        assert usage["by_phase"]["small_talk"]["completion_tokens"] == 20
+        assert usage["total"]["cost_usd"] > 0
+        # Calls outside a tracked conversation only count globally
+        snap = ledger.snapshot()
+        assert snap["total"]["total_tokens"] == 175
+        assert snap["by_phase"]["none"]["calls"] == 1
+        assert snap["conversations"] == 1
+
+    def test_record_events_uses_reported_usage(self):
+        METRICS.reset()
+        ledger = TokenLedger()
+        agent = SimpleNamespace(model=SimpleNamespace(model="ollama_chat/qwen3:4b-instruct"), instruction="你是 Mikko。")
+        meta = types.GenerateContentResponseUsageMetadata(prompt_token_count=300, candidates_token_count=40)
+        with ledger.track("c2", "religion_deep"):
+            ledger.record_events("mikko", agent, _prompt("有清真要求吗？"), [_event("有的。", meta)])
+
+        usage = ledger.conversation("c2")["total"]
+        assert (usage["prompt_tokens"], usage["completion_tokens"], usage["estimated_calls"]) == (300, 40, 0)
+        counters = METRICS.snapshot()["counters"]
+        assert counters["llm_tokens_total{kind=prompt,persona=mikko,phase=religion_deep}"] == 300
+
+    def test_record_events_estimates_without_usage(self):
+        METRICS.reset()
+        ledger = TokenLedger()
+        agent = SimpleNamespace(model="ollama_chat/qwen3:4b-instruct", instruction="你是 Aino。")
+        with ledger.track("c3", "allergy_deep"):
+            ledger.record_events("aino", agent, _prompt("花生过敏"), [_event("要注意")])
+            # Test doubles without an agent still get counted
+            ledger.record_events("aino", None, _prompt("花生"), [_event("好")])
+
+        usage = ledger.conversation("c3")["total"]
+        assert usage["calls"] == 2 and usage["estimated_calls"] == 2
+        assert usage["prompt_tokens"] == estimate_tokens("你是 Aino。花生过敏") + estimate_tokens("花生")
+        assert usage["completion_tokens"] == 4
+        assert METRICS.snapshot()["counters"]["llm_token_estimates_total{persona=aino}"] == 2
+
+
+class TestBudget:
+    """Compact at a fraction of the budget, wrap up once over it; each fires once."""
+
+    def test_compact_then_wrap_up_once_each(self):
+        ledger = TokenLedger(budget=1000, compact_at=0.5, keep_messages=2)
+        assert ledger.budget_action("c4") is None
+        with ledger.track("c4", "small_talk"):
+            ledger.record("mikko", "m", 400, 0)
+            assert ledger.budget_action("c4") is None
+            assert ledger.history_limit() is None
+
+            ledger.record("mikko", "m", 200, 0)
+            assert ledger.budget_action("c4") == "compact"
+            assert ledger.budget_action("c4") is None
+            assert ledger.history_limit() == 2
+
+            ledger.record("mikko", "m", 500, 0)
+            assert ledger.budget_action("c4") == "wrap_up"
+            assert ledger.budget_action("c4") is None
+
+        budget = ledger.conversation("c4")["budget"]
+        assert budget == {"limit": 1000, "remaining": 0, "compacted": True, "wrapped_up": True}
+
+    def test_unlimited_budget(self):
+        ledger = TokenLedger(budget=0)
+        with ledger.track("c5", "small_talk"):
+            ledger.record("mikko", "m", 10**6, 0)
+        assert ledger.budget_action("c5") is None
+        assert ledger.conversation("c5")["budget"]["limit"] is None
+
+    def test_history_trimmed_after_compaction(self):
+        import Main
+
+        messages = MessageLog([Message("user", None, f"第{i}句") for i in range(5)])
+        ledger = TokenLedger(budget=100, compact_at=0.5, keep_messages=2)
+        with patch("Main.TOKENS", ledger), ledger.track("c6", "small_talk"):
+            assert Main._format_conversation_history(messages).count("玩家:") == 5
+            ledger.record("mikko", "m", 60, 0)
+            assert ledger.budget_action("c6") == "compact"
+            trimmed = Main._format_conversation_history(messages)
+            full = Main._format_conversation_history(messages, full=True)
+
+        assert trimmed == "（更早的 3 条对话已省略）\n玩家: 第3句\n玩家: 第4句"
+        assert full.count("玩家:") == 5
+
+    def test_over_budget_turn_moves_to_wrap_up(self):
+        import Main
+
+        cid = "tok_wrap"
+        Main.CONVERSATIONS[cid] = Conversation(persona_ids=["mikko", "aino"], created_at="2024-01-01T00:00:00Z")
+        Main.CONVERSATION_STATES[cid] = PhaseState(phase="small_talk")
+        ledger = TokenLedger(budget=100, compact_at=1.0)
+        with ledger.track(cid, "small_talk"):
+            ledger.record("mikko", "m", 200, 0)
+        with patch("Main.TOKENS", ledger), patch("Main._call_agent", return_value="好的收尾"):
+            asyncio.run(Main._run_chat_round(cid, ["mikko", "aino"], "今天天气不错"))
+
+        assert Main.CONVERSATION_STATES[cid].phase == "wrap_up"
+
+
+class TestUsageEndpoint:
+    """GET /conversations/{id}/usage."""
+
+    def test_usage_endpoint(self, client):
+        import Main
+
+        cid = "tok_api"
+        Main.CONVERSATIONS[cid] = Conversation(persona_ids=["mikko", "aino"], created_at="2024-01-01T00:00:00Z")
+        with TOKENS.track(cid, "opening"):
+            TOKENS.record("mikko", "azure/gpt-4o", 120, 30)
+
+        data = client.get(f"/conversations/{cid}/usage").json()
+        assert data["conversation_id"] == cid
+        assert data["total"]["total_tokens"] == 150
+        assert data["by_persona"]["mikko"]["calls"] == 1
+        assert data["by_phase"]["opening"]["cost_usd"] > 0
+        assert "budget" in data
+
+    def test_usage_unknown_conversation(self, client):
+        assert client.get("/conversations/nope/usage").status_code == 404
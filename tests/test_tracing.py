@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for per-turn timelines and the Chrome trace export."""
+
+import asyncio
+import random
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from google.adk.sessions import InMemorySessionService
+from google.genai import types
+
+from conversation_store import Conversation
+from tracing import TraceStore
+
+
+class StreamingRunner:
+    """Stand-in for InMemoryRunner that streams a reply in a few chunks."""
+
+    def __init__(self, chunks=("Moi! ", "我们八点开始。")):
+        self.session_service = InMemorySessionService()
+        self.chunks = chunks
+
+    async def run_async(self, user_id, session_id, new_message):
+        for chunk in self.chunks:
+            await asyncio.sleep(0.001)
+            yield SimpleNamespace(content=types.Content(role="model", parts=[types.Part(text=chunk)]))
+
+
+def _conversation(Main) -> str:
+    cid = f"trace_{random.getrandbits(64):x}"
+    Main.CONVERSATIONS[cid] = Conversation(
+        persona_ids=["mikko", "aino"],
+        created_at=datetime.now(timezone.utc).isoformat(),
+    )
+    return cid
+
+
+def _names(trace: dict, ph: str) -> list[str]:
+    return [e["name"] for e in trace["traceEvents"] if e["ph"] == ph]
+
+
+class TestTraceStore:
+    """Recording spans and exporting them."""
+
+    def test_spans_and_instants_are_exported(self):
+        store = TraceStore()
+
+        async def main():
+            with store.turn("c1", "hello"):
+                with store.span("call_agent", "agent", persona="mikko"):
+                    await asyncio.sleep(0.01)
+                    store.instant("first_event", "model")
+
+        asyncio.run(main())
+        trace = store.chrome_trace("c1")
+        assert _names(trace, "X") == ["call_agent", "turn"]
+        assert _names(trace, "i") == ["first_event"]
+        spans = {e["name"]: e for e in trace["traceEvents"] if e["ph"] == "X"}
+        turn, call = spans["turn"], spans["call_agent"]
+        assert call["dur"] >= 10_000  # microseconds
+        assert turn["ts"] <= call["ts"] and call["ts"] + call["dur"] <= turn["ts"] + turn["dur"]
+        assert call["args"] == {"persona": "mikko"}
+        assert trace["otherData"]["turns"] == 1
+
+    def test_concurrent_tasks_get_separate_lanes(self):
+        store = TraceStore()
+
+        async def call(name):
+            with store.span(name):
+                await asyncio.sleep(0.01)
+
+        async def main():
+            with store.turn("c1", "hello"):
+                await asyncio.gather(call("a"), call("b"))
+
+        asyncio.run(main())
+        spans = {e["name"]: e for e in store.chrome_trace("c1")["traceEvents"] if e["ph"] == "X"}
+        assert spans["a"]["tid"] != spans["b"]["tid"]
+        assert spans["turn"]["tid"] not in (spans["a"]["tid"], spans["b"]["tid"])
+
+    def test_nothing_is_recorded_without_a_traced_turn(self):
+        store = TraceStore()
+
+        async def main():
+            with store.turn("c1", "hello", enabled=False):
+                with store.span("call_agent"):
+                    store.instant("event")
+
+        asyncio.run(main())
+        assert store.turns("c1") == []
+        assert store.chrome_trace("c1")["traceEvents"] == []
+
+    def test_keeps_recent_turns_and_last_filter(self):
+        store = TraceStore(keep_turns=2)
+
+        async def main():
+            for text in ("one", "two", "three"):
+                with store.turn("c1", text):
+                    await asyncio.sleep(0)
+
+        asyncio.run(main())
+        assert [t.label for t in store.turns("c1")] == ["two", "three"]
+        assert store.chrome_trace("c1", last=1)["otherData"]["turns"] == 1
+
+    def test_header_and_sample_rate(self):
+        assert TraceStore().wanted({"X-Trace": "1"})
+        assert not TraceStore().wanted({})
+        assert TraceStore(sample_rate=1.0).wanted({})
+
+
+class TestTurnTimeline:
+    """A traced turn records every stage of the agent call chain."""
+
+    def test_traced_turn_covers_call_chain(self):
+        import Main
+
+        cid = _conversation(Main)
+        with patch("Main.personas.get_runner", return_value=StreamingRunner()):
+            asyncio.run(Main._run_serialized_turn(cid, "今晚几点开始？", trace=True))
+
+        trace = Main.TRACES.chrome_trace(cid)
+        spans = _names(trace, "X")
+        for name in ("turn", "turn_gate_wait", "respond_in_phase", "call_agent",
+                     "session_fetch", "scheduler_wait", "model_stream", "post_process"):
+            assert name in spans, name
+        instants = _names(trace, "i")
+        assert instants.count("first_event") == spans.count("model_stream")
+        assert instants.count("event") == spans.count("model_stream")  # second chunk of each call
+
+    def test_untraced_turn_records_nothing(self):
+        import Main
+
+        cid = _conversation(Main)
+        with patch("Main.personas.get_runner", return_value=StreamingRunner()):
+            asyncio.run(Main._run_serialized_turn(cid, "今晚几点开始？"))
+        assert Main.TRACES.turns(cid) == []
+
+
+class TestTraceApi:
+    """GET /conversations/{id}/trace."""
+
+    def test_trace_header_records_turn(self, client, mock_generate_initial, mock_run_chat):
+        conv_id = client.post("/conversations", json={"persona_ids": ["mikko", "aino"]}).json()["id"]
+        client.post(f"/conversations/{conv_id}/messages", json={"content": "Hello"}, headers={"X-Trace": "1"})
+        client.post(f"/conversations/{conv_id}/messages", json={"content": "untraced"})
+
+        response = client.get(f"/conversations/{conv_id}/trace")
+        assert response.status_code == 200
+        trace = response.json()
+        assert trace["otherData"]["turns"] == 1
+        assert "turn" in _names(trace, "X")
+        assert trace["displayTimeUnit"] == "ms"
+
+    def test_unknown_conversation_returns_404(self, client):
+        assert client.get("/conversations/nope/trace").status_code == 404
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for per-conversation turn serialization and idempotent retries."""
+
+import asyncio
+import random
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import pytest
+
+from conversation_store import Conversation, Message
+from turn_gate import ConversationBusyError, TurnGates
+
+
+def _new_conversation(Main) -> str:
+    cid = f"test_{random.getrandbits(64):x}"
+    Main.CONVERSATIONS[cid] = Conversation(
+        persona_ids=["mikko", "aino"],
+        created_at=datetime.now(timezone.utc).isoformat(),
+    )
+    return cid
+
+
+async def _fake_call_agent(conversation_id, persona_id, prompt, messages, tier="standard"):
+    """Fake agent: yields to the loop, then replies to the latest user message."""
+    await asyncio.sleep(random.random() * 0.002)
+    last_user = next(m.content for m in reversed(messages) if m.role == "user")
+    await asyncio.sleep(random.random() * 0.002)
+    reply = f"re:{last_user}"
+    messages.append(Message("model", persona_id, reply))
+    return reply
+
+
+async def _fake_observer_reply(conversation_id, messages):
+    await asyncio.sleep(0)
+    return "summary"
+
+
+class TestTurnGates:
+    """Tests for the TurnGates primitive."""
+
+    def test_same_client_message_id_runs_once(self):
+        """Concurrent retries with one client_message_id share a single run."""
+        gates = TurnGates()
+        calls = []
+
+        async def turn():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return {"reply": "ok"}
+
+        async def main():
+            results = await asyncio.gather(*[gates.run("c1", "m1", turn) for _ in range(5)])
+            # A later retry is served from the result cache
+            results.append(await gates.run("c1", "m1", turn))
+            return results
+
+        results = asyncio.run(main())
+        assert len(calls) == 1
+        assert all(r == {"reply": "ok"} for r in results)
+
+    def test_without_key_every_call_runs(self):
+        """Requests without a client_message_id are never coalesced."""
+        gates = TurnGates()
+        calls = []
+
+        async def turn():
+            calls.append(1)
+            return len(calls)
+
+        async def main():
+            return await asyncio.gather(*[gates.run("c1", None, turn) for _ in range(3)])
+
+        assert sorted(asyncio.run(main())) == [1, 2, 3]
+
+    def test_bounded_wait_raises_busy(self):
+        """A caller that cannot get the lock in time gets ConversationBusyError."""
+        gates = TurnGates()
+
+        async def slow():
+            await asyncio.sleep(0.2)
+
+        async def main():
+            first = asyncio.create_task(gates.run("c1", None, slow))
+            await asyncio.sleep(0)
+            with pytest.raises(ConversationBusyError):
+                await gates.run("c1", None, slow, timeout=0.01)
+            await first
+
+        asyncio.run(main())
+
+    def test_failed_turn_is_not_cached(self):
+        """A failed turn propagates its error and a retry runs again."""
+        gates = TurnGates()
+        attempts = []
+
+        async def flaky():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise RuntimeError("boom")
+            return "ok"
+
+        async def main():
+            with pytest.raises(RuntimeError):
+                await gates.run("c1", "m1", flaky)
+            return await gates.run("c1", "m1", flaky)
+
+        assert asyncio.run(main()) == "ok"
+        assert len(attempts) == 2
+
+    def test_busy_while_turn_runs(self):
+        """busy() reports a running turn without creating a gate for unknown ids."""
+        gates = TurnGates()
+        seen = []
+
+        async def turn():
+            seen.append(gates.busy("c1"))
+
+        asyncio.run(gates.run("c1", None, turn))
+        assert seen == [True]
+        assert not gates.busy("c1")
+        assert not gates.busy("unknown") and len(gates) == 1
+
+
+class TestStateMachineConcurrency:
+    """Stress test: concurrent turns on one conversation behave like sequential ones."""
+
+    SCRIPT = [
+        "今晚几点开始？",
+        "有没有清真食品？",
+        "猪肉不行吗",
+        "那酒呢",
+        "明白了",
+        "有人对花生过敏吗？",
+        "那坚果呢",
+        "乳糖不耐受怎么办",
+        "好的",
+        "好了，没问题了",
+        "谢谢",
+    ] * 3
+
+    def _run_turns(self, Main, concurrent: bool):
+        cid = _new_conversation(Main)
+
+        async def main():
+            calls = [Main._run_serialized_turn(cid, text) for text in self.SCRIPT]
+            if concurrent:
+                return await asyncio.gather(*calls)
+            return [await c for c in calls]
+
+        with patch("Main._call_agent", side_effect=_fake_call_agent), \
+             patch("Main._generate_observer_reply", side_effect=_fake_observer_reply):
+            results = asyncio.run(main())
+        return cid, results
+
+    def test_concurrent_turns_match_sequential(self):
+        import Main
+
+        seq_cid, _ = self._run_turns(Main, concurrent=False)
+        con_cid, results = self._run_turns(Main, concurrent=True)
+
+        seq_state = Main.CONVERSATION_STATES[seq_cid]
+        con_state = Main.CONVERSATION_STATES[con_cid]
+        assert con_state == seq_state
+
+        # Every model reply answers the user message of its own turn
+        last_user = None
+        for m in Main.CONVERSATIONS[con_cid].messages:
+            if m.role == "user":
+                last_user = m.content
+            elif m.content.startswith("re:"):
+                assert m.content == f"re:{last_user}"
+
+        # Each response holds exactly its own user message first
+        for text, result in zip(self.SCRIPT, results):
+            assert result["messages"][0].role == "user"
+            assert result["messages"][0].content == text
+            assert all(item.role == "model" for item in result["messages"][1:])
+
+    def test_retry_with_client_message_id_does_not_regenerate(self):
+        import Main
+
+        cid = _new_conversation(Main)
+
+        async def main():
+            return await asyncio.gather(*[
+                Main._run_serialized_turn(cid, "有没有清真食品？", "godot-msg-1")
+                for _ in range(4)
+            ])
+
+        with patch("Main._call_agent", side_effect=_fake_call_agent) as agent:
+            results = asyncio.run(main())
+
+        user_msgs = [m for m in Main.CONVERSATIONS[cid].messages if m.role == "user"]
+        assert len(user_msgs) == 1
+        assert Main.CONVERSATION_STATES[cid].phase == "religion_deep"
+        assert agent.call_count == 2  # expert + sidekick, once
+        assert all(r is results[0] for r in results)
+
+
+class TestSendMessageIdempotencyApi:
+    """API-level checks for client_message_id and busy conversations."""
+
+    def test_retry_returns_cached_reply(self, client, mock_generate_initial, mock_run_chat):
+        conv_id = client.post("/conversations", json={"persona_ids": ["mikko", "aino"]}).json()["id"]
+        body = {"content": "Hello", "client_message_id": "abc"}
+        first = client.post(f"/conversations/{conv_id}/messages", json=body)
+        second = client.post(f"/conversations/{conv_id}/messages", json=body)
+        assert first.status_code == second.status_code == 200
+        assert first.json() == second.json()
+        assert mock_run_chat.call_count == 1
+
+    def test_busy_conversation_returns_409(self, client, mock_generate_initial):
+        conv_id = client.post("/conversations", json={"persona_ids": ["mikko", "aino"]}).json()["id"]
+        with patch("Main.TURN_GATES.run", side_effect=ConversationBusyError(conv_id)):
+            response = client.post(f"/conversations/{conv_id}/messages", json={"content": "Hello"})
+        assert response.status_code == 409
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for the asynchronous turn job API (POST ...?async=true, GET /turns/{id})."""
+
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from turn_jobs import TurnJobPool, TurnQueueFull
+
+
+@pytest.fixture
+def live_client():
+    """TestClient bound to one event loop, so background workers survive between requests."""
+    from Main import app
+    with TestClient(app) as c:
+        yield c
+
+
+def _create(client) -> str:
+    return client.post("/conversations", json={"persona_ids": ["mikko", "aino"]}).json()["id"]
+
+
+class TestAsyncTurnApi:
+    """Tests for the 202 + polling flow."""
+
+    def test_async_post_returns_202_with_turn_id(self, live_client, mock_generate_initial, mock_run_chat):
+        conv_id = _create(live_client)
+        response = live_client.post(f"/conversations/{conv_id}/messages?async=true", json={"content": "Hello"})
+        assert response.status_code == 202
+        data = response.json()
+        assert data["conversation_id"] == conv_id
+        assert response.headers["Location"] == f"/turns/{data['turn_id']}"
+        # let the job finish while _run_chat_round is still mocked
+        assert live_client.get(f"/turns/{data['turn_id']}?wait=5").json()["status"] == "done"
+
+    def test_long_poll_returns_result(self, live_client, mock_generate_initial, mock_run_chat):
+        conv_id = _create(live_client)
+        turn_id = live_client.post(
+            f"/conversations/{conv_id}/messages?async=true", json={"content": "Hello"}
+        ).json()["turn_id"]
+
+        data = live_client.get(f"/turns/{turn_id}?wait=5").json()
+        assert data["status"] == "done"
+        assert data["result"]["reply"] == mock_run_chat.return_value
+        mock_run_chat.assert_awaited_once()
+
+    def test_same_client_message_id_returns_same_turn(self, live_client, mock_generate_initial, mock_run_chat):
+        conv_id = _create(live_client)
+        body = {"content": "Hello", "client_message_id": "retry-1"}
+        first = live_client.post(f"/conversations/{conv_id}/messages?async=true", json=body).json()
+        second = live_client.post(f"/conversations/{conv_id}/messages?async=true", json=body).json()
+        assert first["turn_id"] == second["turn_id"]
+        live_client.get(f"/turns/{first['turn_id']}?wait=5")
+        assert mock_run_chat.await_count == 1
+
+    def test_failed_turn_reports_error(self, live_client, mock_generate_initial, mock_run_chat):
+        mock_run_chat.side_effect = RuntimeError("model down")
+        conv_id = _create(live_client)
+        turn_id = live_client.post(
+            f"/conversations/{conv_id}/messages?async=true", json={"content": "Hello"}
+        ).json()["turn_id"]
+        data = live_client.get(f"/turns/{turn_id}?wait=5").json()
+        assert data["status"] == "failed"
+        assert data["error"] == "model down"
+
+    def test_retry_after_failure_runs_new_turn(self, live_client, mock_generate_initial, mock_run_chat):
+        mock_run_chat.side_effect = [RuntimeError("model down"), "[芬兰学生讨论组] Moi!"]
+        conv_id = _create(live_client)
+        body = {"content": "Hello", "client_message_id": "retry-after-failure"}
+        first = live_client.post(f"/conversations/{conv_id}/messages?async=true", json=body).json()
+        assert live_client.get(f"/turns/{first['turn_id']}?wait=5").json()["status"] == "failed"
+
+        second = live_client.post(f"/conversations/{conv_id}/messages?async=true", json=body).json()
+        assert second["turn_id"] != first["turn_id"]
+        data = live_client.get(f"/turns/{second['turn_id']}?wait=5").json()
+        assert data["status"] == "done"
+        assert mock_run_chat.await_count == 2
+
+    def test_unknown_turn_returns_404(self, live_client):
+        assert live_client.get("/turns/does-not-exist").status_code == 404
+
+
+class TestTurnJobPool:
+    """Tests for the bounded worker pool."""
+
+    def test_worker_count_bounds_concurrency(self):
+        running = []
+        peak = []
+
+        async def execute(job):
+            running.append(job.id)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(job.id)
+            return {"reply": job.content}
+
+        async def main():
+            pool = TurnJobPool(execute, workers=2, queue_size=100)
+            jobs = [pool.submit("c", str(i)) for i in range(10)]
+            for job in jobs:
+                await pool.wait(job, 5)
+            await pool.shutdown()
+            return jobs
+
+        jobs = asyncio.run(main())
+        assert all(j.status == "done" for j in jobs)
+        assert max(peak) == 2
+
+    def test_pending_covers_queued_and_running_jobs(self):
+        release = asyncio.Event()
+
+        async def execute(job):
+            await release.wait()
+            return {}
+
+        async def main():
+            pool = TurnJobPool(execute, workers=1, queue_size=10)
+            running, queued = pool.submit("a", "x"), pool.submit("b", "y")
+            await asyncio.sleep(0)
+            assert (running.status, queued.status) == ("running", "queued")
+            assert pool.pending("a") and pool.pending("b") and not pool.pending("c")
+            release.set()
+            await pool.wait(queued, 5)
+            assert not pool.pending("a") and not pool.pending("b")
+            await pool.shutdown()
+
+        asyncio.run(main())
+
+    def test_queue_full_rejects(self):
+        async def execute(job):
+            await asyncio.sleep(1)
+
+        async def main():
+            pool = TurnJobPool(execute, workers=1, queue_size=1)
+            pool.submit("c", "a")
+            await asyncio.sleep(0)  # worker takes "a"
+            pool.submit("c", "b")
+            with pytest.raises(TurnQueueFull):
+                pool.submit("c", "c")
+            await pool.shutdown()
+
+        asyncio.run(main())
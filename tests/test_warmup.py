@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""pytest tests for startup model warm-up and the /ready endpoint."""
+
+import asyncio
+import json
+from unittest.mock import patch
+
+import httpx
+
+import warmup
+from http_pool import EndpointPool
+
+
+def _warmer(handler, models):
+    pool = EndpointPool("http://fake-ollama:11434", transport=httpx.MockTransport(handler))
+    return warmup.ModelWarmer(models, "http://fake-ollama:11434", "30m", pool.client)
+
+
+class TestModelWarmer:
+    """Tests for ModelWarmer."""
+
+    def test_loads_each_ollama_model_with_keep_alive(self):
+        requests = []
+
+        def handler(request):
+            requests.append(json.loads(request.content))
+            return httpx.Response(200, json={"done": True, "done_reason": "load"})
+
+        warmer = _warmer(handler, ["ollama_chat/qwen3:4b-instruct", "ollama_chat/qwen3:8b", "azure/gpt-4o"])
+        assert not warmer.ready()
+        assert asyncio.run(warmer.warm_all()) is True
+        assert [r["model"] for r in requests] == ["qwen3:4b-instruct", "qwen3:8b"]
+        assert all(r["keep_alive"] == "30m" and r["prompt"] == "" for r in requests)
+        assert warmer.snapshot()["azure/gpt-4o"]["status"] == "warm"
+
+    def test_not_ready_until_every_model_loads(self):
+        def handler(request):
+            if json.loads(request.content)["model"] == "qwen3:8b":
+                return httpx.Response(500, json={"error": "out of memory"})
+            return httpx.Response(200, json={"done": True})
+
+        warmer = _warmer(handler, ["ollama_chat/qwen3:4b-instruct", "ollama_chat/qwen3:8b"])
+        assert asyncio.run(warmer.warm_all()) is False
+        snap = warmer.snapshot()
+        assert snap["ollama_chat/qwen3:4b-instruct"]["status"] == "warm"
+        assert snap["ollama_chat/qwen3:8b"]["status"] == "error"
+
+    def test_distinct_models_from_personas(self):
+        import personas
+
+        models = warmup.distinct_models(personas.PERSONAS)
+        assert len(models) == len(set(models))
+        expected = {info["model"].model for info in personas.PERSONAS.values()}
+        expected |= {info["fast_model"].model for info in personas.PERSONAS.values() if "fast_model" in info}
+        assert expected == set(models)
+
+
+class TestReadyEndpoint:
+    """Tests for GET /ready."""
+
+    def test_ready_reports_503_while_cold(self, client):
+        import Main
+
+        with patch.object(warmup, "WARMUP_ENABLED", True):
+            response = client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["ready"] is False
+
+    def test_ready_when_all_models_warm(self, client):
+        import Main
+
+        with patch.object(warmup, "WARMUP_ENABLED", True), \
+             patch.object(Main.WARMER, "ready", return_value=True):
+            response = client.get("/ready")
+        assert response.status_code == 200
+        assert response.json()["ready"] is True
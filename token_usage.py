@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""按会话 / persona / 阶段统计 token 用量与费用，并执行每个会话的 token 预算。
+
+每次 prompt 都会带上完整的对话记录，ADK session 里还保存着之前的 prompt，
+所以每回合的 prompt token 数随对话变长而增长——负载下真正爆掉的就是这个数字。
+
+用量来源：
+- 优先取模型响应的 usage_metadata（LiteLlm 从后端返回的 usage 填充）
+- 没有时用本地近似分词估算（CJK 字符各算 1 个 token，其他字符每 4 个算 1 个），
+  prompt 按 instruction + 本次输入估算（不含 session 历史，偏低），计入 llm_token_estimates_total
+费用：按 litellm 自带价格表（model_cost）换算，本地 Ollama 模型没有价格，记为 0。
+
+调用方用 TOKENS.track(conversation_id, phase) 标明当前会话与阶段（contextvar，
+模型调用与后台任务会继承）；不在 track 范围内的调用只计入全局统计。
+
+预算（TOKEN_BUDGET_PER_CONVERSATION > 0 时启用）：
+- 用量达到预算的 TOKEN_COMPACT_AT 比例时压缩上下文（一次）：prompt 里的对话记录只保留
+  最近 TOKEN_COMPACT_KEEP_MESSAGES 条，并由调用方清空各 persona 的 ADK session
+- 用量超过预算时优雅收尾：状态机直接进入 wrap_up
+"""
+
+import contextvars
+import functools
+import os
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from metrics import METRICS
+
+# 每个会话的 token 预算（prompt + completion）；0 表示不限制
+TOKEN_BUDGET_PER_CONVERSATION = int(os.getenv("TOKEN_BUDGET_PER_CONVERSATION", "0"))
+
+# 用量达到预算的该比例时压缩上下文；>= 1 表示不压缩
+TOKEN_COMPACT_AT = float(os.getenv("TOKEN_COMPACT_AT", "0.7"))
+
+# 压缩后 prompt 中保留的最近消息条数
+TOKEN_COMPACT_KEEP_MESSAGES = int(os.getenv("TOKEN_COMPACT_KEEP_MESSAGES", "6"))
+
+
+def estimate_tokens(text: str) -> int:
+    """近似 token 数：CJK 字符各算 1 个，其他字符每 4 个算 1 个。"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if "\u3400" <= ch <= "\u9fff" or "\uff00" <= ch <= "\uffef")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+@functools.lru_cache(maxsize=64)
+def _prices(model: str) -> tuple[float, float]:
+    """模型每个 prompt / completion token 的美元价格；价格表里没有时为 0。"""
+    try:
+        import litellm
+
+        info = litellm.model_cost.get(model) or litellm.model_cost.get(model.split("/", 1)[-1])
+    except Exception:
+        info = None
+    if not info:
+        return 0.0, 0.0
+    return float(info.get("input_cost_per_token") or 0), float(info.get("output_cost_per_token") or 0)
+
+
+def cost_usd(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = _prices(model)
+    return prompt_tokens * prompt_price + completion_tokens * completion_price
+
+
+@dataclass(slots=True)
+class Usage:
+    """一组模型调用的累计用量。"""
+
+    calls: int = 0
+    estimated_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost_usd: float = 0.0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def add(self, prompt_tokens: int, completion_tokens: int, cost: float, estimated: bool) -> None:
+        self.calls += 1
+        self.estimated_calls += int(estimated)
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cost_usd += cost
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "estimated_calls": self.estimated_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.total_tokens,
+            "cost_usd": round(self.cost_usd, 6),
+        }
+
+
+@dataclass
+class ConversationUsage:
+    """一个会话的用量（总计、按 persona、按阶段）与预算动作记录。"""
+
+    total: Usage = field(default_factory=Usage)
+    by_persona: dict[str, Usage] = field(default_factory=dict)
+    by_phase: dict[str, Usage] = field(default_factory=dict)
+    compacted: bool = False
+    wrapped_up: bool = False
+
+
+def _bucket(table: dict[str, Usage], key: str) -> Usage:
+    usage = table.get(key)
+    if usage is None:
+        usage = table[key] = Usage()
+    return usage
+
+
+_SCOPE: contextvars.ContextVar[tuple[str, str] | None] = contextvars.ContextVar("token_scope", default=None)
+
+
+class TokenLedger:
+    """全局 token 账本。"""
+
+    def __init__(
+        self,
+        budget: int = TOKEN_BUDGET_PER_CONVERSATION,
+        compact_at: float = TOKEN_COMPACT_AT,
+        keep_messages: int = TOKEN_COMPACT_KEEP_MESSAGES,
+    ):
+        self.budget = budget
+        self.compact_at = compact_at
+        self.keep_messages = keep_messages
+        self._conversations: dict[str, ConversationUsage] = {}
+        self.total = Usage()
+        self.by_persona: dict[str, Usage] = {}
+        self.by_phase: dict[str, Usage] = {}
+
+    @contextmanager
+    def track(self, conversation_id: str, phase: str):
+        """在 with 块内把模型调用的用量记到该会话与阶段。"""
+        token = _SCOPE.set((conversation_id, phase))
+        try:
+            yield
+        finally:
+            _SCOPE.reset(token)
+
+    def record(
+        self,
+        persona_id: str,
+        model: str,
+        prompt_tokens: int,
+        completion_tokens: int,
+        estimated: bool = False,
+    ) -> None:
+        """记录一次模型调用的用量。"""
+        scope = _SCOPE.get()
+        phase = scope[1] if scope else "none"
+        cost = cost_usd(model, prompt_tokens, completion_tokens)
+        buckets = [self.total, _bucket(self.by_persona, persona_id), _bucket(self.by_phase, phase)]
+        if scope is not None:
+            conv = self._conversation(scope[0])
+            buckets += [conv.total, _bucket(conv.by_persona, persona_id), _bucket(conv.by_phase, phase)]
+        for usage in buckets:
+            usage.add(prompt_tokens, completion_tokens, cost, estimated)
+
+        METRICS.inc("llm_tokens_total", prompt_tokens, persona=persona_id, phase=phase, kind="prompt")
+        METRICS.inc("llm_tokens_total", completion_tokens, persona=persona_id, phase=phase, kind="completion")
+        if cost:
+            METRICS.inc("llm_cost_usd_total", cost, persona=persona_id)
+        if estimated:
+            METRICS.inc("llm_token_estimates_total", persona=persona_id)
+
+    def record_events(self, persona_id: str, agent, new_message, events) -> None:
+        """从一次 run_async 的 events 中提取用量；没有 usage_metadata 时本地估算。
+
+        agent 可以为 None（例如测试里的替身 Runner），此时模型记为 "unknown"、instruction 记为空。
+        """
+        model = getattr(agent, "model", None) or "unknown"
+        if not isinstance(model, str):
+            model = getattr(model, "model", None) or "unknown"
+        reported = [e.usage_metadata for e in events if getattr(e, "usage_metadata", None) is not None]
+        if reported:
+            for meta in reported:
+                self.record(persona_id, model, meta.prompt_token_count or 0, meta.candidates_token_count or 0)
+            return
+        instruction = getattr(agent, "instruction", None)
+        if not isinstance(instruction, str):
+            instruction = ""
+        prompt = "".join(p.text or "" for p in (new_message.parts or []))
+        completion = "".join(
+            p.text or ""
+            for e in events
+            if getattr(e, "content", None) is not None and e.content.role == "model"
+            for p in e.content.parts or []
+        )
+        self.record(
+            persona_id, model, estimate_tokens(instruction + prompt), estimate_tokens(completion), estimated=True
+        )
+
+    def _conversation(self, conversation_id: str) -> ConversationUsage:
+        conv = self._conversations.get(conversation_id)
+        if conv is None:
+            conv = self._conversations[conversation_id] = ConversationUsage()
+        return conv
+
+    def budget_action(self, conversation_id: str) -> str | None:
+        """检查会话预算：需要压缩时返回 "compact"，超出预算时返回 "wrap_up"（每种动作只触发一次）。"""
+        conv = self._conversations.get(conversation_id)
+        if self.budget <= 0 or conv is None:
+            return None
+        used = conv.total.total_tokens
+        if used > self.budget and not conv.wrapped_up:
+            conv.wrapped_up = True
+            METRICS.inc("token_budget_actions_total", action="wrap_up")
+            return "wrap_up"
+        if used >= self.budget * self.compact_at and not conv.compacted and self.compact_at < 1:
+            conv.compacted = True
+            METRICS.inc("token_budget_actions_total", action="compact")
+            return "compact"
+        return None
+
+    def history_limit(self) -> int | None:
+        """当前会话已压缩时，prompt 中保留的对话记录条数；未压缩时返回 None。"""
+        scope = _SCOPE.get()
+        conv = self._conversations.get(scope[0]) if scope else None
+        return self.keep_messages if conv is not None and conv.compacted else None
+
+    def conversation(self, conversation_id: str) -> dict:
+        conv = self._conversations.get(conversation_id) or ConversationUsage()
+        return {
+            "total": conv.total.to_dict(),
+            "by_persona": {k: v.to_dict() for k, v in conv.by_persona.items()},
+            "by_phase": {k: v.to_dict() for k, v in conv.by_phase.items()},
+            "budget": {
+                "limit": self.budget or None,
+                "remaining": max(0, self.budget - conv.total.total_tokens) if self.budget else None,
+                "compacted": conv.compacted,
+                "wrapped_up": conv.wrapped_up,
+            },
+        }
+
+    def forget(self, conversation_id: str) -> None:
+        self._conversations.pop(conversation_id, None)
+
+    def snapshot(self) -> dict:
+        return {
+            "total": self.total.to_dict(),
+            "by_persona": {k: v.to_dict() for k, v in self.by_persona.items()},
+            "by_phase": {k: v.to_dict() for k, v in self.by_phase.items()},
+            "conversations": len(self._conversations),
+        }
+
+
+# 全局 token 账本
+TOKENS = TokenLedger()
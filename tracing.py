@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""回合时间线：按需记录一轮对话内的 span 与 event，导出为 Chrome trace-event JSON（Perfetto 可直接打开）。
+
+直方图只能看到各环节的分布，看不到一轮里 _run_chat_round → _expert_respond → _call_agent →
+run_async 的各段如何重叠、时间耗在排队还是模型上。开启 trace 的回合会记录：
+- span：回合、会话锁等待、阶段处理、每次 Agent 调用、session 获取、调度器排队、模型流、回复后处理
+- instant event：模型流的首个 event 与之后的每个 event（每轮最多 TRACE_MAX_EVENTS 条）
+
+开启方式：POST /conversations/{id}/messages 带请求头 X-Trace: 1，或按 TRACE_SAMPLE_RATE 抽样。
+当前回合的 trace 放在 contextvar 中，回合内创建的 task（含后台 Observer 总结）继续写入同一条时间线；
+同一时间线上每个 asyncio task 一条 lane（Chrome trace 的 tid），并发的调用不会叠在一起。
+每个会话保留最近 TRACE_KEEP_TURNS 轮，由 GET /conversations/{id}/trace 导出。
+"""
+
+import asyncio
+import contextvars
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# 随机抽样比例（0-1）；0 表示只记录带请求头的回合
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0"))
+
+# 每个会话保留的回合 trace 数
+TRACE_KEEP_TURNS = int(os.getenv("TRACE_KEEP_TURNS", "10"))
+
+# 每个回合最多记录的 span + event 数
+TRACE_MAX_EVENTS = int(os.getenv("TRACE_MAX_EVENTS", "2000"))
+
+# 请求头名；值为 1 / true 时记录该回合
+TRACE_HEADER = os.getenv("TRACE_HEADER", "X-Trace")
+
+
+class TurnTrace:
+    """一轮对话的时间线。时间戳为 time.perf_counter()，导出时换算成 epoch 微秒。"""
+
+    __slots__ = ("conversation_id", "label", "wall_start", "perf_start", "events", "dropped", "_lanes")
+
+    def __init__(self, conversation_id: str, label: str):
+        self.conversation_id = conversation_id
+        self.label = label
+        self.wall_start = time.time()
+        self.perf_start = time.perf_counter()
+        # (ph, name, cat, start, end, lane, args)
+        self.events: list[tuple] = []
+        self.dropped = 0
+        # id(task) -> (lane 序号, task 名)
+        self._lanes: dict[int, tuple[int, str]] = {}
+
+    def _lane(self) -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        key = id(task) if task is not None else 0
+        lane = self._lanes.get(key)
+        if lane is None:
+            name = task.get_name() if task is not None else "main"
+            lane = self._lanes[key] = (len(self._lanes) + 1, name)
+        return lane[0]
+
+    def add(self, ph: str, name: str, cat: str, start: float, end: float, args: dict) -> None:
+        if len(self.events) >= TRACE_MAX_EVENTS:
+            self.dropped += 1
+            return
+        self.events.append((ph, name, cat, start, end, self._lane(), args))
+
+    def _us(self, perf: float) -> float:
+        return round((self.wall_start + (perf - self.perf_start)) * 1e6, 1)
+
+    def to_chrome(self, pid: int) -> list[dict]:
+        out = [{"ph": "M", "name": "thread_name", "pid": pid, "tid": lane, "args": {"name": name}}
+               for lane, name in self._lanes.values()]
+        for ph, name, cat, start, end, lane, args in self.events:
+            event = {"ph": ph, "name": name, "cat": cat, "pid": pid, "tid": lane, "ts": self._us(start)}
+            if ph == "X":
+                event["dur"] = round((end - start) * 1e6, 1)
+            else:
+                event["s"] = "t"
+            if args:
+                event["args"] = args
+            out.append(event)
+        return out
+
+
+_CURRENT: contextvars.ContextVar[TurnTrace | None] = contextvars.ContextVar("turn_trace", default=None)
+
+
+class TraceStore:
+    """全局入口：开启回合 trace、记录 span / event、按会话导出。"""
+
+    def __init__(
+        self,
+        sample_rate: float = TRACE_SAMPLE_RATE,
+        keep_turns: int = TRACE_KEEP_TURNS,
+        header: str = TRACE_HEADER,
+    ):
+        self.sample_rate = sample_rate
+        self.keep_turns = keep_turns
+        self.header = header
+        self._turns: dict[str, deque[TurnTrace]] = {}
+
+    def wanted(self, headers) -> bool:
+        """请求头要求记录，或命中随机抽样。"""
+        flag = (headers.get(self.header) or "").strip().lower()
+        if flag in ("1", "true", "yes"):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @contextmanager
+    def turn(self, conversation_id: str, label: str, enabled: bool = True):
+        """在 with 块内记录一轮的时间线（enabled=False 时什么都不做），外层 span 名为 "turn"。"""
+        if not enabled:
+            yield None
+            return
+        trace = TurnTrace(conversation_id, label)
+        turns = self._turns.get(conversation_id)
+        if turns is None:
+            turns = self._turns[conversation_id] = deque(maxlen=self.keep_turns)
+        turns.append(trace)
+        token = _CURRENT.set(trace)
+        try:
+            with self.span("turn", "turn", content=label):
+                yield trace
+        finally:
+            _CURRENT.reset(token)
+
+    @contextmanager
+    def span(self, name: str, cat: str = "app", **args):
+        """记录一个 span；当前上下文没有开启 trace 时几乎没有开销。"""
+        trace = _CURRENT.get()
+        if trace is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            trace.add("X", name, cat, start, time.perf_counter(), args)
+
+    def record(self, name: str, start: float, end: float, cat: str = "app", **args) -> None:
+        """记录一个已经结束的 span（start / end 为 time.perf_counter()）。"""
+        trace = _CURRENT.get()
+        if trace is not None:
+            trace.add("X", name, cat, start, end, args)
+
+    def instant(self, name: str, cat: str = "app", **args) -> None:
+        trace = _CURRENT.get()
+        if trace is not None:
+            now = time.perf_counter()
+            trace.add("i", name, cat, now, now, args)
+
+    @property
+    def active(self) -> bool:
+        return _CURRENT.get() is not None
+
+    def turns(self, conversation_id: str) -> list[TurnTrace]:
+        return list(self._turns.get(conversation_id, ()))
+
+    def forget(self, conversation_id: str) -> None:
+        self._turns.pop(conversation_id, None)
+
+    def chrome_trace(self, conversation_id: str, last: int | None = None) -> dict:
+        """Chrome trace-event JSON：每轮一个 process（pid），每个 task 一个 thread（tid）。"""
+        turns = self.turns(conversation_id)
+        if last is not None:
+            turns = turns[-last:] if last > 0 else []
+        events = []
+        for pid, trace in enumerate(turns, start=1):
+            events.append({"ph": "M", "name": "process_name", "pid": pid, "args": {"name": f"turn {pid}: {trace.label}"}})
+            events.append({"ph": "M", "name": "process_sort_index", "pid": pid, "args": {"sort_index": pid}})
+            events.extend(trace.to_chrome(pid))
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {
+                "conversation_id": conversation_id,
+                "turns": len(turns),
+                "dropped_events": sum(t.dropped for t in turns),
+            },
+        }
+
+
+TRACES = TraceStore()
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""会话级回合串行化与重复请求合并。
+
+同一会话的多个 POST /conversations/{id}/messages 并发进入 _run_chat_round 时，
+会交错地追加 messages、修改 sub_agent_turns，并同时驱动同一个 ADK session。
+这里为每个会话提供：
+- 一把 asyncio.Lock，等待有上限（超时抛 ConversationBusyError）
+- 基于客户端消息 id（client_message_id）的幂等：
+  同一 id 的重试会等待正在进行的那一轮，或直接返回缓存的结果，而不是再生成一次
+"""
+
+import asyncio
+import os
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable
+
+# 等待会话锁的最长时间（秒）
+TURN_LOCK_TIMEOUT = float(os.getenv("TURN_LOCK_TIMEOUT", "30"))
+
+# 每个会话缓存的已完成回合结果数（按 client_message_id）
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "32"))
+
+
+class ConversationBusyError(Exception):
+    """在限定时间内没能拿到会话锁。"""
+
+
+class InflightTurn:
+    """一轮正在执行的对话：由闸门持有的任务 + 当前等待它的请求数。"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class TurnGate:
+    """单个会话的锁、进行中回合与已完成结果缓存。"""
+
+    __slots__ = ("lock", "inflight", "results")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        # client_message_id -> 进行中的回合
+        self.inflight: dict[str, InflightTurn] = {}
+        # client_message_id -> 已完成回合的结果（LRU）
+        self.results: OrderedDict[str, Any] = OrderedDict()
+
+    def remember(self, key: str, result: Any) -> None:
+        self.results[key] = result
+        self.results.move_to_end(key)
+        while len(self.results) > IDEMPOTENCY_CACHE_SIZE:
+            self.results.popitem(last=False)
+
+
+def _silence_unretrieved(task: asyncio.Task) -> None:
+    # 所有请求都已离开时，避免 "Task exception was never retrieved" 警告
+    if not task.cancelled():
+        task.exception()
+
+
+class TurnGates:
+    """conversation_id -> TurnGate 的注册表。"""
+
+    def __init__(self):
+        self._gates: dict[str, TurnGate] = {}
+
+    def get(self, conversation_id: str) -> TurnGate:
+        gate = self._gates.get(conversation_id)
+        if gate is None:
+            gate = self._gates[conversation_id] = TurnGate()
+        return gate
+
+    def discard(self, conversation_id: str) -> None:
+        self._gates.pop(conversation_id, None)
+
+    def busy(self, conversation_id: str) -> bool:
+        """会话是否有进行中或排队等锁的回合。"""
+        gate = self._gates.get(conversation_id)
+        return gate is not None and (gate.lock.locked() or bool(gate.inflight))
+
+    def clear(self) -> None:
+        self._gates.clear()
+
+    def __len__(self) -> int:
+        return len(self._gates)
+
+    async def _execute(
+        self,
+        conversation_id: str,
+        gate: TurnGate,
+        key: str | None,
+        turn: Callable[[], Awaitable[Any]],
+        timeout: float,
+    ) -> Any:
+        try:
+            try:
+                await asyncio.wait_for(gate.lock.acquire(), timeout)
+            except asyncio.TimeoutError:
+                raise ConversationBusyError(conversation_id) from None
+            try:
+                result = await turn()
+            finally:
+                gate.lock.release()
+            if key is not None:
+                gate.remember(key, result)
+            return result
+        finally:
+            if key is not None:
+                gate.inflight.pop(key, None)
+
+    async def run(
+        self,
+        conversation_id: str,
+        client_message_id: str | None,
+        turn: Callable[[], Awaitable[Any]],
+        timeout: float | None = None,
+    ) -> Any:
+        """在会话锁内执行一轮对话；同一 client_message_id 只执行一次。
+
+        回合在闸门持有的任务中执行。调用方被取消（例如客户端断开）时只是离开；
+        最后一个等待者离开时才取消该回合，因此重试请求不会被原请求的断开连累。
+
+        Raises:
+            ConversationBusyError: 等待会话锁超时
+        """
+        gate = self.get(conversation_id)
+        key = client_message_id or None
+
+        if key is not None and key in gate.results:
+            gate.results.move_to_end(key)
+            return gate.results[key]
+
+        entry = gate.inflight.get(key) if key is not None else None
+        if entry is None:
+            task = asyncio.create_task(self._execute(
+                conversation_id, gate, key, turn,
+                TURN_LOCK_TIMEOUT if timeout is None else timeout,
+            ))
+            task.add_done_callback(_silence_unretrieved)
+            entry = InflightTurn(task)
+            if key is not None:
+                # 在排队等锁之前登记，排队期间的重试也能合并到这一轮
+                gate.inflight[key] = entry
+
+        entry.waiters += 1
+        try:
+            return await asyncio.shield(entry.task)
+        finally:
+            entry.waiters -= 1
+            if entry.waiters == 0 and not entry.task.done():
+                entry.task.cancel()
+
+
+# 全局注册表，供 Main 使用
+TURN_GATES = TurnGates()
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""异步回合任务：POST ...?async=true 立即返回 turn id，由有界工作池在后台执行。
+
+religion_deep 或 wrap_up + observer 的一轮可能串联三次 LLM 调用，容易撞上
+HTTP 客户端/代理超时。这里把“客户端等待多久”和“模型要跑多久”解耦：
+- TurnJobPool：固定数量的 worker 从有界队列取任务执行（少量 worker 挡在慢 GPU 前面）
+- GET /turns/{id}（可选 wait 长轮询）查询进度与结果
+"""
+
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from metrics import METRICS
+
+# 同时执行的回合数
+TURN_WORKERS = int(os.getenv("TURN_WORKERS", "2"))
+
+# 排队上限，满了返回 503
+TURN_QUEUE_SIZE = int(os.getenv("TURN_QUEUE_SIZE", "256"))
+
+# 保留的任务记录数（含已完成的结果）
+TURN_JOBS_MAX = int(os.getenv("TURN_JOBS_MAX", "10000"))
+
+# 长轮询最长等待（秒）
+MAX_LONG_POLL = 30.0
+
+
+class TurnQueueFull(Exception):
+    """任务队列已满。"""
+
+
+class TurnJob:
+    """一个异步回合任务。status: queued -> running -> done | failed"""
+
+    __slots__ = (
+        "id", "conversation_id", "content", "client_message_id",
+        "status", "created_at", "started_at", "finished_at",
+        "base_len", "result", "error", "done", "trace", "player_id",
+    )
+
+    def __init__(self, conversation_id: str, content: str, client_message_id: str | None, trace: bool = False):
+        self.id = uuid.uuid4().hex
+        self.conversation_id = conversation_id
+        self.content = content
+        self.client_message_id = client_message_id
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: float | None = None
+        self.finished_at: float | None = None
+        # 本轮开始时会话的消息数，用于返回进行中的新增消息
+        self.base_len: int | None = None
+        self.result: dict | None = None
+        self.error: str | None = None
+        self.done = asyncio.Event()
+        # 是否记录本轮时间线（见 tracing.py）
+        self.trace = trace
+        # 提交任务的玩家（占用其回合名额，见 players.py）；由接口在提交后设置
+        self.player_id: str | None = None
+
+
+class TurnJobPool:
+    """有界队列 + 固定数量 worker 的回合执行池。"""
+
+    def __init__(
+        self,
+        execute: Callable[[TurnJob], Awaitable[dict]],
+        workers: int = TURN_WORKERS,
+        queue_size: int = TURN_QUEUE_SIZE,
+        max_jobs: int = TURN_JOBS_MAX,
+    ):
+        self._execute = execute
+        self._n_workers = max(1, workers)
+        self._queue_size = queue_size
+        self._max_jobs = max_jobs
+        self._jobs: OrderedDict[str, TurnJob] = OrderedDict()
+        # (conversation_id, client_message_id) -> turn id
+        self._by_key: dict[tuple[str, str], str] = {}
+        # conversation_id -> 排队中或执行中的任务数（淘汰 / 迁移会话时据此判断是否空闲）
+        self._pending: dict[str, int] = {}
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._workers:
+            return
+        # 首次使用（或事件循环被替换，如测试中）时在当前循环上启动 worker
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self._queue_size)
+        # 旧队列里没跑完的任务不会再执行
+        self._pending.clear()
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"turn-worker-{i}")
+            for i in range(self._n_workers)
+        ]
+
+    def submit(
+        self, conversation_id: str, content: str, client_message_id: str | None = None, trace: bool = False
+    ) -> TurnJob:
+        """提交一轮对话；同一 client_message_id 返回排队中、执行中或已完成的已有任务。
+
+        失败的任务不复用（与 TurnGates 不缓存失败一致）：客户端重试时提交新任务。
+
+        Raises:
+            TurnQueueFull: 队列已满
+        """
+        self._ensure_started()
+        key = (conversation_id, client_message_id) if client_message_id else None
+        if key is not None:
+            existing = self._jobs.get(self._by_key.get(key, ""))
+            if existing is not None and existing.status != "failed":
+                return existing
+
+        job = TurnJob(conversation_id, content, client_message_id, trace)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            METRICS.inc("turn_jobs_rejected_total", reason="queue_full")
+            raise TurnQueueFull() from None
+
+        self._jobs[job.id] = job
+        self._pending[conversation_id] = self._pending.get(conversation_id, 0) + 1
+        if key is not None:
+            self._by_key[key] = job.id
+        self._evict()
+        METRICS.inc("turn_jobs_submitted_total")
+        METRICS.set_gauge("turn_jobs_queue_depth", self._queue.qsize())
+        return job
+
+    def _evict(self) -> None:
+        # 超出上限时丢弃最早的已结束任务；进行中的不丢
+        while len(self._jobs) > self._max_jobs:
+            for tid, job in self._jobs.items():
+                if job.done.is_set():
+                    break
+            else:
+                return
+            del self._jobs[tid]
+            if job.client_message_id:
+                self._by_key.pop((job.conversation_id, job.client_message_id), None)
+
+    def get(self, turn_id: str) -> TurnJob | None:
+        return self._jobs.get(turn_id)
+
+    def pending(self, conversation_id: str) -> bool:
+        """会话是否有排队中或执行中的任务。"""
+        return conversation_id in self._pending
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def wait(self, job: TurnJob, timeout: float) -> None:
+        """等待任务结束，最多 timeout 秒（长轮询）。"""
+        if timeout <= 0 or job.done.is_set():
+            return
+        try:
+            await asyncio.wait_for(job.done.wait(), min(timeout, MAX_LONG_POLL))
+        except asyncio.TimeoutError:
+            pass
+
+    async def _worker(self) -> None:
+        while True:
+            job = await self._queue.get()
+            METRICS.set_gauge("turn_jobs_queue_depth", self._queue.qsize())
+            job.status = "running"
+            job.started_at = time.time()
+            METRICS.observe("turn_job_queue_seconds", job.started_at - job.created_at)
+            try:
+                job.result = await self._execute(job)
+                job.status = "done"
+            except asyncio.CancelledError:
+                job.status = "failed"
+                job.error = "cancelled"
+                raise
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e) or type(e).__name__
+                print(f"[TURN JOB] {job.id} ({job.conversation_id}) 失败: {job.error}")
+            finally:
+                job.finished_at = time.time()
+                METRICS.inc("turn_jobs_finished_total", status=job.status)
+                METRICS.observe("turn_job_run_seconds", job.finished_at - job.started_at)
+                job.done.set()
+                self._release(job.conversation_id)
+                self._queue.task_done()
+
+    def _release(self, conversation_id: str) -> None:
+        left = self._pending.get(conversation_id, 0) - 1
+        if left > 0:
+            self._pending[conversation_id] = left
+        else:
+            self._pending.pop(conversation_id, None)
+
+    async def shutdown(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""启动预热与模型常驻。
+
+部署后第一次请求（或 Ollama 卸载了空闲模型后）要付出几秒的模型加载时间。
+这里在启动时把 PERSONAS 中引用到的每个不同模型加载一次，并用 keep_alive
+让它常驻；之后定期刷新，避免被 Ollama 卸载。GET /ready 只有在所有模型
+都已预热时才返回 200，负载均衡器不会把玩家送到冷的 worker 上。
+"""
+
+import asyncio
+import os
+import time
+
+from metrics import METRICS
+
+# 是否在启动时预热
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+
+# 预热成功后的刷新间隔（秒），应小于 keep_alive
+WARMUP_REFRESH_INTERVAL = float(os.getenv("WARMUP_REFRESH_INTERVAL", "600"))
+
+# 预热失败（如 Ollama 还没起来）后的重试间隔（秒）
+WARMUP_RETRY_INTERVAL = float(os.getenv("WARMUP_RETRY_INTERVAL", "5"))
+
+# 单个模型加载的超时（秒）
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "300"))
+
+_OLLAMA_PREFIXES = ("ollama_chat/", "ollama/")
+
+
+def ollama_model_name(model: str) -> str | None:
+    """"ollama_chat/qwen3:8b" -> "qwen3:8b"；非 Ollama 模型返回 None。"""
+    for prefix in _OLLAMA_PREFIXES:
+        if model.startswith(prefix):
+            return model[len(prefix):]
+    return None
+
+
+def distinct_models(persona_table: dict) -> list[str]:
+    """PERSONAS 中引用的不同模型名（含快速档模型，保持首次出现的顺序）。"""
+    seen: dict[str, None] = {}
+    for info in persona_table.values():
+        seen.setdefault(info["model"].model, None)
+        if "fast_model" in info:
+            seen.setdefault(info["fast_model"].model, None)
+    return list(seen)
+
+
+class ModelWarmState:
+    """单个模型的预热状态。status: cold | warming | warm | error"""
+
+    __slots__ = ("model", "status", "last_warmed", "load_seconds", "error")
+
+    def __init__(self, model: str):
+        self.model = model
+        self.status = "cold"
+        self.last_warmed: float | None = None
+        self.load_seconds: float | None = None
+        self.error: str | None = None
+
+    def snapshot(self) -> dict:
+        return {
+            "status": self.status,
+            "last_warmed": self.last_warmed,
+            "load_seconds": self.load_seconds,
+            "error": self.error,
+        }
+
+
+class ModelWarmer:
+    """加载并保持 Ollama 模型常驻；远端托管的模型（Azure）无需加载，直接视为已预热。"""
+
+    def __init__(self, models: list[str], api_base: str, keep_alive: str, client_factory):
+        # client_factory() -> httpx.AsyncClient（使用共享连接池）
+        self.api_base = api_base.rstrip("/")
+        self.keep_alive = keep_alive
+        self._client_factory = client_factory
+        self.states = {m: ModelWarmState(m) for m in models}
+        self._task: asyncio.Task | None = None
+
+    def ready(self) -> bool:
+        return all(s.status == "warm" for s in self.states.values())
+
+    def snapshot(self) -> dict:
+        return {m: s.snapshot() for m, s in self.states.items()}
+
+    async def warm_one(self, state: ModelWarmState) -> None:
+        name = ollama_model_name(state.model)
+        if name is None:
+            state.status = "warm"
+            state.last_warmed = time.time()
+            return
+        if state.status != "warm":
+            state.status = "warming"
+        started = time.perf_counter()
+        try:
+            # 空 prompt 的 /api/generate 只加载模型；keep_alive 让它常驻
+            response = await self._client_factory().post(
+                f"{self.api_base}/api/generate",
+                json={"model": name, "prompt": "", "stream": False, "keep_alive": self.keep_alive},
+                timeout=WARMUP_TIMEOUT,
+            )
+            response.raise_for_status()
+        except Exception as e:
+            state.status = "error"
+            state.error = str(e) or type(e).__name__
+            METRICS.inc("model_warmup_failures_total", model=state.model)
+            print(f"[WARMUP] {state.model} 预热失败: {state.error}")
+            return
+        state.load_seconds = round(time.perf_counter() - started, 3)
+        state.last_warmed = time.time()
+        state.status = "warm"
+        state.error = None
+        METRICS.observe("model_warmup_seconds", state.load_seconds, model=state.model)
+
+    async def warm_all(self) -> bool:
+        """按顺序预热所有模型（同时加载多个大模型会挤爆显存），返回是否全部就绪。"""
+        for state in self.states.values():
+            await self.warm_one(state)
+        METRICS.set_gauge("models_warm", sum(s.status == "warm" for s in self.states.values()))
+        return self.ready()
+
+    async def run(self) -> None:
+        while True:
+            ready = await self.warm_all()
+            await asyncio.sleep(WARMUP_REFRESH_INTERVAL if ready else WARMUP_RETRY_INTERVAL)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            print(f"[WARMUP] 预热模型: {', '.join(self.states)}")
+            self._task = asyncio.create_task(self.run(), name="model-warmup")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None